@@ -21,7 +21,8 @@ class SecurityAdvisor:
             "Return a JSON mapping of each dependency to 'SAFE' or 'RISK: <reason>'."
         )
         
-        response, _, _ = codex.run_prompt(prompt)
+        # No cwd: the answer depends on the names in the prompt only, so it is shared across workspaces
+        response, _, _ = await codex.arun_prompt(prompt, node="advisor")
         # TODO: Parse JSON response
         return {"summary": "Audit complete via LLM (Mock Parse)"}
 
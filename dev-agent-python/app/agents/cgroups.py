@@ -0,0 +1,322 @@
+import errno
+import logging
+import os
+import resource
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CGROUP_MOUNT = "/sys/fs/cgroup"
+_CONTROLLERS = ("cpu", "memory", "pids", "io")
+# cpu.max period; quota is cpu_cores * period
+_CPU_PERIOD_US = 100000
+
+
+class ResourceLimits:
+    """
+    Limits for one command class, from SANDBOX_RESOURCE_LIMITS (the class entry
+    over "default"). A missing or zero value means unlimited.
+    """
+    __slots__ = ("command_class", "cpu_cores", "memory_mb", "pids", "cpu_seconds", "nofile")
+
+    def __init__(
+        self,
+        command_class: str = "default",
+        cpu_cores: float = 0,
+        memory_mb: int = 0,
+        pids: int = 0,
+        cpu_seconds: int = 0,
+        nofile: int = 0
+    ):
+        self.command_class = command_class
+        self.cpu_cores = cpu_cores
+        self.memory_mb = memory_mb
+        self.pids = pids
+        self.cpu_seconds = cpu_seconds
+        self.nofile = nofile
+
+    @classmethod
+    def for_class(cls, command_class: Optional[str]) -> "ResourceLimits":
+        command_class = command_class or "default"
+        limits = dict(settings.SANDBOX_RESOURCE_LIMITS.get("default", {}))
+        limits.update(settings.SANDBOX_RESOURCE_LIMITS.get(command_class, {}))
+        return cls(
+            command_class,
+            cpu_cores=limits.get("cpu_cores", 0),
+            memory_mb=int(limits.get("memory_mb", 0)),
+            pids=int(limits.get("pids", 0)),
+            cpu_seconds=int(limits.get("cpu_seconds", 0)),
+            nofile=int(limits.get("nofile", 0))
+        )
+
+    def cgroup_files(self) -> Dict[str, str]:
+        files = {
+            "cpu.max": f"{int(self.cpu_cores * _CPU_PERIOD_US)} {_CPU_PERIOD_US}" if self.cpu_cores else f"max {_CPU_PERIOD_US}",
+            "memory.max": str(self.memory_mb * 1024 * 1024) if self.memory_mb else "max",
+            "pids.max": str(self.pids) if self.pids else "max",
+        }
+        if self.memory_mb:
+            # Without this the kernel swaps instead of enforcing memory.max
+            files["memory.swap.max"] = "0"
+        return files
+
+    def apply_rlimits(self, memory: bool):
+        """
+        Runs in the child before exec. CPU seconds and open files have no cgroup
+        equivalent and are always set; memory only when there is no cgroup.
+        RLIMIT_DATA rather than RLIMIT_AS: runtimes like V8 reserve large
+        PROT_NONE regions that count against the address space but not data.
+        """
+        if self.cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 5))
+        if self.nofile:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (self.nofile, self.nofile))
+        if memory and self.memory_mb:
+            limit = self.memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+class ResourceUsage:
+    """
+    What one sandboxed execution consumed. source is "cgroup" when read from
+    the execution's cgroup (whole process tree, including escaped daemons),
+    "rusage" when taken from wait4 of the direct child.
+    """
+    __slots__ = ("source", "cpu_usec", "user_usec", "system_usec", "memory_peak_bytes",
+                 "io_read_bytes", "io_write_bytes", "pids_peak", "oom_kills", "throttled_usec")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.cpu_usec = 0
+        self.user_usec = 0
+        self.system_usec = 0
+        self.memory_peak_bytes = 0
+        self.io_read_bytes = 0
+        self.io_write_bytes = 0
+        self.pids_peak = 0
+        self.oom_kills = 0
+        self.throttled_usec = 0
+
+    @classmethod
+    def from_rusage(cls, usage) -> "ResourceUsage":
+        result = cls("rusage")
+        result.user_usec = int(usage.ru_utime * 1e6)
+        result.system_usec = int(usage.ru_stime * 1e6)
+        result.cpu_usec = result.user_usec + result.system_usec
+        result.memory_peak_bytes = usage.ru_maxrss * 1024
+        # Block counts are in 512-byte units and only cover real disk IO
+        result.io_read_bytes = usage.ru_inblock * 512
+        result.io_write_bytes = usage.ru_oublock * 512
+        return result
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ExecutionCgroup:
+    """
+    Transient leaf cgroup for a single execution.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._procs = os.path.join(path, "cgroup.procs")
+
+    def join_self(self):
+        """
+        Moves the calling process into the cgroup. Used from preexec_fn, so the
+        command and everything it forks start inside it.
+        """
+        fd = os.open(self._procs, os.O_WRONLY)
+        try:
+            os.write(fd, b"0")
+        finally:
+            os.close(fd)
+
+    def _read(self, name: str) -> str:
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    @staticmethod
+    def _fields(text: str) -> Dict[str, int]:
+        fields = {}
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                fields[parts[0]] = int(parts[1])
+        return fields
+
+    def usage(self) -> ResourceUsage:
+        result = ResourceUsage("cgroup")
+        cpu = self._fields(self._read("cpu.stat"))
+        result.cpu_usec = cpu.get("usage_usec", 0)
+        result.user_usec = cpu.get("user_usec", 0)
+        result.system_usec = cpu.get("system_usec", 0)
+        result.throttled_usec = cpu.get("throttled_usec", 0)
+        # memory.peak needs Linux 5.19; older kernels only have the current value
+        peak = self._read("memory.peak").strip() or self._read("memory.current").strip()
+        result.memory_peak_bytes = int(peak) if peak.isdigit() else 0
+        result.oom_kills = self._fields(self._read("memory.events")).get("oom_kill", 0)
+        pids_peak = self._read("pids.peak").strip()
+        result.pids_peak = int(pids_peak) if pids_peak.isdigit() else 0
+        for line in self._read("io.stat").splitlines():
+            # "8:0 rbytes=1459200 wbytes=314773504 rios=192 wios=353 dbytes=0 dios=0"
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "rbytes":
+                    result.io_read_bytes += int(value)
+                elif key == "wbytes":
+                    result.io_write_bytes += int(value)
+        return result
+
+    def kill(self) -> bool:
+        """
+        Kills every process left in the cgroup (Linux 5.14+ cgroup.kill).
+        Returns False when the kernel does not support it.
+        """
+        try:
+            with open(os.path.join(self.path, "cgroup.kill"), "w") as f:
+                f.write("1")
+            return True
+        except OSError:
+            return False
+
+    def remove(self, grace: float = 2.0):
+        """
+        Kills leftovers and removes the cgroup once it is empty.
+        """
+        self.kill()
+        deadline = time.monotonic() + grace
+        while True:
+            try:
+                os.rmdir(self.path)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return
+                if e.errno != errno.EBUSY or time.monotonic() > deadline:
+                    logger.warning(f"CGROUP: Could not remove {self.path}: {e}")
+                    return
+            time.sleep(0.01)
+
+
+class CgroupManager:
+    """
+    Places sandboxed executions in transient cgroup v2 leaves under a parent
+    subtree, resolved once on first use:
+    SANDBOX_CGROUP_ROOT when set (a delegated cgroup the worker may write to),
+    else the worker's own cgroup. Controllers can only be delegated from a cgroup
+    without member processes, so in the own-cgroup case the worker's processes
+    are first moved to a "supervisor" leaf (the same dance container init
+    systems do). Any failure disables cgroups and callers fall back to rlimits.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._parent: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        return self._parent_path() is not None
+
+    def _parent_path(self) -> Optional[str]:
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self._parent = self._setup()
+                    self._resolved = True
+        return self._parent
+
+    def _setup(self) -> Optional[str]:
+        if settings.SANDBOX_CGROUPS.lower() == "off":
+            return None
+        if not os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")):
+            logger.info("CGROUP: No cgroup v2 unified hierarchy; sandbox limits use rlimits.")
+            return None
+        try:
+            if settings.SANDBOX_CGROUP_ROOT:
+                base = os.path.join(CGROUP_MOUNT, settings.SANDBOX_CGROUP_ROOT.strip("/"))
+            else:
+                base = os.path.join(CGROUP_MOUNT, self._own_cgroup().strip("/"))
+                self._evacuate(base)
+            wanted = self._enable_controllers(base)
+            parent = os.path.join(base, "agent-sandbox")
+            os.makedirs(parent, exist_ok=True)
+            enabled = self._enable_controllers(parent)
+            logger.info(f"CGROUP: Sandbox executions run under {parent} (controllers: {' '.join(enabled) or 'none'}).")
+            if set(enabled) != set(wanted):
+                logger.warning(f"CGROUP: Missing controllers {sorted(set(_CONTROLLERS) - set(enabled))}; those limits fall back to rlimits where possible.")
+            return parent
+        except OSError as e:
+            logger.warning(f"CGROUP: cgroup v2 not usable ({e}); sandbox limits use rlimits.")
+            return None
+
+    @staticmethod
+    def _own_cgroup() -> str:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].strip()
+        raise OSError(errno.ENOENT, "no cgroup v2 entry in /proc/self/cgroup")
+
+    @staticmethod
+    def _evacuate(base: str):
+        """
+        Moves every process in base into base/supervisor so base can delegate controllers.
+        """
+        with open(os.path.join(base, "cgroup.procs")) as f:
+            pids = [line.strip() for line in f if line.strip()]
+        if not pids:
+            return
+        supervisor = os.path.join(base, "supervisor")
+        os.makedirs(supervisor, exist_ok=True)
+        for pid in pids:
+            try:
+                with open(os.path.join(supervisor, "cgroup.procs"), "w") as f:
+                    f.write(pid)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    def _enable_controllers(path: str) -> List[str]:
+        with open(os.path.join(path, "cgroup.controllers")) as f:
+            available = f.read().split()
+        wanted = [c for c in _CONTROLLERS if c in available]
+        if wanted:
+            with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+                f.write(" ".join(f"+{c}" for c in wanted))
+        return wanted
+
+    def create(self, limits: ResourceLimits) -> Optional[ExecutionCgroup]:
+        """
+        Creates a leaf cgroup with the given limits, or returns None when cgroups
+        are unavailable or creation fails.
+        """
+        parent = self._parent_path()
+        if parent is None:
+            return None
+        path = os.path.join(parent, f"{limits.command_class}-{uuid.uuid4().hex[:12]}")
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            logger.warning(f"CGROUP: Could not create {path}: {e}")
+            return None
+        for name, value in limits.cgroup_files().items():
+            try:
+                with open(os.path.join(path, name), "w") as f:
+                    f.write(value)
+            except FileNotFoundError:
+                # Controller not delegated here (e.g. no swap accounting); skip that limit
+                pass
+            except OSError as e:
+                logger.warning(f"CGROUP: Could not set {name}={value}: {e}")
+        return ExecutionCgroup(path)
+
+cgroup_manager = CgroupManager()
@@ -0,0 +1,456 @@
+import ast
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import xxhash
+
+from app.agents.knowledge_graph import parse_files, read_index, scan_python_files, write_index
+from app.agents.logic.verify_cache import cache_dir, file_hash
+from app.core.config import settings
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the chunking or the featurizer changes; older indexes are rebuilt
+INDEX_VERSION = 1
+
+# Chunk rows: [start_line, end_line, kind, name], kind: function | class | method | module | lines
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|\b|_)|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_FUNCTIONS = (ast.FunctionDef, ast.AsyncFunctionDef)
+# Names and paths say more about a chunk than any single token of its body
+_NAME_WEIGHT = 3.0
+_PATH_WEIGHT = 1.0
+_TRIGRAM_WEIGHT = 0.5
+# Chunks shorter than this rank a little lower: a two-line class with a matching name is rarely the answer
+_SHORT_CHUNK_LINES = 5
+
+# token -> (buckets, signed weights), per process; identifiers repeat across chunks and files
+_features: Dict[Tuple[str, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def _token_features(token: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed features of one identifier: its subwords (snake_case and
+    camelCase parts; a plain word is its own subword), the whole identifier
+    when it is compound, and the character trigrams of each subword, so
+    "parse_config", "ConfigParser" and "parser" share buckets. A subword's
+    trigrams together weigh _TRIGRAM_WEIGHT. crc32 is stable across
+    processes, unlike hash().
+    """
+    cached = _features.get((token, dim))
+    if cached is not None:
+        return cached
+    subwords = [s.lower() for s in _SUBWORD.findall(token)] or [token.lower()]
+    keys = [("s:" + s, 1.0) for s in subwords]
+    if len(subwords) > 1:
+        keys.append(("w:" + token.lower(), 1.0))
+    for s in subwords:
+        padded = f"#{s}#"
+        trigrams = len(padded) - 2
+        keys += [("t:" + padded[i:i + 3], _TRIGRAM_WEIGHT / trigrams) for i in range(trigrams)]
+    hashes = np.fromiter((zlib.crc32(key.encode()) for key, _ in keys), dtype=np.uint64, count=len(keys))
+    weights = np.fromiter((w for _, w in keys), dtype=np.float32, count=len(keys))
+    # One hash bit picks the sign: collisions cancel out on average instead of piling up
+    signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+    result = ((hashes % dim).astype(np.int64), weights * signs)
+    if len(_features) < 500_000:
+        _features[(token, dim)] = result
+    return result
+
+
+def embed(texts: List[str], dim: int, extras: Optional[List[Dict[str, float]]] = None) -> np.ndarray:
+    """
+    L2-normalized hashed bags of identifier n-grams, one row per text, with
+    sublinear term frequencies. extras add identifiers with a fixed weight
+    (a chunk's name and path). All rows are accumulated in one bincount over
+    the batch's vocabulary instead of per-token array updates.
+    """
+    vocab: Dict[str, int] = {}
+    rows: List[int] = []
+    token_ids: List[int] = []
+    weights: List[float] = []
+    for i, text in enumerate(texts):
+        counts = {token: 1.0 + math.log(n) for token, n in Counter(_IDENTIFIER.findall(text)).items()}
+        for token, weight in (extras[i] if extras else {}).items():
+            counts[token] = counts.get(token, 0.0) + weight
+        token_ids.extend(vocab.setdefault(token, len(vocab)) for token in counts)
+        weights.extend(counts.values())
+        rows.extend([i] * len(counts))
+    if not vocab:
+        return np.zeros((len(texts), dim), dtype=np.float32)
+    features = [_token_features(token, dim) for token in vocab]
+    lengths = np.fromiter((len(b) for b, _ in features), dtype=np.int64, count=len(features))
+    starts = np.cumsum(lengths) - lengths
+    buckets = np.concatenate([b for b, _ in features])
+    values = np.concatenate([v for _, v in features])
+    # Expand every (row, token) pair into the token's feature run, as ImpactIndex._expand does for edges
+    ids = np.asarray(token_ids, dtype=np.int64)
+    runs = lengths[ids]
+    positions = np.repeat(starts[ids] - np.cumsum(runs) + runs, runs) + np.arange(int(runs.sum()), dtype=np.int64)
+    flat = np.repeat(np.asarray(rows, dtype=np.int64) * dim, runs) + buckets[positions]
+    matrix = np.bincount(flat, weights=values[positions] * np.repeat(np.asarray(weights, dtype=np.float32), runs), minlength=len(texts) * dim)
+    matrix = matrix.reshape(len(texts), dim).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+
+def _split(start: int, end: int, kind: str, name: str, max_lines: int) -> List[List[Any]]:
+    return [[s, min(end, s + max_lines - 1), kind, name] for s in range(start, end + 1, max_lines)]
+
+
+def _chunk_rows(tree: ast.Module, line_count: int, max_lines: int) -> List[List[Any]]:
+    """
+    Function and class boundaries of a module: top-level functions, classes
+    (a large class as its header plus one chunk per method) and runs of other
+    module-level statements. A short run right before a function or class
+    (a constant, a cache) joins it. Anything longer than max_lines is windowed.
+    """
+    rows: List[List[Any]] = []
+    pending: Optional[List[int]] = None  # [start, end] of module-level statements not yet emitted
+
+    def flush():
+        nonlocal pending
+        if pending:
+            rows.extend(_split(pending[0], pending[1], "module", "", max_lines))
+        pending = None
+
+    for node in tree.body:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", ())])
+        end = node.end_lineno or node.lineno
+        if isinstance(node, (*_FUNCTIONS, ast.ClassDef)) and pending and pending[1] - pending[0] < 2 and start - pending[1] <= 3:
+            start, pending = pending[0], None
+        if isinstance(node, _FUNCTIONS):
+            flush()
+            rows.extend(_split(start, end, "function", node.name, max_lines))
+        elif isinstance(node, ast.ClassDef):
+            flush()
+            methods = [n for n in node.body if isinstance(n, _FUNCTIONS)]
+            if end - start < max_lines or not methods:
+                rows.extend(_split(start, end, "class", node.name, max_lines))
+                continue
+            header_end = min(min([m.lineno] + [d.lineno for d in m.decorator_list]) for m in methods) - 1
+            rows.extend(_split(start, max(start, header_end), "class", node.name, max_lines))
+            for m in methods:
+                m_start = min([m.lineno] + [d.lineno for d in m.decorator_list])
+                rows.extend(_split(m_start, m.end_lineno or m.lineno, "method", f"{node.name}.{m.name}", max_lines))
+        elif pending and start - pending[1] <= 2 and end - pending[0] < max_lines:
+            pending[1] = end
+        else:
+            flush()
+            pending = [start, end]
+    flush()
+    if not rows and line_count:
+        rows = _split(1, line_count, "module", "", max_lines)
+    return rows
+
+
+def chunk_file(root_dir: str, rel: str) -> Optional[List[Any]]:
+    """
+    [content hash, chunk rows, float32 vectors as bytes] of a file, None when
+    it cannot be read. A file that does not parse is chunked in fixed windows.
+    """
+    dim, max_lines = settings.CODE_SEARCH_DIM, settings.CODE_SEARCH_CHUNK_LINES
+    try:
+        with open(os.path.join(root_dir, rel), "rb") as f:
+            data = f.read()
+    except OSError as e:
+        logger.debug(f"CODE SEARCH: Could not read {rel}: {e}")
+        return None
+    text = data.decode("utf-8", errors="replace")
+    lines = text.splitlines()
+    try:
+        rows = _chunk_rows(ast.parse(data, filename=rel), len(lines), max_lines)
+    except (SyntaxError, ValueError, RecursionError):
+        rows = _split(1, len(lines), "lines", "", max_lines) if lines else []
+    path_tokens = {t: _PATH_WEIGHT for t in _IDENTIFIER.findall(rel[:-3])}
+    extras = []
+    for _start, _end, _kind, name in rows:
+        extra = dict(path_tokens)
+        for part in name.split("."):
+            if part:
+                extra[part] = extra.get(part, 0.0) + _NAME_WEIGHT
+        extras.append(extra)
+    vectors = embed(["\n".join(lines[start - 1:end]) for start, end, _kind, _name in rows], dim, extras)
+    # The same digest as verify_cache.file_hash, from the bytes already read
+    return [xxhash.xxh3_128_hexdigest(data), rows, vectors.tobytes()]
+
+
+class SearchHit:
+    __slots__ = ("file", "start", "end", "kind", "name", "score")
+
+    def __init__(self, file: str, row: List[Any], score: float):
+        self.file = file
+        self.start, self.end, self.kind, self.name = row
+        self.score = score
+
+    def describe(self) -> str:
+        label = f"{self.kind} {self.name}" if self.name else self.kind
+        return f"{self.file}:{self.start}-{self.end} {label} ({self.score:.2f})"
+
+    def snippet(self, root_dir: str, max_lines: Optional[int] = None) -> str:
+        """
+        The chunk's source, read from the workspace (it may have changed
+        since indexing), cut to max_lines.
+        """
+        max_lines = max_lines or settings.CODE_SEARCH_SNIPPET_LINES
+        try:
+            with open(os.path.join(root_dir, self.file), encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()[self.start - 1:self.end]
+        except OSError:
+            return ""
+        if len(lines) > max_lines:
+            lines = lines[:max_lines] + [f"# ... {len(lines) - max_lines} more lines"]
+        return "\n".join(lines)
+
+
+class CodeSearchIndex:
+    """
+    Per-workspace semantic search over code chunks. Files are split on
+    function and class boundaries, each chunk is embedded with hashed
+    identifier n-grams (no model, no network) and the vectors live in a flat
+    inner-product faiss index, memory-mapped from .agent_artifacts/cache.
+
+    Refreshes re-embed only files whose content hash changed (files whose
+    mtime or size changed are hashed first). Queries weight their features
+    by inverse document frequency, so common identifiers ("self", "return")
+    count for little.
+    """
+    def __init__(self, root_dir: str, persist: bool = True):
+        self.root_dir = root_dir
+        self.persist = persist
+        self.dim = settings.CODE_SEARCH_DIM
+        self._files: Dict[str, List[Any]] = {} # file -> [hash, chunk rows], in index row order
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._offsets: Dict[str, int] = {} # file -> first row in the faiss index
+        self._rows: List[Tuple[str, int]] = [] # faiss row -> (file, chunk)
+        self._idf = np.ones(self.dim, dtype=np.float32)
+        self._index = None
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    @property
+    def path(self) -> str:
+        return os.path.join(cache_dir(self.root_dir), "code_search.faiss")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # --- Indexing ---
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Brings the index in line with the workspace. Returns what was done.
+        """
+        with self._lock:
+            started = time.monotonic()
+            from_index = False
+            if not self.loaded:
+                from_index = self._load()
+                self.loaded = True
+            stamps = scan_python_files(self.root_dir)
+            removed = [rel for rel in self._files if rel not in stamps]
+            changed: List[str] = []
+            for rel, stamp in stamps.items():
+                if self._stamps.get(rel) == stamp:
+                    continue
+                known = self._files.get(rel)
+                if known is not None and self._hash(rel) == known[0]:
+                    # Touched or rewritten with the same content: nothing to embed
+                    self._stamps[rel] = stamp
+                else:
+                    changed.append(rel)
+            embedded = {rel: entry for rel, entry in parse_files(chunk_file, self.root_dir, changed) if entry is not None}
+            if changed or removed:
+                self._rebuild(stamps, embedded)
+            result = {
+                "files": len(stamps), "embedded": len(embedded), "removed": len(removed), "chunks": len(self._rows),
+                "from_index": int(from_index), "seconds": round(time.monotonic() - started, 3),
+            }
+            if changed or removed:
+                logger.info(f"CODE SEARCH: {self.root_dir}: {result}")
+            return result
+
+    def _hash(self, rel: str) -> Optional[str]:
+        try:
+            return file_hash(os.path.join(self.root_dir, rel))
+        except OSError:
+            return None
+
+    def _rebuild(self, stamps: Dict[str, Tuple[int, int]], embedded: Dict[str, List[Any]]):
+        """
+        A new index with the vectors of unchanged files copied over and
+        those of changed files replaced, in sorted file order.
+        """
+        old = self._index.reconstruct_n(0, self._index.ntotal) if self._index is not None and self._index.ntotal else None
+        files: Dict[str, List[Any]] = {}
+        parts: List[np.ndarray] = []
+        for rel in sorted(stamps):
+            if rel in embedded:
+                file_hash, rows, data = embedded[rel]
+                vectors = np.frombuffer(data, dtype=np.float32).reshape(len(rows), self.dim)
+                self._stamps[rel] = stamps[rel]
+            elif rel in self._files and old is not None:
+                file_hash, rows = self._files[rel]
+                start = self._offsets[rel]
+                vectors = old[start:start + len(rows)]
+            else:
+                # Unreadable now and never indexed
+                continue
+            files[rel] = [file_hash, rows]
+            parts.append(vectors)
+        for rel in [rel for rel in self._stamps if rel not in files]:
+            del self._stamps[rel]
+        matrix = np.ascontiguousarray(np.concatenate(parts) if parts else np.empty((0, self.dim), dtype=np.float32))
+        index = faiss.IndexFlatIP(self.dim)
+        if len(matrix):
+            index.add(matrix)
+        df = np.count_nonzero(matrix, axis=0)
+        self._set(files, index, df)
+        self._save(df)
+
+    def _set(self, files: Dict[str, List[Any]], index: Any, df: np.ndarray):
+        self._files = files
+        self._index = index
+        self._offsets, self._rows = {}, []
+        for rel, (_hash, rows) in files.items():
+            self._offsets[rel] = len(self._rows)
+            self._rows.extend((rel, i) for i in range(len(rows)))
+        n = len(self._rows)
+        self._idf = (np.log((n + 1) / (np.asarray(df, dtype=np.float32) + 1)) + 1).astype(np.float32)
+
+    def _load(self) -> bool:
+        if not self.persist:
+            return False
+        meta = read_index(self.root_dir, "code_search", INDEX_VERSION)
+        if meta is None or meta.get("dim") != self.dim or meta.get("chunk_lines") != settings.CODE_SEARCH_CHUNK_LINES:
+            return False
+        try:
+            # Zero-copy: the vectors stay in the page cache, shared by every process searching this workspace
+            index = faiss.read_index(self.path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"CODE SEARCH: Ignoring unreadable index {self.path}: {e}")
+            return False
+        files = {rel: [file_hash, rows] for rel, (mtime_ns, size, file_hash, rows) in meta["files"].items()}
+        if index.d != self.dim or index.ntotal != sum(len(rows) for _hash, rows in files.values()):
+            # The faiss file and its metadata come from different writes
+            return False
+        self._stamps = {rel: (entry[0], entry[1]) for rel, entry in meta["files"].items()}
+        self._set(files, index, np.asarray(meta["df"]))
+        return True
+
+    def _save(self, df: np.ndarray):
+        if not self.persist:
+            return
+        try:
+            path = self.path
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            faiss.write_index(self._index, tmp)
+            os.replace(tmp, path)
+            self._index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"CODE SEARCH: Could not persist the index for {self.root_dir}: {e}")
+            return
+        write_index(self.root_dir, "code_search", {
+            "version": INDEX_VERSION,
+            "dim": self.dim,
+            "chunk_lines": settings.CODE_SEARCH_CHUNK_LINES,
+            "df": df.tolist(),
+            "files": {rel: [*self._stamps.get(rel, (0, 0)), *entry] for rel, entry in self._files.items()},
+        })
+
+    # --- Queries ---
+
+    def search(self, query: str, k: Optional[int] = None) -> List[SearchHit]:
+        """
+        The k chunks most similar to query (free text, identifiers or code),
+        best first.
+        """
+        k = k or settings.CODE_SEARCH_TOP_K
+        vector = embed([query], self.dim)[0]
+        with self._lock:
+            if self._index is None or not self._rows:
+                return []
+            vector *= self._idf
+            norm = float(np.linalg.norm(vector))
+            if not norm:
+                return []
+            # Over-fetched so the short-chunk prior can reorder the top k
+            scores, ids = self._index.search((vector / norm)[None, :], min(4 * k, len(self._rows)))
+            hits = []
+            for score, row in zip(scores[0].tolist(), ids[0].tolist()):
+                if row < 0 or score < settings.CODE_SEARCH_MIN_SCORE:
+                    continue
+                rel, chunk = self._rows[row]
+                hit = SearchHit(rel, self._files[rel][1][chunk], score)
+                lines = hit.end - hit.start + 1
+                if lines < _SHORT_CHUNK_LINES:
+                    hit.score *= 1 - 0.05 * (_SHORT_CHUNK_LINES - lines)
+                hits.append(hit)
+        hits.sort(key=lambda h: -h.score)
+        return hits[:k]
+
+    def render(self, hits: List[SearchHit], max_lines: Optional[int] = None) -> str:
+        """
+        Hits with their source, as prompt context.
+        """
+        blocks = []
+        for hit in hits:
+            blocks.append(f"# {hit.describe()}\n{hit.snippet(self.root_dir, max_lines)}")
+        return "\n\n".join(blocks)
+
+
+_indexes: Dict[str, CodeSearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def code_search_for(root_dir: str) -> Optional[CodeSearchIndex]:
+    """
+    The long-lived code search index of a workspace, None when code search
+    is disabled or faiss is not installed; callers refresh() it before searching.
+    """
+    if not settings.CODE_SEARCH_ENABLED or not HAS_FAISS:
+        return None
+    root = os.path.realpath(root_dir)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = CodeSearchIndex(root, persist=settings.KNOWLEDGE_GRAPH_PERSIST)
+    return index
+
+
+def forget_code_search(root_dir: str):
+    with _indexes_lock:
+        _indexes.pop(os.path.realpath(root_dir), None)
+
+
+SEARCH_HELP = "`search TEXT` (the code chunks most similar to a description, identifiers or a snippet)"
+
+
+def run_search(index: Optional[CodeSearchIndex], action: str) -> Optional[str]:
+    """
+    Answers a `search TEXT` action from the index; None when the action is
+    not a search.
+    """
+    verb, _, query = action.strip().partition(" ")
+    if verb != "search" or not query.strip():
+        return None
+    if index is None:
+        return "Code search is not available in this workspace; use the symbol queries."
+    hits = index.search(query)
+    if not hits:
+        return f"No code matches '{query.strip()}'."
+    return index.render(hits)
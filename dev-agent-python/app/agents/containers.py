@@ -0,0 +1,464 @@
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.agents.sandbox import DEFAULT_MAX_OUTPUT_BYTES, TIMEOUT_EXIT_CODE, OutputBuffer, communicate
+
+logger = logging.getLogger(__name__)
+
+
+class PoolClosed(RuntimeError):
+    """
+    The pool was closed (idle for too long, or its provider replaced) before the caller got a container.
+    """
+
+
+class ContainerRuntime:
+    """
+    Minimal container API used by ContainerPool.
+    Implementations must be thread-safe; the pool calls them from several threads.
+    """
+    def start(self, image: str, mount_root: Optional[str]) -> str:
+        """
+        Starts a long-lived idle container with mount_root (if any) bind-mounted at the same path.
+        Returns the container id.
+        """
+        raise NotImplementedError
+
+    def exec(
+        self,
+        container_id: str,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[str, str, int]:
+        raise NotImplementedError
+
+    async def aexec(
+        self,
+        container_id: str,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES
+    ) -> Tuple[str, str, int]:
+        """
+        Asyncio variant of exec. Runtimes without a native implementation run
+        exec on a worker thread and replay stdout to log_callback afterwards.
+        """
+        stdout, stderr, code = await asyncio.to_thread(self.exec, container_id, cmd, cwd, env, stdin, timeout)
+        if log_callback:
+            for line in stdout.splitlines():
+                log_callback(line)
+        return stdout, stderr, code
+
+    def is_dirty(self, container_id: str) -> bool:
+        """
+        True when the container kept state outside the bind mount (changed files,
+        stray processes) and must not be handed to another command.
+        """
+        raise NotImplementedError
+
+    def remove(self, container_id: str):
+        raise NotImplementedError
+
+
+class DockerCliRuntime(ContainerRuntime):
+    """
+    ContainerRuntime backed by the docker CLI.
+    """
+    def __init__(
+        self,
+        docker: str = "docker",
+        network: str = "none",
+        memory: Optional[str] = None,
+        cpus: Optional[str] = None,
+        user: Optional[str] = None
+    ):
+        self.docker = docker
+        self.network = network
+        self.memory = memory
+        self.cpus = cpus
+        # Files written into the bind mount belong to the worker, not to root
+        self.user = user or f"{os.getuid()}:{os.getgid()}"
+
+    def _docker(self, *args: str, timeout: float = 60, stdin: Optional[str] = None) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [self.docker, *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+
+    def start(self, image: str, mount_root: Optional[str]) -> str:
+        args = [
+            "run", "-d", "--rm", "--init",
+            "--name", f"agent-sandbox-{uuid.uuid4().hex[:12]}",
+            "--label", "agent-sandbox=1",
+            "--network", self.network,
+            "--user", self.user,
+            # The host uid usually has no home in the image
+            "-e", "HOME=/tmp",
+        ]
+        if mount_root:
+            args += ["-v", f"{mount_root}:{mount_root}", "-w", mount_root]
+        if self.memory:
+            args += ["--memory", self.memory]
+        if self.cpus:
+            args += ["--cpus", self.cpus]
+        # Keep the container alive without a shell; commands arrive through exec
+        args += [image, "sleep", "infinity"]
+        result = self._docker(*args, timeout=120)
+        if result.returncode != 0:
+            raise RuntimeError(f"docker run failed: {result.stderr.strip()}")
+        return result.stdout.strip()
+
+    def exec(
+        self,
+        container_id: str,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[str, str, int]:
+        args = self._exec_args(container_id, cmd, cwd, env, stdin is not None)
+        try:
+            result = self._docker(*args, timeout=timeout, stdin=stdin)
+        except subprocess.TimeoutExpired as e:
+            # Only the CLI client dies here; the pool recycles the container to kill the command
+            out = e.stdout.decode("utf-8", errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+            return out, "TimeoutExpired", TIMEOUT_EXIT_CODE
+        return result.stdout, result.stderr, result.returncode
+
+    async def aexec(
+        self,
+        container_id: str,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES
+    ) -> Tuple[str, str, int]:
+        """
+        Streams the exec's stdout line by line into log_callback while it runs.
+        A timeout or cancellation kills the CLI client only; the caller
+        recycles the container to stop the command inside.
+        """
+        args = self._exec_args(container_id, cmd, cwd, env, stdin is not None)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.docker, *args,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            return "", str(e), 1
+
+        stdout_buf = OutputBuffer(max_output_bytes)
+        stderr_buf = OutputBuffer(max_output_bytes)
+        try:
+            returncode = await asyncio.wait_for(communicate(process, stdin, stdout_buf, stderr_buf, log_callback), timeout)
+        except asyncio.TimeoutError:
+            await self._kill_client(process)
+            return stdout_buf.getvalue(), "TimeoutExpired", TIMEOUT_EXIT_CODE
+        except asyncio.CancelledError:
+            await self._kill_client(process)
+            raise
+        if stdout_buf.dropped_bytes:
+            logger.warning(f"Container output capped: dropped {stdout_buf.dropped_bytes} bytes from {cmd[0]}")
+        return stdout_buf.getvalue(), stderr_buf.getvalue(), returncode
+
+    @staticmethod
+    def _exec_args(container_id: str, cmd: List[str], cwd: Optional[str], env: Optional[Dict[str, str]], interactive: bool) -> List[str]:
+        args = ["exec"]
+        if interactive:
+            args.append("-i")
+        if cwd:
+            args += ["-w", cwd]
+        for key, value in (env or {}).items():
+            args += ["-e", f"{key}={value}"]
+        return args + [container_id, *cmd]
+
+    @staticmethod
+    async def _kill_client(process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    def is_dirty(self, container_id: str) -> bool:
+        try:
+            # Anything besides init and the keep-alive sleep is a leftover background process
+            top = self._docker("top", container_id, "-eo", "pid,comm", timeout=10)
+            if top.returncode != 0:
+                return True
+            processes = [line.split()[-1] for line in top.stdout.splitlines()[1:] if line.strip()]
+            if any(p not in ("docker-init", "tini", "sleep") for p in processes):
+                return True
+            # Writes to the bind mount are expected; anything else changed the image layer
+            diff = self._docker("diff", container_id, timeout=10)
+            return diff.returncode != 0 or bool(diff.stdout.strip())
+        except subprocess.TimeoutExpired:
+            return True
+
+    def remove(self, container_id: str):
+        try:
+            self._docker("rm", "-f", container_id, timeout=30)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"CONTAINER POOL: Timed out removing {container_id[:12]}")
+
+
+class _PooledContainer:
+    __slots__ = ("id", "uses", "idle_since")
+
+    def __init__(self, container_id: str):
+        self.id = container_id
+        self.uses = 0
+        self.idle_since = time.monotonic()
+
+
+class ContainerPool:
+    """
+    Pre-started containers for one (image, mount root).
+    Commands borrow an idle container and run through exec, so they skip
+    container startup. A container is recycled after max_uses commands, after
+    a timeout, or when the dirty-state check (run after a failed command)
+    finds leftovers. The number of warm
+    idle containers follows queue depth: min_idle plus the callers currently
+    waiting, bounded by max_size in total; surplus idle containers are removed
+    after idle_ttl seconds.
+    """
+    def __init__(
+        self,
+        runtime: ContainerRuntime,
+        image: str,
+        mount_root: Optional[str],
+        min_idle: int = 1,
+        max_size: int = 8,
+        max_uses: int = 50,
+        idle_ttl: float = 300.0,
+        check_dirty: bool = True
+    ):
+        self.runtime = runtime
+        self.image = image
+        self.mount_root = mount_root
+        self.min_idle = min_idle
+        self.max_size = max_size
+        self.max_uses = max_uses
+        self.idle_ttl = idle_ttl
+        self.check_dirty = check_dirty
+        self._idle: Deque[_PooledContainer] = deque()
+        self._busy = 0
+        self._starting = 0
+        self._waiting = 0
+        self._closed = False
+        self._last_used = time.monotonic()
+        self._cond = threading.Condition()
+        self.stats: Dict[str, float] = {
+            "started": 0,
+            "start_failures": 0,
+            "reused": 0,
+            "recycled_max_uses": 0,
+            "recycled_dirty": 0,
+            "scaled_down": 0,
+            "acquire_wait_total": 0.0,
+            "acquire_wait_max": 0.0,
+            "acquires": 0,
+        }
+
+    # --- Borrow / Return ---
+
+    def acquire(self, timeout: Optional[float] = None) -> _PooledContainer:
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Container pool is closed")
+                    if self._idle:
+                        container = self._idle.pop()  # most recently used: warmest caches
+                        self._busy += 1
+                        if container.uses:
+                            self.stats["reused"] += 1
+                        break
+                    if self._size() < self.max_size:
+                        self._starting += 1
+                        container = None
+                        break
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No container available for {self.image} within {timeout}s")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        if container is None:
+            # Cold start on the caller's thread; the pool was empty and had room
+            container = self._start_container()
+            with self._cond:
+                self._starting -= 1
+                if container is None:
+                    self._cond.notify()
+                    raise RuntimeError(f"Could not start a container for {self.image}")
+                self._busy += 1
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._last_used = time.monotonic()
+            self.stats["acquires"] += 1
+            self.stats["acquire_wait_total"] += waited
+            self.stats["acquire_wait_max"] = max(self.stats["acquire_wait_max"], waited)
+        self._scale()
+        return container
+
+    def release(self, container: _PooledContainer, dirty: bool = False, suspect: bool = False):
+        """
+        Returns a container. dirty recycles it outright; suspect (the command
+        failed) runs the dirty-state check first, which costs docker CLI calls.
+        """
+        container.uses += 1
+        reason = None
+        if dirty:
+            reason = "recycled_dirty"
+        elif container.uses >= self.max_uses:
+            reason = "recycled_max_uses"
+        elif suspect and self.check_dirty and self.runtime.is_dirty(container.id):
+            reason = "recycled_dirty"
+
+        with self._cond:
+            self._busy -= 1
+            self._last_used = time.monotonic()
+            if reason is None and not self._closed:
+                container.idle_since = time.monotonic()
+                self._idle.append(container)
+            else:
+                self.stats[reason or "scaled_down"] += 1
+            self._cond.notify()
+
+        if reason is not None or self._closed:
+            self._remove_async(container.id)
+        self._scale()
+
+    # --- Sizing ---
+
+    def _size(self) -> int:
+        return len(self._idle) + self._busy + self._starting
+
+    def _scale(self):
+        """
+        Starts warm containers up to min_idle + queue depth, and removes idle
+        containers that have been surplus for longer than idle_ttl.
+        """
+        to_start = 0
+        expired: List[_PooledContainer] = []
+        with self._cond:
+            if self._closed:
+                return
+            target_idle = self.min_idle + self._waiting
+            deficit = target_idle - len(self._idle) - self._starting
+            to_start = max(0, min(deficit, self.max_size - self._size()))
+            self._starting += to_start
+
+            now = time.monotonic()
+            while len(self._idle) > target_idle and now - self._idle[0].idle_since > self.idle_ttl:
+                expired.append(self._idle.popleft())
+                self.stats["scaled_down"] += 1
+
+        for container in expired:
+            self._remove_async(container.id)
+        for _ in range(to_start):
+            threading.Thread(target=self._prewarm, name="container-prewarm", daemon=True).start()
+
+    def _prewarm(self):
+        container = self._start_container()
+        with self._cond:
+            self._starting -= 1
+            if container is not None and not self._closed:
+                self._idle.append(container)
+            elif container is not None:
+                self._remove_async(container.id)
+            self._cond.notify()
+
+    def _start_container(self) -> Optional[_PooledContainer]:
+        try:
+            container_id = self.runtime.start(self.image, self.mount_root)
+        except Exception as e:
+            logger.warning(f"CONTAINER POOL: Failed to start {self.image}: {e}")
+            with self._cond:
+                self.stats["start_failures"] += 1
+            return None
+        with self._cond:
+            self.stats["started"] += 1
+        logger.debug(f"CONTAINER POOL: Started {container_id[:12]} ({self.image}, {self.mount_root})")
+        return _PooledContainer(container_id)
+
+    def _remove_async(self, container_id: str):
+        threading.Thread(target=self.runtime.remove, args=(container_id,), name="container-remove", daemon=True).start()
+
+    # --- Lifecycle ---
+
+    def unused_for(self) -> float:
+        """
+        Seconds since the last command, or 0 while one is running or waiting.
+        """
+        with self._cond:
+            if self._busy or self._starting or self._waiting:
+                return 0.0
+            return time.monotonic() - self._last_used
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            acquires = self.stats["acquires"]
+            return {
+                "idle": len(self._idle),
+                "busy": self._busy,
+                "starting": self._starting,
+                "waiting": self._waiting,
+                **{k: int(v) for k, v in self.stats.items() if not k.startswith("acquire_wait")},
+                "avg_acquire_ms": round(self.stats["acquire_wait_total"] / acquires * 1000, 1) if acquires else 0.0,
+                "max_acquire_ms": round(self.stats["acquire_wait_max"] * 1000, 1),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for container in idle:
+            self.runtime.remove(container.id)
+
+
+def mount_root_for(cwd: Optional[str], workspace_root: str) -> Optional[str]:
+    """
+    The host directory to bind-mount for a command: the job's directory (the
+    first level under the workspace root) when cwd is inside one, so a
+    container never sees another job's workspace; else cwd itself. None
+    (nothing mounted) without a cwd.
+    """
+    if not cwd:
+        return None
+    root = os.path.realpath(workspace_root)
+    path = os.path.realpath(cwd)
+    if path.startswith(root + os.sep):
+        return os.path.join(root, os.path.relpath(path, root).split(os.sep, 1)[0])
+    return path
@@ -6,6 +6,7 @@ from app.agents.nodes.tester import tester_node
 from app.agents.nodes.manager import repo_prep_node, committer_node
 from app.agents.nodes.orchestrator import strategy_node, scheduler_node, completion_check_node
 from app.agents.nodes.react import react_node
+from app.agents.nodes.parallel import parallel_executor_node
 
 def route_next_node(state: AgentState):
     """
@@ -19,6 +20,9 @@ def route_next_node(state: AgentState):
     
     if status == "task_scheduled":
          return "coder"
+
+    if status == "parallel_scheduled":
+         return "parallel_executor"
          
     if status == "starting":
          return "repo_prep"
@@ -56,6 +60,7 @@ workflow.add_node("planner", planner_node)
 workflow.add_node("strategy", strategy_node)
 workflow.add_node("scheduler", scheduler_node)
 workflow.add_node("reasoner", react_node)
+workflow.add_node("parallel_executor", parallel_executor_node)
 workflow.add_node("coder", coder_node)
 workflow.add_node("tester", tester_node)
 workflow.add_node("committer", committer_node)
@@ -68,8 +73,10 @@ workflow.add_edge("repo_prep", "planner")
 workflow.add_edge("planner", "strategy")
 workflow.add_edge("strategy", "scheduler")
 
-# Scheduler Logic: Reasoner, Coder, or Completion Checker
+# Scheduler Logic: Parallel Executor, Reasoner, Coder, or Completion Checker
 def schedule_gate(state: AgentState):
+    if state.get("status") == "parallel_scheduled":
+        return "parallel_executor"
     if state.get("status") != "task_scheduled":
         return "completion_checker"
     if state.get("strategy") == "react-mode":
@@ -82,12 +89,16 @@ workflow.add_conditional_edges(
     {
         "coder": "coder",
         "reasoner": "reasoner",
+        "parallel_executor": "parallel_executor",
         "completion_checker": "completion_checker"
     }
 )
 
 workflow.add_edge("reasoner", "coder")
 
+# Parallel Executor: merged tasks are completed; what it handed back is scheduled serially
+workflow.add_edge("parallel_executor", "scheduler")
+
 workflow.add_edge("coder", "tester")
 
 # Tester Logic: Retry Coder or proceed to Commit
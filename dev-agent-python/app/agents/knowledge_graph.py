@@ -1,57 +1,418 @@
+import ast
+import json
 import os
 import logging
-from typing import List, Dict, Set
-# Note: tree_sitter and tree_sitter_languages must be installed
-# mocking imports for now if environment is not set up
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.agents.impact_index import ImpactIndex
+
 try:
-    from tree_sitter_languages import get_language, get_parser
-    HAS_TREE_SITTER = True
+    import ormsgpack
+    HAS_MSGPACK = True
 except ImportError:
-    HAS_TREE_SITTER = False
+    HAS_MSGPACK = False
 
 logger = logging.getLogger(__name__)
 
+# Directories never scanned for source files
+SKIP_DIRS = {".git", ".hg", ".venv", "venv", "env", "node_modules", "__pycache__", ".mypy_cache", ".ruff_cache", ".pytest_cache", ".tox", ".agent_artifacts", "build", "dist"}
+
+# Bumped when the index layout or the import extraction changes; older indexes are rebuilt
+INDEX_VERSION = 1
+
+
+def module_names(rel_path: str) -> List[str]:
+    """
+    Importable names for a file: relative to the root, and relative to src/ for src layouts.
+    """
+    parts = rel_path[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    names = [".".join(parts)] if parts else []
+    if len(parts) > 1 and parts[0] == "src":
+        names.append(".".join(parts[1:]))
+    return names
+
+
+def parse_imports(root_dir: str, rel: str) -> Optional[List[str]]:
+    """
+    Dotted names a file imports, relative imports resolved against its package;
+    "from a import b" yields both "a" and "a.b". None when the file does not parse.
+    """
+    try:
+        with open(os.path.join(root_dir, rel), "rb") as f:
+            tree = ast.parse(f.read(), filename=rel)
+    except (OSError, SyntaxError, ValueError) as e:
+        logger.debug(f"KNOWLEDGE GRAPH: Could not parse {rel}: {e}")
+        return None
+
+    names = module_names(rel)
+    package = names[0].split(".") if names else []
+    if not rel.endswith("__init__.py"):
+        package = package[:-1]
+    imported: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imported.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package[:len(package) - node.level + 1] if node.level <= len(package) + 1 else []
+                prefix = ".".join(base + ([node.module] if node.module else []))
+            else:
+                prefix = node.module or ""
+            if prefix:
+                imported.add(prefix)
+            for alias in node.names:
+                if alias.name != "*":
+                    imported.add(f"{prefix}.{alias.name}" if prefix else alias.name)
+    return sorted(imported)
+
+
+def scan_python_files(root_dir: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Every Python file under root_dir (relative path) with its (mtime_ns, size),
+    from one directory walk.
+    """
+    stamps: Dict[str, Tuple[int, int]] = {}
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root_dir, rel_dir) if rel_dir else root_dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS and not entry.name.endswith(".egg-info"):
+                            stack.append(rel)
+                    elif entry.name.endswith(".py"):
+                        st = entry.stat()
+                        stamps[rel] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+    return stamps
+
+
+def _parse_batch(args: Tuple[Callable[[str, str], Any], str, List[str]]) -> List[Tuple[str, Any]]:
+    # Process pool entry point: one task per batch keeps pickling overhead per file small
+    parse, root_dir, rels = args
+    return [(rel, parse(root_dir, rel)) for rel in rels]
+
+
+def parse_files(parse: Callable[[str, str], Any], root_dir: str, rels: List[str]) -> List[Tuple[str, Any]]:
+    """
+    (rel, parse(root_dir, rel)) for every file, across a process pool when
+    there are at least KNOWLEDGE_GRAPH_PARALLEL_MIN_FILES. parse must be a
+    module-level function so it can be pickled.
+    """
+    workers = settings.KNOWLEDGE_GRAPH_WORKERS or os.cpu_count() or 1
+    if workers > 1 and len(rels) >= settings.KNOWLEDGE_GRAPH_PARALLEL_MIN_FILES:
+        size = max(16, len(rels) // (workers * 4))
+        batches = [(parse, root_dir, rels[i:i + size]) for i in range(0, len(rels), size)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return [item for batch in pool.map(_parse_batch, batches) for item in batch]
+        except Exception as e:
+            # e.g. daemonic worker processes may not have children; parse in-process instead
+            logger.warning(f"KNOWLEDGE GRAPH: Process pool unavailable ({e}); parsing {len(rels)} files serially.")
+    return [(rel, parse(root_dir, rel)) for rel in rels]
+
+
+def index_path(root_dir: str, name: str) -> str:
+    """
+    Where a persisted per-workspace index named name lives.
+    """
+    return os.path.join(root_dir, ".agent_artifacts", "cache", f"{name}.msgpack" if HAS_MSGPACK else f"{name}.json")
+
+
+def read_index(root_dir: str, name: str, version: int) -> Optional[Dict[str, Any]]:
+    """
+    A persisted index, None when missing, unreadable or of another version.
+    """
+    path = index_path(root_dir, name)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        index = ormsgpack.unpackb(data) if HAS_MSGPACK else json.loads(data)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"KNOWLEDGE GRAPH: Ignoring unreadable index {path}: {e}")
+        return None
+    return index if isinstance(index, dict) and index.get("version") == version else None
+
+
+def write_index(root_dir: str, name: str, index: Dict[str, Any]):
+    # Imported lazily: verify_cache itself imports SKIP_DIRS from this module
+    from app.agents.logic.verify_cache import cache_dir
+
+    try:
+        path = os.path.join(cache_dir(root_dir), os.path.basename(index_path(root_dir, name)))
+        data = ormsgpack.packb(index) if HAS_MSGPACK else json.dumps(index, separators=(",", ":")).encode()
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"KNOWLEDGE GRAPH: Could not persist {name} for {root_dir}: {e}")
+
+
 class KnowledgeGraph:
     """
-    Builds a dependency graph of the codebase using Tree-Sitter.
+    Builds a dependency graph of the codebase from Python imports (stdlib ast).
     Enables 'Impact Analysis' to see what breaks when a file changes.
+    Files are keyed by their path relative to root_dir, with forward slashes.
+
+    Imports are parsed across a process pool when many files need parsing,
+    and the graph is persisted per workspace (.agent_artifacts/cache) with each
+    file's mtime and size, so a later build only re-parses the files that changed.
     """
-    def __init__(self, root_dir: str = "."):
+    def __init__(self, root_dir: str = ".", persist: bool = True):
         self.root_dir = root_dir
+        self.persist = persist
         self.graph: Dict[str, Set[str]] = {} # file -> {imported_by...}
         self.reverse_graph: Dict[str, Set[str]] = {} # file -> {imports...}
+        self.modules: Dict[str, str] = {} # dotted module name -> file
+        self._imports: Dict[str, Set[str]] = {} # file -> {imported module names...}
+        self._stamps: Dict[str, Tuple[int, int]] = {} # file -> (mtime_ns, size) when parsed
+        self._lock = threading.RLock()
+        self.built = False
+        self.last_build: Dict[str, float] = {}
+        # Bumped whenever edges change; the impact index is rebuilt lazily when it is stale
+        self.version = 0
+        self._impact = None
+
+    module_names = staticmethod(module_names)
 
     def build_graph(self):
-        """Scans the codebase and builds the graph."""
-        if not HAS_TREE_SITTER:
-            logger.warning("Tree-Sitter not installed. Knowledge Graph disabled.")
-            return
+        """
+        Scans the codebase and builds the graph. Files whose mtime and size
+        match the persisted index (or the graph already in memory) are not
+        re-parsed; the rest are, in parallel when there are many.
+        """
+        with self._lock:
+            started = time.monotonic()
+            stamps = scan_python_files(self.root_dir)
+            loaded = False
+            if not self.built:
+                loaded = self._load_index()
+            stale = [rel for rel, stamp in stamps.items() if self._stamps.get(rel) != stamp]
+            removed = [rel for rel in self._imports if rel not in stamps]
+            modules_changed = bool(removed) or any(rel not in self._imports for rel in stale)
+
+            for rel in removed:
+                for name in self.module_names(rel):
+                    self.modules.pop(name, None)
+                self._imports.pop(rel, None)
+                for target in self.reverse_graph.pop(rel, set()):
+                    self.graph.get(target, set()).discard(rel)
+            for rel in stale:
+                self._register(rel)
+            for rel, imported in parse_files(parse_imports, self.root_dir, stale):
+                if imported is None:
+                    # Keep the previous edges of a file that no longer parses; it is being edited
+                    self._imports.setdefault(rel, set())
+                else:
+                    self._imports[rel] = set(imported)
+            # Edges of unchanged files stay valid unless a module appeared or disappeared
+            self._link(list(self._imports) if modules_changed else stale)
+            self._stamps = stamps
+            self.built = True
+            if stale or removed or not loaded:
+                self._save_index()
+            self.last_build = {
+                "files": len(stamps), "parsed": len(stale), "removed": len(removed),
+                "from_index": int(loaded), "seconds": round(time.monotonic() - started, 3),
+            }
+            logger.info(f"KNOWLEDGE GRAPH: Indexed {len(stamps)} files under {self.root_dir} ({len(stale)} parsed, {len(removed)} removed) in {self.last_build['seconds']}s.")
 
-        for root, _, files in os.walk(self.root_dir):
+    def iter_python_files(self) -> Iterable[str]:
+        for root, dirs, files in os.walk(self.root_dir):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.endswith(".egg-info")]
             for file in files:
                 if file.endswith(".py"):
                     full_path = os.path.join(root, file)
-                    self._parse_file(full_path)
+                    yield os.path.relpath(full_path, self.root_dir).replace(os.sep, "/")
 
-    def _parse_file(self, file_path: str):
-        # TODO: Implement actual Tree-Sitter parsing logic here
-        # For now, we'll use a naive regex fallback if TS fails or for simplicity in this stub
-        pass
+    def _register(self, rel: str):
+        for name in self.module_names(rel):
+            self.modules[name] = rel
+
+    def _parse_file(self, rel: str):
+        imported = parse_imports(self.root_dir, rel)
+        if imported is None:
+            # Keep the previous edges of a file that no longer parses; it is being edited
+            self._imports.setdefault(rel, set())
+            return
+        self._imports[rel] = set(imported)
+
+    def _resolve(self, name: str) -> Optional[str]:
+        # "a.b.c" may be a module, or an attribute of module "a.b" / package "a"
+        while name:
+            if name in self.modules:
+                return self.modules[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def _link(self, files: Iterable[str]):
+        self.version += 1
+        for rel in files:
+            for target in self.reverse_graph.get(rel, ()):
+                self.graph.get(target, set()).discard(rel)
+            targets = {t for t in (self._resolve(name) for name in self._imports.get(rel, ())) if t and t != rel}
+            self.reverse_graph[rel] = targets
+            for target in targets:
+                self.graph.setdefault(target, set()).add(rel)
+
+    def refresh(self, paths: Iterable[str]):
+        """
+        Re-indexes the given files (relative paths): changed, added or deleted.
+        Adding or removing a module can change how other files' imports resolve,
+        so those trigger a relink of every file.
+        """
+        with self._lock:
+            if not self.built:
+                self.build_graph()
+                return
+            changed = []
+            modules_changed = False
+            for rel in paths:
+                if not rel.endswith(".py"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.root_dir, rel))
+                except OSError:
+                    st = None
+                known = rel in self._imports
+                if st is None:
+                    if known:
+                        for name in self.module_names(rel):
+                            self.modules.pop(name, None)
+                        self._imports.pop(rel, None)
+                        self._stamps.pop(rel, None)
+                        for target in self.reverse_graph.pop(rel, set()):
+                            self.graph.get(target, set()).discard(rel)
+                        modules_changed = True
+                    continue
+                stamp = (st.st_mtime_ns, st.st_size)
+                if known and self._stamps.get(rel) == stamp:
+                    continue
+                if not known:
+                    self._register(rel)
+                    modules_changed = True
+                self._parse_file(rel)
+                self._stamps[rel] = stamp
+                changed.append(rel)
+            self._link(list(self._imports) if modules_changed else changed)
+            if changed or modules_changed:
+                self._save_index()
+
+    # --- Persistent index ---
+
+    def _load_index(self) -> bool:
+        """
+        Restores imports, edges and stamps from the persisted index. Entries are
+        only trusted while their file's stamp matches; build_graph re-parses the rest.
+        """
+        if not self.persist:
+            return False
+        index = read_index(self.root_dir, "knowledge_graph", INDEX_VERSION)
+        if index is None:
+            return False
+
+        files = index["files"]
+        self.graph, self.reverse_graph, self.modules, self._imports, self._stamps = {}, {}, {}, {}, {}
+        for rel, (mtime_ns, size, imported, targets) in files.items():
+            self._stamps[rel] = (mtime_ns, size)
+            self._imports[rel] = set(imported)
+            self.reverse_graph[rel] = set(targets)
+            self._register(rel)
+        for rel, targets in self.reverse_graph.items():
+            for target in targets:
+                self.graph.setdefault(target, set()).add(rel)
+        self.version += 1
+        return True
+
+    def _save_index(self):
+        if not self.persist:
+            return
+        index = {
+            "version": INDEX_VERSION,
+            "files": {
+                rel: [*self._stamps.get(rel, (0, 0)), sorted(imported), sorted(self.reverse_graph.get(rel, ()))]
+                for rel, imported in self._imports.items()
+            },
+        }
+        write_index(self.root_dir, "knowledge_graph", index)
+
+    # --- Queries ---
+
+    def importers_of(self, rel_path: str) -> Set[str]:
+        """
+        Files whose imports name the module at rel_path. Unlike graph, this also
+        works after the file was deleted, when those imports no longer resolve.
+        """
+        names = self.module_names(rel_path)
+        return {
+            rel for rel, imported in self._imports.items()
+            if any(i == n or i.startswith(n + ".") for i in imported for n in names)
+        }
 
     def get_impacted_files(self, changed_file: str) -> List[str]:
         """Returns a list of files that depend on the changed file."""
-        # Simple BFS
-        impacted = set()
-        queue = [changed_file]
-        
-        while queue:
-            current = queue.pop(0)
-            if current in self.graph:
-                for dependent in self.graph[current]:
-                    if dependent not in impacted:
-                        impacted.add(dependent)
-                        queue.append(dependent)
-        
-        return list(impacted)
-
-knowledge_graph = KnowledgeGraph()
+        return list(self.get_impacted_set([changed_file]) - {changed_file})
+
+    def get_impacted_set(self, changed_files: Iterable[str], max_depth: Optional[int] = None) -> Set[str]:
+        """
+        The changed files plus every file that imports one of them, transitively
+        (up to max_depth import hops when given), for the whole changeset at once.
+        """
+        return self.impact_index().impacted(changed_files, max_depth)
+
+    def impact_index(self) -> "ImpactIndex":
+        """
+        The CSR snapshot of the current graph that answers impact queries.
+        """
+        # Imported lazily: numpy is only needed once impact is queried
+        from app.agents.impact_index import ImpactIndex
+
+        with self._lock:
+            if self._impact is None or self._impact[0] != self.version:
+                self._impact = (self.version, ImpactIndex(self.graph, self._imports))
+            return self._impact[1]
+
+
+_graphs: Dict[str, KnowledgeGraph] = {}
+_graphs_lock = threading.Lock()
+
+
+def graph_for(root_dir: str) -> KnowledgeGraph:
+    """
+    The long-lived graph for a workspace; callers refresh() it with the files they changed.
+    """
+    root = os.path.realpath(root_dir)
+    with _graphs_lock:
+        graph = _graphs.get(root)
+        if graph is None:
+            graph = _graphs[root] = KnowledgeGraph(root, persist=settings.KNOWLEDGE_GRAPH_PERSIST)
+    return graph
+
+
+def forget_graph(root_dir: str):
+    """
+    Drops a workspace's graph, e.g. when a task worktree is removed.
+    """
+    with _graphs_lock:
+        _graphs.pop(os.path.realpath(root_dir), None)
+
+knowledge_graph = KnowledgeGraph(persist=False)
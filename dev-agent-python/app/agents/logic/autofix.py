@@ -0,0 +1,285 @@
+import glob
+import importlib.machinery
+import importlib.metadata
+import logging
+import os
+import re
+import site
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.agents.knowledge_graph import graph_for
+from app.agents.logic.classifier import ErrorClass
+from app.agents.logic.diagnostics import DiagnosticSet
+from app.agents.logic.verify_cache import cache_dir, file_hash, venv_dir, workspace_python
+from app.agents.sandbox import LocalSandbox, TIMEOUT_EXIT_CODE
+from app.core.config import settings
+from app.core.stream import log_streamer
+from app.tools.type_daemons import type_daemons
+
+logger = logging.getLogger(__name__)
+
+# Missing-module messages: mypy (import-not-found / import-untyped) and ImportError tracebacks from pytest
+_MISSING_MODULE = (
+    re.compile(r'Cannot find implementation or library stub for module named "(?P<module>[\w.]+)"'),
+    re.compile(r"No module named '(?P<module>[\w.]+)'"),
+)
+_MISSING_STUBS = re.compile(r'Library stubs not installed for "(?P<module>[\w.]+)"')
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _venv_site_packages(repo_path: str) -> List[str]:
+    return glob.glob(os.path.join(venv_dir(repo_path), "lib", "python*", "site-packages"))
+
+
+def _importable(repo_path: Optional[str], module: str) -> bool:
+    """
+    Whether the workspace's interpreter finds the module: its venv's
+    site-packages, then the worker's that the venv is layered over.
+    """
+    paths = (_venv_site_packages(repo_path) if repo_path else []) + site.getsitepackages()
+    return importlib.machinery.PathFinder.find_spec(module, paths) is not None
+
+
+class FixResult:
+    __slots__ = ("ruff_fixed", "formatted", "packages", "errors", "duration")
+
+    def __init__(self):
+        self.ruff_fixed: List[str] = []  # files ruff --fix changed
+        self.formatted: List[str] = []  # files ruff format changed
+        self.packages: List[str] = []  # distributions installed
+        self.errors: List[str] = []
+        self.duration = 0.0
+
+    @property
+    def applied(self) -> bool:
+        return bool(self.ruff_fixed or self.formatted or self.packages)
+
+    def describe(self) -> str:
+        parts = []
+        if self.ruff_fixed:
+            parts.append(f"ruff --fix changed {len(self.ruff_fixed)} file(s)")
+        if self.formatted:
+            parts.append(f"formatted {len(self.formatted)} file(s)")
+        if self.packages:
+            parts.append(f"installed {', '.join(self.packages)}")
+        return "; ".join(parts) or "nothing to fix"
+
+
+class AutoFixStats:
+    """
+    Per-job auto-fix runs and the LLM retries they made unnecessary, for the
+    job's final metrics. A retry is a reflection call plus a coder call.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = {}
+
+    def record(self, job_id: str, result: FixResult, resolved: bool):
+        with self._lock:
+            e = self._jobs.setdefault(job_id, {"runs": 0, "applied": 0, "ruff_fixed_files": 0, "formatted_files": 0, "packages_installed": 0, "retries_avoided": 0, "total_s": 0.0})
+            e["runs"] += 1
+            e["applied"] += int(result.applied)
+            e["ruff_fixed_files"] += len(result.ruff_fixed)
+            e["formatted_files"] += len(result.formatted)
+            e["packages_installed"] += len(result.packages)
+            e["retries_avoided"] += int(resolved)
+            e["total_s"] += result.duration
+
+    def avoided(self, job_id: str) -> int:
+        with self._lock:
+            return self._jobs.get(job_id, {}).get("retries_avoided", 0)
+
+    def pop(self, job_id: str) -> Dict:
+        with self._lock:
+            e = self._jobs.pop(job_id, None)
+        if e is None:
+            return {}
+        return {**e, "llm_calls_avoided": e["retries_avoided"] * 2, "total_s": round(e["total_s"], 2)}
+
+
+class AutoFixer:
+    """
+    Deterministic fixes the tester applies before spending an LLM retry:
+    `ruff check --fix` on files with lint findings, `ruff format` on those and
+    the job's changed files, and installing the distribution behind a missing
+    import when the module is in AUTOFIX_PACKAGES (stub packages from
+    AUTOFIX_STUB_PACKAGES), recorded in the workspace's requirements file.
+    Packages go into the workspace's own venv (.agent_artifacts/cache/venv),
+    never the worker's interpreter, at the version the workspace's
+    requirements file asks for when it lists one.
+    The caller re-verifies afterwards; only what remains goes to the coder.
+    """
+    def __init__(self, sandbox: Optional[LocalSandbox] = None):
+        self.sandbox = sandbox or LocalSandbox()
+        self.stats = AutoFixStats()
+
+    def fixable(self, repo_path: str, diagnostics: DiagnosticSet) -> bool:
+        """
+        Whether anything in the findings is worth a fix attempt.
+        """
+        if settings.AUTOFIX_RUFF and self._ruff_files(diagnostics):
+            return True
+        return settings.AUTOFIX_INSTALL_PACKAGES and bool(self._missing_packages(diagnostics, repo_path))
+
+    @staticmethod
+    def _ruff_files(diagnostics: DiagnosticSet) -> List[str]:
+        # Syntax errors are reported by ruff too, but no fix applies to them
+        return sorted({d.file for d in diagnostics if d.tool == "ruff" and d.file and d.error_class != ErrorClass.SYNTAX})
+
+    @staticmethod
+    def _missing_packages(diagnostics: DiagnosticSet, repo_path: Optional[str] = None) -> Dict[str, str]:
+        """
+        Distribution -> requirements file kind ("runtime" or "stubs") for the
+        missing modules with a known distribution.
+        """
+        local: Set[str] = set()
+        if repo_path:
+            # A module of the workspace itself is a path problem, not a missing package
+            local = {name.split(".")[0] for name in graph_for(repo_path).modules}
+        packages: Dict[str, str] = {}
+        for d in diagnostics:
+            if d.error_class != ErrorClass.DEPENDENCY:
+                continue
+            m = _MISSING_STUBS.search(d.message)
+            if m:
+                top = m.group("module").split(".")[0]
+                stub = settings.AUTOFIX_STUB_PACKAGES.get(m.group("module")) or settings.AUTOFIX_STUB_PACKAGES.get(top)
+                if stub:
+                    packages.setdefault(stub, "stubs")
+            else:
+                m = next(filter(None, (pattern.search(d.message) for pattern in _MISSING_MODULE)), None)
+            if not m:
+                continue
+            # mypy asks for stubs of packages it knows even when the package itself is missing too
+            module = m.group("module")
+            top = module.split(".")[0]
+            package = settings.AUTOFIX_PACKAGES.get(module) or settings.AUTOFIX_PACKAGES.get(top)
+            if package and top not in local and not _importable(repo_path, top):
+                packages.setdefault(package, "runtime")
+        return packages
+
+    async def fix(self, repo_path: str, job_id: str, diagnostics: DiagnosticSet, changed: Iterable[str] = ()) -> FixResult:
+        """
+        Applies every deterministic fix the findings allow. changed are the
+        job's changed files (relative paths), which are formatted as well.
+        """
+        result = FixResult()
+        started = time.monotonic()
+        if settings.AUTOFIX_RUFF:
+            ruff_files = self._ruff_files(diagnostics)
+            if ruff_files:
+                result.ruff_fixed = await self._ruff(repo_path, job_id, ["check", "--fix", "--force-exclude", "--quiet"], ruff_files, result)
+                to_format = sorted(set(ruff_files) | {f for f in changed if f.endswith(".py")})
+                result.formatted = await self._ruff(repo_path, job_id, ["format", "--force-exclude", "--quiet"], to_format, result)
+        if settings.AUTOFIX_INSTALL_PACKAGES:
+            for package, kind in self._missing_packages(diagnostics, repo_path).items():
+                if await self._install(repo_path, job_id, package, kind, result):
+                    self._add_requirement(repo_path, package, kind)
+            if result.packages:
+                # A running dmypy predates the venv or its new packages
+                type_daemons.shutdown(repo_path, "packages_installed")
+        result.duration = time.monotonic() - started
+        logger.info(f"AUTOFIX: {repo_path}: {result.describe()} in {result.duration:.2f}s.")
+        return result
+
+    async def _ruff(self, repo_path: str, job_id: str, args: List[str], files: List[str], result: FixResult) -> List[str]:
+        paths = [f for f in files if os.path.isfile(os.path.join(repo_path, f))]
+        if not paths:
+            return []
+        before = {f: file_hash(os.path.join(repo_path, f)) for f in paths}
+        stdout, stderr, code = await self.sandbox.aexecute(
+            ["ruff", *args, *paths], cwd=repo_path, timeout=settings.VERIFIER_TIMEOUTS.get("ruff", settings.VERIFIER_DEFAULT_TIMEOUT),
+            command_class="verifier", job_id=job_id
+        )
+        if code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+            result.errors.append(f"ruff {args[0]} timed out")
+        elif code not in (0, 1):
+            # Exit code 1 only means findings remain after --fix
+            result.errors.append(f"ruff {args[0]} failed: {(stderr or stdout).strip()[:500]}")
+        return [f for f in paths if file_hash(os.path.join(repo_path, f)) != before[f]]
+
+    async def _venv(self, repo_path: str, job_id: str, result: FixResult) -> Optional[str]:
+        """
+        The workspace venv's interpreter, creating the venv on first use.
+        """
+        python = workspace_python(repo_path)
+        if python:
+            return python
+        cache_dir(repo_path)
+        stdout, stderr, code = await self.sandbox.aexecute(
+            ["python", "-m", "venv", "--system-site-packages", "--without-pip", venv_dir(repo_path)],
+            cwd=repo_path, timeout=settings.AUTOFIX_INSTALL_TIMEOUT, command_class="verifier", job_id=job_id
+        )
+        python = workspace_python(repo_path)
+        if code != 0 or python is None:
+            result.errors.append(f"Could not create the workspace venv: {(stderr or stdout).strip()[-500:]}")
+            return None
+        return python
+
+    async def _install(self, repo_path: str, job_id: str, package: str, kind: str, result: FixResult) -> bool:
+        python = await self._venv(repo_path, job_id, result)
+        if python is None:
+            return False
+        requirement = self._listed_requirement(repo_path, package, kind) or package
+        log_streamer.publish_log(job_id, f"📦 Auto-fix: installing missing package '{requirement}' into the workspace venv...", "INFO")
+        # pip comes from the worker's site-packages, visible to the venv; it installs into the venv
+        stdout, stderr, code = await self.sandbox.aexecute(
+            [python, "-m", "pip", "install", "--disable-pip-version-check", "-q", requirement],
+            cwd=repo_path, timeout=settings.AUTOFIX_INSTALL_TIMEOUT, command_class="verifier", job_id=job_id
+        )
+        if code != 0:
+            result.errors.append(f"pip install {requirement} failed: {(stderr or stdout).strip()[-500:]}")
+            return False
+        result.packages.append(package)
+        return True
+
+    @staticmethod
+    def _requirements_path(repo_path: str, kind: str) -> str:
+        return os.path.join(repo_path, "requirements-dev.txt" if kind == "stubs" else "requirements.txt")
+
+    @classmethod
+    def _listed_requirement(cls, repo_path: str, package: str, kind: str) -> Optional[str]:
+        """
+        The workspace requirements file's line for the package (its version
+        specifier included), or None when it does not list it.
+        """
+        try:
+            with open(cls._requirements_path(repo_path, kind), encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        for line in lines:
+            line = line.split("#")[0].strip()
+            m = _REQUIREMENT_NAME.match(line)
+            if m and _normalize(m.group(1)) == _normalize(package):
+                return line
+        return None
+
+    @classmethod
+    def _add_requirement(cls, repo_path: str, package: str, kind: str):
+        """
+        Appends the package, pinned to the version installed in the venv, to
+        requirements.txt (requirements-dev.txt for stub packages) when the
+        workspace has that file and does not list it yet.
+        """
+        path = cls._requirements_path(repo_path, kind)
+        if not os.path.isfile(path) or cls._listed_requirement(repo_path, package, kind):
+            return
+        dist = next(iter(importlib.metadata.distributions(name=package, path=_venv_site_packages(repo_path))), None)
+        line = f"{package}=={dist.version}" if dist is not None else package
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(("" if not content or content.endswith("\n") else "\n") + line + "\n")
+        except OSError as e:
+            logger.warning(f"AUTOFIX: Could not add {package} to {path}: {e}")
+
+
+auto_fixer = AutoFixer()
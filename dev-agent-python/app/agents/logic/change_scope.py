@@ -0,0 +1,107 @@
+import fnmatch
+import logging
+import os
+import subprocess
+from typing import List, Optional
+
+from app.core.config import settings
+from app.agents.knowledge_graph import graph_for
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeScope:
+    """
+    What a verification run covers: the whole repository ("full"), or only the
+    files changed since base_commit plus their reverse import dependents ("files").
+    """
+    def __init__(
+        self,
+        mode: str,
+        reason: str,
+        base_commit: Optional[str] = None,
+        changed: Optional[List[str]] = None,
+        files: Optional[List[str]] = None
+    ):
+        self.mode = mode
+        self.reason = reason
+        self.base_commit = base_commit
+        self.changed = changed or []
+        self.files = files or []
+
+    @property
+    def is_full(self) -> bool:
+        return self.mode == "full"
+
+    def describe(self) -> str:
+        if self.is_full:
+            return f"full repository ({self.reason})"
+        dependents = len(self.files) - len([f for f in self.changed if f in self.files])
+        return (
+            f"{len(self.files)} Python file(s): {len(self.changed)} changed since "
+            f"{(self.base_commit or '')[:7]}, {max(dependents, 0)} reverse dependent(s)"
+        )
+
+
+def _git(repo_path: str, *args: str) -> List[str]:
+    result = subprocess.run(
+        ["git", *args],
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def changed_files(repo_path: str, base_commit: str) -> List[str]:
+    """
+    Files that differ between base_commit and the working tree (committed, staged
+    or not), including deletions and untracked files. Paths are relative to repo_path.
+    """
+    # --relative keeps paths relative to repo_path when it is a subdirectory of the repository
+    tracked = _git(repo_path, "diff", "--name-only", "--relative", "--no-renames", base_commit)
+    untracked = _git(repo_path, "ls-files", "--others", "--exclude-standard")
+    return sorted(set(tracked) | set(untracked))
+
+
+def is_config_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in settings.VERIFY_FULL_RUN_FILES)
+
+
+def compute_scope(repo_path: str, base_commit: Optional[str]) -> ChangeScope:
+    """
+    Scopes verification to the changed Python files and the files that import
+    them. Falls back to a full run when incremental verification is off, there is
+    no base commit, git fails, a tool configuration file changed, or the scope
+    would exceed VERIFY_SCOPE_MAX_FILES.
+    """
+    if not settings.VERIFY_INCREMENTAL:
+        return ChangeScope("full", "incremental verification disabled")
+    if not base_commit or not os.path.exists(os.path.join(repo_path, ".git")):
+        return ChangeScope("full", "no base commit")
+    try:
+        changed = changed_files(repo_path, base_commit)
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"CHANGE SCOPE: git diff against {base_commit[:7]} failed: {e}")
+        return ChangeScope("full", "git diff failed", base_commit)
+
+    configs = [path for path in changed if is_config_file(path)]
+    if configs:
+        return ChangeScope("full", f"config changed: {', '.join(configs[:3])}", base_commit, changed)
+
+    changed_py = [path for path in changed if path.endswith(".py")]
+    graph = graph_for(repo_path)
+    graph.refresh(changed_py)
+    # Deleted files cannot be checked themselves, only the files that still import them
+    deleted = [path for path in changed_py if not os.path.exists(os.path.join(repo_path, path))]
+    seeds = set(changed_py) - set(deleted)
+    for path in deleted:
+        seeds |= graph.importers_of(path)
+    files = sorted(graph.get_impacted_set(seeds))
+    if len(files) > settings.VERIFY_SCOPE_MAX_FILES:
+        return ChangeScope("full", f"{len(files)} files in scope", base_commit, changed_py)
+    return ChangeScope("files", "changed files", base_commit, changed_py, files)
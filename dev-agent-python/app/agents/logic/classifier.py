@@ -41,9 +41,15 @@ class ErrorClassifier:
             r"PermissionError:",
             r"sandbox-exec: sandbox_apply",
             r"bandit detected issues"
+        ],
+        ErrorClass.SEMANTIC: [
+            r"AssertionError"
         ]
     }
 
+    # Most fundamental first: a collection error from a missing module outranks the assertions it causes
+    SEVERITY = [ErrorClass.SYNTAX, ErrorClass.DEPENDENCY, ErrorClass.TYPE, ErrorClass.SECURITY, ErrorClass.SEMANTIC, ErrorClass.UNKNOWN]
+
     def classify(self, stderr: str) -> str:
         """
         Classifies a raw traceback or error message into a high-level error class.
@@ -63,4 +69,13 @@ class ErrorClassifier:
             
         return ErrorClass.UNKNOWN
 
+    def classify_diagnostics(self, diagnostics) -> str:
+        """
+        Classifies a diagnostics.DiagnosticSet from its per-class counts: the
+        most fundamental class present wins. No text is scanned.
+        """
+        error_class = diagnostics.primary_class() or ErrorClass.UNKNOWN
+        logger.info(f"Classified {len(diagnostics)} diagnostics as {error_class}: {diagnostics.counts()}")
+        return error_class
+
 classifier = ErrorClassifier()
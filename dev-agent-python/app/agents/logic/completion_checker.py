@@ -1,5 +1,7 @@
+import logging
+from typing import Dict, Tuple
 from app.agents.wrapper import codex
-from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.context_packer import context_packer
 
 logger = logging.getLogger(__name__)
 
@@ -8,17 +10,20 @@ class CompletionChecker:
     Evaluates whether the mission's acceptance criteria are fully satisfied.
     """
     
-    def check(self, state: Dict) -> Tuple[bool, str]:
+    async def check(self, state: Dict) -> Tuple[bool, str]:
         """
         Answers: 'Is the mission satisfied?'
         """
         job_id = state.get("job_id", "unknown")
         logger.info(f"VERIFICATION: Running Completion Check for job {job_id}...")
         
+        context = context_packer.pack("completion_check", {
+            "project_state": context_packer.pack_json(state.get("project_state", {}))
+        })
         prompt = (
             f"Context: You are a QA inspector evaluating an autonomous dev agent.\n"
             f"Mission: {state.get('user_input')}\n"
-            f"Project State: {json.dumps(state.get('project_state', {}))}\n"
+            f"Project State: {context['project_state']}\n"
             f"Current Strategy: {state.get('strategy')}\n\n"
             f"GOAL: Determine if all architectural and functional goals are met.\n"
             f"Format your response as a JSON object:\n"
@@ -35,21 +40,17 @@ class CompletionChecker:
         }
         
         # Call LLM for completion check
-        stdout, stderr, code = codex.run_prompt(
+        frame, stdout, stderr, code = await codex.arun_json(
             prompt, 
             expected_schema=expected_schema,
-            approval="never"
+            approval="never",
+            cwd=state.get("repo_path"),
+            node="completion_check",
+            job_id=job_id # Tracks verification cost
         )
         
-        # Track verification cost
-        token_monitor.log_usage(job_id, len(prompt)//4, len(stdout)//4)
-        
-        if code == 0:
-            import re
-            json_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", stdout, re.MULTILINE)
-            if json_match:
-                res = json.loads(json_match.group(1))
-                return res["satisfied"], res["explanation"]
+        if code == 0 and frame:
+            return frame["satisfied"], frame["explanation"]
                 
         return False, "Checker failed to produce a valid response."
 
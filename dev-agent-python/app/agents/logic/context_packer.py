@@ -0,0 +1,273 @@
+import json
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import CounterWindows
+from app.agents.logic.token_monitor import token_monitor
+
+logger = logging.getLogger(__name__)
+
+# path:line[:col]: message  (ruff, mypy, pyright, compileall, pytest short summaries)
+_LOCATED = re.compile(r"^(?P<path>[^\s:][^:]*):(?P<line>\d+)(?::(?P<col>\d+))?:\s*(?P<message>.+)$")
+# Diagnostic class: a ruff-style code, a trailing mypy [code], or a bandit test id
+_RUFF_CODE = re.compile(r"^([A-Z]{1,4}\d{2,4})\b")
+_MYPY_CODE = re.compile(r"\[([a-z][a-z0-9-]+)\]\s*$")
+_BANDIT_ISSUE = re.compile(r"^>> Issue: \[(?P<code>[A-Z]\d+)[^\]]*\]\s*(?P<message>.*)$")
+_EXCEPTION = re.compile(r"^(?P<code>[A-Z][A-Za-z]*(?:Error|Exception|Warning)):\s*(?P<message>.*)$")
+
+
+class _Diagnostic:
+    __slots__ = ("cls", "key", "text", "count", "locations", "continuation")
+
+    def __init__(self, cls: str, key: str, text: str, location: Optional[str]):
+        self.cls = cls
+        self.key = key
+        self.text = text
+        self.count = 1
+        self.locations: List[str] = [location] if location else []
+        self.continuation: List[str] = []
+
+
+class PackStats:
+    """
+    Bytes in/out per node, so the savings of packing are visible in job metrics.
+    """
+    def __init__(self):
+        self.counters = CounterWindows({"prompts": 0, "raw_bytes": 0, "packed_bytes": 0})
+
+    def record(self, node: str, raw_bytes: int, packed_bytes: int):
+        self.counters.add(node, prompts=1, raw_bytes=raw_bytes, packed_bytes=packed_bytes)
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Dict]:
+        return {
+            node: {
+                **e,
+                "bytes_saved": e["raw_bytes"] - e["packed_bytes"],
+                "ratio": round(e["packed_bytes"] / e["raw_bytes"], 3) if e["raw_bytes"] else 1.0,
+            }
+            for node, e in self.counters.entries(window).items()
+        }
+
+
+class ContextPacker:
+    """
+    Shrinks the variable parts of a prompt (diagnostics, observations, state
+    snapshots) to fit a per-node token budget.
+    Diagnostics are deduplicated and capped per class, long text is cut from the
+    middle (keeping the head and the tail, where tracebacks put the cause), and
+    oversized sections split whatever budget the small ones leave.
+    """
+    def __init__(self):
+        self.stats = PackStats()
+
+    # --- Budgets ---
+
+    @staticmethod
+    def budget_for(node: str) -> int:
+        return settings.CONTEXT_TOKEN_BUDGETS.get(node, settings.CONTEXT_DEFAULT_TOKEN_BUDGET)
+
+    def pack(self, node: str, sections: Dict[str, str], model: Optional[str] = None) -> Dict[str, str]:
+        """
+        Fits the given prompt sections into the node's token budget.
+        Sections under their fair share are kept whole; the rest split what is left.
+        Returns the sections in the same order.
+        """
+        budget = self.budget_for(node)
+        sizes = {name: token_monitor.count_tokens(text, model) for name, text in sections.items()}
+        packed = OrderedDict(sections)
+
+        if sum(sizes.values()) > budget:
+            # Water-filling: smallest sections first, each capped at an equal share of what remains
+            remaining = budget
+            pending = sorted(sections, key=lambda name: sizes[name])
+            while pending:
+                share = remaining // len(pending)
+                name = pending.pop(0)
+                if sizes[name] > share:
+                    packed[name] = self.truncate_middle(sections[name], share, model)
+                    remaining -= share
+                else:
+                    remaining -= sizes[name]
+
+        raw = sum(len(text.encode("utf-8")) for text in sections.values())
+        out = sum(len(text.encode("utf-8")) for text in packed.values())
+        self.stats.record(node, raw, out)
+        if raw != out:
+            logger.info(f"CONTEXT PACKER: {node} prompt context {raw} -> {out} bytes (budget {budget} tokens).")
+        return dict(packed)
+
+    # --- Truncation ---
+
+    def truncate_middle(self, text: str, max_tokens: int, model: Optional[str] = None) -> str:
+        """
+        Keeps the head and tail of text within max_tokens, cutting on line
+        boundaries where possible, and marks what was dropped.
+        """
+        if not text:
+            return text
+        tokens = token_monitor.count_tokens(text, model)
+        if tokens <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return f"[... {tokens} tokens omitted ...]"
+
+        chars_per_token = len(text) / tokens
+        keep = max(int(max_tokens * chars_per_token) - 64, 0)
+        head_end = keep * 2 // 3
+        tail_start = len(text) - (keep - head_end)
+        # Snap to line boundaries when that does not lose too much
+        newline = text.rfind("\n", 0, head_end)
+        if newline > head_end // 2:
+            head_end = newline + 1
+        newline = text.find("\n", tail_start)
+        if 0 <= newline < tail_start + (len(text) - tail_start) // 2:
+            tail_start = newline + 1
+        if tail_start <= head_end:
+            return text
+
+        omitted = text[head_end:tail_start]
+        marker = f"\n[... {omitted.count(chr(10))} lines / ~{tokens - max_tokens} tokens omitted ...]\n"
+        return text[:head_end] + marker + text[tail_start:]
+
+    # --- Diagnostics ---
+
+    def pack_diagnostics(self, text: str, max_per_class: Optional[int] = None) -> str:
+        """
+        Compacts linter / type checker / test output.
+        Identical diagnostics (same class and message) are merged with their
+        locations listed once, at most max_per_class distinct diagnostics are
+        kept per class, and repeated non-diagnostic lines are collapsed.
+        """
+        if not text:
+            return text
+        if max_per_class is None:
+            max_per_class = settings.CONTEXT_MAX_DIAGNOSTICS_PER_CLASS
+
+        blocks: List[Any] = []  # str lines and _Diagnostic entries, in first-seen order
+        by_key: Dict[Tuple[str, str], _Diagnostic] = {}
+        per_class: Dict[str, int] = {}
+        dropped: Dict[str, int] = {}
+        # Indented lines after a diagnostic belong to it; they are kept only for its first
+        # occurrence (current is None while inside a merged or dropped diagnostic)
+        current: Optional[_Diagnostic] = None
+        in_diagnostic = False
+        last_line: Optional[str] = None
+
+        for line in text.splitlines():
+            if in_diagnostic and line.startswith((" ", "\t")) and line.strip():
+                if current is not None:
+                    current.continuation.append(line)
+                continue
+
+            parsed = self._parse(line)
+            if parsed is None:
+                # A blank separator after a merged or dropped diagnostic goes with it
+                suppressed = in_diagnostic and current is None and not line.strip()
+                if line != last_line and not suppressed:
+                    blocks.append(line)
+                current, in_diagnostic = None, False
+                last_line = line
+                continue
+
+            cls, key, display, location = parsed
+            in_diagnostic, current, last_line = True, None, None
+            existing = by_key.get((cls, key))
+            if existing is not None:
+                existing.count += 1
+                if location:
+                    existing.locations.append(location)
+                continue
+            if per_class.get(cls, 0) >= max_per_class:
+                dropped[cls] = dropped.get(cls, 0) + 1
+                continue
+            per_class[cls] = per_class.get(cls, 0) + 1
+            current = _Diagnostic(cls, key, display, location)
+            by_key[(cls, key)] = current
+            blocks.append(current)
+
+        out: List[str] = []
+        for block in blocks:
+            if isinstance(block, str):
+                out.append(block)
+                continue
+            out.append(self._render(block))
+            out.extend(block.continuation)
+        for cls, count in dropped.items():
+            out.append(f"[... {count} more distinct {cls} diagnostics omitted ...]")
+        return "\n".join(out)
+
+    @staticmethod
+    def _parse(line: str) -> Optional[Tuple[str, str, str, Optional[str]]]:
+        """
+        Returns (class, dedupe key, display text, location) for a diagnostic line, else None.
+        """
+        stripped = line.strip()
+        m = _BANDIT_ISSUE.match(stripped)
+        if m:
+            return m.group("code"), m.group("message"), stripped, None
+        m = _LOCATED.match(stripped)
+        if m:
+            message = m.group("message")
+            code = _RUFF_CODE.match(message) or _MYPY_CODE.search(message)
+            cls = code.group(1) if code else message.split(":", 1)[0].split()[0] if message else "diagnostic"
+            location = f"{m.group('path')}:{m.group('line')}"
+            return cls, message, message, location
+        m = _EXCEPTION.match(stripped)
+        if m:
+            return m.group("code"), m.group("message"), stripped, None
+        return None
+
+    @staticmethod
+    def _render(diag: _Diagnostic) -> str:
+        if not diag.locations:
+            return diag.text if diag.count == 1 else f"{diag.text} (x{diag.count})"
+        shown = ", ".join(diag.locations[:5])
+        more = f" (+{len(diag.locations) - 5} more)" if len(diag.locations) > 5 else ""
+        return f"{shown}{more}: {diag.text}"
+
+    # --- Structured context ---
+
+    def pack_observations(self, observations: List[Dict[str, str]], model: Optional[str] = None) -> str:
+        """
+        Serializes ReAct observations with each observation cut from the middle
+        to CONTEXT_OBSERVATION_MAX_TOKENS; the newest observations are kept longest.
+        """
+        limit = settings.CONTEXT_OBSERVATION_MAX_TOKENS
+        packed = []
+        for age, obs in enumerate(reversed(observations)):
+            # Older observations get progressively smaller slices of the cap
+            cap = max(limit // (1 + age // 2), 64)
+            packed.append({
+                "action": obs.get("action", ""),
+                "observation": self.truncate_middle(str(obs.get("observation", "")), cap, model)
+            })
+        packed.reverse()
+        return json.dumps(packed)
+
+    def pack_json(self, obj: Any, max_string_tokens: Optional[int] = None, max_items: int = 20) -> str:
+        """
+        Serializes a state snapshot with long strings cut from the middle and long
+        lists reduced to their first and last items.
+        """
+        if max_string_tokens is None:
+            max_string_tokens = settings.CONTEXT_OBSERVATION_MAX_TOKENS
+
+        def _shrink(value: Any) -> Any:
+            if isinstance(value, str):
+                return self.truncate_middle(value, max_string_tokens)
+            if isinstance(value, dict):
+                return {k: _shrink(v) for k, v in value.items()}
+            if isinstance(value, (list, tuple)):
+                items = list(value)
+                if len(items) > max_items:
+                    head = max_items // 2
+                    items = items[:head] + [f"[... {len(items) - max_items} items omitted ...]"] + items[-(max_items - head):]
+                return [_shrink(v) for v in items]
+            return value
+
+        return json.dumps(_shrink(obj), default=str)
+
+context_packer = ContextPacker()
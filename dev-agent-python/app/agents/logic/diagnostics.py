@@ -0,0 +1,306 @@
+import json
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from app.agents.logic.classifier import ErrorClass, ErrorClassifier
+
+SEVERITIES = ("error", "warning", "note")
+# Error classes in ErrorClassifier.SEVERITY order; a class's index is its counter slot
+CLASSES = tuple(ErrorClassifier.SEVERITY)
+_MYPY_TEXT = re.compile(r"^(?P<file>[^:]+):(?P<line>\d+)(?::\d+)?: (?P<severity>error|warning|note): (?P<message>.*?)(?:  \[(?P<code>[a-z0-9-]+)\])?$")
+_COMPILE_ERROR = re.compile(r"^\*\*\* Error compiling '(?P<path>.+)'\.\.\.$")
+_COMPILE_LOCATION = re.compile(r'^\s*File "(?P<path>.+)", line (?P<line>\d+)')
+_COMPILE_MESSAGE = re.compile(r"^(?P<code>[A-Za-z]*Error): (?P<message>.*)$")
+
+
+class Diagnostic:
+    """
+    One finding of a verifier, reduced to what classification and prompts use.
+    file is relative to the workspace ("" when the finding has no location).
+    """
+    __slots__ = ("tool", "file", "line", "code", "severity", "message", "error_class")
+
+    def __init__(self, tool: str, file: str, line: int, code: str, severity: str, message: str, error_class: str = ErrorClass.UNKNOWN):
+        self.tool = tool
+        self.file = file
+        self.line = line
+        self.code = code
+        self.severity = severity if severity in SEVERITIES else "error"
+        self.message = message
+        self.error_class = error_class if error_class in CLASSES else ErrorClass.UNKNOWN
+
+    def __repr__(self) -> str:
+        return f"Diagnostic({self.tool} {self.file}:{self.line} {self.code} {self.severity}: {self.message!r})"
+
+    def location(self) -> str:
+        return f"{self.file}:{self.line}" if self.file and self.line else self.file
+
+    def as_row(self) -> List[Any]:
+        return [self.tool, self.file, self.line, self.code, self.severity, self.message, self.error_class]
+
+
+class DiagnosticSet:
+    """
+    Array-backed collection of diagnostics. Every string field is interned
+    into one table and stored as an index, so a row is a handful of ints;
+    identical findings (tool, file, line, code, message) are kept once, and
+    the number of diagnostics per error class is a counter, not a scan.
+    """
+    def __init__(self, diagnostics: Iterable[Diagnostic] = ()):
+        self._strings: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._tool = array("I")
+        self._file = array("I")
+        self._line = array("I")
+        self._code = array("I")
+        self._severity = array("B")
+        self._message = array("I")
+        self._class = array("B")
+        self._seen: Set[Tuple[int, int, int, int, int]] = set()
+        self._class_counts = array("I", [0] * len(CLASSES))
+        self.duplicates = 0
+        self.extend(diagnostics)
+
+    def _intern(self, value: str) -> int:
+        index = self._ids.get(value)
+        if index is None:
+            index = self._ids[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def add(self, diagnostic: Diagnostic) -> bool:
+        """
+        Appends the diagnostic unless an identical one is already held.
+        """
+        tool, file, code, message = (self._intern(v) for v in (diagnostic.tool, diagnostic.file, diagnostic.code, diagnostic.message))
+        key = (tool, file, diagnostic.line, code, message)
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        cls = CLASSES.index(diagnostic.error_class)
+        self._tool.append(tool)
+        self._file.append(file)
+        self._line.append(max(diagnostic.line, 0))
+        self._code.append(code)
+        self._severity.append(SEVERITIES.index(diagnostic.severity))
+        self._message.append(message)
+        self._class.append(cls)
+        self._class_counts[cls] += 1
+        return True
+
+    def extend(self, diagnostics: Iterable[Diagnostic]) -> int:
+        return sum(1 for d in diagnostics if self.add(d))
+
+    def __len__(self) -> int:
+        return len(self._line)
+
+    def __getitem__(self, i: int) -> Diagnostic:
+        s = self._strings
+        return Diagnostic(
+            s[self._tool[i]], s[self._file[i]], self._line[i], s[self._code[i]],
+            SEVERITIES[self._severity[i]], s[self._message[i]], CLASSES[self._class[i]]
+        )
+
+    def __iter__(self) -> Iterator[Diagnostic]:
+        return (self[i] for i in range(len(self)))
+
+    # --- Counts and grouping ---
+
+    def count(self, error_class: str) -> int:
+        return self._class_counts[CLASSES.index(error_class)] if error_class in CLASSES else 0
+
+    def counts(self) -> Dict[str, int]:
+        return {cls: n for cls, n in zip(CLASSES, self._class_counts) if n}
+
+    def primary_class(self) -> Optional[str]:
+        """
+        The most fundamental error class present (CLASSES order), None when empty.
+        """
+        for cls, n in zip(CLASSES, self._class_counts):
+            if n:
+                return cls
+        return None
+
+    def group_by(self, field: str) -> Dict[Any, List[Diagnostic]]:
+        """
+        Diagnostics per value of a field (tool, file, code, severity or
+        error_class), in first-seen order.
+        """
+        groups: Dict[Any, List[Diagnostic]] = {}
+        for d in self:
+            groups.setdefault(getattr(d, field), []).append(d)
+        return groups
+
+    def failing(self) -> bool:
+        # Notes only accompany errors (mypy hints); on their own they are not findings
+        return any(s != SEVERITIES.index("note") for s in self._severity)
+
+    # --- Rendering ---
+
+    def render(self, max_per_class: int = 10, skip_tools: Iterable[str] = ()) -> str:
+        """
+        Compact text for prompts: per error class (most fundamental first),
+        identical messages merged with their locations listed once, at most
+        max_per_class distinct messages per class.
+        """
+        skip = {self._ids[t] for t in skip_tools if t in self._ids}
+        merged: Dict[int, Dict[Tuple[int, int, int], List[int]]] = {}
+        for i in range(len(self)):
+            if self._tool[i] in skip:
+                continue
+            merged.setdefault(self._class[i], {}).setdefault((self._tool[i], self._code[i], self._message[i]), []).append(i)
+        s = self._strings
+        out: List[str] = []
+        for cls in sorted(merged):
+            groups = merged[cls]
+            out.append(f"{CLASSES[cls]} ({sum(len(rows) for rows in groups.values())}):")
+            for n, ((tool, code, message), rows) in enumerate(groups.items()):
+                if n == max_per_class:
+                    out.append(f"  [... {len(groups) - n} more distinct {CLASSES[cls]} diagnostics omitted ...]")
+                    break
+                locations = [self[i].location() for i in rows[:5]]
+                shown = ", ".join(loc for loc in locations if loc)
+                more = f" (+{len(rows) - 5} more)" if len(rows) > 5 else ""
+                label = f"{s[tool]} {s[code]}".strip()
+                out.append(f"  {shown}{more}: [{label}] {s[message]}" if shown else f"  [{label}] {s[message]}")
+        return "\n".join(out)
+
+    # --- State ---
+
+    def to_state(self) -> Dict[str, Any]:
+        """
+        JSON-serializable form for the agent state: the string table and the columns.
+        """
+        return {
+            "strings": list(self._strings),
+            "rows": [list(column) for column in (self._tool, self._file, self._line, self._code, self._severity, self._message, self._class)],
+        }
+
+    @classmethod
+    def from_state(cls, state: Optional[Dict[str, Any]]) -> "DiagnosticSet":
+        diagnostics = cls()
+        if not state:
+            return diagnostics
+        s = state["strings"]
+        tool, file, line, code, severity, message, klass = state["rows"]
+        for i in range(len(line)):
+            diagnostics.add(Diagnostic(s[tool[i]], s[file[i]], line[i], s[code[i]], SEVERITIES[severity[i]], s[message[i]], CLASSES[klass[i]]))
+        return diagnostics
+
+
+def _relative(repo_path: str, filename: str) -> str:
+    if not os.path.isabs(filename):
+        filename = os.path.join(repo_path, filename)
+    return os.path.relpath(os.path.realpath(filename), os.path.realpath(repo_path)).replace(os.sep, "/")
+
+
+# --- Parsers: machine-readable tool output -> diagnostics, None when the output is a tool failure ---
+
+def parse_ruff(stdout: str, stderr: str, code: int, repo_path: str) -> Optional[List[Diagnostic]]:
+    if code not in (0, 1):
+        return None
+    try:
+        findings = json.loads(stdout or "[]")
+    except ValueError:
+        return None
+    diagnostics = []
+    for f in findings:
+        rule = f.get("code")
+        # Syntax errors have no rule code, or E999 / invalid-syntax depending on the ruff version
+        syntax = rule in (None, "E999") or "syntax" in rule
+        diagnostics.append(Diagnostic(
+            "ruff", _relative(repo_path, f["filename"]), (f.get("location") or {}).get("row", 0),
+            rule or "syntax-error", "error", f.get("message", ""),
+            ErrorClass.SYNTAX if syntax else ErrorClass.UNKNOWN
+        ))
+    return diagnostics
+
+
+_MYPY_CLASSES = {"syntax": ErrorClass.SYNTAX, "import": ErrorClass.DEPENDENCY, "import-not-found": ErrorClass.DEPENDENCY, "import-untyped": ErrorClass.DEPENDENCY}
+
+
+def parse_mypy(stdout: str, stderr: str, code: int, repo_path: str) -> Optional[List[Diagnostic]]:
+    """
+    mypy -O json (one object per line); plain text lines are accepted too.
+    """
+    if code not in (0, 1, 2):
+        return None
+    diagnostics = []
+    for line in stdout.splitlines():
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                f = json.loads(line)
+            except ValueError:
+                continue
+            file, number, rule, severity, message = f.get("file", ""), f.get("line", 0), f.get("code") or "", f.get("severity", "error"), f.get("message", "")
+        else:
+            m = _MYPY_TEXT.match(line)
+            if not m:
+                continue
+            file, number, rule, severity, message = m.group("file"), int(m.group("line")), m.group("code") or "", m.group("severity"), m.group("message")
+        diagnostics.append(Diagnostic(
+            "mypy", _relative(repo_path, file) if file else "", number, rule, severity, message,
+            _MYPY_CLASSES.get(rule, ErrorClass.TYPE)
+        ))
+    if code == 2 and not diagnostics:
+        # A crash or a configuration error, not findings
+        return None
+    return diagnostics
+
+
+def parse_bandit(stdout: str, stderr: str, code: int, repo_path: str) -> Optional[List[Diagnostic]]:
+    if code not in (0, 1):
+        return None
+    try:
+        report = json.loads(stdout)
+    except ValueError:
+        return None
+    return [
+        Diagnostic(
+            "bandit", _relative(repo_path, issue["filename"]), issue.get("line_number", 0), issue.get("test_id", ""),
+            "error" if issue.get("issue_severity") == "HIGH" else "warning",
+            f"{issue.get('issue_text', '')} [{issue.get('issue_severity', '')}/{issue.get('issue_confidence', '')}]",
+            ErrorClass.SECURITY
+        )
+        for issue in report.get("results", [])
+    ]
+
+
+def parse_compileall(stdout: str, stderr: str, code: int, repo_path: str) -> Optional[List[Diagnostic]]:
+    if code not in (0, 1):
+        return None
+    diagnostics = []
+    current: Optional[Dict[str, Any]] = None
+    for line in stdout.splitlines():
+        m = _COMPILE_ERROR.match(line)
+        if m:
+            current = {"file": _relative(repo_path, m.group("path")), "line": 0}
+            continue
+        if current is None:
+            continue
+        m = _COMPILE_LOCATION.match(line)
+        if m:
+            current["line"] = int(m.group("line"))
+            continue
+        m = _COMPILE_MESSAGE.match(line.strip())
+        if m:
+            diagnostics.append(Diagnostic("compileall", current["file"], current["line"], m.group("code"), "error", m.group("message"), ErrorClass.SYNTAX))
+            current = None
+    if code == 1 and not diagnostics:
+        return None
+    return diagnostics
+
+
+def parse_pip_check(stdout: str, stderr: str, code: int, repo_path: str) -> Optional[List[Diagnostic]]:
+    if code not in (0, 1):
+        return None
+    if code == 0:
+        return []
+    return [
+        Diagnostic("pip_check", "", 0, "dependency-conflict", "error", line.strip(), ErrorClass.DEPENDENCY)
+        for line in stdout.splitlines() if line.strip()
+    ]
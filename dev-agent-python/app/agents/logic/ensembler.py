@@ -36,7 +36,7 @@ class Ensembler:
             logger.info(f"ENSEMBLE: Producing candidate {i+1} (temp={strat['temp']})...")
             
             # This is a simplified call - in real usage we'd vary the prompt based on style
-            stdout, stderr, code = codex.run_prompt(
+            stdout, stderr, code = await codex.arun_prompt(
                 state.get("last_prompt", ""), 
                 sandbox="workspace-write", # Dry run usually
                 approval="never",
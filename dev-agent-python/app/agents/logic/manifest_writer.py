@@ -1,3 +1,8 @@
+import hashlib
+import json
+import logging
+import os
+import time
 from typing import Dict, List
 from app.agents.logic.token_monitor import token_monitor
 
@@ -40,6 +45,7 @@ class ManifestWriter:
             "latency_ms": 0, # TODO: Track timing
             "retry_count": state.get("retry_count", 0),
             "tokens": token_monitor.get_usage(job_id),
+            "tokens_breakdown": token_monitor.get_breakdown(job_id),
             "success": state.get("status") == "mission_success"
         }
         
@@ -2,6 +2,7 @@ from typing import List, Dict, Optional
 import os
 import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,21 @@ class ProjectState:
         self.data["features_completed"].append({"name": name, "summary": summary})
         self.save()
 
+    def complete_task(self, task: Dict) -> bool:
+        """
+        Records a task_graph task as completed; False when it already was.
+        """
+        completed = self.data.setdefault("features_completed", [])
+        if task["id"] in [f.get("id") for f in completed]:
+            return False
+        completed.append({
+            "id": task["id"],
+            "name": task["name"],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        })
+        self.save()
+        return True
+
     def add_decision(self, logic: str):
         self.data["architecture_decisions"].append(logic)
         self.save()
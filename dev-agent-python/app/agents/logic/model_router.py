@@ -0,0 +1,77 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import CounterWindows
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    """
+    Maps graph nodes (and optionally a purpose within a node) to model tiers.
+    MODEL_ROUTES is looked up as "node:purpose", then "node"; unmatched calls use
+    MODEL_DEFAULT_TIER. Tiers resolve to deployments through MODEL_TIERS, and a
+    tier without a deployment falls back to CODEX_MODEL.
+    Also keeps per-tier latency and schema-failure counters.
+    """
+    def __init__(self):
+        self.tiers = CounterWindows(
+            {"calls": 0, "latency_total": 0.0, "latency_max": 0.0, "schema_failures": 0, "escalations": 0},
+            peaks=("latency_max",),
+        )
+
+    def tier_for(self, node: Optional[str], purpose: Optional[str] = None) -> str:
+        routes = settings.MODEL_ROUTES
+        if node and purpose and f"{node}:{purpose}" in routes:
+            return routes[f"{node}:{purpose}"]
+        if node and node in routes:
+            return routes[node]
+        return settings.MODEL_DEFAULT_TIER
+
+    @staticmethod
+    def model_for(tier: str) -> str:
+        return settings.MODEL_TIERS.get(tier) or settings.CODEX_MODEL
+
+    def resolve(self, node: Optional[str], purpose: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Returns (tier, deployment) for a call.
+        """
+        tier = self.tier_for(node, purpose)
+        return tier, self.model_for(tier)
+
+    def escalation_for(self, tier: str, model: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the (tier, deployment) to retry with after a schema failure, or
+        None when the call already ran on the escalation deployment.
+        """
+        target = settings.MODEL_ESCALATION_TIER
+        target_model = self.model_for(target)
+        if tier == target or target_model == model:
+            return None
+        return target, target_model
+
+    def record(self, tier: str, latency: float, schema_ok: bool = True, escalated: bool = False):
+        self.tiers.add(
+            tier,
+            calls=1,
+            latency_total=latency,
+            latency_max=latency,
+            schema_failures=0 if schema_ok else 1,
+            escalations=1 if escalated else 0,
+        )
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Dict]:
+        return {
+            tier: {
+                "model": self.model_for(tier),
+                "calls": int(e["calls"]),
+                "avg_latency_s": round(e["latency_total"] / e["calls"], 2) if e["calls"] else 0.0,
+                "max_latency_s": round(e["latency_max"], 2),
+                "schema_failures": int(e["schema_failures"]),
+                "escalations": int(e["escalations"]),
+            }
+            for tier, e in self.tiers.entries(window).items()
+        }
+
+model_router = ModelRouter()
@@ -0,0 +1,498 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.stream import log_streamer
+from app.agents.logic.change_scope import is_config_file
+from app.agents.logic.classifier import classifier
+from app.agents.logic.diagnostics import Diagnostic
+from app.agents.logic.verify_cache import cache_dir, workspace_python
+from app.agents.knowledge_graph import graph_for
+from app.agents.sandbox import SandboxProvider, sandbox_manager, TIMEOUT_EXIT_CODE
+
+try:
+    from coverage import CoverageData
+except ImportError:
+    CoverageData = None
+
+logger = logging.getLogger(__name__)
+
+_MAP_NAME = "coverage_map.json"
+_HUNK = re.compile(r"^@@ -(?P<start>\d+)(?:,(?P<count>\d+))? \+\d+(?:,\d+)? @@")
+# pytest exit codes: 0 passed, 1 tests failed, 5 nothing collected; anything else means pytest itself failed
+_PYTEST_OK = (0, 1, 5)
+_PLUGINS = ("pytest", "xdist", "pytest_cov")
+# Run with the suite's interpreter: which of argv's modules it can import
+_PLUGIN_PROBE = "import importlib.util, sys; print(' '.join(m for m in sys.argv[1:] if importlib.util.find_spec(m)))"
+
+
+def is_test_file(rel_path: str) -> bool:
+    name = os.path.basename(rel_path)
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+def suite_env(**extra: str) -> Dict[str, str]:
+    """
+    Environment for running a repository's tests: TEST_ENV_ALLOWLIST from the
+    worker plus `extra`. Tests (including generated ones) are untrusted code.
+    """
+    env = {name: os.environ[name] for name in settings.TEST_ENV_ALLOWLIST if name in os.environ}
+    env.update(extra)
+    return env
+
+
+class TestFailure:
+    """
+    One failed or erroring test from the JUnit report.
+    """
+    __slots__ = ("nodeid", "file", "line", "kind", "type", "message", "text")
+
+    def __init__(self, nodeid: str, file: Optional[str], line: Optional[int], kind: str, type: str, message: str, text: str):
+        self.nodeid = nodeid
+        self.file = file
+        self.line = line
+        self.kind = kind  # failure | error
+        self.type = type  # exception type, e.g. AssertionError
+        self.message = message
+        self.text = text
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_diagnostic(self) -> Diagnostic:
+        # The traceback decides the class: an ImportError while collecting is a dependency problem
+        message = self.message
+        if self.kind == "error":
+            # Collection errors only say "collection failure"; the raised exception is the last "E" line
+            raised = [line[1:].strip() for line in self.text.splitlines() if line.startswith("E ")]
+            if raised:
+                message = raised[-1]
+        return Diagnostic(
+            "pytest", self.file or "", self.line or 0, self.type or self.kind, "error", f"{self.nodeid}: {message}",
+            classifier.classify(f"{self.type}: {self.message}\n{self.text}")
+        )
+
+    def describe(self, max_lines: int = 25) -> str:
+        lines = self.text.strip().splitlines()
+        if len(lines) > max_lines:
+            lines = ["..."] + lines[-max_lines:]
+        location = f" ({self.file}{f':{self.line}' if self.line else ''})" if self.file else ""
+        return "\n".join([f"{'ERROR' if self.kind == 'error' else 'FAILED'} {self.nodeid}{location}: {self.message}"] + lines)
+
+
+class TestRunResult:
+    __slots__ = ("mode", "reason", "status", "duration", "selected", "counts", "failures", "error")
+
+    def __init__(self, mode: str, reason: str, status: str = "passed", duration: float = 0.0, selected: int = 0):
+        self.mode = mode  # full | selected | gate
+        self.reason = reason
+        self.status = status  # passed | failed | timeout | skipped
+        self.duration = duration
+        self.selected = selected
+        self.counts: Dict[str, int] = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+        self.failures: List[TestFailure] = []
+        self.error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.status in ("failed", "timeout")
+
+    def describe(self) -> str:
+        c = self.counts
+        return (
+            f"{self.mode} run ({self.reason}): {c['tests']} test(s), {c['failures']} failed, "
+            f"{c['errors']} error(s), {c['skipped']} skipped in {self.duration:.1f}s"
+        )
+
+    def report(self) -> str:
+        """
+        The failures as text for the coder, capped at TEST_MAX_FAILURES_REPORTED.
+        """
+        if self.error:
+            return f"Test Failure (pytest):\n{self.error}"
+        shown = self.failures[:settings.TEST_MAX_FAILURES_REPORTED]
+        parts = [f"Test Failure (pytest): {self.describe()}"] + [f.describe() for f in shown]
+        if len(self.failures) > len(shown):
+            parts.append(f"... and {len(self.failures) - len(shown)} more failing test(s)")
+        return "\n".join(parts)
+
+
+def parse_junit(path: str) -> Tuple[Dict[str, int], List[TestFailure]]:
+    """
+    Counts and failures from a pytest JUnit XML report (junit_family=xunit1,
+    which records each test's file and line).
+    """
+    root = ET.parse(path).getroot()
+    suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+    counts = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+    failures = []
+    for suite in suites:
+        for key in counts:
+            counts[key] += int(suite.get(key, 0) or 0)
+        for case in suite.iter("testcase"):
+            for kind in ("failure", "error"):
+                element = case.find(kind)
+                if element is None:
+                    continue
+                file = case.get("file")
+                line = case.get("line")
+                failures.append(TestFailure(
+                    _nodeid(case),
+                    file,
+                    int(line) + 1 if line and line.isdigit() else None,  # xunit1 lines are 0-based
+                    kind,
+                    element.get("type") or "",
+                    element.get("message") or "",
+                    element.text or ""
+                ))
+    return counts, failures
+
+
+def _nodeid(case: ET.Element) -> str:
+    name = case.get("name", "")
+    classname = case.get("classname", "")
+    file = case.get("file")
+    if not file:
+        return f"{classname}::{name}" if classname else name
+    module = file[:-3].replace("/", ".") if file.endswith(".py") else file
+    if ".".join(part for part in (classname, name) if part) == module:
+        # A collection error is reported against the module itself
+        return file
+    classes = classname[len(module) + 1:].split(".") if classname.startswith(module + ".") else []
+    return "::".join([file, *classes, name])
+
+
+class CoverageMap:
+    """
+    Which tests executed which source lines, recorded from a full suite run
+    with per-test coverage contexts. tree is a git tree of the workspace as it
+    was recorded, so changed lines can be diffed against the recorded line numbers.
+    Lines only executed outside any test (imports, module constants) are not
+    attributed to tests; changes there fall back to the import graph.
+    """
+    def __init__(self, tree: str, tests: List[str], lines: Dict[str, Dict[int, List[int]]]):
+        self.tree = tree
+        self.tests = tests
+        self.lines = lines  # relative path -> line -> indices into tests
+
+    @classmethod
+    def from_coverage(cls, repo_path: str, data_file: str, tree: str) -> "CoverageMap":
+        data = CoverageData(basename=data_file)
+        data.read()
+        root = os.path.realpath(repo_path)
+        index: Dict[str, int] = {}
+        lines: Dict[str, Dict[int, List[int]]] = {}
+        for filename in data.measured_files():
+            rel = os.path.relpath(os.path.realpath(filename), root).replace(os.sep, "/")
+            if rel.startswith("../"):
+                continue
+            per_line = {}
+            for line, contexts in data.contexts_by_lineno(filename).items():
+                # pytest-cov contexts are "<nodeid>|setup", "|run" or "|teardown"
+                tests = {index.setdefault(c.rpartition("|")[0], len(index)) for c in contexts if c}
+                if tests:
+                    per_line[line] = sorted(tests)
+            if per_line:
+                lines[rel] = per_line
+        tests = [nodeid for nodeid, _ in sorted(index.items(), key=lambda item: item[1])]
+        return cls(tree, tests, lines)
+
+    @classmethod
+    def load(cls, repo_path: str) -> Optional["CoverageMap"]:
+        try:
+            with open(os.path.join(cache_dir(repo_path), _MAP_NAME)) as f:
+                raw = json.load(f)
+            lines = {rel: {int(line): tests for line, tests in per_line.items()} for rel, per_line in raw["lines"].items()}
+            return cls(raw["tree"], raw["tests"], lines)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, repo_path: str):
+        path = os.path.join(cache_dir(repo_path), _MAP_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"tree": self.tree, "tests": self.tests, "lines": self.lines}, f)
+        os.replace(path + ".tmp", path)
+
+    def tests_for(self, rel_path: str, lines: Optional[Set[int]]) -> Optional[Set[str]]:
+        """
+        Tests that executed any of `lines` of the file (all of its lines when
+        None), or None when the map knows no test executing the file.
+        """
+        per_line = self.lines.get(rel_path)
+        if not per_line:
+            return None
+        hit = per_line.values() if lines is None else [per_line[line] for line in lines if line in per_line]
+        return {self.tests[i] for tests in hit for i in tests}
+
+
+class Selection:
+    def __init__(self, targets: Optional[List[str]], reason: str, changed: int = 0):
+        self.targets = targets  # pytest node ids / test files; None means the full suite
+        self.reason = reason
+        self.changed = changed
+
+
+def _git(repo_path: str, *args: str, env: Optional[dict] = None) -> str:
+    result = subprocess.run(["git", *args], cwd=repo_path, capture_output=True, text=True, timeout=60, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return result.stdout
+
+
+def snapshot_tree(repo_path: str) -> str:
+    """
+    A git tree of the working tree as it is now (tracked and untracked,
+    honouring .gitignore), written through a throwaway index.
+    """
+    index = os.path.join(cache_dir(repo_path), f"index-{uuid.uuid4().hex}")
+    env = {**os.environ, "GIT_INDEX_FILE": index}
+    try:
+        _git(repo_path, "add", "-A", ".", env=env)
+        return _git(repo_path, "write-tree", env=env).strip()
+    finally:
+        if os.path.exists(index):
+            os.remove(index)
+
+
+def changed_lines(repo_path: str, tree: str) -> Dict[str, Optional[Set[int]]]:
+    """
+    Changed lines per file since `tree`, as line numbers of the recorded
+    version; None for files that are new since (nothing recorded to map).
+    An insertion marks the lines on either side of it.
+    """
+    changes: Dict[str, Optional[Set[int]]] = {}
+    current = None
+    for line in _git(repo_path, "diff", "-U0", "--no-renames", "--no-color", "--relative", tree).splitlines():
+        if line.startswith("--- "):
+            current = line[6:] if line.startswith("--- a/") else None
+        elif line.startswith("+++ ") and current is None:
+            # Added since the tree was recorded
+            if line.startswith("+++ b/"):
+                changes[line[6:]] = None
+        elif current is not None:
+            m = _HUNK.match(line)
+            if m:
+                start = int(m.group("start"))
+                count = int(m.group("count")) if m.group("count") is not None else 1
+                touched = range(start, start + count) if count else (start, start + 1)
+                changes.setdefault(current, set()).update(touched)
+    for rel in _git(repo_path, "ls-files", "--others", "--exclude-standard").splitlines():
+        if rel:
+            changes.setdefault(rel, None)
+    return changes
+
+
+def select_tests(repo_path: str, coverage_map: CoverageMap) -> Selection:
+    """
+    The tests that executed a changed line, plus changed test files as a
+    whole. Python files the map cannot attribute (new, or only changed outside
+    any test's execution) select the test files importing them, transitively.
+    conftest.py or tool configuration changes select the full suite.
+    """
+    try:
+        changes = changed_lines(repo_path, coverage_map.tree)
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"TEST SELECTION: git diff against the coverage map failed: {e}")
+        return Selection(None, "coverage map tree unavailable")
+    for rel in changes:
+        if os.path.basename(rel) == "conftest.py" or is_config_file(rel):
+            return Selection(None, f"{rel} changed", len(changes))
+
+    test_files: Set[str] = set()
+    node_ids: Set[str] = set()
+    unattributed: List[str] = []
+    for rel, lines in changes.items():
+        if not rel.endswith(".py"):
+            continue
+        if is_test_file(rel):
+            if os.path.exists(os.path.join(repo_path, rel)):
+                test_files.add(rel)
+            continue
+        tests = coverage_map.tests_for(rel, lines) if lines is not None else None
+        if tests:
+            node_ids |= tests
+        else:
+            unattributed.append(rel)
+    if unattributed:
+        graph = graph_for(repo_path)
+        graph.refresh(unattributed)
+        seeds = set(unattributed)
+        for rel in unattributed:
+            seeds |= graph.importers_of(rel)
+        test_files |= {rel for rel in graph.get_impacted_set(seeds) if is_test_file(rel)}
+
+    node_ids = {n for n in node_ids if n.split("::", 1)[0] not in test_files}
+    targets = sorted(test_files) + sorted(node_ids)
+    if len(targets) > settings.TEST_SELECTION_MAX_TARGETS:
+        return Selection(None, f"{len(targets)} tests selected", len(changes))
+    return Selection(targets, f"{len(changes)} changed file(s)", len(changes))
+
+
+class TestStageStats:
+    """
+    Per-job test runs, for the job's final metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Dict]] = {}
+
+    def record(self, job_id: str, result: TestRunResult):
+        with self._lock:
+            e = self._jobs.setdefault(job_id, {}).setdefault(result.mode, {"runs": 0, "total_s": 0.0, "tests": 0, "failed": 0, "statuses": {}})
+            e["runs"] += 1
+            e["total_s"] += result.duration
+            e["tests"] += result.counts["tests"]
+            e["failed"] += result.counts["failures"] + result.counts["errors"]
+            e["statuses"][result.status] = e["statuses"].get(result.status, 0) + 1
+
+    def pop(self, job_id: str) -> Dict:
+        with self._lock:
+            job = self._jobs.pop(job_id, {})
+        return {mode: {**e, "total_s": round(e["total_s"], 2)} for mode, e in job.items()}
+
+
+class PytestRunner:
+    """
+    The tester's test stage. The first run in a workspace executes the full
+    suite with per-test coverage and records a CoverageMap; later runs execute
+    only the tests selected from it for the lines changed since, and the full
+    suite is kept for the pre-commit gate (which also re-records the map).
+    Tests run with `pytest -n` (pytest-xdist) when more than one is selected;
+    results are parsed from the JUnit XML report. Runs go through the
+    configured sandbox provider, so Docker isolates them when available.
+    """
+    def __init__(self, sandbox: Optional[SandboxProvider] = None):
+        self.sandbox = sandbox or sandbox_manager
+        self.stats = TestStageStats()
+
+    @staticmethod
+    def has_tests(repo_path: str) -> bool:
+        return any(is_test_file(rel) for rel in graph_for(repo_path).iter_python_files())
+
+    async def _plugins(self, repo_path: str, python: str, on_host: bool, job_id: str) -> Set[str]:
+        """
+        The pytest plugins the suite's interpreter can import. A container has
+        its own site-packages, so the probe runs there rather than in the worker.
+        """
+        if on_host:
+            return {module for module in _PLUGINS if importlib.util.find_spec(module) is not None}
+        stdout, stderr, code = await self.sandbox.aexecute(
+            [python, "-c", _PLUGIN_PROBE, *_PLUGINS], cwd=repo_path, env=suite_env(), timeout=60, command_class="test", job_id=job_id
+        )
+        if code != 0:
+            logger.warning(f"TEST RUNNER: Plugin probe failed in the sandbox ({code}): {(stderr or stdout).strip()[-300:]}")
+            return set()
+        return set(stdout.split())
+
+    @staticmethod
+    def workers(targets: Optional[List[str]]) -> int:
+        cores = settings.TEST_MAX_WORKERS or int(settings.SANDBOX_RESOURCE_LIMITS.get("test", {}).get("cpu_cores") or 0)
+        cores = min(cores or os.cpu_count() or 1, os.cpu_count() or 1)
+        if targets is not None:
+            cores = min(cores, len(targets))
+        return cores
+
+    async def run(self, repo_path: str, job_id: str) -> TestRunResult:
+        """
+        Selected tests first; when they pass, the full-suite gate. A run that
+        records the coverage map is already the full suite and serves as the gate.
+        """
+        coverage_map = await asyncio.to_thread(CoverageMap.load, repo_path) if settings.TEST_SELECTION else None
+        if coverage_map is None:
+            reason = "recording coverage map" if settings.TEST_SELECTION else "test selection disabled"
+            return await self._execute(repo_path, job_id, None, "full", reason)
+
+        selection = await asyncio.to_thread(select_tests, repo_path, coverage_map)
+        if selection.targets is None:
+            return await self._execute(repo_path, job_id, None, "full", selection.reason)
+        if selection.targets:
+            log_streamer.publish_log(job_id, f"🎯 Test selection: {len(selection.targets)} test target(s) for {selection.reason}.", "INFO")
+            result = await self._execute(repo_path, job_id, selection.targets, "selected", selection.reason)
+            if result.failed or result.status == "skipped":
+                return result
+        else:
+            log_streamer.publish_log(job_id, f"🎯 Test selection: no test executes the lines changed ({selection.reason}).", "INFO")
+        log_streamer.publish_log(job_id, "🚦 Pre-commit gate: running the full test suite...", "INFO")
+        return await self._execute(repo_path, job_id, None, "gate", "pre-commit gate")
+
+    async def _execute(self, repo_path: str, job_id: str, targets: Optional[List[str]], mode: str, reason: str) -> TestRunResult:
+        # The workspace venv has the packages auto-fix installed; a container has its own interpreter
+        on_host = await asyncio.to_thread(getattr, self.sandbox, "runs_on_host")
+        python = (workspace_python(repo_path) if on_host else None) or "python"
+        plugins = await self._plugins(repo_path, python, on_host, job_id)
+        if "pytest" not in plugins:
+            log_streamer.publish_log(job_id, "⚠️ pytest is not installed for the suite's interpreter; skipping tests.", "WARN")
+            return TestRunResult(mode, reason, "skipped")
+        directory = cache_dir(repo_path)
+        run_id = uuid.uuid4().hex[:12]
+        junit = os.path.join(directory, f"junit-{run_id}.xml")
+        cmd = [python, "-m", "pytest", "-q", "-rN", f"--junitxml={junit}", "-o", "junit_family=xunit1"]
+
+        workers = self.workers(targets)
+        if workers > 1 and "xdist" in plugins:
+            cmd += ["-n", str(workers)]
+        record = targets is None and settings.TEST_SELECTION and "pytest_cov" in plugins and CoverageData is not None
+        env = suite_env()
+        data_file = os.path.join(directory, f"coverage-{run_id}")
+        tree = None
+        if record:
+            try:
+                # Recorded before the run, so the map's line numbers match the tree
+                tree = await asyncio.to_thread(snapshot_tree, repo_path)
+                cmd += ["--cov=.", "--cov-context=test", "--cov-report="]
+                env["COVERAGE_FILE"] = data_file
+            except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"TEST SELECTION: Not recording a coverage map for {repo_path}: {e}")
+                record = False
+        cmd += targets or []
+
+        log_streamer.publish_log(job_id, f"🧪 Running pytest: {mode} run ({reason}){f' on {workers} workers' if '-n' in cmd else ''}...", "INFO")
+        timeout = settings.TEST_TIMEOUT
+        started = time.monotonic()
+        stdout, stderr, code = await self.sandbox.aexecute(
+            cmd, cwd=repo_path, env=env, timeout=timeout, command_class="test", job_id=job_id
+        )
+        result = TestRunResult(mode, reason, duration=time.monotonic() - started, selected=len(targets or []))
+        try:
+            if code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+                result.status = "timeout"
+                result.error = f"Test run timed out after {timeout}s ({mode} run)."
+            else:
+                reported = os.path.exists(junit)
+                if reported:
+                    # Collection errors stop pytest (exit code 2) but are still reported per module
+                    result.counts, result.failures = parse_junit(junit)
+                # Exit code 1 without a report of any test is not pytest's: the interpreter failed to start it
+                started_tests = code != 1 or (reported and result.counts["tests"] > 0)
+                result.status = "failed" if result.failures or code not in _PYTEST_OK or not started_tests else "passed"
+                if (code not in _PYTEST_OK or not started_tests) and not result.failures:
+                    # Usage / internal error: the output is all there is
+                    result.error = "\n".join((stdout or "").strip().splitlines()[-40:] + (stderr or "").strip().splitlines()[-20:])
+                if record and tree and code in (0, 1):
+                    coverage_map = await asyncio.to_thread(CoverageMap.from_coverage, repo_path, data_file, tree)
+                    await asyncio.to_thread(coverage_map.save, repo_path)
+                    logger.info(f"TEST SELECTION: Recorded coverage map of {len(coverage_map.tests)} tests over {len(coverage_map.lines)} files for {repo_path}.")
+        except (ET.ParseError, OSError, ValueError) as e:
+            result.status = "failed"
+            result.error = f"Could not read the pytest report: {e}"
+        finally:
+            for leftover in (junit, data_file):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        self.stats.record(job_id, result)
+        icon = {"passed": "✅", "failed": "❌", "timeout": "⚠️"}.get(result.status, "⚠️")
+        log_streamer.publish_log(job_id, f"{icon} Tests: {result.describe()}", "ERROR" if result.failed else "INFO")
+        return result
+
+pytest_runner = PytestRunner()
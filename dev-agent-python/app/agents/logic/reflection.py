@@ -1,5 +1,7 @@
+import logging
+from typing import Dict, Tuple
 from app.agents.wrapper import codex
-from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.context_packer import context_packer
 
 logger = logging.getLogger(__name__)
 
@@ -8,18 +10,22 @@ class ReflectionEngine:
     Analyzes task outcomes and generates strategic hypotheses for the next action.
     """
     
-    def reflect(self, state: Dict, observation: str) -> Tuple[str, str]:
+    async def reflect(self, state: Dict, observation: str) -> Tuple[str, str]:
         """
         Ingests state and logs to produce (hypothesis, next_action).
         """
         job_id = state.get("job_id", "unknown")
         logger.info(f"REFLECTION: Ingesting observation for job {job_id}...")
         
+        context = context_packer.pack("reflection", {
+            "plan": str(state.get("plan")),
+            "observation": context_packer.pack_diagnostics(observation)
+        })
         prompt = (
             f"Context: You are an autonomous agent reflecting on a task failure.\n"
             f"Mission: {state.get('user_input')}\n"
-            f"Current Plan: {state.get('plan')}\n"
-            f"Observation (Error/Logs): {observation}\n\n"
+            f"Current Plan: {context['plan']}\n"
+            f"Observation (Error/Logs): {context['observation']}\n\n"
             f"GOAL: Analyze why it failed and propose a fix.\n"
             f"Format your response as a JSON object:\n"
             f"AGENT_JSON_START: {{\"hypothesis\": \"...\", \"next_action\": \"...\"}}\n"
@@ -35,21 +41,17 @@ class ReflectionEngine:
         }
         
         # Call LLM for reflection
-        stdout, stderr, code = codex.run_prompt(
+        frame, stdout, stderr, code = await codex.arun_json(
             prompt, 
             expected_schema=expected_schema,
-            approval="never"
+            approval="never",
+            cwd=state.get("repo_path"),
+            node="reflection",
+            job_id=job_id # Tracks reflection cost
         )
         
-        # Track reflection cost
-        token_monitor.log_usage(job_id, len(prompt)//4, len(stdout)//4)
-        
-        if code == 0:
-            import re
-            json_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", stdout, re.MULTILINE)
-            if json_match:
-                res = json.loads(json_match.group(1))
-                return res["hypothesis"], res["next_action"]
+        if code == 0 and frame:
+            return frame["hypothesis"], frame["next_action"]
                 
         return "Unknown failure cause", "Retry original strategy with caution"
 
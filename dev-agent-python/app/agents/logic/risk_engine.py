@@ -27,12 +27,14 @@ class RiskEngine:
         r"chmod", r"chown", r"eval\(", r"exec\("
     ]
 
-    def calculate_score(self, manifest: Dict, confidence: float = 1.0) -> int:
+    def calculate_score(self, manifest: Dict, confidence: float = 1.0, impacted: int = 0) -> int:
         """
         Calculates a risk score from 0-100 based on the job manifest and metadata.
+        impacted is the number of other files that transitively import the changed files.
         """
         score = 0
-        file_list = manifest.get("files", {})
+        # Manifest entries are {"path", "sha256"} records
+        file_list = [f["path"] if isinstance(f, dict) else f for f in manifest.get("files", [])]
         
         # 1. Path Sensitivity (Max 40 points)
         path_hits = 0
@@ -58,7 +60,17 @@ class RiskEngine:
         confidence_penalty = int((1.0 - confidence) * 30)
         score += max(0, confidence_penalty)
 
-        # 4. Keyword Detection (Bonus points up to 100 total)
+        # 4. Blast Radius (Max 20 points): code that depends on the change
+        if impacted > 50:
+            score += 20
+        elif impacted > 10:
+            score += 10
+        elif impacted > 0:
+            score += 5
+        if impacted:
+            logger.info(f"Risk: {impacted} dependent files impacted.")
+
+        # 5. Keyword Detection (Bonus points up to 100 total)
         # We can't easily scan the full diff text here without the repo access, 
         # but if we have the manifest we can at least flag dangerous operations in commit messages
         # or triggered by specific file extensions.
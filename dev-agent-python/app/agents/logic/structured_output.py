@@ -0,0 +1,214 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+logger = logging.getLogger(__name__)
+
+FRAME_MARKER = "AGENT_JSON_START:"
+# Frames larger than this are abandoned rather than buffered without bound
+MAX_FRAME_CHARS = 4 * 1024 * 1024
+# Upper bound on '{' positions tried by the unframed fallback
+MAX_UNFRAMED_ATTEMPTS = 2000
+
+_STRUCTURAL = re.compile(r'[{}"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_NON_WHITESPACE = re.compile(r"\S")
+
+_validators: Dict[str, Any] = {}
+_decoder = json.JSONDecoder()
+
+
+def get_validator(schema: Optional[dict]):
+    """
+    Returns a compiled jsonschema validator, built once per distinct schema.
+    None when no schema is given or jsonschema is not installed.
+    """
+    if not schema or jsonschema is None:
+        return None
+    key = json.dumps(schema, sort_keys=True)
+    validator = _validators.get(key)
+    if validator is None:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        _validators[key] = validator
+    return validator
+
+
+class FrameScanner:
+    """
+    Incremental extractor for the AGENT_JSON_START framing protocol.
+    Feed it output chunks as they arrive; it tracks brace depth (respecting JSON
+    strings and escapes) so nested frames are captured whole, and stops at the
+    first frame that parses and satisfies the schema.
+    """
+    def __init__(self, schema: Optional[dict] = None, marker: str = FRAME_MARKER):
+        self.marker = marker
+        self.validator = get_validator(schema)
+        self.result: Optional[dict] = None
+        self.rejected = 0
+        self._carry = ""
+        self._awaiting_brace = False
+        self._parts: Optional[List[str]] = None
+        self._size = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: str) -> Optional[dict]:
+        if self.result is not None or not chunk:
+            return self.result
+
+        pos, n = 0, len(chunk)
+        while pos < n:
+            if self._parts is not None:
+                pos = self._scan_frame(chunk, pos)
+                if self.result is not None:
+                    break
+                continue
+
+            if self._awaiting_brace:
+                m = _NON_WHITESPACE.search(chunk, pos)
+                if not m:
+                    break
+                self._awaiting_brace = False
+                pos = m.start()
+                if chunk[pos] == "{":
+                    self._parts, self._size, self._depth = [], 0, 0
+                continue
+
+            window = self._carry + chunk[pos:]
+            idx = window.find(self.marker)
+            if idx < 0:
+                self._carry = window[-(len(self.marker) - 1):]
+                break
+            pos += idx + len(self.marker) - len(self._carry)
+            self._carry = ""
+            self._awaiting_brace = True
+
+        return self.result
+
+    def _scan_frame(self, text: str, pos: int) -> int:
+        """
+        Advances through a frame; returns the position after it (or len(text) if incomplete).
+        """
+        start, i, n = pos, pos, len(text)
+        if self._escape:
+            i += 1
+            self._escape = False
+
+        while i < n:
+            if self._in_string:
+                m = _STRING_SPECIAL.search(text, i)
+                if not m:
+                    i = n
+                    break
+                j = m.start()
+                if text[j] == "\\":
+                    if j + 1 >= n:
+                        self._escape = True
+                        i = n
+                        break
+                    i = j + 2
+                else:
+                    self._in_string = False
+                    i = j + 1
+                continue
+
+            m = _STRUCTURAL.search(text, i)
+            if not m:
+                i = n
+                break
+            j = m.start()
+            c = text[j]
+            if c == '"':
+                self._in_string = True
+            elif c == "{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(text[start:j + 1])
+                    self._complete()
+                    return j + 1
+            i = j + 1
+
+        self._parts.append(text[start:i])
+        self._size += i - start
+        if self._size > MAX_FRAME_CHARS:
+            logger.warning(f"⚠️ Abandoning oversized {self.marker} frame ({self._size} chars).")
+            self._reset_frame()
+        return i
+
+    def _complete(self):
+        candidate = "".join(self._parts)
+        self._reset_frame()
+        obj = accept(candidate, self.validator)
+        if obj is None:
+            self.rejected += 1
+        else:
+            self.result = obj
+
+    def _reset_frame(self):
+        self._parts = None
+        self._size = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+
+def accept(candidate: str, validator) -> Optional[dict]:
+    """
+    Parses a candidate frame; returns it only if it is a JSON object satisfying the validator.
+    """
+    try:
+        obj = json.loads(candidate)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict):
+        return None
+    if validator is not None and not validator.is_valid(obj):
+        return None
+    return obj
+
+
+def find_unframed(text: str, schema: Optional[dict] = None) -> Optional[dict]:
+    """
+    Fallback for models that ignore the framing protocol: the first JSON object
+    anywhere in the text that satisfies the schema.
+    """
+    validator = get_validator(schema)
+    idx = text.find("{")
+    attempts = 0
+    while idx >= 0 and attempts < MAX_UNFRAMED_ATTEMPTS:
+        attempts += 1
+        try:
+            obj, _ = _decoder.raw_decode(text, idx)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict) and (validator is None or validator.is_valid(obj)):
+            return obj
+        idx = text.find("{", idx + 1)
+    return None
+
+
+def extract_frame(text: str, schema: Optional[dict] = None, fallback: bool = True) -> Optional[dict]:
+    """
+    One-shot extraction over a complete transcript: the first valid framed
+    object, else (optionally) the first valid unframed object.
+    """
+    scanner = FrameScanner(schema)
+    result = scanner.feed(text)
+    if result is None and fallback:
+        result = find_unframed(text, schema)
+    return result
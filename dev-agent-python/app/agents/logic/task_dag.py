@@ -0,0 +1,35 @@
+from typing import Dict, Iterable, List
+
+
+def topological_order(task_graph: List[Dict]) -> List[str]:
+    """
+    Task ids with every task after its dependencies, ties kept in plan order.
+    Tasks in a cycle or depending on unknown ids come last, in plan order.
+    """
+    ids = [task["id"] for task in task_graph]
+    pending = {task["id"]: {d for d in task.get("dependencies", [])} for task in task_graph}
+    order: List[str] = []
+    placed = set()
+    progress = True
+    while progress:
+        progress = False
+        for task_id in ids:
+            if task_id not in placed and pending[task_id] <= placed:
+                order.append(task_id)
+                placed.add(task_id)
+                progress = True
+    # Never schedulable: a dependency is unknown or part of a cycle
+    order.extend(task_id for task_id in ids if task_id not in placed)
+    return order
+
+
+def ready_tasks(task_graph: List[Dict], completed: Iterable[str], exclude: Iterable[str] = ()) -> List[Dict]:
+    """
+    Tasks not completed (nor excluded) whose dependencies all are, in plan order.
+    """
+    done = set(completed)
+    skip = done | set(exclude)
+    return [
+        task for task in task_graph
+        if task["id"] not in skip and all(dep in done for dep in task.get("dependencies", []))
+    ]
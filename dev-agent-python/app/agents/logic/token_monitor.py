@@ -1,30 +1,155 @@
 import logging
-from typing import Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
+# Model families that use the o200k vocabulary when tiktoken does not know the exact name
+_O200K_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4", "codex")
+
+
+@lru_cache(maxsize=32)
+def _encoding_for(model: Optional[str]):
+    """
+    Returns the tiktoken encoding for a model name (or deployment name), cached per model.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        if model:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                if model.lower().startswith(_O200K_PREFIXES):
+                    return tiktoken.get_encoding("o200k_base")
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # BPE files are downloaded on first use; offline workers fall back to the estimate
+        logger.warning(f"TOKEN MONITOR: No tiktoken encoding for {model} ({e}); estimating tokens from length.")
+        return None
+
+
 class TokenMonitor:
     """
     Tracks token consumption per job and enforces budget thresholds.
+    Counts are exact tiktoken counts (or the provider's reported usage when
+    available), broken down per node and per model.
     """
-    
-    def __init__(self, max_tokens_per_job: int = 200000):
+
+    def __init__(self, max_tokens_per_job: int = 200000, batch_threshold_chars: int = 256 * 1024, count_threads: int = 4):
         self.max_tokens_per_job = max_tokens_per_job
+        self.batch_threshold_chars = batch_threshold_chars
+        self.count_threads = count_threads
         self.job_usage: Dict[str, int] = {}
+        # job_id -> {"by_node": {node: counters}, "by_model": {model: counters}}
+        self.job_breakdown: Dict[str, Dict[str, Dict[str, Dict[str, int]]]] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """
+        Exact token count for text under the model's encoding.
+        Very large texts are split on line boundaries and encoded in parallel
+        (tiktoken releases the GIL while encoding).
+        """
+        if not text:
+            return 0
+        encoding = _encoding_for(model)
+        if encoding is None:
+            return len(text) // 4
+        if len(text) < self.batch_threshold_chars:
+            return len(encoding.encode_ordinary(text))
+
+        chunks = self._split(text)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.count_threads, thread_name_prefix="token-count")
+        return sum(len(tokens) for tokens in self._executor.map(encoding.encode_ordinary, chunks))
+
+    def _split(self, text: str) -> List[str]:
+        chunk_size = max(self.batch_threshold_chars // self.count_threads, 16 * 1024)
+        chunks = []
+        start = 0
+        while start < len(text):
+            end = min(start + chunk_size, len(text))
+            if end < len(text):
+                # Split after a newline so no token straddles two chunks
+                newline = text.rfind("\n", start, end)
+                if newline > start:
+                    end = newline + 1
+            chunks.append(text[start:end])
+            start = end
+        return chunks
 
-    def log_usage(self, job_id: str, tokens_in: int, tokens_out: int):
+    def record_call(
+        self,
+        job_id: str,
+        prompt: str,
+        completion: str,
+        model: Optional[str] = None,
+        node: Optional[str] = None,
+        usage: Optional[Dict] = None
+    ) -> int:
+        """
+        Records one LLM call (see call_tokens). Returns the call's total tokens.
+        """
+        tokens_in, tokens_out, cached = self.call_tokens(prompt, completion, model, usage)
+        self.log_usage(job_id, tokens_in, tokens_out, node=node, model=model, cached_tokens=cached)
+        return tokens_in + tokens_out
+
+    def call_tokens(
+        self,
+        prompt: str,
+        completion: str,
+        model: Optional[str] = None,
+        usage: Optional[Dict] = None
+    ) -> Tuple[int, int, int]:
+        """
+        (prompt, completion, cached prompt) tokens of one call: the provider's
+        usage block when the API returned one, otherwise tiktoken counts.
+        """
+        if usage:
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached
+        return self.count_tokens(prompt, model), self.count_tokens(completion, model), 0
+
+    def log_usage(
+        self,
+        job_id: str,
+        tokens_in: int,
+        tokens_out: int,
+        node: Optional[str] = None,
+        model: Optional[str] = None,
+        cached_tokens: int = 0
+    ):
         """
         Records token usage for a specific job.
         """
         total = tokens_in + tokens_out
-        if job_id not in self.job_usage:
-            self.job_usage[job_id] = 0
-            
-        self.job_usage[job_id] += total
-        
-        usage = self.job_usage[job_id]
-        logger.info(f"TOKEN MONITOR: Job {job_id} usage: {usage} total tokens.")
-        
+        with self._lock:
+            if job_id not in self.job_usage:
+                self.job_usage[job_id] = 0
+            self.job_usage[job_id] += total
+            usage = self.job_usage[job_id]
+
+            breakdown = self.job_breakdown.setdefault(job_id, {"by_node": {}, "by_model": {}})
+            for group, key in (("by_node", node or "unknown"), ("by_model", model or "unknown")):
+                counters = breakdown[group].setdefault(key, {"calls": 0, "prompt": 0, "completion": 0, "cached": 0})
+                counters["calls"] += 1
+                counters["prompt"] += tokens_in
+                counters["completion"] += tokens_out
+                counters["cached"] += cached_tokens
+
+        logger.info(f"TOKEN MONITOR: Job {job_id} usage: {usage} total tokens (+{tokens_in} in / +{tokens_out} out from {node or 'unknown'}).")
+
         if usage > self.max_tokens_per_job:
             logger.warning(f"⚠️ BUDGET EXCEEDED: Job {job_id} has used {usage} tokens (Limit: {self.max_tokens_per_job}).")
             # In a real impl, this would return an Abort signal to the controller
@@ -32,6 +157,21 @@ class TokenMonitor:
     def get_usage(self, job_id: str) -> int:
         return self.job_usage.get(job_id, 0)
 
+    def get_breakdown(self, job_id: str) -> Dict[str, Dict[str, Dict[str, int]]]:
+        with self._lock:
+            breakdown = self.job_breakdown.get(job_id, {"by_node": {}, "by_model": {}})
+            return {group: {k: dict(v) for k, v in entries.items()} for group, entries in breakdown.items()}
+
+    def pop(self, job_id: str) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        Returns the job's breakdown and forgets the job.
+        """
+        breakdown = self.get_breakdown(job_id)
+        with self._lock:
+            self.job_usage.pop(job_id, None)
+            self.job_breakdown.pop(job_id, None)
+        return breakdown
+
     def is_within_budget(self, job_id: str) -> bool:
         return self.job_usage.get(job_id, 0) <= self.max_tokens_per_job
 
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.stream import log_streamer
+from app.agents.logic.classifier import ErrorClass
+from app.agents.logic.change_scope import ChangeScope
+from app.agents.logic.diagnostics import (
+    Diagnostic, DiagnosticSet, parse_bandit, parse_compileall, parse_mypy, parse_pip_check, parse_ruff
+)
+from app.agents.logic.verify_cache import cache_for, config_hash, tool_version, workspace_python
+from app.agents.knowledge_graph import graph_for
+from app.agents.sandbox import LocalSandbox, TIMEOUT_EXIT_CODE
+from app.tools.type_daemons import type_daemons
+
+logger = logging.getLogger(__name__)
+
+# Maps a tool's machine-readable output to diagnostics (file paths relative to the
+# repository), or None when the output is a tool failure rather than findings
+OutputParser = Callable[[str, str, int, str], Optional[List[Diagnostic]]]
+# Answers a verifier from a warm daemon: (repo path, files or None, timeout) -> (stdout, stderr, exit code),
+# or None when no daemon is available and the command should run cold
+DaemonRunner = Callable[[str, Optional[List[str]], float], Optional[Tuple[str, str, int]]]
+# Cached per-file results are diagnostic rows; bumping this invalidates older entries
+_CACHE_FORMAT = "diagnostics-1"
+# Bytes of file paths per command line; well under ARG_MAX, which also holds the environment
+_MAX_ARG_BYTES = 100_000
+
+
+class Verifier:
+    """
+    One verification tool: its command, how its output parses into
+    diagnostics, when it applies, and how an unparseable failure is reported.
+    error_class is the class of such a failure; parsed diagnostics carry their own.
+    command gets the repository path and the files to check (None for the whole
+    repository). Whole-repo verifiers (scoped=False) only run on full-scope runs.
+    Verifiers with a per_file_command report per file, so their results can be
+    cached and only changed files re-analysed. Verifiers with a daemon ask it
+    first (TYPE_DAEMONS_ENABLED) and run their command cold without one.
+    """
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        command: Callable[[str, Optional[List[str]]], List[str]],
+        error_class: str,
+        error_prefix: str,
+        parse: OutputParser,
+        applies: Optional[Callable[[str], bool]] = None,
+        include_stderr: bool = False,
+        scoped: bool = True,
+        per_file_command: Optional[Callable[[List[str]], List[str]]] = None,
+        daemon: Optional[DaemonRunner] = None
+    ):
+        self.name = name
+        self.description = description
+        self.command = command
+        self.error_class = error_class
+        self.error_prefix = error_prefix
+        self.parse = parse
+        self.applies = applies or (lambda repo_path: True)
+        self.include_stderr = include_stderr
+        self.scoped = scoped
+        self.per_file_command = per_file_command
+        self.daemon = daemon
+
+    @property
+    def cacheable(self) -> bool:
+        return self.per_file_command is not None
+
+
+class VerifierResult:
+    __slots__ = ("name", "status", "duration", "error", "error_class", "diagnostics", "cache_hits", "cache_misses")
+
+    def __init__(
+        self,
+        name: str,
+        status: str,
+        duration: float = 0.0,
+        error: Optional[str] = None,
+        error_class: Optional[str] = None,
+        diagnostics: Optional[List[Diagnostic]] = None
+    ):
+        self.name = name
+        self.status = status  # passed | failed | timeout | skipped | cancelled
+        self.duration = duration
+        self.error = error  # rendered diagnostics, or the raw output when it did not parse
+        self.error_class = error_class
+        self.diagnostics = diagnostics or []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def failed(self) -> bool:
+        return self.status == "failed"
+
+
+def _has_type_config(repo_path: str) -> bool:
+    return os.path.exists(os.path.join(repo_path, "pyproject.toml")) or os.path.exists(os.path.join(repo_path, "mypy.ini"))
+
+
+def _python_executable(repo_path: str) -> List[str]:
+    # mypy resolves installed packages from the workspace venv once auto-fix created one
+    python = workspace_python(repo_path)
+    return ["--python-executable", python] if python else []
+
+
+def _targets(repo_path: str, files: Optional[List[str]]) -> List[str]:
+    if files is None:
+        return [repo_path]
+    return [os.path.join(repo_path, f) for f in files]
+
+
+def _batches(paths: List[str]) -> List[List[str]]:
+    """
+    Splits paths into runs whose command lines stay within _MAX_ARG_BYTES.
+    """
+    batches: List[List[str]] = [[]]
+    size = 0
+    for path in paths:
+        length = len(os.fsencode(path)) + 1
+        if batches[-1] and size + length > _MAX_ARG_BYTES:
+            batches.append([])
+            size = 0
+        batches[-1].append(path)
+        size += length
+    return batches if batches[0] else []
+
+
+DEFAULT_VERIFIERS: List[Verifier] = [
+    # Declared order is launch order and report order; cheap, blocking checks first
+    Verifier("compileall", "Checking syntax (compileall)", lambda p, f: ["python", "-m", "compileall", "-q", *_targets(p, f)],
+             ErrorClass.SYNTAX, "Syntax Error: ", parse_compileall, include_stderr=True,
+             per_file_command=lambda paths: ["python", "-m", "compileall", "-q", *paths]),
+    # --force-exclude keeps the configured excludes when files are passed explicitly
+    Verifier("ruff", "Running Ruff static analysis", lambda p, f: ["ruff", "check", "--output-format", "json", "--force-exclude", *_targets(p, f)],
+             ErrorClass.UNKNOWN, "Linting Error (Ruff):\n", parse_ruff,
+             per_file_command=lambda paths: ["ruff", "check", "--output-format", "json", "--force-exclude", *paths]),
+    # Given files, mypy still follows their imports but only reports errors in them
+    Verifier("mypy", "Running Mypy type checking", lambda p, f: ["mypy", *_python_executable(p), "-O", "json", *_targets(p, f)],
+             ErrorClass.TYPE, "Type Error (Mypy):\n", parse_mypy, applies=_has_type_config, daemon=type_daemons.mypy_check),
+    # Audits the environment, not the sources: only worth re-running when dependency config changed
+    Verifier("pip_check", "Running Dependency Audit (pip check)", lambda p, f: [workspace_python(p) or "python", "-m", "pip", "check"],
+             ErrorClass.DEPENDENCY, "Dependency Conflict:\n", parse_pip_check, scoped=False),
+    Verifier("bandit", "Running Security Scan (Bandit)", lambda p, f: ["bandit", "-ll", "-q", "-f", "json", *(["-r", p] if f is None else _targets(p, f))],
+             ErrorClass.SECURITY, "Security Issue (Bandit):\n", parse_bandit,
+             per_file_command=lambda paths: ["bandit", "-ll", "-q", "-f", "json", *paths]),
+]
+
+
+class VerificationStats:
+    """
+    Per-job verifier durations and outcomes, for the job's final metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Dict]] = {}
+
+    def record(self, job_id: str, results: List[VerifierResult], wall_time: float, scope_mode: str = "full"):
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {"runs": 0, "wall_time_s": 0.0, "serial_time_s": 0.0, "scopes": {}, "verifiers": {}})
+            job["runs"] += 1
+            job["wall_time_s"] += wall_time
+            job["scopes"][scope_mode] = job["scopes"].get(scope_mode, 0) + 1
+            for r in results:
+                job["serial_time_s"] += r.duration
+                e = job["verifiers"].setdefault(r.name, {"runs": 0, "total_s": 0.0, "max_s": 0.0, "statuses": {}, "cache_hits": 0, "cache_misses": 0})
+                e["runs"] += 1
+                e["cache_hits"] += r.cache_hits
+                e["cache_misses"] += r.cache_misses
+                e["total_s"] += r.duration
+                e["max_s"] = max(e["max_s"], r.duration)
+                e["statuses"][r.status] = e["statuses"].get(r.status, 0) + 1
+
+    def pop(self, job_id: str) -> Dict:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return {}
+        return {
+            "runs": job["runs"],
+            "wall_time_s": round(job["wall_time_s"], 2),
+            # What running the verifiers one after another would have cost
+            "serial_time_s": round(job["serial_time_s"], 2),
+            "scopes": job["scopes"],
+            "verifiers": {
+                name: {
+                    "runs": e["runs"],
+                    "avg_s": round(e["total_s"] / e["runs"], 2),
+                    "max_s": round(e["max_s"], 2),
+                    "statuses": e["statuses"],
+                    "cache_hits": e["cache_hits"],
+                    "cache_misses": e["cache_misses"],
+                }
+                for name, e in job["verifiers"].items()
+            },
+        }
+
+
+class VerificationPipeline:
+    """
+    Runs the verifiers concurrently, at most VERIFIER_MAX_PARALLEL at a time,
+    each in the sandbox with its own timeout (VERIFIER_TIMEOUTS).
+    In fail-fast mode (VERIFIER_FAIL_FAST) the first failure whose error class
+    is in VERIFIER_FAIL_FAST_CLASSES cancels the verifiers still queued or running.
+    A verifier whose tool is not installed is skipped. With a file scope,
+    file-scoped verifiers only check those files and whole-repo ones are skipped.
+    Per-file verifiers answer unchanged files from the workspace's
+    VerificationCache (VERIFY_CACHE_ENABLED) and only run on the rest.
+    """
+    def __init__(self, verifiers: Optional[List[Verifier]] = None, sandbox: Optional[LocalSandbox] = None):
+        self.verifiers = verifiers if verifiers is not None else DEFAULT_VERIFIERS
+        # Verifiers run on the worker host (they need its toolchain); the sandbox meters them per job
+        self.sandbox = sandbox or LocalSandbox()
+        self.stats = VerificationStats()
+
+    @staticmethod
+    def timeout_for(name: str) -> float:
+        return settings.VERIFIER_TIMEOUTS.get(name, settings.VERIFIER_DEFAULT_TIMEOUT)
+
+    async def run(
+        self,
+        repo_path: str,
+        job_id: str,
+        fail_fast: Optional[bool] = None,
+        scope: Optional[ChangeScope] = None
+    ) -> List[VerifierResult]:
+        """
+        Returns one result per verifier, in declared order.
+        """
+        scope = scope or ChangeScope("full", "no scope given")
+        if fail_fast is None:
+            fail_fast = settings.VERIFIER_FAIL_FAST
+        blocking = set(settings.VERIFIER_FAIL_FAST_CLASSES) if fail_fast else set()
+        slots = asyncio.Semaphore(max(1, settings.VERIFIER_MAX_PARALLEL))
+        stop = asyncio.Event()
+        started = time.monotonic()
+        config = await asyncio.to_thread(config_hash, repo_path) if settings.VERIFY_CACHE_ENABLED else ""
+
+        async def _guarded(verifier: Verifier) -> VerifierResult:
+            async with slots:
+                if stop.is_set():
+                    return VerifierResult(verifier.name, "cancelled")
+                result = await self._run_one(verifier, repo_path, job_id, scope, config)
+            if result.failed and result.error_class in blocking:
+                log_streamer.publish_log(job_id, f"⛔ Fail-fast: {verifier.name} found a {result.error_class}; cancelling remaining verifiers.", "WARN")
+                stop.set()
+            return result
+
+        applicable = [v for v in self.verifiers if v.applies(repo_path)]
+        tasks = {v.name: asyncio.create_task(_guarded(v)) for v in applicable}
+        if blocking:
+            # Cancel running verifiers as soon as a blocking failure lands
+            stopper = asyncio.create_task(stop.wait())
+            pending = set(tasks.values())
+            while pending and not stop.is_set():
+                _, pending = await asyncio.wait(pending | {stopper}, return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(stopper)
+            for task in pending:
+                task.cancel()
+            stopper.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        results = []
+        for verifier in applicable:
+            task = tasks[verifier.name]
+            if task.cancelled():
+                results.append(VerifierResult(verifier.name, "cancelled"))
+            elif task.exception() is not None:
+                logger.error(f"VERIFICATION: {verifier.name} crashed: {task.exception()}")
+                results.append(VerifierResult(verifier.name, "skipped", error=str(task.exception())))
+            else:
+                results.append(task.result())
+
+        wall_time = time.monotonic() - started
+        self.stats.record(job_id, results, wall_time, scope.mode)
+        timings = " | ".join(f"{r.name} {r.duration:.1f}s ({r.status})" for r in results)
+        log_streamer.publish_log(job_id, f"⏱️ Verification of {scope.describe()} took {wall_time:.1f}s: {timings}", "INFO")
+        self._log_cache(job_id, repo_path, results)
+        return results
+
+    @staticmethod
+    def _log_cache(job_id: str, repo_path: str, results: List[VerifierResult]):
+        looked_up = [r for r in results if r.cache_hits or r.cache_misses]
+        if not looked_up:
+            return
+        hits = sum(r.cache_hits for r in looked_up)
+        total = hits + sum(r.cache_misses for r in looked_up)
+        per_tool = ", ".join(f"{r.name} {r.cache_hits}/{r.cache_hits + r.cache_misses}" for r in looked_up)
+        log_streamer.publish_log(
+            job_id,
+            f"🗃️ Verification cache: {hits}/{total} file results reused ({hits / total:.0%}; {per_tool}); "
+            f"workspace hit rate {cache_for(repo_path).hit_rate():.0%}",
+            "INFO"
+        )
+
+    async def _run_one(self, verifier: Verifier, repo_path: str, job_id: str, scope: ChangeScope, config: str = "") -> VerifierResult:
+        if not scope.is_full and (not verifier.scoped or not scope.files):
+            return VerifierResult(verifier.name, "skipped")
+        cmd = verifier.command(repo_path, None if scope.is_full else scope.files)
+        if shutil.which(cmd[0]) is None:
+            log_streamer.publish_log(job_id, f"⚠️ {verifier.name} is not installed; skipping.", "WARN")
+            return VerifierResult(verifier.name, "skipped")
+        if verifier.cacheable and settings.VERIFY_CACHE_ENABLED:
+            return await self._run_cached(verifier, repo_path, job_id, scope, config)
+
+        log_streamer.publish_log(job_id, f"🔎 {verifier.description}...", "DEBUG")
+        timeout = self.timeout_for(verifier.name)
+        started = time.monotonic()
+        answer = None
+        if verifier.daemon is not None and settings.TYPE_DAEMONS_ENABLED:
+            try:
+                answer = await asyncio.to_thread(verifier.daemon, repo_path, None if scope.is_full else scope.files, timeout)
+            except subprocess.TimeoutExpired:
+                answer = ("", "TimeoutExpired", TIMEOUT_EXIT_CODE)
+        if answer is None:
+            answer = await self.sandbox.aexecute(
+                cmd, timeout=timeout, command_class="verifier", job_id=job_id
+            )
+        stdout, stderr, code = answer
+        duration = time.monotonic() - started
+
+        if code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+            log_streamer.publish_log(job_id, f"⚠️ {verifier.name} timed out after {timeout}s; result ignored.", "WARN")
+            return VerifierResult(verifier.name, "timeout", duration)
+        return self._outcome(verifier, job_id, duration, stdout, stderr, code, verifier.parse(stdout, stderr, code, repo_path))
+
+    def _outcome(
+        self,
+        verifier: Verifier,
+        job_id: str,
+        duration: float,
+        stdout: str,
+        stderr: str,
+        code: int,
+        diagnostics: Optional[List[Diagnostic]]
+    ) -> VerifierResult:
+        """
+        Passed, or failed with the parsed diagnostics; output that did not parse
+        fails the verifier with the raw text when the tool exited non-zero.
+        """
+        if diagnostics is None:
+            if code == 0:
+                log_streamer.publish_log(job_id, f"✅ {verifier.name} passed.", "DEBUG")
+                return VerifierResult(verifier.name, "passed", duration)
+            output = (stderr or stdout) if verifier.include_stderr else (stdout or stderr)
+            log_streamer.publish_log(job_id, f"❌ {verifier.name} failed to run.", "ERROR")
+            return VerifierResult(verifier.name, "failed", duration, f"{verifier.error_prefix}{output}", verifier.error_class)
+        found = DiagnosticSet(diagnostics)
+        if not found.failing():
+            log_streamer.publish_log(job_id, f"✅ {verifier.name} passed.", "DEBUG")
+            return VerifierResult(verifier.name, "passed", duration)
+        log_streamer.publish_log(job_id, f"❌ {verifier.name} detected {len(found)} issue(s).", "ERROR")
+        return VerifierResult(
+            verifier.name, "failed", duration, f"{verifier.error_prefix}{found.render()}", found.primary_class(), list(found)
+        )
+
+    async def _run_cached(self, verifier: Verifier, repo_path: str, job_id: str, scope: ChangeScope, config: str) -> VerifierResult:
+        """
+        Looks every file up in the cache, runs the tool on the misses only and
+        stores their per-file diagnostics. Findings are reported in file order.
+        Misses are passed in batches so a full-scope run on a large repository
+        does not overflow the command line.
+        """
+        if scope.is_full:
+            files = await asyncio.to_thread(lambda: sorted(graph_for(repo_path).iter_python_files()))
+        else:
+            files = scope.files
+        cache = cache_for(repo_path)
+        version = await asyncio.to_thread(tool_version, verifier.per_file_command([])[0])
+        version = f"{version} ({_CACHE_FORMAT})"
+        hits, misses, keys = await asyncio.to_thread(cache.lookup, verifier.name, version, config, files)
+        per_file: Dict[str, List[Diagnostic]] = {f: [Diagnostic(*row) for row in json.loads(rows)] for f, rows in hits.items()}
+
+        duration = 0.0
+        stdout = stderr = ""
+        code = 0
+        parsed: Optional[List[Diagnostic]] = []
+        if misses:
+            log_streamer.publish_log(job_id, f"🔎 {verifier.description} ({len(misses)}/{len(files)} files not cached)...", "DEBUG")
+            timeout = self.timeout_for(verifier.name)
+            started = time.monotonic()
+            relative = {os.path.join(repo_path, f): f for f in misses}
+            for batch in _batches(list(relative)):
+                stdout, stderr, code = await self.sandbox.aexecute(
+                    verifier.per_file_command(batch), timeout=timeout, command_class="verifier", job_id=job_id
+                )
+                duration = time.monotonic() - started
+                if code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+                    log_streamer.publish_log(job_id, f"⚠️ {verifier.name} timed out after {timeout}s; result ignored.", "WARN")
+                    result = VerifierResult(verifier.name, "timeout", duration)
+                    result.cache_hits, result.cache_misses = len(hits), len(misses)
+                    return result
+                parsed = verifier.parse(stdout, stderr, code, repo_path)
+                if parsed is None:
+                    if code != 0:
+                        break
+                    continue
+                fresh: Dict[str, List[Diagnostic]] = {relative[path]: [] for path in batch}
+                for d in parsed:
+                    fresh.setdefault(d.file, []).append(d)
+                await asyncio.to_thread(
+                    cache.store, verifier.name, {f: json.dumps([d.as_row() for d in found]) for f, found in fresh.items()}, keys
+                )
+                per_file.update(fresh)
+
+        if parsed is None and code != 0:
+            # The tool itself failed (bad config, crash): report it as is and cache nothing
+            result = self._outcome(verifier, job_id, duration, stdout, stderr, code, None)
+        else:
+            listed = set(files)
+            ordered = [d for f in files for d in per_file.get(f, [])]
+            ordered += [d for f, found in per_file.items() if f not in listed for d in found]
+            result = self._outcome(verifier, job_id, duration, stdout, stderr, code, ordered)
+        result.cache_hits, result.cache_misses = len(hits), len(misses)
+        return result
+
+verification_pipeline = VerificationPipeline()
@@ -0,0 +1,235 @@
+import fnmatch
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import xxhash
+from app.core.config import settings
+from app.agents.knowledge_graph import SKIP_DIRS
+
+logger = logging.getLogger(__name__)
+
+_CACHE_DIR = os.path.join(".agent_artifacts", "cache")
+# Packages auto-fix installs for the workspace, layered over the worker's (--system-site-packages)
+_VENV_DIR = os.path.join(_CACHE_DIR, "venv")
+_DB_NAME = "verification.sqlite3"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    path TEXT NOT NULL,
+    output TEXT NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+# SQLite caps bound parameters per statement
+_BATCH = 500
+
+_versions: Dict[Tuple[str, float], str] = {}
+_versions_lock = threading.Lock()
+
+
+def tool_version(executable: str) -> str:
+    """
+    `<tool> --version`, memoized per resolved binary and its mtime so upgrades invalidate results.
+    """
+    path = shutil.which(executable)
+    if path is None:
+        return "missing"
+    try:
+        key = (os.path.realpath(path), os.path.getmtime(path))
+    except OSError:
+        return "unknown"
+    with _versions_lock:
+        if key in _versions:
+            return _versions[key]
+    try:
+        result = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=30)
+        lines = (result.stdout or result.stderr).strip().splitlines()
+        version = lines[0] if lines else "unknown"
+    except (OSError, subprocess.TimeoutExpired):
+        version = "unknown"
+    with _versions_lock:
+        _versions[key] = version
+    return version
+
+
+def config_hash(repo_path: str) -> str:
+    """
+    Hash of every tool / dependency config file in the workspace (VERIFY_FULL_RUN_FILES).
+    """
+    h = xxhash.xxh3_64()
+    for root, dirs, files in os.walk(repo_path):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in settings.VERIFY_FULL_RUN_FILES):
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "rb") as f:
+                        h.update(os.path.relpath(path, repo_path).encode("utf-8") + b"\0" + f.read() + b"\0")
+                except OSError:
+                    pass
+    return h.hexdigest()
+
+
+def cache_dir(repo_path: str) -> str:
+    """
+    The workspace's .agent_artifacts/cache directory, created on first use.
+    """
+    directory = os.path.join(repo_path, _CACHE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    ignore = os.path.join(directory, ".gitignore")
+    if not os.path.exists(ignore):
+        # Keeps everything in it (and this file) out of the committer's `git add -A`
+        with open(ignore, "w") as f:
+            f.write("*\n")
+    return directory
+
+
+def venv_dir(repo_path: str) -> str:
+    return os.path.join(repo_path, _VENV_DIR)
+
+
+def workspace_python(repo_path: str) -> Optional[str]:
+    """
+    The interpreter of the workspace's venv, or None while it has none.
+    Type checking and tests use it so they see the packages installed there.
+    """
+    python = os.path.join(venv_dir(repo_path), "bin", "python")
+    return python if os.path.exists(python) else None
+
+
+def file_hash(path: str) -> str:
+    h = xxhash.xxh3_128()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class VerificationCache:
+    """
+    Per-file verifier results for one workspace, in SQLite under
+    .agent_artifacts/cache (git-ignored). An entry is keyed by tool, tool
+    version, config hash, path and file content hash, so any of those changing
+    is simply a miss. Entries unused for VERIFY_CACHE_TTL_DAYS are evicted, and
+    the least recently used ones once the store exceeds VERIFY_CACHE_MAX_ENTRIES.
+    """
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.path = os.path.join(repo_path, _CACHE_DIR, _DB_NAME)
+        self._ready = False
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            cache_dir(self.repo_path)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+            self._ready = True
+        return conn
+
+    @staticmethod
+    def _key(tool: str, version: str, config: str, path: str, content: str) -> str:
+        h = xxhash.xxh3_128()
+        for part in (tool, version, config, path, content):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def lookup(self, tool: str, version: str, config: str, files: List[str]) -> Tuple[Dict[str, str], List[str], Dict[str, str]]:
+        """
+        Returns (cached output per hit file, missed files, cache key per file).
+        Files that cannot be read are treated as misses.
+        """
+        keys: Dict[str, str] = {}
+        for rel in files:
+            try:
+                keys[rel] = self._key(tool, version, config, rel, file_hash(os.path.join(self.repo_path, rel)))
+            except OSError:
+                pass
+        hits: Dict[str, str] = {}
+        by_key = {key: rel for rel, key in keys.items()}
+        try:
+            with closing(self._connect()) as conn, conn:
+                for batch in _batches(list(by_key)):
+                    marks = ",".join("?" * len(batch))
+                    for key, output in conn.execute(f"SELECT key, output FROM results WHERE key IN ({marks})", batch):
+                        hits[by_key[key]] = output
+                    conn.execute(f"UPDATE results SET last_used = ? WHERE key IN ({marks})", [time.time(), *batch])
+        except sqlite3.Error as e:
+            logger.warning(f"VERIFY CACHE: Lookup failed for {self.path}: {e}")
+            hits = {}
+        misses = [rel for rel in files if rel not in hits]
+        with self._lock:
+            self.counters["hits"] += len(hits)
+            self.counters["misses"] += len(misses)
+        return hits, misses, keys
+
+    def store(self, tool: str, results: Dict[str, str], keys: Dict[str, str]):
+        rows = [(keys[rel], tool, rel, output, time.time()) for rel, output in results.items() if rel in keys]
+        if not rows:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO results (key, tool, path, output, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+                evicted = self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"VERIFY CACHE: Store failed for {self.path}: {e}")
+            return
+        with self._lock:
+            self.counters["stores"] += len(rows)
+            self.counters["evictions"] += evicted
+
+    @staticmethod
+    def _evict(conn: sqlite3.Connection) -> int:
+        cutoff = time.time() - settings.VERIFY_CACHE_TTL_DAYS * 86400
+        evicted = conn.execute("DELETE FROM results WHERE last_used < ?", (cutoff,)).rowcount
+        (count,) = conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        excess = count - settings.VERIFY_CACHE_MAX_ENTRIES
+        if excess > 0:
+            evicted += conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,)
+            ).rowcount
+        return evicted
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            total = self.counters["hits"] + self.counters["misses"]
+            return self.counters["hits"] / total if total else 0.0
+
+
+def _batches(items: List[str]) -> Iterable[List[str]]:
+    for i in range(0, len(items), _BATCH):
+        yield items[i:i + _BATCH]
+
+
+_caches: Dict[str, VerificationCache] = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(repo_path: str) -> VerificationCache:
+    root = os.path.realpath(repo_path)
+    with _caches_lock:
+        cache = _caches.get(root)
+        if cache is None:
+            cache = _caches[root] = VerificationCache(root)
+    return cache
+
+
+def forget_cache(repo_path: str):
+    with _caches_lock:
+        _caches.pop(os.path.realpath(repo_path), None)
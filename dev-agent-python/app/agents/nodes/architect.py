@@ -30,7 +30,7 @@ async def architect_node(state: AgentState) -> AgentState:
         if line.strip():
             log_streamer.publish_log(job_id, f"📐 {line.strip()}", "DEBUG")
 
-    design_doc, stderr, _ = codex.run_prompt(prompt, log_callback=stream_callback)
+    design_doc, stderr, _ = await codex.arun_prompt(prompt, log_callback=stream_callback)
     
     if not design_doc:
         design_doc = "No architectural guidelines generated. Proceeding with default structure."
@@ -1,12 +1,39 @@
 from app.agents.state import AgentState
 from app.agents.wrapper import codex
 from app.core.stream import log_streamer
-from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.context_packer import context_packer
+from app.agents.code_search import code_search_for
+import asyncio
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
+# Characters of task text and errors used as the code search query
+CODE_SEARCH_QUERY_CHARS = 4000
+
+
+async def relevant_code(repo_path: str, query: str, job_id: str) -> str:
+    """
+    The workspace chunks most similar to the task (and its errors on a
+    retry), rendered with their source; empty when code search is
+    unavailable or nothing matches.
+    """
+    index = code_search_for(repo_path) if repo_path else None
+    if index is None or not query.strip():
+        return ""
+    try:
+        await asyncio.to_thread(index.refresh)
+        hits = index.search(query[:CODE_SEARCH_QUERY_CHARS])
+    except Exception as e:
+        logger.warning(f"CODE SEARCH: Skipped for the coder: {e}")
+        return ""
+    if not hits:
+        return ""
+    log_streamer.publish_log(job_id, f"🔎 Code search: {len(hits)} relevant snippet(s) added to the coder prompt.", "DEBUG")
+    return index.render(hits)
+
+
 async def coder_node(state: AgentState) -> AgentState:
     job_id = state.get("job_id", "unknown")
     repo_path = state.get("repo_path")
@@ -45,28 +72,43 @@ async def coder_node(state: AgentState) -> AgentState:
         "required": ["status", "intent", "files_modified"]
     }
 
+    # The planner's task_graph schema only requires id, name and dependencies
+    task_description = current_task.get("description") or current_task["name"] if current_task else plan
+    task_text = f"{current_task['name']}\n{task_description}" if current_task else plan
+    snippets = await relevant_code(repo_path, f"{task_text}\n{test_errors or ''}", job_id)
+    code_header = "Relevant code (from the workspace search index; open the files for full context):\n"
+
     if test_errors:
         log_streamer.publish_log(job_id, f"♻️ Retry #{retry_count}: Fixing errors for task '{current_task['name'] if current_task else 'Current Task'}'...", "WARN")
-        # Retry Prompt with Reflection
-        reflection_context = f"\n\nReflection/Hypothesis: {reflection_hypothesis}" if reflection_hypothesis else ""
+        # Retry Prompt with Reflection (diagnostics deduplicated and fitted to the coder's budget).
+        # The tester already rendered structured findings compactly; only free-form errors need re-parsing.
+        context = context_packer.pack("coder", {
+            "errors": test_errors if state.get("diagnostics") else context_packer.pack_diagnostics(test_errors),
+            "reflection": reflection_hypothesis or "",
+            "code": snippets
+        })
+        reflection_context = f"\n\nReflection/Hypothesis: {context['reflection']}" if reflection_hypothesis else ""
+        code_context = f"\n\n{code_header}{context['code']}" if snippets else ""
         prompt = (
             f"IMPORTANT: You MUST start your response with a JSON block.\n"
             f"JSON Format: {{\"status\": \"...\", \"intent\": \"...\", \"files_modified\": [...]}}\n\n"
             f"Goal: Fix errors in task '{current_task['name'] if current_task else 'Current Task'}'.\n"
-            f"Task Description: {current_task['description'] if current_task else plan}\n"
-            f"Errors Encountered:\n{test_errors}"
-            f"{reflection_context}\n\n"
+            f"Task Description: {task_description}\n"
+            f"Errors Encountered:\n{context['errors']}"
+            f"{reflection_context}{code_context}\n\n"
             f"Please edit the files directly to resolve these errors."
         )
     else:
         task_name = current_task['name'] if current_task else "mission components"
         log_streamer.publish_log(job_id, f"👨‍💻 Coding: Implementing task '{task_name}'...", "INFO")
+        code_context = f"{code_header}{context_packer.pack('coder', {'code': snippets})['code']}\n\n" if snippets else ""
         prompt = (
             f"IMPORTANT: You MUST start your response with a JSON block.\n"
             f"JSON Format: {{\"status\": \"...\", \"intent\": \"...\", \"files_modified\": [...]}}\n\n"
             f"Goal: Implement atomic task '{task_name}'.\n"
-            f"Description: {current_task['description'] if current_task else plan}\n"
+            f"Description: {task_description}\n"
             f"Acceptance Criteria: {', '.join(current_task.get('acceptance_criteria', [])) if current_task else 'N/A'}\n\n"
+            f"{code_context}"
             f"Please write the code and modify the necessary files in the workspace directly."
         )
     
@@ -75,19 +117,18 @@ async def coder_node(state: AgentState) -> AgentState:
         if line.strip():
             log_streamer.publish_log(job_id, f"🤖 {line.strip()}", "DEBUG")
 
-    # Fire and Forget execution
-    code_text, stderr, exit_code = codex.run_prompt(
+    # Fire and Forget execution (streams into the job log while Codex runs)
+    frame, code_text, stderr, exit_code = await codex.arun_json(
         prompt, 
         log_callback=stream_callback,
         sandbox="workspace-write",
         approval="never",
         cwd=repo_path,
-        expected_schema=CODEX_RESPONSE_SCHEMA
+        expected_schema=CODEX_RESPONSE_SCHEMA,
+        node="coder",
+        job_id=job_id # Tracks coding cost
     )
     
-    # Track coding cost
-    token_monitor.log_usage(job_id, len(prompt)//4, len(code_text)//4)
-    
     if exit_code != 0:
         error_msg = f"Coding failed: {stderr or code_text}"
         log_streamer.publish_log(job_id, f"❌ {error_msg}", "ERROR")
@@ -95,15 +136,8 @@ async def coder_node(state: AgentState) -> AgentState:
 
     log_streamer.publish_log(job_id, f"✅ Autonomous coding execution completed.", "SUCCESS")
 
-    # Extract files_modified from validated JSON
-    import re
-    files_modified = []
-    json_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", code_text, re.MULTILINE)
-    if json_match:
-        try:
-             files_modified = json.loads(json_match.group(1)).get("files_modified", [])
-        except:
-             pass
+    # files_modified from the validated frame
+    files_modified = frame.get("files_modified", []) if frame else []
 
     return {
         **state,
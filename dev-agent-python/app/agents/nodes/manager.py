@@ -10,10 +10,42 @@ from app.agents.logic.memory import ProjectState
 from app.agents.logic.risk_engine import risk_engine
 from app.agents.logic.strategy_router import strategy_router
 from app.agents.logic.manifest_writer import manifest_writer
-from typing import Optional
+from app.agents.knowledge_graph import graph_for
+from app.agents.nodes.tester import ensure_tests
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+
+def assess_changes(state: AgentState, repo_path: str, files_modified: List[str]) -> Tuple[Dict, int, str]:
+    """
+    Writes the audit manifest of the changed files and scores the change:
+    (manifest, risk score, strategy). Shared by the committer and the parallel
+    executor, whose merged tasks never pass through the committer.
+    """
+    job_id = state.get("job_id", "unknown")
+    # Priority F: Cryptographic Auditing (Observability)
+    manifest = manifest_writer.generate_manifest(state, files_modified)
+    manifest_writer.save_manifest(repo_path, manifest)
+    log_streamer.publish_log(job_id, f"📝 Audit: Generated MANIFEST.json ({len(manifest['files'])} files hashed)", "DEBUG")
+
+    # Priority A: Strategy Routing (Brain Upgrade)
+    # We use risk, confidence (default 1.0 for now), and current state
+    changed_paths = [f["path"] for f in manifest["files"]]
+    impacted = 0
+    try:
+        # The whole changeset's dependents in one impact query
+        graph = graph_for(repo_path)
+        graph.refresh(changed_paths)
+        impacted = len(graph.get_impacted_set(changed_paths) - set(changed_paths))
+    except Exception as e:
+        logger.warning(f"Risk: Could not compute the impact of {len(changed_paths)} changed files: {e}")
+    risk_score = risk_engine.calculate_score(manifest, impacted=impacted)
+    strategy = strategy_router.route(risk_score, 1.0, state)
+
+    log_streamer.publish_log(job_id, f"⚖️ Decision: Strategy '{strategy}' selected (Risk: {risk_score}/100)", "INFO")
+    return manifest, risk_score, strategy
+
 async def repo_prep_node(state: AgentState) -> AgentState:
     """
     Ensures the target repository is cloned or ready for modification.
@@ -42,9 +74,12 @@ async def repo_prep_node(state: AgentState) -> AgentState:
             
     # Transactionality: Create an ephemeral branch for this job
     original_branch = None
+    base_commit = None
     if os.path.exists(os.path.join(target_path, ".git")):
         try:
             repo = git.Repo(target_path)
+            if repo.head.is_valid():
+                base_commit = repo.head.commit.hexsha
             original_branch = repo.active_branch.name
             new_branch = f"job/{job_id}"
             
@@ -54,6 +89,9 @@ async def repo_prep_node(state: AgentState) -> AgentState:
         except Exception as e:
             logger.warning(f"Transactional branch creation failed: {e}")
     
+    # Generated once on the job branch, before any task runs (and before parallel worktrees fork from it)
+    await ensure_tests(target_path, job_id)
+
     # Priority 3: Initialize Project Memory
     memory = ProjectState(target_path)
     log_streamer.publish_log(job_id, f"🧠 Memory: Loaded persistent state from {target_path}", "DEBUG")
@@ -62,6 +100,7 @@ async def repo_prep_node(state: AgentState) -> AgentState:
         **state,
         "repo_path": target_path,
         "original_branch": original_branch,
+        "base_commit": base_commit,
         "project_state": memory.data,
         "status": "workspace_ready"
     }
@@ -102,19 +141,9 @@ async def committer_node(state: AgentState) -> AgentState:
             commit = repo.index.commit(commit_message)
             log_streamer.publish_log(job_id, f"✅ Committed changes to ephemeral branch: {commit.hexsha[:7]}", "SUCCESS")
 
-            # Priority F: Cryptographic Auditing (Observability)
             # Find modified files from the coder's output (already in state)
             files_modified = state.get("files_modified", []) # Need to ensure coder sets this
-            manifest = manifest_writer.generate_manifest(state, files_modified)
-            manifest_writer.save_manifest(repo_path, manifest)
-            log_streamer.publish_log(job_id, f"📝 Audit: Generated MANIFEST.json ({len(manifest['files'])} files hashed)", "DEBUG")
-
-            # Priority A: Strategy Routing (Brain Upgrade)
-            # We use risk, confidence (default 1.0 for now), and current state
-            risk_score = risk_engine.calculate_score(manifest)
-            strategy = strategy_router.route(risk_score, 1.0, state)
-            
-            log_streamer.publish_log(job_id, f"⚖️ Decision: Strategy '{strategy}' selected (Risk: {risk_score}/100)", "INFO")
+            manifest, risk_score, strategy = assess_changes(state, repo_path, files_modified)
 
             # Transactional Merge/Rollback
             if original_branch:
@@ -133,18 +162,7 @@ async def committer_node(state: AgentState) -> AgentState:
             current_task = state.get("current_task")
             if current_task and not has_errors:
                 memory = ProjectState(repo_path)
-                if "features_completed" not in memory.data:
-                    memory.data["features_completed"] = []
-                
-                # Check if already recorded
-                completed_ids = [f["id"] for f in memory.data["features_completed"]]
-                if current_task["id"] not in completed_ids:
-                    memory.data["features_completed"].append({
-                        "id": current_task["id"],
-                        "name": current_task["name"],
-                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-                    })
-                    memory.save()
+                if memory.complete_task(current_task):
                     log_streamer.publish_log(job_id, f"🧠 Memory: Task '{current_task['name']}' recorded as completed.", "DEBUG")
 
             return {**state, "status": "changes_applied", "risk_score": risk_score, "strategy": strategy, "project_state": memory.data}
@@ -3,6 +3,7 @@ from typing import Dict, List
 from app.agents.state import AgentState
 from app.agents.logic.strategy_router import strategy_router
 from app.agents.logic.completion_checker import completion_checker
+from app.agents.nodes.parallel import parallel_ready
 from app.core.stream import log_streamer
 
 logger = logging.getLogger(__name__)
@@ -29,6 +30,12 @@ async def scheduler_node(state: AgentState) -> AgentState:
     project_state = state.get("project_state", {})
     completed_ids = [f["id"] for f in project_state.get("features_completed", [])]
     
+    # Independent branches of the DAG run concurrently in their own worktrees
+    parallel = parallel_ready(state)
+    if parallel:
+        log_streamer.publish_log(job_id, f"📅 Scheduler: {len(parallel)} independent tasks ready; running them in parallel.", "INFO")
+        return {**state, "current_task": None, "status": "parallel_scheduled"}
+    
     # Simple dependency resolution
     next_task = None
     for task in task_graph:
@@ -51,7 +58,7 @@ async def completion_check_node(state: AgentState) -> AgentState:
     Final semantic verification of the mission.
     """
     job_id = state.get("job_id", "unknown")
-    satisfied, explanation = completion_checker.check(state)
+    satisfied, explanation = await completion_checker.check(state)
     
     if satisfied:
         log_streamer.publish_log(job_id, "🏁 Mission Accomplished: Acceptance criteria satisfied.", "SUCCESS")
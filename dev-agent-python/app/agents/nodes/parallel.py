@@ -0,0 +1,316 @@
+from app.agents.state import AgentState
+from app.core.stream import log_streamer
+from app.core.config import settings
+from app.agents.logic.memory import ProjectState
+from app.agents.logic.task_dag import ready_tasks, topological_order
+from app.agents.logic.verify_cache import cache_dir, forget_cache, venv_dir
+from app.agents.knowledge_graph import forget_graph
+from app.agents.symbol_index import forget_symbols
+from app.agents.code_search import forget_code_search
+from app.agents.nodes.coder import coder_node
+from app.agents.nodes.manager import assess_changes
+from app.agents.nodes.tester import tester_node
+from app.agents.nodes.react import react_node
+from app.tools.type_daemons import type_daemons
+import asyncio
+import git
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Agent scaffolding, never part of a task's commit: each worktree writes its own copies,
+# and the job's MANIFEST.json is rewritten for the merged result
+AGENT_PATHS = (".agent_artifacts", ".agent_memory.json", "AGENTS.md", "MANIFEST.json")
+_UNSAFE_REF_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class ParallelStats:
+    """
+    Per-job parallel execution results, for the job's final metrics. task_s
+    is the sum of the task runs; wall_s what the parallel phases took.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = {}
+
+    def record(self, job_id: str, merged: int, fallback: int, conflicts: int, task_s: float, wall_s: float):
+        with self._lock:
+            e = self._jobs.setdefault(job_id, {"phases": 0, "merged": 0, "fallback": 0, "conflicts": 0, "task_s": 0.0, "wall_s": 0.0})
+            e["phases"] += 1
+            e["merged"] += merged
+            e["fallback"] += fallback
+            e["conflicts"] += conflicts
+            e["task_s"] += task_s
+            e["wall_s"] += wall_s
+
+    def pop(self, job_id: str) -> Dict:
+        with self._lock:
+            e = self._jobs.pop(job_id, None)
+        if e is None:
+            return {}
+        return {**e, "task_s": round(e["task_s"], 2), "wall_s": round(e["wall_s"], 2), "speedup": round(e["task_s"] / e["wall_s"], 2) if e["wall_s"] else 1.0}
+
+
+parallel_stats = ParallelStats()
+
+
+def parallel_ready(state: AgentState) -> List[Dict]:
+    """
+    The ready tasks to run in parallel: at least two, in a git workspace with
+    no uncommitted changes outside the agent's own files. Empty otherwise,
+    and the scheduler picks one task as usual.
+    """
+    repo_path = state.get("repo_path")
+    if settings.TASK_PARALLEL_WIDTH < 2 or not repo_path or not os.path.exists(os.path.join(repo_path, ".git")):
+        return []
+    completed = [f["id"] for f in (state.get("project_state") or {}).get("features_completed", [])]
+    ready = ready_tasks(state.get("task_graph") or [], completed, state.get("parallel_fallback") or [])
+    if len(ready) < 2:
+        return []
+    try:
+        repo = git.Repo(repo_path)
+        if not repo.head.is_valid() or repo.head.is_detached:
+            return []
+        dirty = [line[3:] for line in repo.git.status("--porcelain", "--untracked-files=no").splitlines()]
+        if any(not path.startswith(AGENT_PATHS) for path in dirty):
+            return []
+    except Exception as e:
+        logger.warning(f"PARALLEL: Workspace check failed, running tasks serially: {e}")
+        return []
+    return ready
+
+
+class _TaskRun:
+    __slots__ = ("task", "branch", "path", "base", "started", "state")
+
+    def __init__(self, task: Dict, branch: str, path: str, base: str):
+        self.task = task
+        self.branch = branch
+        self.path = path
+        self.base = base
+        self.started = time.monotonic()
+        self.state: Optional[AgentState] = None
+
+
+def _worktree_root(repo_path: str) -> str:
+    root = os.path.join(repo_path, ".agent_artifacts", "worktrees")
+    os.makedirs(root, exist_ok=True)
+    ignore = os.path.join(root, ".gitignore")
+    if not os.path.exists(ignore):
+        # Keeps the worktrees out of the main workspace's `git add -A` and status
+        with open(ignore, "w") as f:
+            f.write("*\n")
+    return root
+
+
+def _create_worktree(repo: git.Repo, repo_path: str, job_id: str, task: Dict) -> _TaskRun:
+    """
+    A new worktree on its own branch, at the job branch's current HEAD (which
+    holds every merged dependency). The workspace's index cache is copied
+    over, so code search only re-hashes files instead of re-embedding them;
+    the auto-fix venv is not (a worktree creates its own if it needs one).
+    """
+    safe_id = _UNSAFE_REF_CHARS.sub("-", str(task["id"])).strip("-") or "task"
+    branch = f"job/{job_id}-task-{safe_id}"
+    path = os.path.join(_worktree_root(repo_path), f"{job_id}-{safe_id}")
+    if os.path.exists(path):
+        repo.git.worktree("remove", "--force", path)
+    base = repo.head.commit.hexsha
+    repo.git.worktree("add", "-B", branch, path, base)
+    source_cache = os.path.join(repo_path, ".agent_artifacts", "cache")
+    if os.path.isdir(source_cache):
+        venv = os.path.realpath(venv_dir(repo_path))
+        shutil.copytree(
+            source_cache, cache_dir(path), dirs_exist_ok=True,
+            ignore=lambda directory, names: [n for n in names if os.path.realpath(os.path.join(directory, n)) == venv]
+        )
+    return _TaskRun(task, branch, path, base)
+
+
+def _commit_worktree(run: _TaskRun, job_id: str) -> bool:
+    """
+    Commits the task's changes on its branch; False when it changed nothing.
+    """
+    repo = git.Repo(run.path)
+    repo.git.add("-A", "--", ".", *[f":(exclude){p}" for p in AGENT_PATHS])
+    if not repo.git.diff("--cached", "--name-only"):
+        return False
+    # The committer's commit path, hooks included
+    repo.index.commit(f"feat: {run.task['name']} ({run.task['id']})\n\nAutonomous agent implementation for Job {job_id}")
+    return True
+
+
+def _merge(repo: git.Repo, run: _TaskRun) -> Tuple[bool, List[str]]:
+    """
+    Merges the task branch into the job branch. On a conflict the merge is
+    aborted and the conflicting paths are returned.
+    """
+    try:
+        repo.git.merge("--no-ff", "-m", f"Merge task '{run.task['name']}' ({run.task['id']})", run.branch)
+        return True, []
+    except git.GitCommandError as e:
+        conflicts = [p for p in repo.git.diff("--name-only", "--diff-filter=U").splitlines() if p]
+        try:
+            repo.git.merge("--abort")
+        except git.GitCommandError:
+            # Refused before starting (e.g. untracked files in the way): nothing to abort
+            pass
+        return False, conflicts or [str(e.stderr or e).strip()[:300]]
+
+
+def _remove_worktree(repo: git.Repo, run: _TaskRun):
+    type_daemons.shutdown(run.path, reason="task_end")
+    # Long-lived workers would otherwise keep a graph and indexes per task ever run
+    forget_graph(run.path)
+    forget_cache(run.path)
+    forget_symbols(run.path)
+    forget_code_search(run.path)
+    try:
+        repo.git.worktree("remove", "--force", run.path)
+        repo.git.branch("-D", run.branch)
+    except git.GitCommandError as e:
+        logger.warning(f"PARALLEL: Could not remove the worktree of {run.branch}: {e}")
+
+
+def _commit_generated_tests(repo: git.Repo, job_id: str):
+    tests = [f for f in os.listdir(repo.working_tree_dir) if f.startswith("test_") and f.endswith(".py")]
+    if not tests:
+        return
+    repo.git.add("--", *tests)
+    if repo.git.diff("--cached", "--name-only"):
+        repo.index.commit(f"test: Autonomous test generation for Job {job_id}")
+
+
+async def _run_task(state: AgentState, run: _TaskRun) -> AgentState:
+    """
+    The serial coder/tester loop of one task, inside its worktree.
+    """
+    task_state: AgentState = {
+        **state,
+        "repo_path": run.path,
+        "base_commit": run.base,
+        "current_task": run.task,
+        "retry_count": 0,
+        "test_errors": None,
+        "test_failures": None,
+        "diagnostics": None,
+        "error_class": None,
+        "reflection_hypothesis": None,
+        "next_recommended_action": None,
+        "status": "task_scheduled",
+    }
+    if task_state.get("strategy") == "react-mode":
+        task_state = await react_node(task_state)
+    while True:
+        task_state = await coder_node(task_state)
+        if task_state.get("status") == "failed":
+            return task_state
+        task_state = await tester_node(task_state)
+        if task_state.get("status") != "testing_failed":
+            return task_state
+
+
+async def parallel_executor_node(state: AgentState) -> AgentState:
+    """
+    Runs the ready tasks of the TaskGraph concurrently, each in its own git
+    worktree, up to TASK_PARALLEL_WIDTH at a time; a task starts as soon as
+    its dependencies are merged, so the phase takes about the critical path.
+    Finished tasks are committed on their branch and merged onto the job
+    branch in dependency order. A task that fails its tests or conflicts on
+    merge is handed back to the serial loop, with everything depending on it.
+    The merged result gets the committer's manifest and risk assessment.
+    """
+    job_id = state.get("job_id", "unknown")
+    repo_path = state["repo_path"]
+    task_graph = state.get("task_graph") or []
+    width = settings.TASK_PARALLEL_WIDTH
+    order = {task_id: i for i, task_id in enumerate(topological_order(task_graph))}
+    memory = ProjectState(repo_path)
+    completed = {f["id"] for f in memory.data.get("features_completed", [])}
+    fallback = set(state.get("parallel_fallback") or [])
+    repo = git.Repo(repo_path)
+    started = time.monotonic()
+    task_seconds = 0.0
+    merged = conflicts = 0
+
+    try:
+        # repo_prep's generated tests go on the job branch; worktrees must not each regenerate them
+        await asyncio.to_thread(_commit_generated_tests, repo, job_id)
+        # Worktrees left registered by an interrupted run would block their branches
+        await asyncio.to_thread(repo.git.worktree, "prune")
+        phase_base = repo.head.commit.hexsha
+    except git.GitCommandError as e:
+        log_streamer.publish_log(job_id, f"⚠️ Parallel: Could not prepare the job branch ({e}); running tasks serially.", "WARN")
+        fallback = {task["id"] for task in task_graph}
+        return {**state, "parallel_fallback": sorted(fallback), "status": "strategy_selected"}
+
+    log_streamer.publish_log(job_id, f"🔀 Parallel: Running independent tasks in git worktrees (width {width}).", "INFO")
+    running: Dict[asyncio.Task, _TaskRun] = {}
+    while True:
+        launching = ready_tasks(task_graph, completed, fallback | {run.task["id"] for run in running.values()})
+        for task in launching[:width - len(running)]:
+            try:
+                run = await asyncio.to_thread(_create_worktree, repo, repo_path, job_id, task)
+            except Exception as e:
+                log_streamer.publish_log(job_id, f"⚠️ Parallel: Could not create a worktree for '{task['name']}' ({e}); it runs serially.", "WARN")
+                fallback.add(task["id"])
+                continue
+            log_streamer.publish_log(job_id, f"🌱 Parallel: Task '{task['name']}' ({task['id']}) started in {os.path.relpath(run.path, repo_path)}.", "INFO")
+            running[asyncio.create_task(_run_task(state, run))] = run
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        # Tasks finishing together merge in dependency (then plan) order
+        for future in sorted(done, key=lambda f: order.get(running[f].task["id"], len(order))):
+            run = running.pop(future)
+            task = run.task
+            task_seconds += time.monotonic() - run.started
+            try:
+                run.state = future.result()
+            except Exception as e:
+                logger.error(f"PARALLEL: Task {task['id']} raised: {e}")
+                run.state = {**state, "status": "failed", "error": str(e)}
+            try:
+                if run.state.get("status") != "testing_complete":
+                    log_streamer.publish_log(job_id, f"⚠️ Parallel: Task '{task['name']}' ended with '{run.state.get('status')}'; it will be retried serially.", "WARN")
+                    fallback.add(task["id"])
+                elif not await asyncio.to_thread(_commit_worktree, run, job_id):
+                    log_streamer.publish_log(job_id, f"ℹ️ Parallel: Task '{task['name']}' made no changes.", "INFO")
+                    completed.add(task["id"])
+                    memory.complete_task(task)
+                else:
+                    ok, conflicted = await asyncio.to_thread(_merge, repo, run)
+                    if ok:
+                        merged += 1
+                        completed.add(task["id"])
+                        memory.complete_task(task)
+                        log_streamer.publish_log(job_id, f"🔀 Parallel: Merged '{task['name']}' onto the job branch ({time.monotonic() - run.started:.1f}s).", "SUCCESS")
+                    else:
+                        conflicts += 1
+                        fallback.add(task["id"])
+                        log_streamer.publish_log(job_id, f"⚠️ Parallel: Merge conflict for '{task['name']}' in {', '.join(conflicted[:5])}; it will be redone serially on the merged branch.", "WARN")
+            except Exception as e:
+                log_streamer.publish_log(job_id, f"⚠️ Parallel: Could not merge '{task['name']}' ({e}); it will be retried serially.", "WARN")
+                fallback.add(task["id"])
+            finally:
+                await asyncio.to_thread(_remove_worktree, repo, run)
+
+    wall = time.monotonic() - started
+    parallel_stats.record(job_id, merged, len(fallback), conflicts, task_seconds, wall)
+    log_streamer.publish_log(job_id, f"🏁 Parallel: {merged} task(s) merged in {wall:.1f}s ({task_seconds:.1f}s of task time); {len(fallback)} left to the serial loop.", "INFO")
+    result = {**state, "project_state": memory.data, "parallel_fallback": sorted(fallback), "current_task": None, "status": "strategy_selected"}
+    if merged:
+        try:
+            changed = (await asyncio.to_thread(repo.git.diff, "--name-only", phase_base, "HEAD")).splitlines()
+            manifest, risk_score, strategy = await asyncio.to_thread(assess_changes, state, repo_path, changed)
+            result.update({"manifest": manifest, "risk_score": risk_score, "strategy": strategy})
+        except Exception as e:
+            log_streamer.publish_log(job_id, f"⚠️ Parallel: Could not assess the merged changes ({e}).", "WARN")
+    return result
@@ -1,7 +1,6 @@
 from app.agents.state import AgentState
 from app.agents.wrapper import codex
 from app.core.stream import log_streamer
-from app.agents.logic.token_monitor import token_monitor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -40,29 +39,22 @@ async def planner_node(state: AgentState) -> AgentState:
     }
 
     # Call LLM with framing and schema validation
-    plan_text, stderr, code = codex.run_prompt(
+    frame, plan_text, stderr, code = await codex.arun_json(
         prompt, 
         expected_schema=expected_schema,
-        approval="never"
+        approval="never",
+        cwd=state.get("repo_path"),
+        node="planner",
+        job_id=job_id # Tracks planning cost
     )
     
-    # Track planning cost
-    token_monitor.log_usage(job_id, len(prompt)//4, len(plan_text)//4)
-    
     if code != 0:
         error_msg = f"Planning failed: {stderr}"
         log_streamer.publish_log(job_id, f"❌ {error_msg}", "ERROR")
         return {**state, "status": "failed", "error": error_msg}
 
-    # Extract Task Graph from validated JSON
-    import re
-    task_graph = []
-    json_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", plan_text, re.MULTILINE)
-    if json_match:
-        try:
-            task_graph = json.loads(json_match.group(1)).get("task_graph", [])
-        except:
-             pass
+    # Task Graph from the validated frame
+    task_graph = frame.get("task_graph", []) if frame else []
         
     # Save Artifact
     import os
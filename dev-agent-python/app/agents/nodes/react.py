@@ -3,10 +3,25 @@ from app.agents.wrapper import codex
 from app.core.stream import log_streamer
 from app.agents.logic.react_guard import react_guard
 from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.context_packer import context_packer
+from app.agents.symbol_index import QUERY_HELP, run_query, symbols_for
+from app.agents.code_search import SEARCH_HELP, code_search_for, run_search
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+REACT_STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "action": {"type": "string"},
+        "is_final": {"type": "boolean"}
+    },
+    "required": ["thought"]
+}
+
 async def react_node(state: AgentState) -> AgentState:
     """
     Implements a ReAct (Reason-Act-Observe) loop for complex missions.
@@ -15,12 +30,24 @@ async def react_node(state: AgentState) -> AgentState:
     job_id = state.get("job_id", "unknown")
     repo_path = state.get("repo_path")
     strategy = state.get("strategy")
+    current_task = state.get("current_task")
+    # Parallel tasks reason concurrently within one job; each gets its own guard history
+    guard_key = current_task["id"] if current_task else "reasoning"
     
     if strategy != "react-mode":
         return state
 
     log_streamer.publish_log(job_id, "🧠 ReAct Mode: Dynamic Tool-Use Reasoning initiated.", "INFO")
-    
+
+    # Definitions and references are answered in-process instead of a grep over the tree per step
+    symbols = symbols_for(repo_path)
+    indexed = await asyncio.to_thread(symbols.refresh)
+    log_streamer.publish_log(job_id, f"📇 Symbol index: {indexed['files']} files ({indexed['parsed']} parsed) in {indexed['seconds']}s.", "DEBUG")
+    search = code_search_for(repo_path)
+    if search is not None:
+        indexed = await asyncio.to_thread(search.refresh)
+        log_streamer.publish_log(job_id, f"🔎 Code search index: {indexed['chunks']} chunks ({indexed['embedded']} files embedded) in {indexed['seconds']}s.", "DEBUG")
+
     # Internal ReAct Loop
     observations = []
     
@@ -28,62 +55,66 @@ async def react_node(state: AgentState) -> AgentState:
     while True:
         log_streamer.publish_log(job_id, f"🤔 ReAct: Thinking about the next step...", "DEBUG")
         
+        context = context_packer.pack("react", {"observations": context_packer.pack_observations(observations)})
         prompt = (
             f"You are the Greater God Reasoner. You are solving: {state['user_input']}\n"
             f"Current Strategy: {strategy}\n"
-            f"Previous Observations: {json.dumps(observations)}\n\n"
-            f"GOAL: Use tools (ls, grep, cat, find) to understand the codebase. \n"
+            f"Previous Observations: {context['observations']}\n\n"
+            f"GOAL: Use tools to understand the codebase. Navigation queries are answered instantly from a symbol index: {QUERY_HELP}; "
+            f"and from a code search index: {SEARCH_HELP}. "
+            f"These are the only actions available; no shell commands are run.\n"
             f"Format your response as a JSON object:\n"
-            f"AGENT_JSON_START: {{\"thought\": \"your reasoning\", \"action\": \"command_to_run\", \"is_final\": false}}\n"
+            f"AGENT_JSON_START: {{\"thought\": \"your reasoning\", \"action\": \"query_to_run\", \"is_final\": false}}\n"
             f"If you have enough info to implement, set \"is_final\": true and provide your final hypothesis summary in \"thought\"."
         )
         
         # Reasoning Step (Read-Only)
-        stdout, stderr, code = codex.run_prompt(
+        frame, stdout, stderr, code = await codex.arun_json(
             prompt, 
+            REACT_STEP_SCHEMA,
             sandbox="read-only",
             approval="never",
-            cwd=repo_path
+            cwd=repo_path,
+            node="react",
+            purpose="think",
+            job_id=job_id # Tracks reasoning cost
         )
         
-        # Track reasoning cost
-        token_monitor.log_usage(job_id, len(prompt)//4, len(stdout)//4)
-        
         if code == 0:
-            import re
-            json_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", stdout, re.MULTILINE)
-            if json_match:
-                res = json.loads(json_match.group(1))
-                thought = res.get("thought", "")
-                action = res.get("action", "")
-                is_final = res.get("is_final", False)
+            if frame:
+                thought = frame.get("thought", "")
+                action = frame.get("action", "")
+                is_final = frame.get("is_final", False)
                 
                 log_streamer.publish_log(job_id, f"💭 Thought: {thought}", "DEBUG")
                 
                 if is_final:
                     log_streamer.publish_log(job_id, "🎯 ReAct: Reasoning complete.", "SUCCESS")
-                    react_guard.reset_task(job_id, "reasoning")
+                    react_guard.reset_task(job_id, guard_key)
                     return {**state, "reflection_hypothesis": thought, "status": "reasoning_complete"}
                 
                 if action:
                     # Governance: Guard against loops and over-reasoning
-                    if not react_guard.track_action(job_id, "reasoning", action):
+                    if not react_guard.track_action(job_id, guard_key, action):
                         log_streamer.publish_log(job_id, "🛑 ReAct: Logic gate active. Fallback to implementation.", "WARN")
                         break
                         
-                    log_streamer.publish_log(job_id, f"🛠️ Act: Running `{action}`", "INFO")
-                    
                     # Execution Step (The "Act")
-                    act_stdout, act_stderr, act_code = codex.run_command(
-                        action,
-                        sandbox="read-only",
-                        cwd=repo_path
-                    )
-                    
-                    observations.append({
-                        "action": action, 
-                        "observation": act_stdout if act_code == 0 else f"Error: {act_stderr}"
-                    })
+                    started = time.perf_counter()
+                    answer = run_query(symbols, action)
+                    searched = None if answer is not None else run_search(search, action)
+                    if answer is not None:
+                        log_streamer.publish_log(job_id, f"📇 Act: Symbol query `{action}` ({(time.perf_counter() - started) * 1000:.2f}ms)", "INFO")
+                        observations.append({"action": action, "observation": answer})
+                    elif searched is not None:
+                        log_streamer.publish_log(job_id, f"🔎 Act: Code search `{action}` ({(time.perf_counter() - started) * 1000:.2f}ms)", "INFO")
+                        observations.append({"action": action, "observation": searched})
+                    else:
+                        log_streamer.publish_log(job_id, f"⚠️ Act: Unknown action `{action}`", "WARN")
+                        observations.append({
+                            "action": action,
+                            "observation": f"Error: unknown action. Available actions: {QUERY_HELP}; {SEARCH_HELP}"
+                        })
         else:
             log_streamer.publish_log(job_id, "⚠️ ReAct: Prompt failed. Falling back.", "WARN")
             break
@@ -14,7 +14,7 @@ async def reviewer_node(state: AgentState) -> AgentState:
     prompt = f"Review these changes:\n{state.get('code_diffs', [])}\n\nTest Results:\n{state.get('test_results', '')}\n\nApprove or Reject?"
     
     # Call LLM
-    review_output, stderr, code = codex.run_prompt(prompt)
+    review_output, stderr, code = await codex.arun_prompt(prompt)
     
     # Save Artifact
     import os
@@ -2,23 +2,70 @@ from app.agents.state import AgentState
 from app.core.stream import log_streamer
 from app.agents.logic.classifier import classifier
 from app.agents.logic.reflection import reflection_engine
-from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.verification import verification_pipeline
+from app.agents.logic.change_scope import ChangeScope, compute_scope
+from app.agents.logic.pytest_runner import TestRunResult, pytest_runner
+from app.agents.logic.diagnostics import DiagnosticSet
+from app.agents.logic.autofix import auto_fixer
+from app.agents.knowledge_graph import graph_for
+from app.core.config import settings
+import asyncio
 import logging
-import os
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-async def tester_node(state: AgentState) -> AgentState:
-    job_id = state.get("job_id", "unknown")
-    logger.info("TESTING: Running verification...")
-    log_streamer.publish_log(job_id, "🧪 Testing: Verifying changes...", "INFO")
-    repo_path = state.get("repo_path")
-    if not repo_path:
-        return {**state, "status": "testing_complete"}
 
-    # Phase 4.3: Automated Test Generation (if no tests exist)
-    test_files = [f for f in os.listdir(repo_path) if f.startswith("test_") and f.endswith(".py")]
-    if not test_files:
+async def _verify(repo_path: str, job_id: str, base_commit: Optional[str]) -> Tuple[bool, DiagnosticSet, List[str], Optional[ChangeScope], Optional[TestRunResult]]:
+    """
+    One verification pass: the verifiers on the change scope, then the test
+    stage when they pass. Returns (has_errors, diagnostics, raw outputs of
+    tools whose output did not parse and test reports, scope, test run).
+    """
+    test_output: List[str] = []
+    diagnostics = DiagnosticSet()
+    has_errors = False
+    scope = None
+    test_run = None
+
+    try:
+        # Only files changed since the job's base commit and their importers, unless config changed
+        scope = await asyncio.to_thread(compute_scope, repo_path, base_commit)
+        log_streamer.publish_log(job_id, f"🎯 Verification scope: {scope.describe()}", "INFO")
+
+        # compileall, ruff, mypy, pip check and bandit run concurrently; failures are reported in declared order
+        results = await verification_pipeline.run(repo_path, job_id, scope=scope)
+        for result in results:
+            if result.failed:
+                has_errors = True
+                if result.diagnostics:
+                    diagnostics.extend(result.diagnostics)
+                else:
+                    test_output.append(result.error)
+        if not has_errors:
+            log_streamer.publish_log(job_id, "✅ All verifiers passed.", "DEBUG")
+
+        # Tests only run on code that verifies: selected tests first, then the full-suite gate before commit
+        if not has_errors and settings.TEST_STAGE_ENABLED and await asyncio.to_thread(pytest_runner.has_tests, repo_path):
+            test_run = await pytest_runner.run(repo_path, job_id)
+            if test_run.failed:
+                has_errors = True
+                diagnostics.extend(f.to_diagnostic() for f in test_run.failures)
+                test_output.append(test_run.report())
+
+    except Exception as e:
+        log_streamer.publish_log(job_id, f"⚠️ Could not complete verification: {e}", "WARN")
+
+    return has_errors, diagnostics, test_output, scope, test_run
+
+
+async def ensure_tests(repo_path: str, job_id: str):
+    """
+    Phase 4.3: Automated Test Generation (if the workspace has Python code but no tests).
+    Runs once per job, from repo_prep, before any task (or worktree) exists.
+    """
+    has_code = await asyncio.to_thread(lambda: next(graph_for(repo_path).iter_python_files(), None) is not None)
+    if has_code and not await asyncio.to_thread(pytest_runner.has_tests, repo_path):
         log_streamer.publish_log(job_id, "🧪 Audit: No tests found. Triggering Autonomous Test Generation...", "WARN")
         test_gen_prompt = (
             f"Goal: Generate a comprehensive pytest unit test file for this repository.\n"
@@ -28,90 +75,59 @@ async def tester_node(state: AgentState) -> AgentState:
         )
         # We use workspace-write sandbox to allow creating the test file
         from app.agents.wrapper import codex
-        stdout, stderr, code = codex.run_prompt(
+        stdout, stderr, code = await codex.arun_prompt(
             test_gen_prompt, 
             sandbox="workspace-write", 
             approval="never", 
-            cwd=repo_path
+            cwd=repo_path,
+            node="tester",
+            job_id=job_id # Tracks autonomous test generation cost
         )
         
-        # Track autonomous test generation cost
-        token_monitor.log_usage(job_id, len(test_gen_prompt)//4, len(stdout)//4)
         log_streamer.publish_log(job_id, "✅ Audit: Created 'test_autonomous.py'.", "SUCCESS")
 
+
+async def tester_node(state: AgentState) -> AgentState:
+    job_id = state.get("job_id", "unknown")
+    logger.info("TESTING: Running verification...")
+    log_streamer.publish_log(job_id, "🧪 Testing: Verifying changes...", "INFO")
+    repo_path = state.get("repo_path")
+    if not repo_path:
+        return {**state, "status": "testing_complete"}
+
     # Run Verification Command
     # Since Codex wrote the files autonomously, we just verify the repo directly
-    test_output = []
-    has_errors = False
-    
-    # Simple syntax check loop across the repo
-    import subprocess
-    try:
-        # 1. Compile python files to check syntax
-        result = subprocess.run(
-            ["python", "-m", "compileall", "-q", repo_path], 
-            capture_output=True, 
-            text=True
-        )
-        if result.returncode != 0:
-            has_errors = True
-            error_msg = f"Syntax Error: {result.stderr or result.stdout}"
-            test_output.append(error_msg)
-            log_streamer.publish_log(job_id, f"❌ {error_msg}", "ERROR")
-        else:
-            log_streamer.publish_log(job_id, "✅ Clean compilation across workspace.", "DEBUG")
-
-        # 2. Run Ruff for linting and formatting checks
-        log_streamer.publish_log(job_id, "🔎 Running Ruff static analysis...", "DEBUG")
-        ruff_result = subprocess.run(
-            ["ruff", "check", repo_path],
-            capture_output=True,
-            text=True
-        )
-        if ruff_result.returncode != 0:
-            # We treat linting as a warning or a soft error? The roadmap says "Guardrails".
-            # Let's count them as errors for now to ensure quality.
-            has_errors = True
-            error_msg = f"Linting Error (Ruff):\n{ruff_result.stdout}"
-            test_output.append(error_msg)
-            log_streamer.publish_log(job_id, "❌ Ruff detected issues.", "ERROR")
-        
-        # 3. Run Mypy for type checking (if config exists)
-        if os.path.exists(os.path.join(repo_path, "pyproject.toml")) or os.path.exists(os.path.join(repo_path, "mypy.ini")):
-            log_streamer.publish_log(job_id, "🔎 Running Mypy type checking...", "DEBUG")
-            mypy_result = subprocess.run(
-                ["mypy", repo_path],
-                capture_output=True,
-                text=True
-            )
-            if mypy_result.returncode != 0:
-                has_errors = True
-                error_msg = f"Type Error (Mypy):\n{mypy_result.stdout}"
-                test_output.append(error_msg)
-                log_streamer.publish_log(job_id, "❌ Mypy detected type issues.", "ERROR")
-        
-        # 4. Dependency Conflict Audit
-        log_streamer.publish_log(job_id, "🔎 Running Dependency Audit (pip check)...", "DEBUG")
-        dep_result = subprocess.run(["pip", "check"], capture_output=True, text=True)
-        if dep_result.returncode != 0:
-            has_errors = True
-            test_output.append(f"Dependency Conflict:\n{dep_result.stdout}")
-            log_streamer.publish_log(job_id, "❌ Dependency conflicts detected.", "ERROR")
-            
-        # 5. Security Scan (Bandit)
-        log_streamer.publish_log(job_id, "🔎 Running Security Scan (Bandit)...", "DEBUG")
-        bandit_result = subprocess.run(["bandit", "-r", repo_path, "-ll"], capture_output=True, text=True)
-        if bandit_result.returncode != 0:
-             has_errors = True
-             test_output.append(f"Security Issue (Bandit):\n{bandit_result.stdout}")
-             log_streamer.publish_log(job_id, "❌ Bandit detected security issues.", "ERROR")
+    has_errors, diagnostics, test_output, scope, test_run = await _verify(repo_path, job_id, state.get("base_commit"))
 
-    except Exception as e:
-        log_streamer.publish_log(job_id, f"⚠️ Could not complete verification: {e}", "WARN")
+    # Deterministic fixes (ruff --fix / format, known missing packages) first; an LLM retry is only spent on what remains
+    if has_errors and settings.AUTOFIX_ENABLED and scope is not None and await asyncio.to_thread(auto_fixer.fixable, repo_path, diagnostics):
+        try:
+            fix = await auto_fixer.fix(repo_path, job_id, diagnostics, scope.changed)
+            resolved = False
+            if fix.applied:
+                log_streamer.publish_log(job_id, f"🩹 Auto-fix: {fix.describe()}. Re-verifying...", "INFO")
+                has_errors, diagnostics, test_output, scope, test_run = await _verify(repo_path, job_id, state.get("base_commit"))
+                resolved = not has_errors
+            auto_fixer.stats.record(job_id, fix, resolved)
+            if resolved:
+                log_streamer.publish_log(job_id, f"🩹 Auto-fix resolved every finding; LLM retry skipped ({auto_fixer.stats.avoided(job_id)} so far this job).", "SUCCESS")
+            elif fix.applied:
+                log_streamer.publish_log(job_id, f"🩹 Auto-fix left {len(diagnostics)} finding(s) for the coder.", "INFO")
+            for error in fix.errors:
+                log_streamer.publish_log(job_id, f"⚠️ Auto-fix: {error}", "WARN")
+        except Exception as e:
+            log_streamer.publish_log(job_id, f"⚠️ Auto-fix failed: {e}", "WARN")
 
+    scope_note = scope.describe() if scope is not None else "full repository"
     if has_errors:
-        error_summary = "\n".join(test_output)
-        error_class = classifier.classify(error_summary)
+        # Test failures are listed with their tracebacks in the pytest report, not again in the summary
+        rendered = diagnostics.render(settings.CONTEXT_MAX_DIAGNOSTICS_PER_CLASS, skip_tools=("pytest",))
+        error_summary = "\n".join([f"Verification scope: {scope_note}"] + ([rendered] if rendered else []) + test_output)
+        test_failures = [f.as_dict() for f in test_run.failures] if test_run and test_run.failed else None
+        if len(diagnostics):
+            error_class = classifier.classify_diagnostics(diagnostics)
+        else:
+            error_class = classifier.classify(error_summary)
         current_retries = state.get("retry_count", 0)
         
         log_streamer.publish_log(job_id, f"🔍 Error Class: {error_class}", "INFO")
@@ -119,15 +135,17 @@ async def tester_node(state: AgentState) -> AgentState:
         # Prevent infinite loops if we hit max retries
         if current_retries >= 3:
              log_streamer.publish_log(job_id, f"❌ {error_summary} (Max retries reached)", "ERROR")
-             return {**state, "test_errors": error_summary, "error_class": error_class, "status": "testing_failed_max_retries"}
+             return {**state, "test_errors": error_summary, "test_failures": test_failures, "diagnostics": diagnostics.to_state(), "error_class": error_class, "status": "testing_failed_max_retries"}
 
         # Priority C: Strategic Reflection
-        hypothesis, next_action = reflection_engine.reflect(state, error_summary)
+        hypothesis, next_action = await reflection_engine.reflect(state, error_summary)
         log_streamer.publish_log(job_id, f"🤔 Reflection: {hypothesis}", "DEBUG")
 
         return {
             **state,
             "test_errors": error_summary,
+            "test_failures": test_failures,
+            "diagnostics": diagnostics.to_state(),
             "error_class": error_class,
             "reflection_hypothesis": hypothesis,
             "next_recommended_action": next_action,
@@ -135,13 +153,17 @@ async def tester_node(state: AgentState) -> AgentState:
             "status": "testing_failed"
         }
 
-    results = "Tests Passed (Syntax Verified)"
+    results = f"Tests Passed (Syntax Verified; scope: {scope_note})"
+    if test_run is not None:
+        results = f"Tests Passed ({test_run.describe()}; verification scope: {scope_note})"
     log_streamer.publish_log(job_id, f"✅ Tests passed: {results}", "SUCCESS")
     
     return {
         **state,
         "test_results": results,
         "test_errors": None,
+        "test_failures": None,
+        "diagnostics": None,
         "error_class": None, # Clear on success
         "reflection_hypothesis": None,
         "next_recommended_action": None,
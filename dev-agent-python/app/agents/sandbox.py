@@ -2,15 +2,286 @@ import subprocess
 import logging
 import os
 import shutil
-import resource
-from typing import List, Optional, Tuple
+import signal
+import asyncio
+import mmap
+import select
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from app.agents.cgroups import ExecutionCgroup, ResourceLimits, ResourceUsage, cgroup_manager
+from app.core.metrics import job_metrics
 
 logger = logging.getLogger(__name__)
 
+# Exit code reported when a command is killed for exceeding its deadline (mirrors coreutils `timeout`)
+TIMEOUT_EXIT_CODE = 124
+# Output retained per stream when the caller does not specify a cap
+DEFAULT_MAX_OUTPUT_BYTES = 16 * 1024 * 1024
+# Deadline applied by execute() when the caller does not give one
+DEFAULT_TIMEOUT_SECONDS = 600
+# Output above this size is spooled to a temp file and returned as a memory-mapped view
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+_READ_CHUNK_SIZE = 64 * 1024
+_KILL_GRACE_SECONDS = 5
+
+
+class OutputBuffer:
+    """
+    Memory-capped accumulator for streamed process output.
+    Keeps the head (where the AGENT_JSON_START frame lives) and the tail (where
+    the final result and errors live) and drops the middle once the cap is hit.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_OUTPUT_BYTES):
+        self.max_bytes = max_bytes
+        self._head: List[str] = []
+        self._head_bytes = 0
+        self._tail: deque = deque()
+        self._tail_bytes = 0
+        self.dropped_bytes = 0
+
+    def append(self, text: str, size: int):
+        half = self.max_bytes // 2
+        if not self._tail and self._head_bytes + size <= half:
+            self._head.append(text)
+            self._head_bytes += size
+            return
+
+        self._tail.append((text, size))
+        self._tail_bytes += size
+        while self._tail_bytes > half and len(self._tail) > 1:
+            _, dropped = self._tail.popleft()
+            self._tail_bytes -= dropped
+            self.dropped_bytes += dropped
+
+    def getvalue(self) -> str:
+        head = "".join(self._head)
+        tail = "".join(text for text, _ in self._tail)
+        if self.dropped_bytes:
+            return f"{head}\n... [{self.dropped_bytes} bytes of output truncated] ...\n{tail}"
+        return head + tail
+
+
+async def _pump(stream: asyncio.StreamReader, buffer: OutputBuffer, log_callback: Optional[Callable[[str], None]]):
+    """
+    Reads a pipe in fixed-size chunks and emits complete lines.
+    Chunked reads avoid StreamReader.readline's 64KB line limit.
+    """
+    def _emit(raw: bytes):
+        text = raw.decode("utf-8", errors="replace")
+        buffer.append(text, len(raw))
+        if log_callback:
+            try:
+                log_callback(text.rstrip("\n"))
+            except Exception as e:
+                logger.debug(f"Sandbox log callback failed: {e}")
+
+    pending = b""
+    while True:
+        chunk = await stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            _emit(line + b"\n")
+        # A single enormous line must not defeat the memory cap
+        if len(pending) > buffer.max_bytes // 2:
+            _emit(pending)
+            pending = b""
+    if pending:
+        _emit(pending)
+
+
+async def communicate(
+    process: asyncio.subprocess.Process,
+    stdin: Optional[str],
+    stdout_buf: OutputBuffer,
+    stderr_buf: OutputBuffer,
+    log_callback: Optional[Callable[[str], None]] = None
+) -> int:
+    """
+    Feeds stdin, drains both pipes into their buffers (stdout line by line
+    into log_callback as well) and returns the exit code.
+    """
+    async def _feed_stdin():
+        try:
+            process.stdin.write(stdin.encode("utf-8"))
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # Child exited without reading all of its input
+            pass
+        finally:
+            process.stdin.close()
+
+    tasks = [
+        _pump(process.stdout, stdout_buf, log_callback),
+        _pump(process.stderr, stderr_buf, None),
+    ]
+    if stdin is not None:
+        tasks.append(_feed_stdin())
+    await asyncio.gather(*tasks)
+    return await process.wait()
+
+
+class _SpooledStream:
+    """
+    Drains one child pipe on a background thread into a SpooledTemporaryFile:
+    small output stays in memory, larger output rolls over to disk. Bytes past
+    max_bytes are read and discarded so the child never blocks on a full pipe.
+    """
+    def __init__(self, pipe, spool_threshold: int, max_bytes: int):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold, prefix="sandbox-")
+        self.size = 0
+        self.dropped_bytes = 0
+        self._pipe = pipe
+        self._max_bytes = max_bytes
+        self._thread = threading.Thread(target=self._drain, name="sandbox-spool", daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        try:
+            while True:
+                # Unbuffered pipe: read() returns whatever is available
+                chunk = self._pipe.read(_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                room = self._max_bytes - self.size
+                if room > 0:
+                    self.file.write(chunk[:room])
+                    self.size += min(len(chunk), room)
+                self.dropped_bytes += max(len(chunk) - max(room, 0), 0)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._pipe.close()
+
+    def join(self, timeout: Optional[float] = None):
+        self._thread.join(timeout)
+
+    @property
+    def spooled(self) -> bool:
+        return self.file._rolled
+
+    def view(self) -> Union[bytes, mmap.mmap]:
+        """
+        The captured bytes: the in-memory buffer, or a read-only mmap of the spool file.
+        """
+        if self.size == 0:
+            return b""
+        if self.spooled:
+            self.file.flush()
+            return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.file._file.getvalue()
+
+
+class ExecutionResult:
+    """
+    Outcome of LocalSandbox.run: exit status, resource usage and the captured output.
+    stdout_view/stderr_view expose the raw bytes (an mmap for spooled output, so
+    large logs are not copied onto the heap); stdout/stderr decode on first access.
+    Call close() (or use as a context manager) to release spool files early.
+    """
+    def __init__(
+        self,
+        returncode: int,
+        stdout: Optional[_SpooledStream],
+        stderr: Optional[_SpooledStream],
+        timed_out: bool = False,
+        wall_time: float = 0.0,
+        cpu_time: float = 0.0,
+        max_rss_kb: int = 0,
+        error: Optional[str] = None,
+        usage: Optional[ResourceUsage] = None,
+        command_class: str = "default"
+    ):
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss_kb = max_rss_kb
+        self.error = error
+        self.usage = usage
+        self.command_class = command_class
+        self._streams = (stdout, stderr)
+        self._views: List[Optional[Union[bytes, mmap.mmap]]] = [None, None]
+        self._text: List[Optional[str]] = [None, None]
+
+    def _view(self, index: int) -> Union[bytes, mmap.mmap]:
+        if self._views[index] is None:
+            stream = self._streams[index]
+            self._views[index] = stream.view() if stream is not None else b""
+        return self._views[index]
+
+    def _decoded(self, index: int) -> str:
+        if self._text[index] is None:
+            self._text[index] = bytes(self._view(index)).decode("utf-8", errors="replace")
+        return self._text[index]
+
+    @property
+    def stdout_view(self) -> Union[bytes, mmap.mmap]:
+        return self._view(0)
+
+    @property
+    def stderr_view(self) -> Union[bytes, mmap.mmap]:
+        return self._view(1)
+
+    @property
+    def stdout(self) -> str:
+        return self._decoded(0)
+
+    @property
+    def stderr(self) -> str:
+        if self.timed_out:
+            return "TimeoutExpired"
+        if self.error is not None:
+            return self.error
+        return self._decoded(1)
+
+    @property
+    def spooled(self) -> bool:
+        return any(s is not None and s.spooled for s in self._streams)
+
+    def as_tuple(self) -> Tuple[str, str, int]:
+        return self.stdout, self.stderr, self.returncode
+
+    def metrics(self) -> dict:
+        return {
+            "wall_time_s": round(self.wall_time, 3),
+            "cpu_time_s": round(self.cpu_time, 3),
+            "max_rss_kb": self.max_rss_kb,
+            "timed_out": self.timed_out,
+            "stdout_bytes": self._streams[0].size if self._streams[0] else 0,
+            "spooled": self.spooled,
+            "command_class": self.command_class,
+            "usage": self.usage.as_dict() if self.usage else None,
+        }
+
+    def close(self):
+        for i, view in enumerate(self._views):
+            if isinstance(view, mmap.mmap):
+                view.close()
+            self._views[i] = None
+        for stream in self._streams:
+            if stream is not None:
+                stream.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 class SandboxProvider:
     """
     Base class for sandbox execution environments.
     """
+    # Commands see the worker's filesystem and interpreters (a workspace venv works)
+    runs_on_host = True
+
     def validate_network_policy(self, env: Optional[dict]):
         """
         Enforce proxy-only or restricted network access.
@@ -21,78 +292,698 @@ class SandboxProvider:
             # Future: inject HTTP_PROXY/HTTPS_PROXY allowlist here
             pass
 
-    def execute(self, cmd: List[str], cwd: Optional[str] = None, env: Optional[dict] = None, stdin: Optional[str] = None) -> Tuple[str, str, int]:
+    def execute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = DEFAULT_TIMEOUT_SECONDS,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
         raise NotImplementedError
 
+    async def aexecute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Asyncio variant of execute. Providers without a native implementation
+        run the blocking call on a worker thread so the event loop stays free.
+        """
+        return await asyncio.to_thread(
+            self.execute, cmd, cwd, env, stdin, timeout, command_class=command_class, job_id=job_id
+        )
+
+    @staticmethod
+    def record_usage(
+        job_id: Optional[str],
+        command_class: str,
+        cmd: List[str],
+        usage: Optional[ResourceUsage],
+        wall_time: float,
+        timed_out: bool = False
+    ):
+        """
+        Adds one execution to the job's resource metrics and log stream.
+        """
+        if not job_id:
+            return
+        job_metrics.record(job_id, command_class, usage.as_dict() if usage else {}, wall_time, timed_out)
+        if usage is None:
+            return
+        from app.core.stream import log_streamer
+        log_streamer.publish_log(
+            job_id,
+            f"📈 Sandbox [{command_class}] {os.path.basename(cmd[0])}: {wall_time:.1f}s wall, "
+            f"{usage.cpu_usec / 1e6:.1f}s CPU, peak {usage.memory_peak_bytes / (1024 * 1024):.0f}MB, "
+            f"IO {usage.io_read_bytes / (1024 * 1024):.1f}/{usage.io_write_bytes / (1024 * 1024):.1f}MB r/w"
+            + (f", {usage.oom_kills} OOM kill(s)" if usage.oom_kills else ""),
+            "DEBUG"
+        )
+
 class LocalSandbox(SandboxProvider):
     """
     OS-level sandboxing using standard subprocess.
+    Each execution gets the limits of its command class (SANDBOX_RESOURCE_LIMITS),
+    enforced by a transient cgroup v2 leaf when the worker can delegate one, or
+    by rlimits otherwise; usage is collected from the same place.
     """
-    def _set_limits(self):
+    @staticmethod
+    def _limits_setter(limits: ResourceLimits, cgroup: Optional[ExecutionCgroup]) -> Callable[[], None]:
+        def _set_limits():
+            """
+            Callback to set resource limits in the child process before execution.
+            """
+            in_cgroup = False
+            if cgroup is not None:
+                try:
+                    cgroup.join_self()
+                    in_cgroup = True
+                except OSError:
+                    pass
+            try:
+                limits.apply_rlimits(memory=not in_cgroup)
+            except (ValueError, OSError):
+                # Limits above the hard limit inherited from the worker; run with those
+                pass
+        return _set_limits
+
+    @staticmethod
+    def _collect_usage(cgroup: Optional[ExecutionCgroup], rusage) -> Optional[ResourceUsage]:
+        usage = cgroup.usage() if cgroup is not None else None
+        if usage is not None and usage.cpu_usec:
+            return usage
+        # No cgroup, or the child could not join it
+        return ResourceUsage.from_rusage(rusage) if rusage is not None else None
+
+    def execute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = DEFAULT_TIMEOUT_SECONDS,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
         """
-        Callback to set resource limits in the child process before execution.
+        Runs cmd to completion or until the deadline.
+        On timeout the whole process group is killed and (stdout, "TimeoutExpired", 124) is returned.
         """
-        try:
-            # CPU Limit: 60 seconds
-            resource.setrlimit(resource.RLIMIT_CPU, (60, 65))
-            # Memory Limit: 1GB
-            resource.setrlimit(resource.RLIMIT_AS, (1024 * 1024 * 1024, 1050 * 1024 * 1024))
-            # File Handle Limit: 256
-            resource.setrlimit(resource.RLIMIT_NOFILE, (256, 512))
-        except Exception as e:
-            logger.warning(f"Failed to set sandbox resource limits: {e}")
+        with self.run(cmd, cwd=cwd, env=env, stdin=stdin, timeout=timeout, command_class=command_class, job_id=job_id) as result:
+            return result.as_tuple()
 
-    def execute(self, cmd: List[str], cwd: Optional[str] = None, env: Optional[dict] = None, stdin: Optional[str] = None) -> Tuple[str, str, int]:
+    def run(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = DEFAULT_TIMEOUT_SECONDS,
+        spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> ExecutionResult:
+        """
+        Blocking execution with a deadline, process-group kill, spooled output
+        and per-execution resource usage (recorded against job_id when given).
+        """
+        self.validate_network_policy(env)
+        limits = ResourceLimits.for_class(command_class)
+        cgroup = cgroup_manager.create(limits)
+        started = time.monotonic()
         try:
-            self.validate_network_policy(env)
-            
             process = subprocess.Popen(
                 cmd,
-                stdin=subprocess.PIPE,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
+                bufsize=0,
                 env=env,
                 cwd=cwd,
-                preexec_fn=self._set_limits # Apply limits in child
+                preexec_fn=self._limits_setter(limits, cgroup), # Apply limits in child
+                start_new_session=True # Own process group, so a timeout kills grandchildren too
             )
-            stdout, stderr = process.communicate(input=stdin)
-            return stdout, stderr, process.returncode
         except Exception as e:
+            if cgroup is not None:
+                cgroup.remove()
+            return ExecutionResult(1, None, None, error=str(e), command_class=command_class)
+
+        stdout = _SpooledStream(process.stdout, spool_threshold, max_output_bytes)
+        stderr = _SpooledStream(process.stderr, spool_threshold, max_output_bytes)
+        if stdin is not None:
+            threading.Thread(target=self._feed_stdin, args=(process.stdin, stdin), name="sandbox-stdin", daemon=True).start()
+
+        deadline = started + timeout if timeout else None
+        reaped = self._wait4(process.pid, deadline)
+        timed_out = reaped is None
+        if timed_out:
+            logger.error(f"Sandbox command timed out after {timeout}s: {cmd[0]}")
+            self._kill_group(process.pid, signal.SIGTERM)
+            reaped = self._wait4(process.pid, time.monotonic() + _KILL_GRACE_SECONDS)
+            if reaped is None:
+                self._kill_group(process.pid, signal.SIGKILL)
+                if cgroup is not None:
+                    cgroup.kill()
+                reaped = self._wait4(process.pid, None)
+        status, rusage = reaped
+        # We reaped the child ourselves; tell Popen so it does not wait on a recycled pid
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.monotonic() - started
+
+        usage = self._collect_usage(cgroup, rusage)
+        if cgroup is not None:
+            # Transient cgroup: anything the command left running dies with it
+            cgroup.remove()
+        # Pipes close once every process holding them is gone; don't hang on escaped daemons
+        stdout.join(_KILL_GRACE_SECONDS)
+        stderr.join(_KILL_GRACE_SECONDS)
+
+        result = ExecutionResult(
+            TIMEOUT_EXIT_CODE if timed_out else process.returncode,
+            stdout,
+            stderr,
+            timed_out=timed_out,
+            wall_time=wall_time,
+            cpu_time=usage.cpu_usec / 1e6,
+            max_rss_kb=usage.memory_peak_bytes // 1024,
+            usage=usage,
+            command_class=command_class
+        )
+        if stdout.dropped_bytes:
+            logger.warning(f"Sandbox output capped: dropped {stdout.dropped_bytes} bytes from {cmd[0]}")
+        if usage.oom_kills:
+            logger.warning(f"Sandbox [{command_class}] {cmd[0]} hit its memory limit ({limits.memory_mb}MB): {usage.oom_kills} OOM kill(s)")
+        logger.debug(f"Sandbox execution of {cmd[0]}: {result.metrics()}")
+        self.record_usage(job_id, command_class, cmd, usage, wall_time, timed_out)
+        return result
+
+    @staticmethod
+    def _feed_stdin(pipe, text: str):
+        try:
+            pipe.write(text.encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError, ValueError):
+            # Child exited without reading all of its input
+            pass
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _wait4(pid: int, deadline: Optional[float]):
+        """
+        Reaps pid with its resource usage, or returns None once the deadline passes.
+        Sleeps on a pidfd where available instead of polling.
+        """
+        pidfd = None
+        if deadline is not None and hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                pidfd = None
+        try:
+            delay = 0.001
+            while True:
+                if deadline is None:
+                    _, status, usage = os.wait4(pid, 0)
+                    return status, usage
+                waited_pid, status, usage = os.wait4(pid, os.WNOHANG)
+                if waited_pid == pid:
+                    return status, usage
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if pidfd is not None:
+                    select.select([pidfd], [], [], remaining)
+                else:
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, 0.05)
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+
+    @staticmethod
+    def _kill_group(pid: int, sig: int):
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def aexecute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Streams the child's stdout line by line into log_callback while it runs.
+        The child gets its own session so a timeout or cancellation kills the
+        whole process group, not just the direct child.
+        asyncio reaps the child itself, so usage is only collected with a cgroup.
+        """
+        self.validate_network_policy(env)
+        limits = ResourceLimits.for_class(command_class)
+        cgroup = await asyncio.to_thread(cgroup_manager.create, limits) if cgroup_manager.available else None
+        started = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=env,
+                cwd=cwd,
+                preexec_fn=self._limits_setter(limits, cgroup), # Apply limits in child
+                start_new_session=True
+            )
+        except Exception as e:
+            if cgroup is not None:
+                cgroup.remove()
             return "", str(e), 1
 
+        stdout_buf = OutputBuffer(max_output_bytes)
+        stderr_buf = OutputBuffer(max_output_bytes)
+
+        timed_out = False
+        try:
+            returncode = await asyncio.wait_for(communicate(process, stdin, stdout_buf, stderr_buf, log_callback), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Sandbox command timed out after {timeout}s: {cmd[0]}")
+            await self._terminate_group(process)
+            timed_out = True
+        except asyncio.CancelledError:
+            await self._terminate_group(process)
+            raise
+        finally:
+            if cgroup is not None:
+                usage = self._collect_usage(cgroup, None)
+                await asyncio.to_thread(cgroup.remove)
+                self.record_usage(job_id, command_class, cmd, usage, time.monotonic() - started, timed_out)
+            else:
+                self.record_usage(job_id, command_class, cmd, None, time.monotonic() - started, timed_out)
+
+        if timed_out:
+            return stdout_buf.getvalue(), "TimeoutExpired", TIMEOUT_EXIT_CODE
+
+        if stdout_buf.dropped_bytes:
+            logger.warning(f"Sandbox output capped: dropped {stdout_buf.dropped_bytes} bytes from {cmd[0]}")
+        return stdout_buf.getvalue(), stderr_buf.getvalue(), returncode
+
+    @staticmethod
+    async def _terminate_group(process: asyncio.subprocess.Process):
+        """
+        SIGTERM the child's process group, escalating to SIGKILL after a grace period.
+        """
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), _KILL_GRACE_SECONDS)
+                return
+            except asyncio.TimeoutError:
+                pass
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
 class DockerSandbox(SandboxProvider):
     """
     Containerized sandboxing using Docker.
+    Commands run via `exec` in pre-started containers drawn from a pool per
+    (image, mount root). Only the job's own directory under the workspace root
+    is bind-mounted, at the same path (so cwd works unchanged inside), and the
+    containers run as the worker's uid:gid. A job's pool is closed once it has
+    been unused for SANDBOX_POOL_IDLE_TTL.
     """
-    def __init__(self, image: str = "python:3.11-slim"):
-        self.image = image
-        self.container_id = None
+    runs_on_host = False
 
-    def execute(self, cmd: List[str], cwd: Optional[str] = None, env: Optional[dict] = None, stdin: Optional[str] = None) -> Tuple[str, str, int]:
-        # Implementation for Docker execution
-        # For now, we simulate the logic since daemon is down
-        if not shutil.which("docker"):
-             return "", "Docker not installed", 1
-        
-        # Real implementation would involve 'docker run -v ...'
-        # Since we found daemon is down in preflight, this will likely only be used
-        # when the user starts the daemon.
-        return "", "Docker daemon not running", 1
+    def __init__(self, image: Optional[str] = None, runtime=None):
+        from app.core.config import settings
+        from app.agents.containers import DockerCliRuntime
+
+        self.image = image or settings.SANDBOX_DOCKER_IMAGE
+        self.runtime = runtime or DockerCliRuntime(
+            network=settings.SANDBOX_DOCKER_NETWORK,
+            memory=settings.SANDBOX_DOCKER_MEMORY,
+            cpus=settings.SANDBOX_DOCKER_CPUS,
+            user=settings.SANDBOX_DOCKER_USER
+        )
+        self.workspace_root = settings.SANDBOX_WORKSPACE_ROOT
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool_for(self, cwd: Optional[str]):
+        from app.core.config import settings
+        from app.agents.containers import ContainerPool, mount_root_for
+
+        mount_root = mount_root_for(cwd, self.workspace_root)
+        root = os.path.realpath(self.workspace_root)
+        with self._lock:
+            # Pools of finished jobs would otherwise keep their warm containers forever
+            expired = [key for key, pool in self._pools.items() if key != mount_root and pool.unused_for() > pool.idle_ttl]
+            stale = [self._pools.pop(key) for key in expired]
+            pool = self._pools.get(mount_root)
+            if pool is None:
+                if mount_root:
+                    os.makedirs(mount_root, exist_ok=True)
+                pool = ContainerPool(
+                    self.runtime,
+                    self.image,
+                    mount_root,
+                    # Job pools are kept warm for the job's next commands; other directories start cold
+                    min_idle=settings.SANDBOX_POOL_MIN_IDLE if mount_root and os.path.dirname(mount_root) == root else 0,
+                    max_size=settings.SANDBOX_POOL_MAX_SIZE,
+                    max_uses=settings.SANDBOX_CONTAINER_MAX_USES,
+                    idle_ttl=settings.SANDBOX_POOL_IDLE_TTL,
+                    check_dirty=settings.SANDBOX_CONTAINER_DIRTY_CHECK
+                )
+                self._pools[mount_root] = pool
+        for old in stale:
+            old.close()
+        return pool
+
+    def _lease(self, cwd: Optional[str], timeout: Optional[float]):
+        """
+        (pool, container) for a command; retries once when the pool expired between lookup and acquire.
+        """
+        from app.agents.containers import PoolClosed
+
+        pool = self.pool_for(cwd)
+        try:
+            return pool, pool.acquire(timeout=timeout)
+        except PoolClosed:
+            pool = self.pool_for(cwd)
+            return pool, pool.acquire(timeout=timeout)
+
+    def execute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = DEFAULT_TIMEOUT_SECONDS,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Limits are the container's (SANDBOX_DOCKER_MEMORY / _CPUS); only wall
+        time and timeouts are recorded per command class.
+        """
+        self.validate_network_policy(env)
+        container_env = self._container_env(env)
+        cwd = os.path.realpath(cwd) if cwd else None
+
+        try:
+            pool, container = self._lease(cwd, timeout)
+        except Exception as e:
+            return "", str(e), 1
+
+        dirty = timed_out = False
+        suspect = True
+        started = time.monotonic()
+        try:
+            stdout, stderr, code = self.runtime.exec(container.id, cmd, cwd=cwd, env=container_env, stdin=stdin, timeout=timeout)
+            # A timed-out command may still be running inside; never reuse that container
+            dirty = timed_out = code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired"
+            # Only failed commands pay for the dirty-state check
+            suspect = code != 0
+            return stdout, stderr, code
+        except Exception as e:
+            dirty = True
+            return "", str(e), 1
+        finally:
+            pool.release(container, dirty=dirty, suspect=suspect)
+            self.record_usage(job_id, command_class, cmd, None, time.monotonic() - started, timed_out)
+
+    async def aexecute(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        env: Optional[dict] = None,
+        stdin: Optional[str] = None,
+        timeout: Optional[float] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        command_class: str = "default",
+        job_id: Optional[str] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Streams the command's stdout into log_callback while it runs, capped
+        at max_output_bytes like LocalSandbox. Pool calls that may block
+        (acquire, the dirty check on release) run on worker threads.
+        """
+        self.validate_network_policy(env)
+        container_env = self._container_env(env)
+        cwd = os.path.realpath(cwd) if cwd else None
+
+        try:
+            pool, container = await asyncio.to_thread(self._lease, cwd, timeout)
+        except Exception as e:
+            return "", str(e), 1
+
+        dirty = timed_out = False
+        suspect = True
+        started = time.monotonic()
+        try:
+            stdout, stderr, code = await self.runtime.aexec(
+                container.id, cmd, cwd=cwd, env=container_env, stdin=stdin, timeout=timeout,
+                log_callback=log_callback, max_output_bytes=max_output_bytes
+            )
+            dirty = timed_out = code == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired"
+            suspect = code != 0
+            return stdout, stderr, code
+        except asyncio.CancelledError:
+            # The command may still be running inside
+            dirty = True
+            raise
+        except Exception as e:
+            dirty = True
+            return "", str(e), 1
+        finally:
+            await asyncio.shield(asyncio.to_thread(pool.release, container, dirty, suspect))
+            self.record_usage(job_id, command_class, cmd, None, time.monotonic() - started, timed_out)
+
+    @staticmethod
+    def _container_env(env: Optional[dict]) -> dict:
+        # Forward only what the caller set or changed; the worker's own PATH etc. mean nothing in the image
+        return {k: v for k, v in (env or {}).items() if os.environ.get(k) != v}
+
+    def stats(self) -> dict:
+        with self._lock:
+            pools = dict(self._pools)
+        return {root: pool.snapshot() for root, pool in pools.items()}
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
 
 class SandboxFactory:
+    @staticmethod
+    def docker_available(timeout: float = 2.0) -> bool:
+        """
+        True when the docker CLI exists and its daemon answers within timeout.
+        """
+        if not shutil.which("docker"):
+            return False
+        try:
+            res = subprocess.run(
+                ["docker", "info", "--format", "{{.ServerVersion}}"],
+                capture_output=True,
+                timeout=timeout
+            )
+            return res.returncode == 0
+        except (subprocess.TimeoutExpired, OSError):
+            return False
+
     @staticmethod
     def get_provider() -> SandboxProvider:
+        from app.core.config import settings
+
+        choice = settings.SANDBOX_PROVIDER.lower()
+        if choice == "local":
+            return LocalSandbox()
+        if choice == "docker":
+            return DockerSandbox()
+
         # Check if Docker is available and running
-        try:
-            res = subprocess.run(["docker", "ps"], capture_output=True)
-            if res.returncode == 0:
-                logger.debug("Using DockerSandbox provider.")
-                return DockerSandbox()
-        except:
-            pass
-        
+        if SandboxFactory.docker_available(settings.SANDBOX_PROBE_TIMEOUT):
+            logger.debug("Using DockerSandbox provider.")
+            return DockerSandbox()
+
         logger.debug("Falling back to LocalSandbox provider.")
         return LocalSandbox()
 
-sandbox_manager = SandboxFactory.get_provider()
+
+class LazySandboxManager:
+    """
+    Resolves the sandbox provider on first use instead of at import time.
+    With SANDBOX_PROVIDER=auto the Docker probe result is cached for
+    SANDBOX_PROBE_TTL seconds; once stale, callers keep using the current
+    provider while a background thread re-probes and swaps it if Docker
+    came up or went away. Commands lease the provider they run on, and a
+    replaced provider is closed when its last command returns. Command
+    classes in SANDBOX_HOST_COMMAND_CLASSES always run on a LocalSandbox.
+    """
+    def __init__(self):
+        self._provider: Optional[SandboxProvider] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self._reprobing = False
+        self._host = LocalSandbox()
+        self._leases: Dict[SandboxProvider, int] = {}
+        self._retired: Set[SandboxProvider] = set()
+
+    @property
+    def provider(self) -> SandboxProvider:
+        provider = self._provider
+        if provider is None:
+            with self._lock:
+                if self._provider is None:
+                    self._set(SandboxFactory.get_provider())
+                provider = self._provider
+        elif self._is_stale():
+            self._reprobe_in_background()
+        return provider
+
+    def _borrow(self) -> SandboxProvider:
+        provider = self.provider
+        with self._lock:
+            # The current provider, in case a re-probe swapped it meanwhile
+            provider = self._provider or provider
+            self._leases[provider] = self._leases.get(provider, 0) + 1
+        return provider
+
+    def _return(self, provider: SandboxProvider):
+        with self._lock:
+            left = self._leases[provider] - 1
+            if left:
+                self._leases[provider] = left
+                return
+            del self._leases[provider]
+            if provider not in self._retired:
+                return
+            self._retired.discard(provider)
+        self._close(provider)
+
+    @staticmethod
+    def _on_host(command_class: str) -> bool:
+        from app.core.config import settings
+
+        return command_class in settings.SANDBOX_HOST_COMMAND_CLASSES
+
+    def execute(self, *args, **kwargs) -> Tuple[str, str, int]:
+        if self._on_host(kwargs.get("command_class", "default")):
+            return self._host.execute(*args, **kwargs)
+        provider = self._borrow()
+        try:
+            return provider.execute(*args, **kwargs)
+        finally:
+            self._return(provider)
+
+    async def aexecute(self, *args, **kwargs) -> Tuple[str, str, int]:
+        if self._on_host(kwargs.get("command_class", "default")):
+            return await self._host.aexecute(*args, **kwargs)
+        if self._provider is None:
+            # First use from a coroutine: keep the probe off the event loop
+            provider = await asyncio.to_thread(self._borrow)
+        else:
+            provider = self._borrow()
+        try:
+            return await provider.aexecute(*args, **kwargs)
+        finally:
+            # Closing a retired provider removes its containers
+            await asyncio.shield(asyncio.to_thread(self._return, provider))
+
+    def __getattr__(self, name: str):
+        return getattr(self.provider, name)
+
+    def reset(self):
+        """
+        Forgets the resolved provider; the next call probes again.
+        """
+        with self._lock:
+            old = self._set(None)
+        self._close(old)
+
+    def _set(self, provider: Optional[SandboxProvider]) -> Optional[SandboxProvider]:
+        """
+        Swaps the provider (callers hold the lock). Returns the old one when
+        nothing runs on it any more, for the caller to close outside the lock;
+        otherwise the last _return closes it.
+        """
+        old, self._provider = self._provider, provider
+        self._resolved_at = time.monotonic()
+        if old is None or old is provider:
+            return None
+        if self._leases.get(old):
+            self._retired.add(old)
+            return None
+        return old
+
+    @staticmethod
+    def _close(provider: Optional[SandboxProvider]):
+        if provider is not None and hasattr(provider, "close"):
+            provider.close()
+
+    def _is_stale(self) -> bool:
+        from app.core.config import settings
+
+        if settings.SANDBOX_PROVIDER.lower() != "auto":
+            return False
+        return time.monotonic() - self._resolved_at > settings.SANDBOX_PROBE_TTL
+
+    def _reprobe_in_background(self):
+        with self._lock:
+            if self._reprobing:
+                return
+            self._reprobing = True
+        threading.Thread(target=self._reprobe, name="sandbox-reprobe", daemon=True).start()
+
+    def _reprobe(self):
+        from app.core.config import settings
+
+        try:
+            docker_up = SandboxFactory.docker_available(settings.SANDBOX_PROBE_TIMEOUT)
+            # Built outside the lock; only the swap holds it
+            replacement = None
+            if docker_up != isinstance(self._provider, DockerSandbox):
+                replacement = DockerSandbox() if docker_up else LocalSandbox()
+            old = None
+            with self._lock:
+                if replacement is not None and docker_up != isinstance(self._provider, DockerSandbox):
+                    logger.info(f"Sandbox provider changed: Docker is {'up' if docker_up else 'down'}.")
+                    old, replacement = self._set(replacement), None
+                else:
+                    self._resolved_at = time.monotonic()
+            # A replacement that lost a race to reset() is never used
+            self._close(replacement)
+            self._close(old)
+        except Exception as e:
+            logger.warning(f"Sandbox provider re-probe failed: {e}")
+        finally:
+            self._reprobing = False
+
+sandbox_manager = LazySandboxManager()
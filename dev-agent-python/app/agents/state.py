@@ -1,4 +1,4 @@
-from typing import TypedDict, List, Optional
+from typing import TypedDict, Dict, List, Optional
 
 class AgentState(TypedDict):
     """
@@ -19,6 +19,8 @@ class AgentState(TypedDict):
     file_actions: Optional[List[dict]]      # New: Structured actions for filesystem changes
     test_results: Optional[str]
     test_errors: Optional[str]              # New: For feedback loop
+    test_failures: Optional[List[Dict]]     # New: Structured pytest failures (nodeid, file, line, type, message, text)
+    diagnostics: Optional[Dict]             # New: Verifier findings as a DiagnosticSet (to_state form)
     review_feedback: Optional[str]
     
     # Metadata
@@ -27,6 +29,7 @@ class AgentState(TypedDict):
     attempts: int
     retry_count: int                        # New: Loop counter
     original_branch: Optional[str]          # New: Track original branch for transactional merge
+    base_commit: Optional[str]              # New: HEAD when the job started; verification is scoped to changes since
     error_class: Optional[str]              # New: Category for targeted repair (SYNTAX, DEP, etc)
     risk_score: Optional[int]               # New: Priority 2 risk assessment score
     task_graph: Optional[List[Dict]]        # New: Priority 3 DAG of tasks
@@ -35,3 +38,4 @@ class AgentState(TypedDict):
     reflection_hypothesis: Optional[str]    # New: Priority C repair logic
     next_recommended_action: Optional[str]  # New: Priority C repair logic
     current_task: Optional[Dict]            # New: Priority B current DAG node mapping
+    parallel_fallback: Optional[List[str]]  # New: Task ids the parallel executor handed back to the serial loop
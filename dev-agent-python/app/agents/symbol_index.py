@@ -0,0 +1,472 @@
+import ast
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.agents.knowledge_graph import HAS_MSGPACK, module_names, parse_files, read_index, scan_python_files, write_index
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the index layout or the extraction changes; older indexes are rebuilt
+INDEX_VERSION = 1
+
+# Definition rows: [name, qualname, kind, line, end_line, signature]
+# Reference rows: [name, line, scope qualname ("" at module level), kind: call | load | import].
+# A file's references are stored as (name, line, scope, kind) index quadruples in one uint32
+# array over its own name and scope tables: the bulk of the index loads as a bytes blob.
+REF_KINDS = ("call", "load", "import")
+_FUNCTIONS = (ast.FunctionDef, ast.AsyncFunctionDef)
+_KIND_ORDER = {"class": 0, "function": 1, "method": 2, "variable": 3, "attribute": 4}
+
+
+def _signature(node: ast.AST) -> str:
+    try:
+        if isinstance(node, _FUNCTIONS):
+            returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+            return f"({ast.unparse(node.args)}){returns}"
+        if isinstance(node, ast.ClassDef) and (node.bases or node.keywords):
+            return "(" + ", ".join(ast.unparse(b) for b in [*node.bases, *node.keywords]) + ")"
+    except (ValueError, RecursionError):
+        pass
+    return ""
+
+
+class _Extractor:
+    """
+    One pass over a module: definitions with their scope, call sites and
+    other name references with the enclosing definition, imports by local
+    alias, and the literal __all__.
+    """
+    def __init__(self, rel: str):
+        names = module_names(rel)
+        self.module = names[0] if names else ""
+        self.package = self.module.split(".") if self.module else []
+        if not rel.endswith("__init__.py"):
+            self.package = self.package[:-1]
+        self.defs: List[List[Any]] = []
+        self.refs: Dict[Tuple[str, int, str, str], None] = {}
+        self.imports: Dict[str, str] = {}
+        self.exports: Optional[List[str]] = None
+
+    def _ref(self, name: str, line: int, scope: str, kind: str):
+        self.refs[(name, line, scope, kind)] = None
+
+    def encode_refs(self) -> Tuple[List[str], List[str], Any]:
+        names: Dict[str, int] = {}
+        scopes: Dict[str, int] = {}
+        packed = array("I")
+        for name, line, scope, kind in self.refs:
+            packed.extend((names.setdefault(name, len(names)), line, scopes.setdefault(scope, len(scopes)), REF_KINDS.index(kind)))
+        return list(names), list(scopes), _pack(packed)
+
+    def visit_block(self, body: List[ast.stmt], scope: str, scope_kind: str):
+        for stmt in body:
+            self.visit_stmt(stmt, scope, scope_kind)
+
+    def visit_def(self, node: ast.AST, scope: str, scope_kind: str):
+        qualname = f"{scope}.{node.name}" if scope else node.name
+        if isinstance(node, ast.ClassDef):
+            kind = "class"
+        else:
+            kind = "method" if scope_kind == "class" else "function"
+        self.defs.append([node.name, qualname, kind, node.lineno, node.end_lineno or node.lineno, _signature(node)])
+        # Decorators, bases and return annotations are evaluated in the enclosing scope
+        for expr in node.decorator_list:
+            self.visit_expr(expr, scope, scope_kind)
+        if isinstance(node, ast.ClassDef):
+            for expr in (*node.bases, *node.keywords):
+                self.visit_expr(expr, scope, scope_kind)
+            self.visit_block(node.body, qualname, "class")
+        else:
+            self.visit_expr(node.args, qualname, "function")
+            if node.returns:
+                self.visit_expr(node.returns, scope, scope_kind)
+            self.visit_block(node.body, qualname, "function")
+
+    def visit_stmt(self, node: ast.stmt, scope: str, scope_kind: str):
+        if isinstance(node, (*_FUNCTIONS, ast.ClassDef)):
+            self.visit_def(node, scope, scope_kind)
+            return
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                local = alias.asname or alias.name.split(".")[0]
+                self.imports[local] = alias.name if alias.asname else local
+                self._ref(alias.name.split(".")[-1], node.lineno, scope, "import")
+            return
+        if isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = self.package[:len(self.package) - node.level + 1] if node.level <= len(self.package) + 1 else []
+                prefix = ".".join(base + ([node.module] if node.module else []))
+            else:
+                prefix = node.module or ""
+            for alias in node.names:
+                if alias.name != "*":
+                    self.imports[alias.asname or alias.name] = f"{prefix}.{alias.name}" if prefix else alias.name
+                    self._ref(alias.name, node.lineno, scope, "import")
+            return
+        if isinstance(node, (ast.Assign, ast.AnnAssign)) and scope_kind in ("module", "class"):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for name in ast.walk(target):
+                    if isinstance(name, ast.Name):
+                        qualname = f"{scope}.{name.id}" if scope else name.id
+                        kind = "attribute" if scope_kind == "class" else "variable"
+                        self.defs.append([name.id, qualname, kind, node.lineno, node.end_lineno or node.lineno, ""])
+                        if name.id == "__all__" and scope_kind == "module":
+                            self.exports = self._literal_names(node.value)
+        # if / for / while / with / try bodies stay in the current scope
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.stmt):
+                self.visit_stmt(child, scope, scope_kind)
+            else:
+                self.visit_expr(child, scope, scope_kind)
+
+    def visit_expr(self, node: ast.AST, scope: str, scope_kind: str):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, ast.stmt):
+                # Bodies of except handlers and match cases
+                self.visit_stmt(current, scope, scope_kind)
+                continue
+            if isinstance(current, ast.Call):
+                func = current.func
+                if isinstance(func, ast.Name):
+                    self._ref(func.id, current.lineno, scope, "call")
+                elif isinstance(func, ast.Attribute):
+                    self._ref(func.attr, current.lineno, scope, "call")
+                    stack.append(func.value)
+                else:
+                    stack.append(func)
+                stack.extend(current.args)
+                stack.extend(current.keywords)
+                continue
+            if isinstance(current, ast.Name) and isinstance(current.ctx, ast.Load):
+                self._ref(current.id, current.lineno, scope, "load")
+            elif isinstance(current, ast.Attribute) and isinstance(current.ctx, ast.Load):
+                self._ref(current.attr, current.lineno, scope, "load")
+            stack.extend(ast.iter_child_nodes(current))
+
+    @staticmethod
+    def _literal_names(value: Optional[ast.AST]) -> Optional[List[str]]:
+        if isinstance(value, (ast.List, ast.Tuple)):
+            names = [e.value for e in value.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+            return names if len(names) == len(value.elts) else None
+        return None
+
+
+def _pack(packed: array) -> Any:
+    # The JSON fallback index cannot hold bytes
+    return packed.tobytes() if HAS_MSGPACK else packed.tolist()
+
+
+def _unpack(value: Any) -> array:
+    packed = array("I")
+    if isinstance(value, (bytes, bytearray)):
+        packed.frombytes(value)
+    else:
+        packed.extend(value)
+    return packed
+
+
+def parse_symbols(root_dir: str, rel: str) -> Optional[List[Any]]:
+    """
+    [module, definitions, reference names, reference scopes, packed
+    references, exports, imports] of one file, None when it does not parse.
+    """
+    try:
+        with open(os.path.join(root_dir, rel), "rb") as f:
+            tree = ast.parse(f.read(), filename=rel)
+        extractor = _Extractor(rel)
+        extractor.visit_block(tree.body, "", "module")
+    except (OSError, SyntaxError, ValueError, RecursionError) as e:
+        logger.debug(f"SYMBOL INDEX: Could not parse {rel}: {e}")
+        return None
+    return [extractor.module, extractor.defs, *extractor.encode_refs(), extractor.exports, extractor.imports]
+
+
+class Definition:
+    __slots__ = ("name", "qualname", "kind", "file", "line", "end_line", "signature", "module")
+
+    def __init__(self, row: List[Any], file: str, module: str):
+        self.name, self.qualname, self.kind, self.line, self.end_line, self.signature = row
+        self.file = file
+        self.module = module
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.module}.{self.qualname}" if self.module else self.qualname
+
+    def describe(self) -> str:
+        lines = f"{self.line}-{self.end_line}" if self.end_line > self.line else str(self.line)
+        return f"{self.file}:{lines} {self.kind} {self.full_name}{self.signature}"
+
+
+class Reference:
+    __slots__ = ("name", "file", "line", "scope", "kind")
+
+    def __init__(self, row: List[Any], file: str):
+        self.name, self.line, self.scope, self.kind = row
+        self.file = file
+
+    def describe(self) -> str:
+        return f"{self.file}:{self.line} {self.kind} {self.name} in {self.scope or '<module>'}"
+
+
+class SymbolIndex:
+    """
+    Per-workspace definitions and references for in-process navigation,
+    built with ast and kept up to date per file (mtime and size) like the
+    KnowledgeGraph, persisted in .agent_artifacts/cache. Queries go through
+    name -> files maps, so they only touch the files that mention the name.
+    """
+    def __init__(self, root_dir: str, persist: bool = True):
+        self.root_dir = root_dir
+        self.persist = persist
+        self._files: Dict[str, List[Any]] = {} # file -> [module, defs, refs, exports, imports]
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._def_files: Dict[str, Set[str]] = {} # simple name -> files defining it
+        self._ref_files: Dict[str, Set[str]] = {} # simple name -> files referencing it
+        self._modules: Dict[str, str] = {} # dotted module name -> file
+        self._by_name: Dict[str, Dict[str, List[List[Any]]]] = {} # file -> name -> definition rows
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    # --- Indexing ---
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Brings the index in line with the workspace, re-parsing only the files
+        whose mtime or size changed. Returns what was done.
+        """
+        with self._lock:
+            started = time.monotonic()
+            from_index = False
+            if not self.loaded:
+                from_index = self._load()
+                self.loaded = True
+            stamps = scan_python_files(self.root_dir)
+            stale = [rel for rel, stamp in stamps.items() if self._stamps.get(rel) != stamp]
+            removed = [rel for rel in self._files if rel not in stamps]
+            for rel in removed:
+                self._drop(rel)
+                self._stamps.pop(rel, None)
+            for rel, entry in parse_files(parse_symbols, self.root_dir, stale):
+                if entry is None:
+                    # Keep the previous symbols of a file that no longer parses; it is being edited
+                    if rel not in self._files:
+                        self._add(rel, [(module_names(rel) or [""])[0], [], [], [], _pack(array("I")), None, {}])
+                else:
+                    self._drop(rel)
+                    self._add(rel, entry)
+                self._stamps[rel] = stamps[rel]
+            if stale or removed or (not from_index and self.persist):
+                self._save()
+            result = {"files": len(stamps), "parsed": len(stale), "removed": len(removed), "from_index": int(from_index), "seconds": round(time.monotonic() - started, 3)}
+            if stale or removed:
+                logger.info(f"SYMBOL INDEX: {self.root_dir}: {result}")
+            return result
+
+    def _add(self, rel: str, entry: List[Any]):
+        self._files[rel] = entry
+        module, defs, ref_names = entry[0], entry[1], entry[2]
+        if module:
+            self._modules[module] = rel
+            for name in module_names(rel)[1:]:
+                self._modules[name] = rel
+        for name in {row[0] for row in defs}:
+            self._def_files.setdefault(name, set()).add(rel)
+        for name in ref_names:
+            self._ref_files.setdefault(name, set()).add(rel)
+
+    def _drop(self, rel: str):
+        entry = self._files.pop(rel, None)
+        self._by_name.pop(rel, None)
+        if entry is None:
+            return
+        for name in module_names(rel):
+            if self._modules.get(name) == rel:
+                del self._modules[name]
+        for index, names in ((self._def_files, {row[0] for row in entry[1]}), (self._ref_files, entry[2])):
+            for name in names:
+                files = index.get(name)
+                if files is not None:
+                    files.discard(rel)
+                    if not files:
+                        del index[name]
+
+    def _defs_named(self, rel: str, name: str) -> List[List[Any]]:
+        # Per-file name -> definition rows, built on first query of the file
+        defs = self._by_name.get(rel)
+        if defs is None:
+            defs = self._by_name[rel] = {}
+            for row in self._files[rel][1]:
+                defs.setdefault(row[0], []).append(row)
+        return defs.get(name, [])
+
+    def _refs_named(self, rel: str, name: str) -> List[List[Any]]:
+        # Only the matching quadruples are decoded; array.index does the scan in C
+        entry = self._files[rel]
+        try:
+            target = entry[2].index(name)
+        except ValueError:
+            return []
+        packed = _unpack(entry[4])
+        ids = packed[0::4]
+        rows = []
+        i = -1
+        while True:
+            try:
+                i = ids.index(target, i + 1)
+            except ValueError:
+                return rows
+            rows.append([name, packed[4 * i + 1], entry[3][packed[4 * i + 2]], REF_KINDS[packed[4 * i + 3]]])
+
+    def _load(self) -> bool:
+        if not self.persist:
+            return False
+        index = read_index(self.root_dir, "symbols", INDEX_VERSION)
+        if index is None:
+            return False
+        for rel, (mtime_ns, size, *entry) in index["files"].items():
+            self._stamps[rel] = (mtime_ns, size)
+            self._add(rel, entry)
+        return True
+
+    def _save(self):
+        if not self.persist:
+            return
+        write_index(self.root_dir, "symbols", {
+            "version": INDEX_VERSION,
+            "files": {rel: [*self._stamps.get(rel, (0, 0)), *entry] for rel, entry in self._files.items()},
+        })
+
+    # --- Queries ---
+
+    def definitions(self, name: str) -> List[Definition]:
+        """
+        Where a symbol is defined. name may be simple ("run"), scoped
+        ("Runner.run") or fully qualified ("app.runner.Runner.run").
+        """
+        simple = name.rsplit(".", 1)[-1]
+        found = []
+        with self._lock:
+            for rel in sorted(self._def_files.get(simple, ())):
+                module = self._files[rel][0]
+                for row in self._defs_named(rel, simple):
+                    d = Definition(row, rel, module)
+                    if name == simple or d.qualname == name or d.full_name == name or d.full_name.endswith("." + name):
+                        found.append(d)
+        found.sort(key=lambda d: (_KIND_ORDER.get(d.kind, 9), d.file, d.line))
+        return found
+
+    def references(self, name: str, calls_only: bool = False) -> List[Reference]:
+        """
+        Call sites (and, unless calls_only, other uses and imports) of a symbol.
+        For a qualified name, files that import the simple name from elsewhere
+        are left out.
+        """
+        simple = name.rsplit(".", 1)[-1]
+        targets: Set[str] = set()
+        if "." in name:
+            targets = {d.full_name for d in self.definitions(name)}
+        found = []
+        with self._lock:
+            for rel in sorted(self._ref_files.get(simple, ())):
+                imported = self._files[rel][6].get(simple)
+                if targets and imported and imported not in targets:
+                    continue
+                for row in self._refs_named(rel, simple):
+                    if calls_only and row[3] != "call":
+                        continue
+                    found.append(Reference(row, rel))
+        return found
+
+    def callers(self, name: str) -> List[Reference]:
+        return self.references(name, calls_only=True)
+
+    def module_file(self, module: str) -> Optional[str]:
+        """
+        The file of a dotted module name or a workspace-relative path.
+        """
+        with self._lock:
+            if module in self._files:
+                return module
+            return self._modules.get(module)
+
+    def module_symbols(self, module: str) -> Tuple[Optional[List[str]], List[Definition]]:
+        """
+        (exports, definitions) of a module: __all__ when it is a literal list
+        (else the public top-level names), and its classes, functions,
+        methods and module-level variables.
+        """
+        rel = self.module_file(module)
+        if rel is None:
+            return None, []
+        with self._lock:
+            entry = self._files[rel]
+            defs = [Definition(row, rel, entry[0]) for row in entry[1]]
+            exports = entry[5]
+        if exports is None:
+            exports = sorted({d.name for d in defs if "." not in d.qualname and not d.name.startswith("_")})
+        return exports, sorted(defs, key=lambda d: d.line)
+
+
+_indexes: Dict[str, SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def symbols_for(root_dir: str) -> SymbolIndex:
+    """
+    The long-lived symbol index of a workspace; callers refresh() it before querying.
+    """
+    root = os.path.realpath(root_dir)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = SymbolIndex(root, persist=settings.KNOWLEDGE_GRAPH_PERSIST)
+    return index
+
+
+def forget_symbols(root_dir: str):
+    with _indexes_lock:
+        _indexes.pop(os.path.realpath(root_dir), None)
+
+
+QUERY_HELP = (
+    "`def NAME` (where a class/function/variable is defined), `callers NAME` (call sites), "
+    "`refs NAME` (all uses and imports), `symbols MODULE_OR_PATH` (a module's exports and definitions)"
+)
+
+
+def run_query(index: SymbolIndex, action: str) -> Optional[str]:
+    """
+    Answers a navigation action (see QUERY_HELP) from the index; None when
+    the action is not a symbol query.
+    """
+    parts = action.strip().split()
+    if len(parts) != 2 or parts[0] not in ("def", "callers", "refs", "symbols"):
+        return None
+    verb, name = parts
+    limit = settings.SYMBOL_QUERY_MAX_RESULTS
+    if verb == "symbols":
+        exports, defs = index.module_symbols(name)
+        if not defs and exports is None:
+            return f"No module '{name}' in the workspace."
+        lines = [f"{index.module_file(name)}: exports {', '.join(exports) or '(none)'}"]
+        lines += [d.describe() for d in defs[:limit]]
+        shown = defs
+    elif verb == "def":
+        shown = index.definitions(name)
+        lines = [f"{len(shown)} definition(s) of '{name}':"] + [d.describe() for d in shown[:limit]]
+    else:
+        shown = index.references(name, calls_only=verb == "callers")
+        label = "call site(s)" if verb == "callers" else "reference(s)"
+        lines = [f"{len(shown)} {label} of '{name}':"] + [r.describe() for r in shown[:limit]]
+    if len(shown) > limit:
+        lines.append(f"... {len(shown) - limit} more")
+    return "\n".join(lines)
@@ -1,18 +1,55 @@
-import subprocess
 import shlex
 import logging
 import os
-from typing import Tuple, Optional, Callable
+import asyncio
+import time
+import weakref
+from typing import Dict, List, Tuple, Optional, Callable
 from app.core.config import settings
-from app.agents.sandbox import sandbox_manager
-import json
-try:
-    import jsonschema
-except ImportError:
-    jsonschema = None
+from app.agents.sandbox import sandbox_manager, TIMEOUT_EXIT_CODE
+from app.core.http_client import llm_http
+from app.core.llm_cache import llm_cache
+from app.core.metrics import CounterWindows
+from app.core.rate_limit import rate_limiter
+from app.agents.logic.model_router import model_router
+from app.agents.logic.structured_output import FrameScanner, extract_frame, find_unframed
+from app.agents.logic.token_monitor import token_monitor
 
 logger = logging.getLogger(__name__)
 
+class EnsembleStats:
+    """
+    Per-model race counters for run_ensemble: entries, wins, cancellations
+    and the latency of every candidate that ran to completion.
+    """
+    def __init__(self):
+        self.counters = CounterWindows({"races": 0, "wins": 0, "cancelled": 0, "completed": 0, "latency_total": 0.0})
+
+    def record(self, model: str, won: bool = False, cancelled: bool = False, latency: Optional[float] = None):
+        self.counters.add(
+            model,
+            races=1,
+            wins=1 if won else 0,
+            cancelled=1 if cancelled else 0,
+            completed=1 if latency is not None else 0,
+            latency_total=latency or 0.0,
+        )
+
+    def record_win(self, model: str):
+        self.counters.add(model, wins=1)
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Dict]:
+        return {
+            model: {
+                "races": int(e["races"]),
+                "wins": int(e["wins"]),
+                "win_rate": round(e["wins"] / e["races"], 3) if e["races"] else 0.0,
+                "cancelled": int(e["cancelled"]),
+                "avg_latency_s": round(e["latency_total"] / e["completed"], 2) if e["completed"] else None,
+            }
+            for model, e in self.counters.entries(window).items()
+        }
+
 class CodexConnector:
     """
     Wrapper around the 'codex' CLI tool.
@@ -30,27 +67,20 @@ class CodexConnector:
         else:
              self.cli_path = cli_path
         self.timeout = timeout
+        self.ensemble_stats = EnsembleStats()
+        # Bounds concurrent ensemble candidates per event loop (one loop per Celery job)
+        self._ensemble_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
 
-    def run_prompt(
-        self, 
-        prompt: str, 
-        model: str = settings.CODEX_MODEL, 
-        log_callback: Optional[Callable[[str], None]] = None,
-        sandbox: str = "read-only",
-        approval: str = "never",
-        cwd: Optional[str] = None,
-        expected_schema: Optional[dict] = None
-    ) -> Tuple[str, str, int]:
-        """
-        Runs a prompt against the Codex CLI.
-        Falls back to direct Azure OpenAI API call if CLI is missing.
-        Returns: (stdout, stderr, exit_code)
-        """
-        # Check if CLI exists (fast check to avoid exception overhead if known missing)
+    def _cli_available(self) -> bool:
+        # Fast check to avoid exception overhead if the CLI is known missing
         import shutil
-        if not shutil.which(self.cli_path) and not os.path.exists(self.cli_path):
-             return self._run_api_fallback(prompt, model)
+        return bool(shutil.which(self.cli_path)) or os.path.exists(self.cli_path)
 
+    def _build_invocation(self, prompt: str, model: str, sandbox: str, approval: str) -> Tuple[List[str], dict, str]:
+        """
+        Builds the Codex CLI argv, its environment and the framed prompt for stdin.
+        Returns: (cmd, env, framed_prompt)
+        """
         # Use 'exec' subcommand for non-interactive mode
         # Pass prompt via stdin for robustness
         # Skip git checks since we are running via wrapper
@@ -101,62 +131,88 @@ class CodexConnector:
         # Force unbuffered output for Python subprocesses (if codex is python)
         env["PYTHONUNBUFFERED"] = "1"
 
-        stdout_lines = []
-        stderr_lines = [] # We merge stderr into stdout for streaming, but keep separate if possible? No, merging is safer.
+        # Priority 1: Deterministic Handshake Prompting
+        # We prefix the prompt to guide the agent toward the framing protocol
+        handshake_prefix = (
+            "CRITICAL: YOUR OUTPUT MUST START WITH A JSONL LINE PREFIXED BY 'AGENT_JSON_START:'.\n"
+            "EXAMPLE: AGENT_JSON_START: {\"status\": \"success\", \"intent\": \"apply_patch\"}\n\n"
+        )
+        return cmd, env, handshake_prefix + prompt
+
+    def _estimate_tokens(self, prompt: str, model: str) -> int:
+        """
+        Token cost reserved against TPM before a call: the prompt plus the expected completion.
+        """
+        return token_monitor.count_tokens(prompt, model) + settings.LLM_RATE_LIMIT_COMPLETION_TOKENS
+
+    def _extract_frame(self, full_output: str, expected_schema: Optional[dict]) -> Optional[dict]:
+        """
+        Refined JSON Extraction via Framing Protocol (see structured_output).
+        """
+        frame = extract_frame(full_output, expected_schema)
+        self._log_frame(frame, expected_schema)
+        return frame
+
+    @staticmethod
+    def _log_frame(frame: Optional[dict], expected_schema: Optional[dict]):
+        if not expected_schema:
+            return
+        if frame is not None:
+            logger.info("✅ Framed JSON validated successfully.")
+        else:
+            logger.warning("⚠️ No AGENT_JSON_START frame satisfying the expected schema was found.")
+
+    def run_prompt(
+        self, 
+        prompt: str, 
+        model: str = settings.CODEX_MODEL, 
+        log_callback: Optional[Callable[[str], None]] = None,
+        sandbox: str = "read-only",
+        approval: str = "never",
+        cwd: Optional[str] = None,
+        expected_schema: Optional[dict] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Runs a prompt against the Codex CLI.
+        Falls back to direct Azure OpenAI API call if CLI is missing.
+        Blocking: async callers should use arun_prompt instead.
+        Returns: (stdout, stderr, exit_code)
+        """
+        provider = settings.LLM_PROVIDER.lower()
+        if rate_limiter.limits_for(provider, model):
+            rate_limiter.acquire_blocking(provider, model, self._estimate_tokens(prompt, model))
+
+        if not self._cli_available():
+             return self._run_api_fallback(prompt, model)
+
+        cmd, env, framed_prompt = self._build_invocation(prompt, model, sandbox, approval)
 
         try:
             logger.info(f"Running Codex command: {' '.join(cmd)} ...") 
-            
-            # Priority 1: Deterministic Handshake Prompting
-            # We prefix the prompt to guide the agent toward the framing protocol
-            handshake_prefix = (
-                "CRITICAL: YOUR OUTPUT MUST START WITH A JSONL LINE PREFIXED BY 'AGENT_JSON_START:'.\n"
-                "EXAMPLE: AGENT_JSON_START: {\"status\": \"success\", \"intent\": \"apply_patch\"}\n\n"
-            )
-            prompt = handshake_prefix + prompt
 
-            # Use Sandbox Manager instead of raw Popen for execution
+            # Use Sandbox Manager instead of raw Popen for execution (kills the process group at the deadline)
             full_output, stderr, returncode = sandbox_manager.execute(
                 cmd,
                 cwd=cwd,
                 env=env,
-                stdin=prompt
+                stdin=framed_prompt,
+                timeout=self.timeout,
+                command_class="codex"
             )
 
-            # Refined JSON Extraction via Framing Protocol
-            if expected_schema and jsonschema:
-                try:
-                    # Look for the framed line
-                    import re
-                    json_frame_match = re.search(r"^AGENT_JSON_START:\s*(\{.*?\})", full_output, re.MULTILINE)
-                    
-                    # Fallback to general regex if framing fails
-                    if not json_frame_match:
-                        json_frame_match = re.search(r"(\{.*?\})", full_output, re.DOTALL)
-
-                    if json_frame_match:
-                        json_str = json_frame_match.group(1)
-                        response_json = json.loads(json_str)
-                        jsonschema.validate(instance=response_json, schema=expected_schema)
-                        logger.info("✅ Framed JSON validated successfully.")
-                    else:
-                        logger.warning("⚠️ No valid AGENT_JSON_START frame found.")
-                except Exception as e:
-                    logger.error(f"❌ Deterministic I/O Validation Failed: {e}")
-                    # We don't necessarily fail the whole process yet, but we could return an error code
+            if returncode == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+                logger.error(f"Codex CLI timed out after {self.timeout}s")
+                return full_output, stderr, returncode
+
+            self._extract_frame(full_output, expected_schema)
             
             # Extract code blocks if present to separate from logs
             # Simple heuristic: if we find a code block, try to extract it?
             # Or just return everything and let the node handle it.
             # But the user sees the raw log file.
             
-            return full_output, "", process.returncode
+            return full_output, "", returncode
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"Codex CLI timed out after {self.timeout}s")
-            if process:
-                process.kill()
-            return "".join(stdout_lines), "TimeoutExpired", 124
         except FileNotFoundError:
             # Fallback if shutil.which failed to detect absence or path issues
             return self._run_api_fallback(prompt, model)
@@ -164,144 +220,350 @@ class CodexConnector:
             logger.exception("Unexpected error running Codex CLI")
             return "", str(e), 1
 
-    async def run_ensemble(
+    async def arun_prompt(
         self, 
         prompt: str, 
-        models: List[str], 
+        model: Optional[str] = None, 
+        log_callback: Optional[Callable[[str], None]] = None,
+        sandbox: str = "read-only",
+        approval: str = "never",
+        cwd: Optional[str] = None,
+        expected_schema: Optional[dict] = None,
+        node: Optional[str] = None,
+        job_id: Optional[str] = None,
+        purpose: Optional[str] = None
+    ) -> Tuple[str, str, int]:
+        """
+        Asyncio-native variant of run_prompt for graph nodes.
+        Streams Codex stdout into log_callback line by line as it is produced,
+        kills the CLI's whole process group after self.timeout seconds and caps
+        retained output at CODEX_MAX_OUTPUT_BYTES.
+        `node` names the calling graph node; read-only calls from nodes listed in
+        LLM_CACHE_TTLS are answered from the response cache when possible.
+        With `job_id`, token usage is recorded against the job, node and model.
+        Without `model`, the deployment is routed from (node, purpose) via MODEL_ROUTES.
+        Returns: (stdout, stderr, exit_code)
+        """
+        _, stdout, stderr, returncode = await self.arun_json(
+            prompt, expected_schema, model=model, log_callback=log_callback,
+            sandbox=sandbox, approval=approval, cwd=cwd, node=node, job_id=job_id, purpose=purpose
+        )
+        return stdout, stderr, returncode
+
+    async def arun_json(
+        self,
+        prompt: str,
+        expected_schema: Optional[dict] = None,
+        model: Optional[str] = None,
+        log_callback: Optional[Callable[[str], None]] = None,
+        sandbox: str = "read-only",
+        approval: str = "never",
+        cwd: Optional[str] = None,
+        node: Optional[str] = None,
+        job_id: Optional[str] = None,
+        purpose: Optional[str] = None
+    ) -> Tuple[Optional[dict], str, str, int]:
+        """
+        Like arun_prompt, but also returns the parsed AGENT_JSON_START frame.
+        The frame is extracted while the output streams in, so callers never
+        re-parse the transcript.
+        Without an explicit model, the deployment is picked by MODEL_ROUTES for
+        (node, purpose); if a smaller tier's answer fails schema validation the
+        call is repeated once on MODEL_ESCALATION_TIER.
+        Returns: (frame or None, stdout, stderr, exit_code)
+        """
+        if model is not None:
+            return await self._arun_once(
+                prompt, expected_schema, model, None, log_callback, sandbox, approval, cwd, node, job_id
+            )
+
+        tier, model = model_router.resolve(node, purpose)
+        result = await self._arun_once(
+            prompt, expected_schema, model, tier, log_callback, sandbox, approval, cwd, node, job_id
+        )
+        frame, _, _, returncode = result
+        if expected_schema and frame is None and returncode == 0:
+            escalation = model_router.escalation_for(tier, model)
+            if escalation is not None:
+                logger.warning(f"MODEL ROUTER: {node or 'call'} answer from '{tier}' tier failed schema validation; escalating to '{escalation[0]}'.")
+                result = await self._arun_once(
+                    prompt, expected_schema, escalation[1], escalation[0], log_callback, sandbox, approval, cwd, node, job_id,
+                    escalated=True
+                )
+        return result
+
+    async def _arun_once(
+        self,
+        prompt: str,
+        expected_schema: Optional[dict],
+        model: str,
+        tier: Optional[str],
+        log_callback: Optional[Callable[[str], None]],
+        sandbox: str,
+        approval: str,
+        cwd: Optional[str],
+        node: Optional[str],
+        job_id: Optional[str],
+        escalated: bool = False
+    ) -> Tuple[Optional[dict], str, str, int]:
+        """
+        One call on one deployment: response cache, rate limit, the call itself
+        and token / tier accounting.
+        """
+        cache_ttl = llm_cache.ttl_for(node, sandbox)
+        if cache_ttl:
+            # The workspace fingerprint runs git and the Redis tier does network I/O
+            cache_key = await asyncio.to_thread(llm_cache.make_key, model, sandbox, prompt, cwd)
+            cached = await asyncio.to_thread(llm_cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"LLM CACHE: Hit for node '{node}' ({model}).")
+                return extract_frame(cached, expected_schema), cached, "", 0
+
+        # Wait for quota shared with every worker; coder calls are admitted ahead of checks
+        grant = None
+        provider = settings.LLM_PROVIDER.lower()
+        if rate_limiter.limits_for(provider, model):
+            estimate = await asyncio.to_thread(self._estimate_tokens, prompt, model)
+            grant = await rate_limiter.acquire(provider, model, estimate, node=node, job_id=job_id)
+
+        started = time.monotonic()
+        used = None
+        try:
+            frame, stdout, stderr, returncode, usage = await self._arun_uncached(
+                prompt, model, log_callback, sandbox, approval, cwd, expected_schema, job_id
+            )
+            if tier is not None:
+                schema_ok = frame is not None or not expected_schema or returncode != 0
+                model_router.record(tier, time.monotonic() - started, schema_ok=schema_ok, escalated=escalated)
+            # tiktoken counting is CPU-bound; keep it off the event loop
+            if job_id:
+                used = await asyncio.to_thread(token_monitor.record_call, job_id, prompt, stdout, model=model, node=node, usage=usage)
+            elif grant is not None:
+                used = sum((await asyncio.to_thread(token_monitor.call_tokens, prompt, stdout, model, usage))[:2])
+        finally:
+            if grant is not None:
+                if used is None:
+                    # Failed or cancelled before usage was known: charge the prompt, return the completion reserve
+                    used = max(grant.estimated_tokens - settings.LLM_RATE_LIMIT_COMPLETION_TOKENS, 0)
+                await asyncio.shield(asyncio.to_thread(rate_limiter.settle, grant, used))
+
+        if cache_ttl and returncode == 0 and (frame is not None or not expected_schema):
+            await asyncio.to_thread(llm_cache.set, cache_key, stdout, cache_ttl)
+        return frame, stdout, stderr, returncode
+
+    async def _arun_uncached(
+        self,
+        prompt: str,
+        model: str,
+        log_callback: Optional[Callable[[str], None]],
+        sandbox: str,
+        approval: str,
+        cwd: Optional[str],
+        expected_schema: Optional[dict],
+        job_id: Optional[str] = None
+    ) -> Tuple[Optional[dict], str, str, int, Optional[dict]]:
+        """
+        Dispatches to the Codex CLI (or the API fallback).
+        Returns: (frame or None, stdout, stderr, exit_code, provider usage or None)
+        """
+        if not self._cli_available():
+            stdout, stderr, returncode, usage = await self._arun_api_fallback(prompt, model)
+            return self._extract_frame(stdout, expected_schema), stdout, stderr, returncode, usage
+
+        cmd, env, framed_prompt = self._build_invocation(prompt, model, sandbox, approval)
+        logger.info(f"Running Codex command (async): {' '.join(cmd)} ...")
+
+        # Scan for the frame as lines arrive instead of regex-scanning the whole transcript afterwards
+        scanner = FrameScanner(expected_schema)
+
+        def _on_line(line: str):
+            if not scanner.done:
+                scanner.feed(line + "\n")
+            if log_callback:
+                log_callback(line)
+
+        full_output, stderr, returncode = await sandbox_manager.aexecute(
+            cmd,
+            cwd=cwd,
+            env=env,
+            stdin=framed_prompt,
+            timeout=self.timeout,
+            log_callback=_on_line,
+            max_output_bytes=settings.CODEX_MAX_OUTPUT_BYTES,
+            command_class="codex",
+            job_id=job_id
+        )
+
+        if returncode == TIMEOUT_EXIT_CODE and stderr == "TimeoutExpired":
+            logger.error(f"Codex CLI timed out after {self.timeout}s")
+            return None, full_output, stderr, returncode, None
+
+        frame = scanner.result
+        if frame is None:
+            frame = find_unframed(full_output, expected_schema)
+        self._log_frame(frame, expected_schema)
+        return frame, full_output, stderr if returncode != 0 else "", returncode, None
+
+    async def run_ensemble(
+        self,
+        prompt: str,
+        models: List[str],
+        expected_schema: Optional[dict] = None,
+        predicate: Optional[Callable[[Optional[dict], str], bool]] = None,
+        race: bool = True,
         **kwargs
     ) -> Tuple[str, str, int]:
         """
         Runs the prompt against multiple models in parallel.
-        Returns the first success based on JSON status.
+        With race=True, returns as soon as one candidate is accepted and cancels
+        the others (their Codex process groups are killed and HTTP requests aborted).
+        A candidate is accepted when it exits 0 and `predicate(frame, stdout)` holds;
+        without a predicate it must yield a valid frame for `expected_schema`, or
+        report "status": "success" when no schema is given.
+        Returns: (stdout, stderr, exit_code)
         """
-        import asyncio
-        
-        async def _run_one(model_name):
-            # Run in thread pool since run_prompt is likely blocking
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(
-                None, 
-                lambda: self.run_prompt(prompt, model=model_name, **kwargs)
+        def _accepted(frame: Optional[dict], stdout: str, code: int) -> bool:
+            if code != 0:
+                return False
+            if predicate is not None:
+                try:
+                    return bool(predicate(frame, stdout))
+                except Exception as e:
+                    logger.warning(f"ENSEMBLE: Predicate raised {e!r}; rejecting candidate.")
+                    return False
+            if expected_schema:
+                return frame is not None
+            if frame is not None:
+                return frame.get("status") == "success"
+            return '"status": "success"' in stdout
+
+        slots = self._get_ensemble_slots()
+        started = time.monotonic()
+
+        async def _run_one(model_name: str):
+            async with slots:
+                t0 = time.monotonic()
+                result = await self.arun_json(prompt, expected_schema, model=model_name, **kwargs)
+                return result, time.monotonic() - t0
+
+        tasks = {asyncio.create_task(_run_one(m)): m for m in models}
+        finished: List[Tuple[str, Tuple[Optional[dict], str, str, int]]] = []
+        winner: Optional[str] = None
+        try:
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer the earlier model when several finish in the same tick
+                for task in sorted(done, key=lambda t: models.index(tasks[t])):
+                    model_name = tasks[task]
+                    if task.exception() is not None:
+                        logger.warning(f"ENSEMBLE: {model_name} failed: {task.exception()!r}")
+                        self.ensemble_stats.record(model_name)
+                        continue
+                    result, latency = task.result()
+                    frame, stdout, _, code = result
+                    accepted = winner is None and race and _accepted(frame, stdout, code)
+                    if accepted:
+                        winner = model_name
+                    self.ensemble_stats.record(model_name, won=accepted, latency=latency)
+                    finished.append((model_name, result))
+        finally:
+            losers = [t for t in tasks if not t.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+                for task in losers:
+                    self.ensemble_stats.record(tasks[task], cancelled=True)
+
+        if winner is not None:
+            logger.info(
+                f"ENSEMBLE: {winner} won the race in {time.monotonic() - started:.1f}s; "
+                f"cancelled {len(losers)} of {len(models)} candidates."
             )
+            _, stdout, stderr, code = next(r for m, r in finished if m == winner)
+            return stdout, stderr, code
+
+        # No race (or nobody accepted): first accepted candidate in model order, else first that ran
+        finished.sort(key=lambda item: models.index(item[0]))
+        for model_name, (frame, stdout, stderr, code) in finished:
+            if _accepted(frame, stdout, code):
+                if not race:
+                    self.ensemble_stats.record_win(model_name)
+                return stdout, stderr, code
+        for _, (_, stdout, stderr, code) in finished:
+            return stdout, stderr, code
 
-        results = await asyncio.gather(*[_run_one(m) for m in models], return_exceptions=True)
-        
-        for res in results:
-            if isinstance(res, Exception): continue
-            stdout, stderr, code = res
-            if code == 0 and '"status": "success"' in stdout:
-                return res
-        
-        # Fallback to first if none "success"
-        for res in results:
-            if not isinstance(res, Exception):
-                return res
-                
         return "", "All models failed", 1
 
+    def _get_ensemble_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._ensemble_slots.get(loop)
+        if slots is None:
+            slots = asyncio.Semaphore(settings.ENSEMBLE_MAX_CONCURRENCY)
+            self._ensemble_slots[loop] = slots
+        return slots
+
+    def _api_request(self, prompt: str, model: str) -> Tuple[str, dict, dict]:
+        """
+        Builds the Azure OpenAI chat-completions request.
+        GPT-5 Codex models are actually Chat Completion models despite the name.
+        Returns: (url, headers, payload)
+        """
+        url = llm_http.azure_chat_url(model)
+        headers = {
+            "api-key": settings.AZURE_OPENAI_API_KEY,
+            "Content-Type": "application/json"
+        }
+        # Reasoning models reject max_tokens/temperature, so only send messages
+        payload = {
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        return url, headers, payload
+
+    @staticmethod
+    def _parse_api_response(response) -> Tuple[str, str, int, Optional[dict]]:
+        """
+        Returns: (content, error, exit_code, provider usage block or None)
+        """
+        if response.status_code == 200:
+            data = response.json()
+            return data["choices"][0]["message"]["content"], "", 0, data.get("usage")
+        error_msg = f"API Error {response.status_code}: {response.text}"
+        logger.error(error_msg)
+        return "", error_msg, 1, None
+
     def _run_api_fallback(self, prompt: str, model: str) -> Tuple[str, str, int]:
         """
         Direct API call to Azure OpenAI when CLI is not available.
         """
-        import requests
-        
         if not settings.AZURE_OPENAI_API_KEY or not settings.AZURE_OPENAI_ENDPOINT:
             return "", "Azure OpenAI credentials not configured.", 1
 
-        # Construct URL
-        # URL format: https://{resource}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version={api-version}
-        
-        endpoint = settings.AZURE_OPENAI_ENDPOINT.rstrip("/")
-        
-        # Standardize base URL by removing known suffixes that might be pasted in by users
-        # e.g. .../openai/v1 -> .../openai
-        if endpoint.endswith("/v1"):
-            endpoint = endpoint[:-3]
-        
-        # Ensure we don't double up on /openai/deployments if the user just gave the resource root
-        if "/openai" not in endpoint:
-             endpoint = f"{endpoint}/openai"
-
-        # Now endpoint should be .../openai
-        
-        # But wait, if user provided .../openai/v1, stripping /v1 gives .../openai.
-        # Then we want .../openai/deployments/...
-        
-        # However, if user provided .../openai/, stripping /v1 (if not present) leaves .../openai.
-        
-        # Safe construction:
-        # If the endpoint already has /deployments, assume it's a full URL and don't touch it (rare/custom proxy).
-        if "/deployments" in endpoint:
-             # Just append chat/completions if not present? Too risky.
-             # Let's assume standard Azure resource URL structure.
-             pass
-             
-        # Let's simply handle the common case: user provided .../openai/v1
-        base_url = settings.AZURE_OPENAI_ENDPOINT.rstrip("/")
-        if base_url.endswith("/v1"):
-            base_url = base_url[:-3] # Remove /v1
-            
-        # If it still ends in /openai, great. If not (resource root), add /openai?
-        # Actually Azure endpoints are usually .../openai/deployments/...
-        
-        # Robust fix:
-        if base_url.endswith("/openai"):
-             pass # Correct
-        elif "/openai" not in base_url:
-             base_url = f"{base_url}/openai"
-             
-        # If base_url is .../openai, then append /deployments/...
-        
-        # Determine if Chat or Completion model based on name (heuristic)
-        # GPT-5 Codex models are actually Chat Com-letion models despite the name
-        is_chat_model = True 
-        
-        operation = "chat/completions" if is_chat_model else "completions"
-        if is_chat_model:
-             # Ensure we don't have double /chat/completions if the user already provided it in base_url (rare but possible)
-             pass
-
-        url = f"{base_url}/deployments/{model}/{operation}?api-version={settings.AZURE_OPENAI_API_VERSION}"
-        
-        headers = {
-            "api-key": settings.AZURE_OPENAI_API_KEY,
-            "Content-Type": "application/json"
-        }
-        
-        if is_chat_model:
-            # Chat Completion payload
-            payload = {
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            # Remove unsupported params for reasoning models if necessary
-            # payload["max_tokens"] = 2000 
-            # payload["temperature"] = 0.7
-        else:
-            # Legacy Completion payload (for Codex models)
-            payload = {
-                "prompt": prompt,
-                "max_tokens": 2000,
-                "temperature": 0.7
-            }
-        
+        url, headers, payload = self._api_request(prompt, model)
         try:
-            logger.info(f"Calling Azure OpenAI API ({operation}): {model} at {base_url}...")
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if is_chat_model:
-                    content = data["choices"][0]["message"]["content"]
-                else:
-                    content = data["choices"][0]["text"]
-                return content, "", 0
-            else:
-                error_msg = f"API Error {response.status_code}: {response.text}"
-                logger.error(error_msg)
-                return "", error_msg, 1
-                
+            logger.info(f"Calling Azure OpenAI API (chat/completions): {model} at {llm_http.azure_base_url}...")
+            response = llm_http.post(url, headers, payload, timeout=self.timeout)
+            return self._parse_api_response(response)[:3]
         except Exception as e:
             logger.exception("Azure OpenAI API Connection Failed")
             return "", str(e), 1
 
+    async def _arun_api_fallback(self, prompt: str, model: str) -> Tuple[str, str, int, Optional[dict]]:
+        """
+        Async direct API call over the pooled keep-alive client.
+        Returns: (content, error, exit_code, provider usage block or None)
+        """
+        if not settings.AZURE_OPENAI_API_KEY or not settings.AZURE_OPENAI_ENDPOINT:
+            return "", "Azure OpenAI credentials not configured.", 1, None
+
+        url, headers, payload = self._api_request(prompt, model)
+        try:
+            logger.info(f"Calling Azure OpenAI API (chat/completions, async): {model} at {llm_http.azure_base_url}...")
+            response = await llm_http.apost(url, headers, payload, timeout=self.timeout)
+            return self._parse_api_response(response)
+        except Exception as e:
+            logger.exception("Azure OpenAI API Connection Failed")
+            return "", str(e), 1, None
+
 codex = CodexConnector()
@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 from pydantic import AnyHttpUrl, validator
 from pydantic_settings import BaseSettings
 
@@ -22,6 +22,41 @@ class Settings(BaseSettings):
     
     # Paths
     CODEX_CLI_PATH: str = "codex" 
+    # Max bytes of Codex stdout retained per run (head and tail are kept, the middle is dropped)
+    CODEX_MAX_OUTPUT_BYTES: int = 16 * 1024 * 1024
+    # Sandbox provider: "auto" probes Docker on first use (cached for SANDBOX_PROBE_TTL), or force "local" / "docker"
+    SANDBOX_PROVIDER: str = "auto"
+    SANDBOX_PROBE_TTL: float = 300.0
+    SANDBOX_PROBE_TIMEOUT: float = 2.0
+    # Per-execution limits by command class ("default" fills missing keys; 0 = unlimited).
+    # Enforced with a transient cgroup v2 leaf when available, else rlimits (memory via RLIMIT_DATA)
+    SANDBOX_CGROUPS: str = "auto"  # auto | off
+    # Delegated cgroup to create execution cgroups under, relative to /sys/fs/cgroup (default: the worker's own)
+    SANDBOX_CGROUP_ROOT: Optional[str] = None
+    SANDBOX_RESOURCE_LIMITS: Dict[str, Dict[str, float]] = {
+        "default": {"cpu_cores": 1, "memory_mb": 1024, "pids": 256, "cpu_seconds": 60, "nofile": 256},
+        # The Codex CLI is bounded by its wall-clock timeout rather than CPU seconds
+        "codex": {"cpu_cores": 2, "memory_mb": 4096, "pids": 512, "cpu_seconds": 0, "nofile": 1024},
+        "verifier": {"cpu_cores": 2, "memory_mb": 2048, "pids": 512, "cpu_seconds": 300, "nofile": 1024},
+        "test": {"cpu_cores": 4, "memory_mb": 4096, "pids": 1024, "cpu_seconds": 900, "nofile": 1024},
+    }
+    # Docker sandbox: warm container pool per job, only the job's directory bind-mounted at the same path
+    SANDBOX_DOCKER_IMAGE: str = "python:3.11-slim"
+    SANDBOX_WORKSPACE_ROOT: str = "workspace"
+    SANDBOX_DOCKER_NETWORK: str = "none"
+    SANDBOX_DOCKER_MEMORY: Optional[str] = "1g"
+    SANDBOX_DOCKER_CPUS: Optional[str] = None
+    SANDBOX_DOCKER_USER: Optional[str] = None  # "uid:gid" inside containers; default the worker's own
+    SANDBOX_POOL_MIN_IDLE: int = 2
+    SANDBOX_POOL_MAX_SIZE: int = 8
+    SANDBOX_CONTAINER_MAX_USES: int = 50
+    SANDBOX_POOL_IDLE_TTL: float = 300.0
+    SANDBOX_CONTAINER_DIRTY_CHECK: bool = True
+    # Command classes that never run in a container: the Codex CLI needs its binary and API egress,
+    # which the sandbox image and network "none" do not have
+    SANDBOX_HOST_COMMAND_CLASSES: List[str] = ["codex"]
+    # Max ensemble candidates running at once per job; extra models wait for a slot
+    ENSEMBLE_MAX_CONCURRENCY: int = 3
     
     # LLM Provider Configuration
     LLM_PROVIDER: str = "azure" # Options: azure, openai
@@ -33,6 +68,172 @@ class Settings(BaseSettings):
     AZURE_OPENAI_API_VERSION: str = "2023-05-15"
     CODEX_MODEL: str = "gpt-4"
 
+    # Latency-tiered routing: tier -> deployment (empty means CODEX_MODEL)
+    MODEL_TIERS: Dict[str, str] = {
+        "large": "",
+        "small": "",
+    }
+    # "node:purpose" or "node" -> tier; short structured-JSON decisions go to the small tier
+    MODEL_ROUTES: Dict[str, str] = {
+        "planner": "large",
+        "coder": "large",
+        "tester": "large",
+        "react:think": "small",
+        "reflection": "small",
+        "completion_check": "small",
+        "advisor": "small",
+    }
+    MODEL_DEFAULT_TIER: str = "large"
+    # Tier retried when a smaller tier's answer fails schema validation
+    MODEL_ESCALATION_TIER: str = "large"
+
+    # LLM HTTP client (API fallback): pooled keep-alive connections with retry on 429/5xx
+    LLM_HTTP_MAX_CONNECTIONS: int = 20
+    LLM_HTTP_MAX_KEEPALIVE: int = 10
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_HTTP_TIMEOUT: float = 300.0
+    LLM_HTTP_MAX_RETRIES: int = 4
+    LLM_HTTP_BACKOFF_BASE: float = 0.5
+    LLM_HTTP_MAX_RETRY_DELAY: float = 60.0
+
+    # LLM response cache (opt-in): read-only calls from these nodes are replayed for TTL seconds
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_TTLS: Dict[str, int] = {
+        "planner": 6 * 3600,
+        "reflection": 3600,
+        "completion_check": 600,
+        "advisor": 7 * 24 * 3600,
+    }
+    LLM_CACHE_MEMORY_MAX_BYTES: int = 64 * 1024 * 1024
+    LLM_CACHE_REDIS_MAX_BYTES: int = 512 * 1024 * 1024
+    LLM_CACHE_MAX_ENTRY_BYTES: int = 4 * 1024 * 1024
+    LLM_CACHE_ZSTD_LEVEL: int = 3
+
+    # Cluster-wide LLM rate limit (Redis token buckets shared by all workers).
+    # Quotas are looked up as "provider:deployment", then "provider", then "*".
+    LLM_RATE_LIMIT_ENABLED: bool = False
+    LLM_RATE_LIMITS: Dict[str, Dict[str, int]] = {
+        "azure": {"rpm": 300, "tpm": 300000},
+        "openai": {"rpm": 500, "tpm": 500000},
+    }
+    # Lower bands are admitted first when calls queue for quota
+    LLM_RATE_LIMIT_PRIORITIES: Dict[str, int] = {
+        "coder": 0,
+        "react": 0,
+        "tester": 1,
+        "planner": 1,
+        "advisor": 2,
+        "reflection": 2,
+        "completion_check": 2,
+    }
+    LLM_RATE_LIMIT_DEFAULT_PRIORITY: int = 1
+    LLM_RATE_LIMIT_BURST_SECONDS: int = 10
+    LLM_RATE_LIMIT_POLL_MS: int = 100
+    LLM_RATE_LIMIT_MAX_WAIT: float = 300.0
+    LLM_RATE_LIMIT_COMPLETION_TOKENS: int = 2048
+    # Worker processes assumed to split the quota while Redis is unreachable
+    LLM_RATE_LIMIT_LOCAL_WORKERS: int = 4
+
+    # Prompt context packing: token budget for the variable sections of each node's prompt
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+        "coder": 8000,
+        "react": 6000,
+        "reflection": 4000,
+        "completion_check": 4000,
+    }
+    CONTEXT_DEFAULT_TOKEN_BUDGET: int = 6000
+    CONTEXT_MAX_DIAGNOSTICS_PER_CLASS: int = 10
+    CONTEXT_OBSERVATION_MAX_TOKENS: int = 1500
+
+    # Knowledge graph: imports parsed across a process pool, index persisted per workspace (.agent_artifacts/cache)
+    KNOWLEDGE_GRAPH_PERSIST: bool = True
+    # 0 uses os.cpu_count(); the pool is only started when at least PARALLEL_MIN_FILES files need parsing
+    KNOWLEDGE_GRAPH_WORKERS: int = 0
+    KNOWLEDGE_GRAPH_PARALLEL_MIN_FILES: int = 256
+    # Impact queries: full dependent closures cached for seeds queried this often (0 entries disables)
+    IMPACT_CLOSURE_HOT_QUERIES: int = 3
+    IMPACT_CLOSURE_CACHE_SIZE: int = 256
+    # Symbol index queries (ReAct navigation): results listed per answer
+    SYMBOL_QUERY_MAX_RESULTS: int = 40
+    # Code search: chunks embedded as hashed identifier n-grams in a memory-mapped faiss index per workspace
+    CODE_SEARCH_ENABLED: bool = True
+    CODE_SEARCH_DIM: int = 512
+    # Longer functions, classes and module-level runs are split into windows of this many lines
+    CODE_SEARCH_CHUNK_LINES: int = 80
+    CODE_SEARCH_TOP_K: int = 5
+    # Hits scoring below this (cosine similarity) are left out as noise
+    CODE_SEARCH_MIN_SCORE: float = 0.05
+    # Source lines shown per hit in prompts and ReAct observations
+    CODE_SEARCH_SNIPPET_LINES: int = 40
+    # Parallel task execution: independent task_graph tasks run their coder/tester loop in separate git worktrees,
+    # this many at a time, and are merged back onto the job branch in dependency order. Experimental: 1 (the default)
+    # keeps the serial scheduler
+    TASK_PARALLEL_WIDTH: int = 1
+    # Verification: tester verifiers run concurrently, each with its own timeout (seconds)
+    VERIFIER_MAX_PARALLEL: int = 3
+    VERIFIER_TIMEOUTS: Dict[str, float] = {
+        "compileall": 120,
+        "ruff": 120,
+        "mypy": 600,
+        "pip_check": 60,
+        "bandit": 300,
+    }
+    VERIFIER_DEFAULT_TIMEOUT: float = 300
+    # Incremental verification: check files changed since the job's base commit plus their importers
+    VERIFY_INCREMENTAL: bool = True
+    VERIFY_SCOPE_MAX_FILES: int = 500
+    # A change to any of these (basename patterns) forces a full-repository run
+    VERIFY_FULL_RUN_FILES: List[str] = [
+        "pyproject.toml", "setup.cfg", "setup.py", "tox.ini", "ruff.toml", ".ruff.toml",
+        "mypy.ini", ".mypy.ini", ".bandit", "requirements*.txt", "constraints*.txt",
+    ]
+    # Per-file ruff / bandit / compileall results cached per workspace (.agent_artifacts/cache)
+    VERIFY_CACHE_ENABLED: bool = True
+    VERIFY_CACHE_MAX_ENTRIES: int = 100000
+    VERIFY_CACHE_TTL_DAYS: float = 14
+    # Fail-fast: a failure in one of these error classes cancels the remaining verifiers
+    VERIFIER_FAIL_FAST: bool = False
+    VERIFIER_FAIL_FAST_CLASSES: List[str] = ["SYNTAX_ERROR"]
+    # Test stage: pytest on the tests a per-test coverage map selects; the full suite only at the pre-commit gate
+    TEST_STAGE_ENABLED: bool = True
+    TEST_SELECTION: bool = True
+    TEST_SELECTION_MAX_TARGETS: int = 2000
+    TEST_TIMEOUT: float = 1800
+    # pytest -n workers; 0 uses the "test" resource class's cpu_cores
+    TEST_MAX_WORKERS: int = 0
+    TEST_MAX_FAILURES_REPORTED: int = 10
+    # The only worker variables the suite under test sees (never API keys or REDIS_URL)
+    TEST_ENV_ALLOWLIST: List[str] = ["PATH", "HOME", "LANG", "PYTHONPATH"]
+    # Warm type checkers (dmypy for the tester, pyright-langserver for LSPTool), one per workspace
+    TYPE_DAEMONS_ENABLED: bool = True
+    TYPE_DAEMON_IDLE_TIMEOUT: float = 600
+    TYPE_DAEMON_START_TIMEOUT: float = 60
+    # Limits across all live daemons on a worker; least recently used daemons are stopped beyond them
+    TYPE_DAEMON_MAX_TOTAL_MB: int = 3072
+    TYPE_DAEMON_MAX_LIVE: int = 8
+    # Auto-fix before an LLM retry: ruff --fix / ruff format, and installing known missing packages
+    AUTOFIX_ENABLED: bool = True
+    AUTOFIX_RUFF: bool = True
+    # Opt-in: installs what model-edited code imports (into the workspace venv)
+    AUTOFIX_INSTALL_PACKAGES: bool = False
+    AUTOFIX_INSTALL_TIMEOUT: float = 300
+    # Import name -> distribution; only these are installed for a missing import
+    AUTOFIX_PACKAGES: Dict[str, str] = {
+        "yaml": "PyYAML", "PIL": "Pillow", "cv2": "opencv-python", "sklearn": "scikit-learn",
+        "bs4": "beautifulsoup4", "dateutil": "python-dateutil", "dotenv": "python-dotenv", "jwt": "PyJWT",
+        "Crypto": "pycryptodome", "OpenSSL": "pyOpenSSL", "magic": "python-magic", "docx": "python-docx",
+        "pptx": "python-pptx", "serial": "pyserial", "usb": "pyusb", "gi": "PyGObject", "zmq": "pyzmq",
+        "requests": "requests", "numpy": "numpy", "pandas": "pandas", "toml": "toml", "attr": "attrs",
+        "attrs": "attrs", "six": "six", "tabulate": "tabulate", "pytz": "pytz", "click": "click",
+    }
+    # Import name -> stub distribution, for mypy's "Library stubs not installed"
+    AUTOFIX_STUB_PACKAGES: Dict[str, str] = {
+        "yaml": "types-PyYAML", "requests": "types-requests", "dateutil": "types-python-dateutil",
+        "six": "types-six", "toml": "types-toml", "pytz": "types-pytz", "tabulate": "types-tabulate",
+        "setuptools": "types-setuptools", "docutils": "types-docutils", "simplejson": "types-simplejson",
+        "cachetools": "types-cachetools", "psutil": "types-psutil", "ujson": "types-ujson", "markdown": "types-Markdown",
+    }
+
     # Security
     API_KEY: str = "changeme"
     
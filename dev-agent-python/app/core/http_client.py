@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httpx
+from app.core.config import settings
+from app.core.metrics import CounterWindows
+
+try:
+    import h2  # noqa: F401 - HTTP/2 support for httpx
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PoolStats:
+    """
+    Connection-pool counters for the LLM HTTP client.
+    """
+    def __init__(self):
+        self.counters = CounterWindows(
+            {"requests": 0, "new_connections": 0, "reused_connections": 0, "retries": 0, "queue_time_total": 0.0, "queue_time_max": 0.0},
+            peaks=("queue_time_max",)
+        )
+
+    def record(self, trace: "_RequestTrace"):
+        queue_time = trace.queue_time
+        self.counters.add(
+            "pool", requests=1, new_connections=int(trace.new_connection), reused_connections=int(not trace.new_connection),
+            queue_time_total=queue_time, queue_time_max=queue_time
+        )
+
+    def record_retry(self):
+        self.counters.add("pool", retries=1)
+
+    def snapshot(self, window: Optional[str] = None) -> Dict:
+        """
+        Lifetime counters, or those of a job's window.
+        """
+        e = self.counters.entry("pool", window)
+        requests = e["requests"]
+        return {
+            "requests": int(requests),
+            "new_connections": int(e["new_connections"]),
+            "reused_connections": int(e["reused_connections"]),
+            "reuse_rate": round(e["reused_connections"] / requests, 3) if requests else 0.0,
+            "retries": int(e["retries"]),
+            "avg_queue_ms": round(e["queue_time_total"] / requests * 1000, 2) if requests else 0.0,
+            "max_queue_ms": round(e["queue_time_max"] * 1000, 2),
+        }
+
+
+class _RequestTrace:
+    """
+    httpcore trace hook for a single request.
+    A request that opens a TCP connection did not reuse a pooled one; time spent
+    before the request headers go out, minus connection setup, is pool queueing.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.new_connection = False
+        self._connect_started: Optional[float] = None
+        self._connect_finished: Optional[float] = None
+        self._headers_started: Optional[float] = None
+
+    def _on_event(self, name: str):
+        now = time.perf_counter()
+        if name in ("connection.connect_tcp.started", "connection.connect_unix_socket.started"):
+            self.new_connection = True
+            self._connect_started = now
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self._connect_finished = now
+        elif name.endswith("send_request_headers.started") and self._headers_started is None:
+            self._headers_started = now
+
+    def sync_hook(self, name: str, info: dict):
+        self._on_event(name)
+
+    async def async_hook(self, name: str, info: dict):
+        self._on_event(name)
+
+    @property
+    def queue_time(self) -> float:
+        if self._headers_started is None:
+            return 0.0
+        waited = self._headers_started - self.started
+        if self._connect_started is not None and self._connect_finished is not None:
+            waited -= self._connect_finished - self._connect_started
+        return max(0.0, waited)
+
+
+class LLMHttpClient:
+    """
+    Shared keep-alive HTTP client for direct LLM API calls.
+    One pooled httpx.AsyncClient per event loop (Celery runs each job in its own
+    asyncio.run loop) plus one sync client, with jittered retries on 429/5xx.
+    """
+    def __init__(self):
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, str] = {}
+        self._azure_base_url: Optional[str] = None
+        self.stats = PoolStats()
+
+    # --- Endpoints ---
+
+    def azure_chat_url(self, deployment: str) -> str:
+        """
+        Chat-completions URL for an Azure deployment, computed once per deployment.
+        URL format: https://{resource}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version={api-version}
+        """
+        url = self._endpoints.get(deployment)
+        if url is None:
+            url = f"{self.azure_base_url}/deployments/{deployment}/chat/completions?api-version={settings.AZURE_OPENAI_API_VERSION}"
+            self._endpoints[deployment] = url
+        return url
+
+    @property
+    def azure_base_url(self) -> str:
+        if self._azure_base_url is None:
+            # Users paste either the resource root, .../openai or .../openai/v1
+            base_url = settings.AZURE_OPENAI_ENDPOINT.rstrip("/")
+            if base_url.endswith("/v1"):
+                base_url = base_url[:-3]
+            if "/openai" not in base_url:
+                base_url = f"{base_url}/openai"
+            self._azure_base_url = base_url
+        return self._azure_base_url
+
+    # --- Clients ---
+
+    def _client_kwargs(self) -> Dict:
+        return {
+            "http2": HAS_HTTP2,
+            "limits": httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            "timeout": httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=10.0),
+        }
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(**self._client_kwargs())
+            self._async_clients[loop] = client
+            logger.debug(f"HTTP POOL: Created async client (http2={HAS_HTTP2}).")
+        return client
+
+    def get_sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None or self._sync_client.is_closed:
+                self._sync_client = httpx.Client(**self._client_kwargs())
+            return self._sync_client
+
+    async def aclose(self):
+        """
+        Closes the client bound to the running loop (call before the loop shuts down).
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    # --- Requests ---
+
+    async def apost(self, url: str, headers: Dict, payload: Dict, timeout: Optional[float] = None) -> httpx.Response:
+        """
+        POSTs JSON through the pooled async client, retrying 429/5xx and transport errors.
+        """
+        client = self.get_async_client()
+        attempt = 0
+        while True:
+            trace = _RequestTrace()
+            try:
+                response = await client.post(
+                    url, headers=headers, json=payload,
+                    timeout=timeout or httpx.USE_CLIENT_DEFAULT,
+                    extensions={"trace": trace.async_hook}
+                )
+            except httpx.TransportError as e:
+                if attempt >= settings.LLM_HTTP_MAX_RETRIES:
+                    raise
+                delay = self._retry_delay(None, attempt)
+                logger.warning(f"HTTP POOL: {type(e).__name__} on attempt {attempt + 1}, retrying in {delay:.2f}s")
+            else:
+                self.stats.record(trace)
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= settings.LLM_HTTP_MAX_RETRIES:
+                    return response
+                delay = self._retry_delay(response, attempt)
+                logger.warning(f"HTTP POOL: {response.status_code} on attempt {attempt + 1}, retrying in {delay:.2f}s")
+            self.stats.record_retry()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def post(self, url: str, headers: Dict, payload: Dict, timeout: Optional[float] = None) -> httpx.Response:
+        """
+        Blocking counterpart of apost for sync callers.
+        """
+        client = self.get_sync_client()
+        attempt = 0
+        while True:
+            trace = _RequestTrace()
+            try:
+                response = client.post(
+                    url, headers=headers, json=payload,
+                    timeout=timeout or httpx.USE_CLIENT_DEFAULT,
+                    extensions={"trace": trace.sync_hook}
+                )
+            except httpx.TransportError as e:
+                if attempt >= settings.LLM_HTTP_MAX_RETRIES:
+                    raise
+                delay = self._retry_delay(None, attempt)
+                logger.warning(f"HTTP POOL: {type(e).__name__} on attempt {attempt + 1}, retrying in {delay:.2f}s")
+            else:
+                self.stats.record(trace)
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= settings.LLM_HTTP_MAX_RETRIES:
+                    return response
+                delay = self._retry_delay(response, attempt)
+                logger.warning(f"HTTP POOL: {response.status_code} on attempt {attempt + 1}, retrying in {delay:.2f}s")
+            self.stats.record_retry()
+            attempt += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+        """
+        Full-jitter exponential backoff, never shorter than the server's Retry-After.
+        """
+        cap = settings.LLM_HTTP_MAX_RETRY_DELAY
+        backoff = random.uniform(0, min(cap, settings.LLM_HTTP_BACKOFF_BASE * (2 ** attempt)))
+        retry_after = LLMHttpClient._parse_retry_after(response) if response is not None else None
+        if retry_after is None:
+            return backoff
+        # Spread clients that were all told the same Retry-After
+        return min(cap, retry_after + random.uniform(0, settings.LLM_HTTP_BACKOFF_BASE))
+
+    @staticmethod
+    def _parse_retry_after(response: httpx.Response) -> Optional[float]:
+        # Azure sends retry-after-ms; the standard header is seconds or an HTTP date
+        value = response.headers.get("retry-after-ms")
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+llm_http = LLMHttpClient()
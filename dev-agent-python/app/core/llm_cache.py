@@ -0,0 +1,254 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import redis
+import xxhash
+import zstandard
+from app.core.config import settings
+from app.core.metrics import CounterWindows
+
+logger = logging.getLogger(__name__)
+
+# Sandbox modes that let the model touch the workspace; their output is never replayed
+WRITE_SANDBOXES = {"workspace-write", "danger-full-access"}
+# Directories skipped when fingerprinting a workspace that is not a git repo
+_IGNORED_DIRS = {".git", ".agent_artifacts", "node_modules", "__pycache__", ".venv", "venv"}
+_REDIS_RETRY_SECONDS = 30
+# Store: the byte total moves by the size difference, so overwriting a key does not inflate it
+# KEYS: entry, index, sizes, total; ARGV: blob, ttl, written at, blob size
+_STORE_SCRIPT = """
+local previous = tonumber(redis.call('HGET', KEYS[3], KEYS[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('HSET', KEYS[3], KEYS[1], ARGV[4])
+return redis.call('INCRBY', KEYS[4], tonumber(ARGV[4]) - previous)
+"""
+# Evict: pops the oldest entries and subtracts their recorded sizes; an empty index resets the accounting
+# KEYS: index, sizes, total; ARGV: batch size. Returns {entries evicted, new total}
+_EVICT_SCRIPT = """
+local oldest = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+if #oldest == 0 then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    return {0, 0}
+end
+local freed = 0
+for i = 1, #oldest, 2 do
+    freed = freed + tonumber(redis.call('HGET', KEYS[2], oldest[i]) or '0')
+    redis.call('DEL', oldest[i])
+    redis.call('HDEL', KEYS[2], oldest[i])
+end
+return {#oldest / 2, redis.call('DECRBY', KEYS[3], freed)}
+"""
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for read-only LLM calls.
+    Tier 1 is an in-process LRU bounded by bytes; tier 2 is Redis with
+    zstd-compressed values, per-node TTLs and a byte budget enforced by
+    evicting the least recently written entries.
+    """
+    KEY_PREFIX = "llmcache:"
+    INDEX_KEY = "llmcache:index"
+    SIZES_KEY = "llmcache:sizes"
+    TOTAL_KEY = "llmcache:bytes"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._redis: Optional[redis.Redis] = None
+        self._store_script = None
+        self._evict_script = None
+        self._redis_down_until = 0.0
+        self._compressor = zstandard.ZstdCompressor(level=settings.LLM_CACHE_ZSTD_LEVEL)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self.counters = CounterWindows({
+            "memory_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "skipped_write": 0,
+        })
+
+    # --- Keys ---
+
+    def ttl_for(self, node: Optional[str], sandbox: str) -> Optional[int]:
+        """
+        Returns the TTL for a call, or None when the call must not be cached.
+        Caching is opt-in per node via LLM_CACHE_TTLS.
+        """
+        if not settings.LLM_CACHE_ENABLED or not node:
+            return None
+        if sandbox in WRITE_SANDBOXES:
+            self._count("skipped_write")
+            return None
+        return settings.LLM_CACHE_TTLS.get(node)
+
+    def make_key(self, model: str, sandbox: str, prompt: str, cwd: Optional[str] = None) -> str:
+        h = xxhash.xxh3_128()
+        for part in (model, sandbox, self.workspace_fingerprint(cwd) if cwd else "", prompt):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return self.KEY_PREFIX + h.hexdigest()
+
+    @staticmethod
+    def workspace_fingerprint(cwd: str) -> str:
+        """
+        Hashes the state of the workspace the model can read.
+        Git repos: HEAD tree plus the size/mtime of every dirty or untracked path.
+        Otherwise: size/mtime of every file under cwd.
+        """
+        h = xxhash.xxh3_64()
+        # .git is a file in worktrees
+        if os.path.exists(os.path.join(cwd, ".git")):
+            try:
+                tree = subprocess.run(
+                    ["git", "rev-parse", "HEAD^{tree}"],
+                    cwd=cwd, capture_output=True, text=True, timeout=10
+                ).stdout.strip()
+                status = subprocess.run(
+                    ["git", "status", "--porcelain=v1", "-z", "--untracked-files=all"],
+                    cwd=cwd, capture_output=True, text=True, timeout=30
+                ).stdout
+                h.update(tree.encode())
+                for entry in filter(None, status.split("\0")):
+                    path = os.path.join(cwd, entry[3:])
+                    h.update(entry.encode("utf-8", errors="replace"))
+                    try:
+                        st = os.stat(path)
+                        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+                    except OSError:
+                        pass
+                return h.hexdigest()
+            except Exception as e:
+                logger.debug(f"LLM CACHE: git fingerprint failed for {cwd}: {e}")
+
+        for root, dirs, files in os.walk(cwd):
+            dirs[:] = sorted(d for d in dirs if d not in _IGNORED_DIRS)
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                h.update(f"{os.path.relpath(path, cwd)}:{st.st_size}:{st.st_mtime_ns}\n".encode("utf-8", errors="replace"))
+        return h.hexdigest()
+
+    # --- Lookup / Store ---
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count("memory_hits")
+                    return value
+                self._drop_memory(key)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline()
+                pipe.get(key)
+                pipe.ttl(key)
+                blob, ttl = pipe.execute()
+                if blob is not None:
+                    value = self._decompressor.decompress(blob).decode("utf-8")
+                    self._put_memory(key, value, max(ttl, 1))
+                    self._count("redis_hits")
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str, ttl: int):
+        size = len(value.encode("utf-8"))
+        if size > settings.LLM_CACHE_MAX_ENTRY_BYTES:
+            return
+        self._put_memory(key, value, ttl)
+        self._count("stores")
+
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            blob = self._compressor.compress(value.encode("utf-8"))
+            total = self._store_script(
+                keys=[key, self.INDEX_KEY, self.SIZES_KEY, self.TOTAL_KEY], args=[blob, ttl, time.time(), len(blob)]
+            )
+            if total > settings.LLM_CACHE_REDIS_MAX_BYTES:
+                self._evict_redis(client, total)
+        except Exception as e:
+            self._redis_failed(e)
+
+    def stats(self, window: Optional[str] = None) -> Dict:
+        """
+        Lifetime counters, or those of a job's window; the memory tier's size is current.
+        """
+        counters = {name: int(value) for name, value in self.counters.entry("cache", window).items()}
+        with self._lock:
+            counters["memory_entries"] = len(self._memory)
+            counters["memory_bytes"] = self._memory_bytes
+        lookups = counters["memory_hits"] + counters["redis_hits"] + counters["misses"]
+        counters["hit_rate"] = round((lookups - counters["misses"]) / lookups, 3) if lookups else 0.0
+        return counters
+
+    # --- Internals ---
+
+    def _count(self, name: str, n: int = 1):
+        self.counters.add("cache", **{name: n})
+
+    def _put_memory(self, key: str, value: str, ttl: int):
+        size = len(value)
+        with self._lock:
+            if key in self._memory:
+                self._drop_memory(key)
+            self._memory[key] = (value, time.time() + ttl, size)
+            self._memory_bytes += size
+            while self._memory_bytes > settings.LLM_CACHE_MEMORY_MAX_BYTES and len(self._memory) > 1:
+                oldest = next(iter(self._memory))
+                self._drop_memory(oldest)
+                self._count("evictions")
+
+    def _drop_memory(self, key: str):
+        _, _, size = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    def _evict_redis(self, client: redis.Redis, total: int):
+        """
+        Drops the oldest entries until the Redis tier fits its byte budget again.
+        An empty index with bytes still recorded resets the total.
+        """
+        target = int(settings.LLM_CACHE_REDIS_MAX_BYTES * 0.9)
+        while total > target:
+            evicted, total = self._evict_script(keys=[self.INDEX_KEY, self.SIZES_KEY, self.TOTAL_KEY], args=[8], client=client)
+            if not evicted:
+                break
+            self._count("evictions", evicted)
+
+    def _get_redis(self) -> Optional[redis.Redis]:
+        if time.time() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.from_url(settings.REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._store_script = self._redis.register_script(_STORE_SCRIPT)
+            self._evict_script = self._redis.register_script(_EVICT_SCRIPT)
+        return self._redis
+
+    def _redis_failed(self, error: Exception):
+        logger.warning(f"LLM CACHE: Redis tier unavailable, using memory tier only for {_REDIS_RETRY_SECONDS}s: {error}")
+        self._redis_down_until = time.time() + _REDIS_RETRY_SECONDS
+
+llm_cache = ResponseCache()
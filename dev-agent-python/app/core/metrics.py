@@ -0,0 +1,106 @@
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Usage fields summed across executions; the rest are maxima
+_SUMMED = ("cpu_usec", "user_usec", "system_usec", "io_read_bytes", "io_write_bytes", "oom_kills", "throttled_usec")
+_PEAK = ("memory_peak_bytes", "pids_peak")
+
+
+class JobResourceMetrics:
+    """
+    Sandbox resource usage per job and command class (codex, verifier, ...),
+    reported with the job's final metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def record(self, job_id: str, command_class: str, usage: Dict[str, int], wall_time: float = 0.0, timed_out: bool = False):
+        with self._lock:
+            classes = self._jobs.setdefault(job_id, {})
+            e = classes.setdefault(command_class, {"executions": 0, "timeouts": 0, "wall_time_s": 0.0, **{k: 0 for k in _SUMMED + _PEAK}})
+            e["executions"] += 1
+            e["wall_time_s"] += wall_time
+            if timed_out:
+                e["timeouts"] += 1
+            for key in _SUMMED:
+                e[key] += usage.get(key, 0)
+            for key in _PEAK:
+                e[key] = max(e[key], usage.get(key, 0))
+
+    def snapshot(self, job_id: str) -> Dict[str, Dict]:
+        with self._lock:
+            classes = self._jobs.get(job_id, {})
+            return {
+                command_class: {
+                    "executions": int(e["executions"]),
+                    "timeouts": int(e["timeouts"]),
+                    "wall_time_s": round(e["wall_time_s"], 2),
+                    "cpu_time_s": round(e["cpu_usec"] / 1e6, 2),
+                    "cpu_throttled_s": round(e["throttled_usec"] / 1e6, 2),
+                    "memory_peak_mb": round(e["memory_peak_bytes"] / (1024 * 1024), 1),
+                    "io_read_mb": round(e["io_read_bytes"] / (1024 * 1024), 1),
+                    "io_write_mb": round(e["io_write_bytes"] / (1024 * 1024), 1),
+                    "pids_peak": int(e["pids_peak"]),
+                    "oom_kills": int(e["oom_kills"]),
+                }
+                for command_class, e in classes.items()
+            }
+
+    def pop(self, job_id: str) -> Dict[str, Dict]:
+        """
+        Returns the job's snapshot and forgets it.
+        """
+        snapshot = self.snapshot(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        return snapshot
+
+job_metrics = JobResourceMetrics()
+
+
+class CounterWindows:
+    """
+    Counters per key (a model, a tier, a node...) over the process lifetime,
+    and the same counters for every open window. A job opens a window when it
+    starts, so its final metrics cover its own run rather than everything the
+    worker did before it. Fields in `peaks` keep the maximum instead of the sum.
+    """
+    def __init__(self, fields: Dict[str, float], peaks: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._fields = fields
+        self._peaks = frozenset(peaks)
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._windows: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def add(self, key: str, **values: float):
+        with self._lock:
+            for entries in (self._totals, *self._windows.values()):
+                e = entries.setdefault(key, dict(self._fields))
+                for name, value in values.items():
+                    e[name] = max(e[name], value) if name in self._peaks else e[name] + value
+
+    def entries(self, window: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """
+        A copy of the lifetime counters, or of the window's when one is given.
+        """
+        with self._lock:
+            entries = self._totals if window is None else self._windows.get(window, {})
+            return {key: dict(e) for key, e in entries.items()}
+
+    def entry(self, key: str, window: Optional[str] = None) -> Dict[str, float]:
+        """
+        One key's counters, zero when nothing was recorded for it.
+        """
+        return self.entries(window).get(key) or dict(self._fields)
+
+    def open(self, window: str):
+        with self._lock:
+            self._windows[window] = {}
+
+    def close(self, window: str):
+        with self._lock:
+            self._windows.pop(window, None)
@@ -0,0 +1,439 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+import redis
+from app.core.config import settings
+from app.core.metrics import CounterWindows
+
+logger = logging.getLogger(__name__)
+
+_REDIS_RETRY_SECONDS = 30
+
+# Atomically: enqueue the ticket (once), drop abandoned tickets at the head, and if the
+# ticket is at the head and both buckets can cover it, consume and dequeue it.
+# Queue score: priority band, then the job's virtual slot, then arrival order. Each new
+# ticket takes its job's next slot (never behind the slot last granted), so jobs with
+# calls queued are served round-robin instead of first-come-first-served.
+# Returns 0 when granted, otherwise the suggested wait in milliseconds.
+_ACQUIRE_LUA = """
+local req_key, tok_key, queue_key, beats_key, slots_key, seq_key, vtime_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7]
+local ticket, job, band = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local rpm, tpm, cost = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local burst_ms, lease_ms, poll_ms = tonumber(ARGV[7]), tonumber(ARGV[8]), tonumber(ARGV[9])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local score = redis.call('ZSCORE', queue_key, ticket)
+if not score then
+  local vtime = tonumber(redis.call('GET', vtime_key) or '0')
+  local slot = math.max(tonumber(redis.call('HGET', slots_key, job) or '0'), vtime) + 1
+  redis.call('HSET', slots_key, job, slot)
+  local seq = redis.call('INCR', seq_key)
+  score = band * 1e12 + (slot % 1e6) * 1e6 + (seq % 1e6)
+  redis.call('ZADD', queue_key, score, ticket)
+end
+redis.call('HSET', beats_key, ticket, now + lease_ms)
+redis.call('PEXPIRE', queue_key, 3600000)
+redis.call('PEXPIRE', beats_key, 3600000)
+
+local head = redis.call('ZRANGE', queue_key, 0, 0)[1]
+while head and head ~= ticket do
+  local lease = tonumber(redis.call('HGET', beats_key, head) or '0')
+  if lease >= now then
+    return poll_ms
+  end
+  redis.call('ZREM', queue_key, head)
+  redis.call('HDEL', beats_key, head)
+  head = redis.call('ZRANGE', queue_key, 0, 0)[1]
+end
+
+local function refill(key, per_minute)
+  local rate = per_minute / 60000
+  local capacity = math.max(rate * burst_ms, 1)
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local level = tonumber(state[1]) or capacity
+  local ts = tonumber(state[2]) or now
+  level = math.min(capacity, level + math.max(0, now - ts) * rate)
+  return level, rate, capacity
+end
+
+local wait = 0
+local req_level, req_rate, tok_level, tok_rate
+if rpm > 0 then
+  req_level, req_rate = refill(req_key, rpm)
+  if req_level < 1 then wait = math.max(wait, (1 - req_level) / req_rate) end
+end
+if tpm > 0 then
+  local capacity
+  tok_level, tok_rate, capacity = refill(tok_key, tpm)
+  cost = math.min(cost, capacity)
+  if tok_level < cost then wait = math.max(wait, (cost - tok_level) / tok_rate) end
+end
+if wait > 0 then
+  return math.max(1, math.ceil(wait))
+end
+
+if rpm > 0 then
+  redis.call('HSET', req_key, 'tokens', req_level - 1, 'ts', now)
+  redis.call('PEXPIRE', req_key, 120000)
+end
+if tpm > 0 then
+  redis.call('HSET', tok_key, 'tokens', tok_level - cost, 'ts', now)
+  redis.call('PEXPIRE', tok_key, 120000)
+end
+redis.call('ZREM', queue_key, ticket)
+redis.call('HDEL', beats_key, ticket)
+redis.call('SET', vtime_key, math.floor((tonumber(score) % 1e12) / 1e6), 'PX', 3600000)
+redis.call('PEXPIRE', slots_key, 3600000)
+return 0
+"""
+
+# Corrects the token bucket once the real usage of a granted call is known
+_SETTLE_LUA = """
+local tok_key = KEYS[1]
+local tpm, delta, burst_ms = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local level = tonumber(redis.call('HGET', tok_key, 'tokens'))
+if not level then return 0 end
+local capacity = math.max(tpm / 60000 * burst_ms, 1)
+redis.call('HSET', tok_key, 'tokens', math.min(capacity, level + delta))
+return 1
+"""
+
+_RELEASE_LUA = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class RateLimitGrant:
+    """
+    Receipt for one admitted LLM call; pass it to RateLimiter.settle once the real usage is known.
+    """
+    def __init__(self, limit_key: str, tpm: int, estimated_tokens: int, waited: float):
+        self.limit_key = limit_key
+        self.tpm = tpm
+        self.estimated_tokens = estimated_tokens
+        self.waited = waited
+
+
+class RateLimitStats:
+    """
+    Wait-time counters per limit key and per priority band.
+    """
+    def __init__(self):
+        self.counters = CounterWindows(
+            {"grants": 0, "throttled": 0, "local": 0, "wait_total": 0.0, "wait_max": 0.0},
+            peaks=("wait_max",),
+        )
+
+    def record(self, limit_key: str, band: int, waited: float, throttled: bool, local: bool):
+        for key in (limit_key, f"band:{band}"):
+            self.counters.add(
+                key,
+                grants=1,
+                throttled=1 if throttled else 0,
+                local=1 if local else 0,
+                wait_total=waited,
+                wait_max=waited,
+            )
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Dict]:
+        return {
+            key: {
+                "grants": int(e["grants"]),
+                "throttled": int(e["throttled"]),
+                "local_fallback": int(e["local"]),
+                "avg_wait_ms": round(e["wait_total"] / e["grants"] * 1000, 1) if e["grants"] else 0.0,
+                "max_wait_ms": round(e["wait_max"] * 1000, 1),
+            }
+            for key, e in self.counters.entries(window).items()
+        }
+
+
+class _LocalBucket:
+    """
+    In-process RPM/TPM bucket used while Redis is unreachable.
+    Each worker process assumes an equal share of the quota.
+    """
+    def __init__(self, rpm: int, tpm: int):
+        share = max(settings.LLM_RATE_LIMIT_LOCAL_WORKERS, 1)
+        burst = settings.LLM_RATE_LIMIT_BURST_SECONDS
+        self.req_rate = rpm / share / 60.0
+        self.tok_rate = tpm / share / 60.0
+        self.req_capacity = max(self.req_rate * burst, 1.0)
+        self.tok_capacity = max(self.tok_rate * burst, 1.0)
+        self.req_level = self.req_capacity
+        self.tok_level = self.tok_capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, cost: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            elapsed, self.ts = now - self.ts, now
+            self.req_level = min(self.req_capacity, self.req_level + elapsed * self.req_rate)
+            self.tok_level = min(self.tok_capacity, self.tok_level + elapsed * self.tok_rate)
+            cost = min(cost, self.tok_capacity)
+            wait = 0.0
+            if self.req_rate and self.req_level < 1:
+                wait = max(wait, (1 - self.req_level) / self.req_rate)
+            if self.tok_rate and self.tok_level < cost:
+                wait = max(wait, (cost - self.tok_level) / self.tok_rate)
+            if wait > 0:
+                return wait
+            if self.req_rate:
+                self.req_level -= 1
+            if self.tok_rate:
+                self.tok_level -= cost
+            return 0.0
+
+    def settle(self, delta: int):
+        with self.lock:
+            if self.tok_rate:
+                self.tok_level = min(self.tok_capacity, self.tok_level + delta)
+
+
+class RateLimiter:
+    """
+    Cluster-wide token-bucket limiter for LLM calls, shared by every Celery worker through Redis.
+    Buckets are keyed by provider and deployment and enforce both requests and
+    tokens per minute. Callers queue in a Redis sorted set ordered by priority
+    band, then round-robin across jobs, so jobs share the quota fairly and
+    coder calls overtake reflection/checks.
+    Falls back to a per-process bucket when Redis is down.
+    """
+    KEY_PREFIX = "ratelimit:"
+
+    def __init__(self):
+        self._redis: Optional[redis.Redis] = None
+        self._redis_down_until = 0.0
+        self._acquire_script = None
+        self._settle_script = None
+        self._release_script = None
+        self._local: Dict[str, _LocalBucket] = {}
+        self._local_lock = threading.Lock()
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tickets = itertools.count()
+        self.stats = RateLimitStats()
+
+    # --- Configuration ---
+
+    @staticmethod
+    def limits_for(provider: str, deployment: str) -> Optional[Tuple[str, int, int]]:
+        """
+        Returns (limit_key, rpm, tpm) for a deployment, or None when it is not limited.
+        Looks up "provider:deployment", then "provider", then "*" in LLM_RATE_LIMITS.
+        """
+        if not settings.LLM_RATE_LIMIT_ENABLED:
+            return None
+        for key in (f"{provider}:{deployment}", provider, "*"):
+            quota = settings.LLM_RATE_LIMITS.get(key)
+            if quota:
+                return f"{provider}:{deployment}", int(quota.get("rpm", 0)), int(quota.get("tpm", 0))
+        return None
+
+    @staticmethod
+    def priority_for(node: Optional[str]) -> int:
+        return settings.LLM_RATE_LIMIT_PRIORITIES.get(node or "", settings.LLM_RATE_LIMIT_DEFAULT_PRIORITY)
+
+    # --- Acquire ---
+
+    async def acquire(
+        self,
+        provider: str,
+        deployment: str,
+        tokens: int,
+        node: Optional[str] = None,
+        job_id: Optional[str] = None
+    ) -> Optional[RateLimitGrant]:
+        """
+        Waits until the call fits the deployment's RPM/TPM budget.
+        Returns None when the deployment has no configured limit.
+        """
+        limits = self.limits_for(provider, deployment)
+        if limits is None:
+            return None
+        attempt = self._attempt(limits, tokens, node, job_id)
+        step = None
+        grant = None
+        try:
+            while True:
+                # Each step is a Redis round-trip; it runs off the event loop
+                step = asyncio.ensure_future(asyncio.to_thread(self._advance, attempt))
+                wait, grant = await asyncio.shield(step)
+                if wait is None:
+                    return grant
+                await asyncio.sleep(wait)
+        finally:
+            if grant is None:
+                if step is not None and not step.done():
+                    # Cancelled mid-step: the generator is still running in its thread
+                    await asyncio.wait([step])
+                # Releases the queued ticket
+                await asyncio.to_thread(attempt.close)
+
+    def acquire_blocking(
+        self,
+        provider: str,
+        deployment: str,
+        tokens: int,
+        node: Optional[str] = None,
+        job_id: Optional[str] = None
+    ) -> Optional[RateLimitGrant]:
+        """
+        Blocking counterpart of acquire for sync callers.
+        """
+        limits = self.limits_for(provider, deployment)
+        if limits is None:
+            return None
+        attempt = self._attempt(limits, tokens, node, job_id)
+        try:
+            wait = next(attempt)
+            while wait:
+                time.sleep(wait)
+                wait = attempt.send(None)
+        except StopIteration as done:
+            return done.value
+        finally:
+            attempt.close()
+
+    @staticmethod
+    def _advance(attempt) -> Tuple[Optional[float], Optional[RateLimitGrant]]:
+        """
+        Runs an _attempt generator to its next sleep: (seconds, None), or (None, grant) when done.
+        """
+        try:
+            return attempt.send(None), None
+        except StopIteration as done:
+            return None, done.value
+
+    def _attempt(self, limits: Tuple[str, int, int], tokens: int, node: Optional[str], job_id: Optional[str]):
+        """
+        Generator driving one acquisition: yields seconds to sleep, returns the grant.
+        Shared by the async and blocking front-ends. If abandoned (e.g. the caller
+        is cancelled) the queued ticket is released.
+        """
+        limit_key, rpm, tpm = limits
+        band = self.priority_for(node)
+        ticket = f"{self._worker_id}:{next(self._tickets)}"
+        started = time.monotonic()
+        deadline = started + settings.LLM_RATE_LIMIT_MAX_WAIT
+        granted = False
+        throttled = False
+        queued = False
+        local = False
+        try:
+            while True:
+                wait = None
+                client = self._get_redis()
+                if client is not None:
+                    try:
+                        wait = self._redis_try_acquire(client, limit_key, ticket, job_id or "unknown", band, rpm, tpm, tokens)
+                        queued = True
+                        local = False
+                    except Exception as e:
+                        self._redis_failed(e)
+                if wait is None:
+                    wait = self._local_bucket(limit_key, rpm, tpm).try_acquire(tokens)
+                    local = True
+                if wait <= 0:
+                    granted = True
+                    break
+                if time.monotonic() + wait > deadline:
+                    logger.warning(f"RATE LIMIT: Waited {time.monotonic() - started:.1f}s for {limit_key}; proceeding over quota.")
+                    break
+                throttled = True
+                # Jitter so queued workers do not poll in lockstep
+                yield wait * random.uniform(1.0, 1.2)
+        finally:
+            if queued and not granted:
+                self._release(limit_key, ticket)
+
+        waited = time.monotonic() - started
+        self.stats.record(limit_key, band, waited, throttled, local)
+        if waited > 1.0:
+            logger.info(f"RATE LIMIT: {node or 'call'} waited {waited:.1f}s for {limit_key} (band {band}).")
+        return RateLimitGrant(limit_key, tpm, tokens, waited)
+
+    # --- Settle ---
+
+    def settle(self, grant: Optional[RateLimitGrant], actual_tokens: int):
+        """
+        Returns unused (or charges extra) tokens once the call's real usage is known.
+        """
+        if grant is None or not grant.tpm:
+            return
+        delta = grant.estimated_tokens - actual_tokens
+        if delta == 0:
+            return
+        local = self._local.get(grant.limit_key)
+        if local is not None:
+            local.settle(delta)
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            self._settle_script(
+                keys=[self._key(grant.limit_key, "tok")],
+                args=[grant.tpm, delta, settings.LLM_RATE_LIMIT_BURST_SECONDS * 1000],
+                client=client
+            )
+        except Exception as e:
+            self._redis_failed(e)
+
+    # --- Internals ---
+
+    def _key(self, limit_key: str, suffix: str) -> str:
+        return f"{self.KEY_PREFIX}{limit_key}:{suffix}"
+
+    def _redis_try_acquire(self, client: redis.Redis, limit_key: str, ticket: str, job: str, band: int, rpm: int, tpm: int, tokens: int) -> float:
+        poll_ms = settings.LLM_RATE_LIMIT_POLL_MS
+        wait_ms = self._acquire_script(
+            keys=[self._key(limit_key, s) for s in ("req", "tok", "queue", "leases", "slots", "seq", "vtime")],
+            args=[ticket, job, band, rpm, tpm, tokens,
+                  settings.LLM_RATE_LIMIT_BURST_SECONDS * 1000, max(poll_ms * 10, 2000), poll_ms],
+            client=client
+        )
+        # Never sleep past a poll interval: the head of the queue may change meanwhile
+        return min(int(wait_ms), poll_ms * 5) / 1000
+
+    def _release(self, limit_key: str, ticket: str):
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            self._release_script(keys=[self._key(limit_key, "queue"), self._key(limit_key, "leases")], args=[ticket], client=client)
+        except Exception as e:
+            self._redis_failed(e)
+
+    def _local_bucket(self, limit_key: str, rpm: int, tpm: int) -> _LocalBucket:
+        bucket = self._local.get(limit_key)
+        if bucket is None:
+            with self._local_lock:
+                bucket = self._local.setdefault(limit_key, _LocalBucket(rpm, tpm))
+        return bucket
+
+    def _get_redis(self) -> Optional[redis.Redis]:
+        if time.time() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.from_url(settings.REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._acquire_script = self._redis.register_script(_ACQUIRE_LUA)
+            self._settle_script = self._redis.register_script(_SETTLE_LUA)
+            self._release_script = self._redis.register_script(_RELEASE_LUA)
+        return self._redis
+
+    def _redis_failed(self, error: Exception):
+        logger.warning(f"RATE LIMIT: Redis unavailable, using per-process buckets for {_REDIS_RETRY_SECONDS}s: {error}")
+        self._redis_down_until = time.time() + _REDIS_RETRY_SECONDS
+
+rate_limiter = RateLimiter()
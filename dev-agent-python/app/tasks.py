@@ -3,11 +3,49 @@ from app.agents.graph import agent_graph
 from app.agents.state import AgentState
 from app.core.budget import budget_manager
 from app.core.stream import log_streamer
+from app.core.http_client import llm_http
+from app.core.llm_cache import llm_cache
+from app.core.rate_limit import rate_limiter
+from app.core.metrics import job_metrics
+from app.agents.wrapper import codex
+from app.agents.logic.token_monitor import token_monitor
+from app.agents.logic.context_packer import context_packer
+from app.agents.logic.model_router import model_router
+from app.agents.logic.verification import verification_pipeline
+from app.agents.logic.pytest_runner import pytest_runner
+from app.agents.logic.autofix import auto_fixer
+from app.agents.nodes.parallel import parallel_stats
+from app.tools.type_daemons import type_daemons
 import asyncio
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Process-lifetime counters; each job reports only what its own window saw
+_COUNTER_WINDOWS = (
+    llm_http.stats.counters,
+    llm_cache.counters,
+    codex.ensemble_stats.counters,
+    rate_limiter.stats.counters,
+    context_packer.stats.counters,
+    model_router.tiers,
+)
+
+
+def _pop_job_stats(job_id: str) -> dict:
+    """
+    Removes everything recorded per job, so failed jobs do not leak their entries.
+    """
+    return {
+        "sandbox_resources": job_metrics.pop(job_id),
+        "verification": verification_pipeline.stats.pop(job_id),
+        "tests": pytest_runner.stats.pop(job_id),
+        "autofix": auto_fixer.stats.pop(job_id),
+        "parallel_tasks": parallel_stats.pop(job_id),
+        "tokens": token_monitor.pop(job_id),
+    }
+
 @celery_app.task(bind=True)
 def run_agent_workflow(self, user_input: str, job_id: str, repo_url: str = None, repo_path: str = None):
     """
@@ -29,6 +67,8 @@ def run_agent_workflow(self, user_input: str, job_id: str, repo_url: str = None,
         "file_actions": None,
         "test_results": None,
         "test_errors": None,
+        "test_failures": None,
+        "diagnostics": None,
         "review_feedback": None,
         "status": "started",
         "error": None,
@@ -39,6 +79,9 @@ def run_agent_workflow(self, user_input: str, job_id: str, repo_url: str = None,
     # Run Graph (Async execution in sync task requires asyncio.run)
     config = {"configurable": {"thread_id": job_id}}
 
+    for counters in _COUNTER_WINDOWS:
+        counters.open(job_id)
+    job_stats = None
     try:
         # Check budget first
         budget_manager.check_budget(job_id)
@@ -51,12 +94,19 @@ def run_agent_workflow(self, user_input: str, job_id: str, repo_url: str = None,
             # improved: Use MemorySaver for stability (SqliteSaver caused import issues)
             memory = MemorySaver()
             app = workflow.compile(checkpointer=memory)
-            return await app.ainvoke(initial_state, config=config)
+            try:
+                return await app.ainvoke(initial_state, config=config)
+            finally:
+                # The pooled HTTP client is bound to this loop; release its connections
+                await llm_http.aclose()
+                # Type-checker daemons only stay warm for the job's retries
+                await asyncio.to_thread(type_daemons.shutdown, initial_state["repo_path"])
 
         import time
         start_time = time.time()
         final_state = asyncio.run(_run_workflow())
         latency = time.time() - start_time
+        job_stats = _pop_job_stats(job_id)
         
         # Phase 4.3: Sustainability Metrics
         metrics = {
@@ -64,13 +114,32 @@ def run_agent_workflow(self, user_input: str, job_id: str, repo_url: str = None,
             "status": final_state.get("status"),
             "retries": final_state.get("retry_count", 0),
             "latency_seconds": round(latency, 2),
-            "success": final_state.get("status") == "testing_complete"
+            "success": final_state.get("status") == "testing_complete",
+            "http_pool": llm_http.stats.snapshot(job_id),
+            "llm_cache": llm_cache.stats(job_id),
+            "ensemble": codex.ensemble_stats.snapshot(job_id),
+            "rate_limit": rate_limiter.stats.snapshot(job_id),
+            "context_packing": context_packer.stats.snapshot(job_id),
+            "model_tiers": model_router.snapshot(job_id),
+            "sandbox_resources": job_stats["sandbox_resources"],
+            "verification": job_stats["verification"],
+            "tests": job_stats["tests"],
+            "autofix": job_stats["autofix"],
+            "parallel_tasks": job_stats["parallel_tasks"],
+            "type_daemons": type_daemons.snapshot(),
+            "tokens": job_stats["tokens"]
         }
         logger.info(f"📊 SUSTAINABILITY METRICS: {json.dumps(metrics)}")
-        log_streamer.publish_log(job_id, f"📊 Analytics: Latency {metrics['latency_seconds']}s | Retries {metrics['retries']}", "INFO")
+        log_streamer.publish_log(job_id, f"📊 Analytics: Latency {metrics['latency_seconds']}s | Retries {metrics['retries']} | LLM retries avoided by auto-fix {metrics['autofix'].get('retries_avoided', 0)}", "INFO")
 
         return final_state
 
     except Exception as e:
         logger.error(f"JOB {job_id}: Failed with {e}")
         return {"status": "failed", "error": str(e)}
+
+    finally:
+        if job_stats is None:
+            _pop_job_stats(job_id)
+        for counters in _COUNTER_WINDOWS:
+            counters.close(job_id)
@@ -3,6 +3,8 @@ import logging
 import json
 from typing import List, Dict
 
+from app.tools.type_daemons import type_daemons
+
 logger = logging.getLogger(__name__)
 
 class LSPTool:
@@ -11,8 +13,12 @@ class LSPTool:
     """
     def check_python(self, file_path: str) -> List[Dict]:
         """
-        Runs pyright on a file.
+        Runs pyright on a file: through the workspace's warm language server
+        when available, else a cold `pyright --outputjson` run.
         """
+        diagnostics = type_daemons.pyright_diagnostics(file_path)
+        if diagnostics is not None:
+            return diagnostics
         try:
             # pyright file.py --outputjson
             result = subprocess.run(
@@ -0,0 +1,649 @@
+import atexit
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.agents.knowledge_graph import SKIP_DIRS
+from app.agents.logic.verify_cache import cache_dir, workspace_python
+
+logger = logging.getLogger(__name__)
+
+# dmypy client messages meaning the daemon is gone or broken rather than findings
+_DMYPY_DEAD = ("Daemon crashed", "Daemon has died", "No status file found", "Daemon is stuck")
+_PYRIGHT_SEVERITY = {1: "error", 2: "warning", 3: "information"}
+
+
+def _python_files(workspace: str) -> Dict[str, int]:
+    """
+    Relative path -> mtime_ns of every Python file in the workspace.
+    """
+    snapshot = {}
+    for root, dirs, files in os.walk(workspace):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.endswith(".egg-info")]
+        for name in files:
+            if name.endswith((".py", ".pyi")):
+                path = os.path.join(root, name)
+                try:
+                    snapshot[os.path.relpath(path, workspace).replace(os.sep, "/")] = os.stat(path).st_mtime_ns
+                except OSError:
+                    pass
+    return snapshot
+
+
+def _rss_bytes(pid: int) -> int:
+    """
+    Resident memory of a process and its descendants, from /proc.
+    """
+    total = 0
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            total = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(c) for c in f.read().split()]
+    except (OSError, ValueError, IndexError):
+        return total
+    return total + sum(_rss_bytes(child) for child in children)
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class TypeDaemon:
+    """
+    A long-lived type checker serving one workspace. Requests are serialized
+    by lock; last_used drives idle shutdown and LRU eviction.
+    """
+    kind = ""
+    executable = ""
+
+    def __init__(self, workspace: str):
+        self.workspace = workspace
+        self.lock = threading.Lock()
+        self.started_at = 0.0
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self._files: Optional[Dict[str, int]] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def pid(self) -> Optional[int]:
+        raise NotImplementedError
+
+    def alive(self) -> bool:
+        return _alive(self.pid())
+
+    def rss_bytes(self) -> int:
+        pid = self.pid()
+        return _rss_bytes(pid) if pid else 0
+
+    def _file_changes(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        (current snapshot, path -> LSP change type) since the last request:
+        1 created, 2 changed, 3 deleted. Everything is "created" on the first call.
+        """
+        current = _python_files(self.workspace)
+        previous = self._files or {}
+        changes = {rel: 1 for rel in current if rel not in previous}
+        changes.update({rel: 2 for rel, mtime in current.items() if rel in previous and previous[rel] != mtime})
+        changes.update({rel: 3 for rel in previous if rel not in current})
+        return current, changes
+
+
+class DmypyDaemon(TypeDaemon):
+    """
+    `dmypy` (mypy's fine-grained daemon) for one workspace, with the workspace's
+    own mypy configuration and JSON output. The first check analyses the project; later ones
+    only re-process what changed since: `recheck` when the set of files is the
+    same, `check` (which re-discovers sources but keeps the daemon's state)
+    when files were added or removed.
+    """
+    kind = "dmypy"
+    executable = "dmypy"
+
+    def __init__(self, workspace: str):
+        super().__init__(workspace)
+        self.status_file = os.path.join(workspace, ".agent_artifacts", "cache", "dmypy.json")
+        self._checked = False
+
+    def _client(self, *args: str, timeout: float) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            ["dmypy", "--status-file", self.status_file, *args],
+            cwd=self.workspace,
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+
+    def start(self):
+        cache_dir(self.workspace)
+        # The daemon's own idle timeout backs ours up if this worker dies without stopping it
+        idle = int(settings.TYPE_DAEMON_IDLE_TIMEOUT * 2) or 3600
+        # Findings as one JSON object per line, like the cold `mypy -O json`
+        flags = ["-O", "json"]
+        python = workspace_python(self.workspace)
+        if python:
+            flags += ["--python-executable", python]
+        result = self._client("start", "--timeout", str(idle), "--", *flags, timeout=settings.TYPE_DAEMON_START_TIMEOUT)
+        if result.returncode != 0 and "already running" not in result.stdout + result.stderr:
+            raise RuntimeError((result.stderr or result.stdout).strip())
+        self.started_at = time.monotonic()
+
+    def stop(self):
+        try:
+            result = self._client("stop", timeout=10)
+            if result.returncode == 0:
+                return
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        try:
+            self._client("kill", timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+
+    def pid(self) -> Optional[int]:
+        try:
+            with open(self.status_file) as f:
+                return int(json.load(f)["pid"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def check(self, files: Optional[List[str]], timeout: float) -> Optional[Tuple[str, str, int]]:
+        """
+        mypy output for the workspace, or only for `files` (relative paths)
+        when given; None when the project-wide analysis cannot answer for
+        those files. Raises RuntimeError when the daemon is broken.
+        """
+        current, changes = self._file_changes()
+        added_or_removed = any(kind != 2 for kind in changes.values())
+        if self._checked and not added_or_removed:
+            result = self._client("recheck", timeout=timeout)
+            if "only valid after a 'check'" in result.stdout + result.stderr:
+                result = self._client("check", ".", timeout=timeout)
+        else:
+            result = self._client("check", ".", timeout=timeout)
+        output = result.stdout + result.stderr
+        if result.returncode == 2 and any(marker in output for marker in _DMYPY_DEAD):
+            self._checked = False
+            raise RuntimeError(output.strip()[-500:])
+        self._checked = True
+        self._files = current
+        if files is None or (result.returncode == 2 and not result.stdout.strip()):
+            return result.stdout, result.stderr, result.returncode
+        stdout = self._only(result.stdout, files)
+        if result.returncode == 2 and not stdout.strip():
+            # Blocking errors (syntax) elsewhere stopped the analysis before these files; only a cold run can tell
+            return None
+        return stdout, result.stderr, 1 if stdout.strip() else 0
+
+    @staticmethod
+    def _only(stdout: str, files: List[str]) -> str:
+        """
+        Keeps the findings in `files`.
+        """
+        wanted = set(files)
+        lines = []
+        for line in stdout.splitlines():
+            try:
+                file = json.loads(line).get("file") if line.startswith("{") else line.split(":", 1)[0]
+            except ValueError:
+                continue
+            if file in wanted:
+                lines.append(line)
+        return "\n".join(lines)
+
+
+class PyrightDaemon(TypeDaemon):
+    """
+    `pyright-langserver --stdio` for one workspace. Files are pushed to it
+    incrementally: on-disk changes as workspace/didChangeWatchedFiles, the
+    checked file's text as didOpen / didChange. Diagnostics of an unchanged
+    file are answered from the last publishDiagnostics without a round trip.
+    """
+    kind = "pyright"
+    executable = "pyright-langserver"
+
+    def __init__(self, workspace: str):
+        super().__init__(workspace)
+        self._proc: Optional[subprocess.Popen] = None
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self._responses: Dict[int, Any] = {}
+        self._published: Dict[str, Tuple[Optional[int], List[Dict]]] = {}  # uri -> (version, diagnostics)
+        self._open: Dict[str, Tuple[int, str]] = {}  # uri -> (version, text)
+
+    def start(self):
+        self._proc = subprocess.Popen(
+            ["pyright-langserver", "--stdio"],
+            cwd=self.workspace,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        threading.Thread(target=self._read_loop, name=f"pyright-{os.path.basename(self.workspace)}", daemon=True).start()
+        root_uri = self._uri(self.workspace)
+        self._request("initialize", {
+            "processId": os.getpid(),
+            "rootUri": root_uri,
+            "workspaceFolders": [{"uri": root_uri, "name": os.path.basename(self.workspace)}],
+            "capabilities": {
+                "textDocument": {"publishDiagnostics": {"versionSupport": True}},
+                "workspace": {"configuration": True, "didChangeWatchedFiles": {"dynamicRegistration": True}},
+            },
+        }, timeout=settings.TYPE_DAEMON_START_TIMEOUT)
+        self._notify("initialized", {})
+        self._files = _python_files(self.workspace)
+        self.started_at = time.monotonic()
+
+    def stop(self):
+        if self._proc is None:
+            return
+        try:
+            if self._proc.poll() is None:
+                self._request("shutdown", None, timeout=5)
+                self._notify("exit", None)
+                self._proc.wait(timeout=5)
+        except (OSError, RuntimeError, TimeoutError, subprocess.TimeoutExpired):
+            pass
+        if self._proc.poll() is None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self._proc.wait()
+
+    def pid(self) -> Optional[int]:
+        if self._proc is None or self._proc.poll() is not None:
+            return None
+        return self._proc.pid
+
+    @staticmethod
+    def _uri(path: str) -> str:
+        return "file://" + os.path.abspath(path)
+
+    def _send(self, message: Dict):
+        body = json.dumps({"jsonrpc": "2.0", **message}).encode("utf-8")
+        with self._write_lock:
+            if self._proc is None or self._proc.stdin is None:
+                raise RuntimeError("pyright-langserver is not running")
+            try:
+                self._proc.stdin.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+                self._proc.stdin.flush()
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"pyright-langserver pipe closed: {e}") from e
+
+    def _notify(self, method: str, params: Any):
+        self._send({"method": method, "params": params})
+
+    def _request(self, method: str, params: Any, timeout: float) -> Any:
+        with self._cond:
+            self._next_id += 1
+            request_id = self._next_id
+        self._send({"id": request_id, "method": method, "params": params})
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while request_id not in self._responses:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"pyright-langserver did not answer {method} within {timeout}s")
+                if self.pid() is None:
+                    raise RuntimeError("pyright-langserver exited")
+                self._cond.wait(min(remaining, 1.0))
+            return self._responses.pop(request_id)
+
+    def _read_loop(self):
+        stream = self._proc.stdout
+        while True:
+            headers = {}
+            while True:
+                line = stream.readline()
+                if not line:
+                    with self._cond:
+                        self._cond.notify_all()
+                    return
+                line = line.strip()
+                if not line:
+                    break
+                name, _, value = line.decode("ascii", "replace").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                message = json.loads(stream.read(int(headers.get("content-length", "0"))))
+            except ValueError:
+                continue
+            self._dispatch(message)
+
+    def _dispatch(self, message: Dict):
+        method = message.get("method")
+        if method is None:
+            with self._cond:
+                self._responses[message.get("id")] = message.get("result")
+                self._cond.notify_all()
+        elif method == "textDocument/publishDiagnostics":
+            params = message.get("params") or {}
+            with self._cond:
+                self._published[params.get("uri")] = (params.get("version"), params.get("diagnostics", []))
+                self._cond.notify_all()
+        elif "id" in message:
+            # Server-to-client requests: default configuration, accept registrations and progress
+            result = None
+            if method == "workspace/configuration":
+                result = [None for _ in (message.get("params") or {}).get("items", [])]
+            try:
+                self._send({"id": message["id"], "result": result})
+            except RuntimeError:
+                pass
+
+    def diagnostics(self, file_path: str, timeout: float) -> List[Dict]:
+        """
+        Diagnostics for one file, shaped like `pyright --outputjson` generalDiagnostics.
+        """
+        current, changes = self._file_changes()
+        if changes:
+            self._notify("workspace/didChangeWatchedFiles", {
+                "changes": [{"uri": self._uri(os.path.join(self.workspace, rel)), "type": kind} for rel, kind in changes.items()]
+            })
+        self._files = current
+
+        uri = self._uri(file_path)
+        with open(file_path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        version, sent = self._open.get(uri, (0, None))
+        if sent is None:
+            version = 1
+            self._notify("textDocument/didOpen", {"textDocument": {"uri": uri, "languageId": "python", "version": version, "text": text}})
+        elif sent != text or changes or uri not in self._published:
+            # A dependency changing can change this file's diagnostics too
+            version += 1
+            self._notify("textDocument/didChange", {"textDocument": {"uri": uri, "version": version}, "contentChanges": [{"text": text}]})
+        self._open[uri] = (version, text)
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                published = self._published.get(uri)
+                if published is not None and published[0] in (version, None):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"pyright-langserver published no diagnostics for {file_path} within {timeout}s")
+                if self.pid() is None:
+                    raise RuntimeError("pyright-langserver exited")
+                self._cond.wait(min(remaining, 1.0))
+        return [
+            {
+                "file": os.path.abspath(file_path),
+                "severity": _PYRIGHT_SEVERITY[d.get("severity", 1)],
+                "message": d.get("message", ""),
+                "range": d.get("range"),
+                **({"rule": d["code"]} if d.get("code") else {}),
+            }
+            # Hints (unused code, deprecated) are editor decorations; the CLI does not report them
+            for d in published[1] if d.get("severity", 1) in _PYRIGHT_SEVERITY
+        ]
+
+
+class TypeDaemonStats:
+    """
+    Worker-wide daemon lifecycle counters.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"starts": 0, "start_failures": 0, "requests": 0, "warm_requests": 0, "failures": 0}
+        self.stops: Dict[str, int] = {}
+        self.peak_rss_mb = 0.0
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def stopped(self, reason: str):
+        with self._lock:
+            self.stops[reason] = self.stops.get(reason, 0) + 1
+
+    def observe_rss(self, total_bytes: int):
+        with self._lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, total_bytes / (1024 * 1024))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {**self.counters, "stops": dict(self.stops), "peak_total_rss_mb": round(self.peak_rss_mb, 1)}
+
+
+class TypeDaemonManager:
+    """
+    Warm type-checker daemons per workspace (dmypy for the tester, a pyright
+    language server for LSPTool), started on first use and reused across
+    retries. A daemon is stopped after TYPE_DAEMON_IDLE_TIMEOUT without
+    requests, when its job ends (shutdown), or, least recently used first,
+    while the daemons on this worker together exceed TYPE_DAEMON_MAX_TOTAL_MB
+    or number more than TYPE_DAEMON_MAX_LIVE. Callers fall back to a cold run
+    whenever a method returns None.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._daemons: "OrderedDict[Tuple[str, str], TypeDaemon]" = OrderedDict()
+        self._reaper: Optional[threading.Thread] = None
+        self.stats = TypeDaemonStats()
+        atexit.register(self.shutdown_all)
+
+    def _acquire(self, cls: type, workspace: str) -> Optional[TypeDaemon]:
+        if not settings.TYPE_DAEMONS_ENABLED or shutil.which(cls.executable) is None:
+            return None
+        key = (cls.kind, os.path.realpath(workspace))
+        with self._lock:
+            daemon = self._daemons.get(key)
+            if daemon is not None:
+                self._daemons.move_to_end(key)
+        if daemon is not None and not daemon.busy and not daemon.alive():
+            logger.warning(f"TYPE DAEMON: {cls.kind} for {key[1]} died; restarting.")
+            self._remove(daemon, "died")
+            daemon = None
+        if daemon is not None:
+            self.stats.incr("warm_requests")
+            return daemon
+
+        daemon = cls(key[1])
+        try:
+            daemon.start()
+        except (OSError, RuntimeError, TimeoutError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"TYPE DAEMON: Could not start {cls.kind} for {key[1]}: {e}")
+            self.stats.incr("start_failures")
+            daemon.stop()
+            return None
+        with self._lock:
+            existing = self._daemons.get(key)
+            if existing is None:
+                self._daemons[key] = daemon
+        if existing is not None:
+            # Another thread started one for this workspace meanwhile
+            daemon.stop()
+            return existing
+        self.stats.incr("starts")
+        logger.info(f"TYPE DAEMON: Started {cls.kind} for {key[1]} (pid {daemon.pid()}).")
+        self._ensure_reaper()
+        self._enforce_limits(keep=daemon)
+        return daemon
+
+    def _remove(self, daemon: TypeDaemon, reason: str):
+        with self._lock:
+            if self._daemons.get((daemon.kind, daemon.workspace)) is not daemon:
+                return
+            del self._daemons[(daemon.kind, daemon.workspace)]
+        daemon.stop()
+        self.stats.stopped(reason)
+        logger.info(f"TYPE DAEMON: Stopped {daemon.kind} for {daemon.workspace} ({reason}, {daemon.requests} requests).")
+
+    def mypy_check(self, workspace: str, files: Optional[List[str]], timeout: float) -> Optional[Tuple[str, str, int]]:
+        """
+        (stdout, stderr, exit code) of mypy on the workspace, or only reporting
+        on `files` when given; None when no daemon is available. A request
+        that times out stops the daemon and raises subprocess.TimeoutExpired.
+        """
+        for _ in range(2):
+            daemon = self._acquire(DmypyDaemon, workspace)
+            if daemon is None:
+                return None
+            try:
+                with daemon.lock:
+                    daemon.last_used = time.monotonic()
+                    daemon.requests += 1
+                    self.stats.incr("requests")
+                    answer = daemon.check(files, timeout)
+                    daemon.last_used = time.monotonic()
+            except subprocess.TimeoutExpired:
+                self._remove(daemon, "timeout")
+                raise
+            except (OSError, RuntimeError) as e:
+                # Broken daemon: replace it once, then let the caller run mypy cold
+                logger.warning(f"TYPE DAEMON: dmypy failed for {daemon.workspace}: {e}")
+                self.stats.incr("failures")
+                self._remove(daemon, "failed")
+                continue
+            self._enforce_limits(keep=daemon)
+            return answer
+        return None
+
+    def pyright_diagnostics(self, file_path: str, timeout: float = 120.0) -> Optional[List[Dict]]:
+        """
+        Pyright diagnostics of one file from its workspace's language server,
+        or None when no server is available.
+        """
+        daemon = self._acquire(PyrightDaemon, self.workspace_for(file_path))
+        if daemon is None:
+            return None
+        try:
+            with daemon.lock:
+                daemon.last_used = time.monotonic()
+                daemon.requests += 1
+                self.stats.incr("requests")
+                diagnostics = daemon.diagnostics(file_path, timeout)
+                daemon.last_used = time.monotonic()
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.warning(f"TYPE DAEMON: pyright failed for {file_path}: {e}")
+            self.stats.incr("failures")
+            self._remove(daemon, "failed")
+            return None
+        self._enforce_limits(keep=daemon)
+        return diagnostics
+
+    def workspace_for(self, file_path: str) -> str:
+        """
+        The workspace of a live daemon containing the file, else its nearest
+        ancestor with a project marker, else its directory.
+        """
+        path = os.path.realpath(file_path)
+        with self._lock:
+            live = sorted({ws for _, ws in self._daemons}, key=len, reverse=True)
+        for workspace in live:
+            if path.startswith(workspace + os.sep):
+                return workspace
+        directory = os.path.dirname(path)
+        candidate = directory
+        while True:
+            if any(os.path.exists(os.path.join(candidate, marker)) for marker in (".git", "pyproject.toml", "pyrightconfig.json", "setup.py")):
+                return candidate
+            parent = os.path.dirname(candidate)
+            if parent == candidate:
+                return directory
+            candidate = parent
+
+    def _enforce_limits(self, keep: Optional[TypeDaemon] = None):
+        """
+        Stops idle daemons, least recently used first, until the live ones fit
+        TYPE_DAEMON_MAX_LIVE and TYPE_DAEMON_MAX_TOTAL_MB. Busy daemons and
+        `keep` (the one just used) are never stopped.
+        """
+        with self._lock:
+            daemons = list(self._daemons.values())
+        sizes = {id(d): d.rss_bytes() for d in daemons}
+        total = sum(sizes.values())
+        self.stats.observe_rss(total)
+        cap = settings.TYPE_DAEMON_MAX_TOTAL_MB * 1024 * 1024
+        live = len(daemons)
+        for daemon in daemons:
+            if total <= cap and live <= settings.TYPE_DAEMON_MAX_LIVE:
+                break
+            if daemon is keep or daemon.busy:
+                continue
+            reason = "memory" if total > cap else "max_live"
+            logger.info(f"TYPE DAEMON: {total / (1024 * 1024):.0f} MB in {live} daemons; evicting {daemon.kind} for {daemon.workspace}.")
+            self._remove(daemon, reason)
+            total -= sizes[id(daemon)]
+            live -= 1
+        if total > cap:
+            logger.warning(f"TYPE DAEMON: {total / (1024 * 1024):.0f} MB in use by busy daemons, over TYPE_DAEMON_MAX_TOTAL_MB.")
+
+    def reap_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            daemons = list(self._daemons.values())
+        for daemon in daemons:
+            if not daemon.busy and now - daemon.last_used > settings.TYPE_DAEMON_IDLE_TIMEOUT:
+                self._remove(daemon, "idle")
+        self._enforce_limits()
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="type-daemon-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, min(30.0, settings.TYPE_DAEMON_IDLE_TIMEOUT / 4)))
+            with self._lock:
+                if not self._daemons:
+                    self._reaper = None
+                    return
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.error(f"TYPE DAEMON: Reaper failed: {e}")
+
+    def shutdown(self, workspace: str, reason: str = "job_end"):
+        """
+        Stops every daemon serving the workspace (or a directory inside it).
+        """
+        root = os.path.realpath(workspace)
+        with self._lock:
+            daemons = [d for (_, ws), d in self._daemons.items() if ws == root or ws.startswith(root + os.sep)]
+        for daemon in daemons:
+            self._remove(daemon, reason)
+
+    def shutdown_all(self):
+        with self._lock:
+            daemons = list(self._daemons.values())
+        for daemon in daemons:
+            self._remove(daemon, "exit")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            live = [f"{kind}:{ws}" for kind, ws in self._daemons]
+        return {**self.stats.snapshot(), "live": live}
+
+type_daemons = TypeDaemonManager()
@@ -0,0 +1,120 @@
+import argparse
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Set
+
+from app.agents.impact_index import ImpactIndex
+
+
+def make_graph(files: int, edges: int, seed: int = 7) -> Dict[str, Set[str]]:
+    """
+    A synthetic import graph as KnowledgeGraph.graph stores it (file -> files
+    importing it). Files import only lower layers (no cycles, like most
+    packages), and a few utility modules are imported far more than the rest.
+    """
+    rng = random.Random(seed)
+    names = [f"pkg{i // 100}/mod{i}.py" for i in range(files)]
+    hubs = names[:max(1, files // 200)]
+    graph: Dict[str, Set[str]] = {name: set() for name in names}
+    added = 0
+    while added < edges:
+        importer = rng.randrange(1, files)
+        # One import in five goes to a utility module, the rest to any lower module
+        target = rng.choice(hubs) if rng.random() < 0.2 else names[rng.randrange(0, importer)]
+        if target != names[importer] and names[importer] not in graph[target]:
+            graph[target].add(names[importer])
+            added += 1
+    return graph
+
+
+def bfs_list_pop(graph: Dict[str, Set[str]], changed: Iterable[str]) -> Set[str]:
+    # The original KnowledgeGraph.get_impacted_files: one file at a time, queue as a list
+    result: Set[str] = set(changed)
+    for changed_file in changed:
+        impacted: Set[str] = set()
+        queue = [changed_file]
+        while queue:
+            current = queue.pop(0)
+            if current in graph:
+                for dependent in graph[current]:
+                    if dependent not in impacted:
+                        impacted.add(dependent)
+                        queue.append(dependent)
+        result |= impacted
+    return result
+
+
+def bfs_deque(graph: Dict[str, Set[str]], changed: Iterable[str]) -> Set[str]:
+    # Multi-source BFS over the dict of sets
+    impacted = set(changed)
+    queue = deque(impacted)
+    while queue:
+        for dependent in graph.get(queue.popleft(), ()):
+            if dependent not in impacted:
+                impacted.add(dependent)
+                queue.append(dependent)
+    return impacted
+
+
+def best_ms(fn: Callable[[], Set[str]], repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark changeset impact queries: BFS over dict-of-sets vs the CSR ImpactIndex")
+    parser.add_argument("--files", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--edges", type=int, default=100000)
+    parser.add_argument("--changeset", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-list-pop", action="store_true", help="Skip the quadratic per-file list.pop(0) baseline")
+    args = parser.parse_args()
+
+    print("| Files | Edges | Changed | Impacted | list.pop(0) per file (ms) | deque batch (ms) | CSR batch (ms) | CSR + closure cache (ms) | Speedup vs list.pop(0) | Speedup vs deque |")
+    print("| :--- | :--- | :--- | :--- | :--- | :--- | :--- | :--- | :--- | :--- |")
+    for files in args.files:
+        graph = make_graph(files, args.edges)
+        started = time.perf_counter()
+        index = ImpactIndex(graph)
+        build_ms = (time.perf_counter() - started) * 1000
+        rng = random.Random(files)
+        names: List[str] = sorted(graph)
+        # Changes cluster in the lower half of the layers, where impact sets are largest
+        pool = names[:files // 2]
+        for size in args.changeset:
+            changed = rng.sample(pool, size)
+            expected = bfs_deque(graph, changed)
+            assert index.impacted(changed) == expected
+            list_pop = "skipped"
+            if not args.skip_list_pop:
+                assert bfs_list_pop(graph, changed) == expected
+                list_pop_ms = best_ms(lambda graph=graph, changed=changed: bfs_list_pop(graph, changed), max(1, args.repeats // 2))
+                list_pop = f"{list_pop_ms:.2f}"
+            deque_ms = best_ms(lambda graph=graph, changed=changed: bfs_deque(graph, changed), args.repeats)
+            # A fresh index per measurement so no closure is cached yet
+            cold = ImpactIndex(graph)
+            csr_ms = min(_timed(lambda cold=cold, changed=changed: cold.impacted(changed), lambda cold=cold: (cold._closures.clear(), cold._heat.clear())) for _ in range(args.repeats))
+            # Repeated queries for the same files: hot seeds are answered from their cached closures
+            for _ in range(3):
+                index.impacted(changed)
+            assert index.impacted(changed) == expected
+            cached_ms = best_ms(lambda index=index, changed=changed: index.impacted(changed), args.repeats)
+            vs_list = f"{list_pop_ms / csr_ms:.1f}x" if not args.skip_list_pop else "-"
+            print(f"| {files} | {index.edges} | {size} | {len(expected)} | {list_pop} | {deque_ms:.2f} | {csr_ms:.2f} | {cached_ms:.2f} | {vs_list} | {deque_ms / csr_ms:.1f}x |")
+        print(f"\nCSR index for {files} files / {index.edges} edges built in {build_ms:.1f}ms.\n")
+
+
+def _timed(fn: Callable[[], object], reset: Callable[[], object]) -> float:
+    reset()
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# "import time:     self [us] |   cumulative | imported package"
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once(module: str) -> Tuple[float, Dict[str, int], str]:
+    """
+    Imports module in a fresh interpreter with -X importtime.
+    Returns (wall seconds, top-level cumulative microseconds per module, error).
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=env
+    )
+    wall = time.perf_counter() - start
+
+    cumulative: Dict[str, int] = {}
+    error_lines: List[str] = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            name = m.group(4)
+            cumulative[name] = max(cumulative.get(name, 0), int(m.group(2)))
+        elif line.strip():
+            error_lines.append(line)
+    error = error_lines[-1] if proc.returncode != 0 and error_lines else ""
+    return wall, cumulative, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the API and worker entry points")
+    parser.add_argument("--modules", nargs="+", default=["app.main", "app.worker"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest app modules to list per entry point")
+    args = parser.parse_args()
+
+    print("| Module | Best wall (ms) | Median wall (ms) | Import (ms) | Status |")
+    print("| :--- | :--- | :--- | :--- | :--- |")
+    slowest: Dict[str, List[Tuple[str, int]]] = {}
+    for module in args.modules:
+        walls = []
+        cumulative: Dict[str, int] = {}
+        error = ""
+        for _ in range(args.repeats):
+            wall, run, error = import_once(module)
+            walls.append(wall)
+            # Keep the fastest run per module so disk cache warm-up does not skew the ranking
+            for name, us in run.items():
+                cumulative[name] = min(cumulative.get(name, us), us)
+        walls.sort()
+        status = f"FAILED: {error}" if error else "ok"
+        print(f"| {module} | {walls[0] * 1000:.1f} | {walls[len(walls) // 2] * 1000:.1f} | {cumulative.get(module, 0) / 1000:.1f} | {status} |")
+        slowest[module] = sorted(
+            ((name, us) for name, us in cumulative.items() if name.startswith("app.")),
+            key=lambda item: item[1],
+            reverse=True
+        )[:args.top]
+
+    for module, rows in slowest.items():
+        print(f"\nSlowest app modules under {module} (cumulative):")
+        print("| Module | Cumulative (ms) |")
+        print("| :--- | :--- |")
+        for name, us in rows:
+            print(f"| {name} | {us / 1000:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import io
+import json
+import random
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+from app.agents.logic.structured_output import FrameScanner, extract_frame
+
+PLANNER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "task_graph": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "dependencies": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["id", "name", "dependencies"]
+            }
+        }
+    },
+    "required": ["task_graph"]
+}
+
+CODE_LINES = [
+    "def handler(event: dict) -> dict:",
+    "    payload = {\"id\": event.get(\"id\"), \"items\": [x for x in event[\"items\"] if x]}",
+    "    return {k: v for k, v in payload.items() if v is not None}",
+    "exec: rg -n \"AGENT_JSON\" app/ | head -20",
+    "config = {'retries': 3, 'backoff': {'base': 0.5, 'cap': 30}}",
+    "2026-01-01T00:00:00Z INFO worker: processed batch {size=128 latency_ms=42}",
+    "    if (x > 0) { return y; } else { throw new Error(\"bad {input}\"); }",
+]
+
+
+def make_transcript(size_mb: float, frame_position: float) -> str:
+    """
+    Builds a Codex-like transcript of roughly size_mb with a nested planner
+    frame placed at frame_position (0.0 = start, 1.0 = end).
+    """
+    rng = random.Random(42)
+    frame = {"task_graph": [
+        {"id": str(i), "name": f"Task {i}", "dependencies": [str(d) for d in range(i)]}
+        for i in range(8)
+    ]}
+    target = int(size_mb * 1024 * 1024)
+    lines: List[str] = []
+    size = 0
+    while size < target:
+        line = rng.choice(CODE_LINES)
+        lines.append(line)
+        size += len(line) + 1
+    insert_at = int(len(lines) * frame_position)
+    lines.insert(insert_at, f"AGENT_JSON_START: {json.dumps(frame)}")
+    return "\n".join(lines)
+
+
+def legacy_extract(text: str, schema: dict) -> Optional[dict]:
+    """
+    The pre-extractor behaviour: run_prompt's framed + DOTALL regexes with a
+    fresh validator, then the node re-parsing with its own regex.
+    """
+    match = re.search(r"^AGENT_JSON_START:\s*(\{.*?\})", text, re.MULTILINE)
+    if not match:
+        match = re.search(r"(\{.*?\})", text, re.DOTALL)
+    if match:
+        try:
+            obj = json.loads(match.group(1))
+            if jsonschema:
+                jsonschema.validate(instance=obj, schema=schema)
+        except Exception:
+            pass
+    node_match = re.search(r"AGENT_JSON_START:\s*(\{.*?\})", text, re.MULTILINE)
+    if node_match:
+        try:
+            return json.loads(node_match.group(1))
+        except ValueError:
+            return None
+    return None
+
+
+def streaming_extract(text: str, schema: dict) -> Optional[dict]:
+    scanner = FrameScanner(schema)
+    for line in io.StringIO(text):
+        if scanner.feed(line) is not None:
+            break
+    return scanner.result
+
+
+def bench(name: str, fn: Callable[[str, dict], Optional[dict]], text: str, repeats: int) -> Dict:
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(text, PLANNER_SCHEMA)
+        timings.append(time.perf_counter() - start)
+    task_count = len(result.get("task_graph", [])) if result else 0
+    return {"name": name, "best_ms": round(min(timings) * 1000, 2), "tasks_parsed": task_count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AGENT_JSON_START extraction on large transcripts")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="Transcript sizes in MB")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print("| Size | Frame at | Extractor | Best (ms) | Tasks parsed |")
+    print("| :--- | :--- | :--- | :--- | :--- |")
+    for size in args.sizes:
+        for position in (0.0, 0.5, 1.0):
+            text = make_transcript(size, position)
+            for name, fn in (("legacy regex", legacy_extract), ("extract_frame", extract_frame), ("FrameScanner (streamed lines)", streaming_extract)):
+                r = bench(name, fn, text, args.repeats)
+                print(f"| {size}MB | {position:.0%} | {r['name']} | {r['best_ms']} | {r['tasks_parsed']}/8 |")
+
+
+if __name__ == "__main__":
+    main()
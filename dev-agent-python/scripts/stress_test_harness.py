@@ -58,6 +58,7 @@ class StressTestHarness:
                 "duration_s": round(duration, 2),
                 "status": final_state.get("status", "unknown"),
                 "tokens": tokens_used,
+                "tokens_by_node": token_monitor.get_breakdown(job_id)["by_node"],
                 "risk_score": final_state.get("risk_score", 0)
             }
             self.results.append(result)
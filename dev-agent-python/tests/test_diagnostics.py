@@ -0,0 +1,93 @@
+import json
+
+from app.agents.logic.classifier import ErrorClass
+from app.agents.logic.diagnostics import (
+    Diagnostic, DiagnosticSet, parse_bandit, parse_compileall, parse_mypy, parse_pip_check, parse_ruff
+)
+
+
+def _d(file="a.py", line=1, code="F401", message="unused import", error_class=ErrorClass.UNKNOWN, severity="error", tool="ruff"):
+    return Diagnostic(tool, file, line, code, severity, message, error_class)
+
+
+def test_set_dedups_and_counts_per_class():
+    found = DiagnosticSet([
+        _d(),
+        _d(),
+        _d(line=2),
+        _d(code="syntax-error", message="bad", error_class=ErrorClass.SYNTAX),
+        _d(tool="mypy", code="arg-type", message="wrong", error_class=ErrorClass.TYPE),
+    ])
+    assert len(found) == 4 and found.duplicates == 1
+    assert found.count(ErrorClass.UNKNOWN) == 2 and found.count(ErrorClass.SECURITY) == 0
+    assert found.counts() == {ErrorClass.SYNTAX: 1, ErrorClass.TYPE: 1, ErrorClass.UNKNOWN: 2}
+    assert found.primary_class() == ErrorClass.SYNTAX
+    assert list(found.group_by("tool")) == ["ruff", "mypy"]
+    assert DiagnosticSet().primary_class() is None
+
+
+def test_notes_alone_do_not_fail():
+    assert not DiagnosticSet([_d(tool="mypy", code="", severity="note", message="hint")]).failing()
+    assert DiagnosticSet([_d()]).failing()
+
+
+def test_render_merges_identical_messages():
+    found = DiagnosticSet([_d(file=f"m{i}.py") for i in range(7)] + [_d(code="syntax-error", message="bad", error_class=ErrorClass.SYNTAX)])
+    text = found.render()
+    lines = text.splitlines()
+    # Most fundamental class first; one line per distinct message with at most five locations
+    assert lines[0] == f"{ErrorClass.SYNTAX} (1):"
+    assert lines[2] == f"{ErrorClass.UNKNOWN} (7):"
+    assert lines[3] == "  m0.py:1, m1.py:1, m2.py:1, m3.py:1, m4.py:1 (+2 more): [ruff F401] unused import"
+    assert "ruff" not in found.render(skip_tools=["ruff"])
+
+
+def test_state_round_trip():
+    found = DiagnosticSet([_d(), _d(file="b.py", line=9, tool="bandit", code="B602", severity="warning", error_class=ErrorClass.SECURITY)])
+    restored = DiagnosticSet.from_state(json.loads(json.dumps(found.to_state())))
+    assert [d.as_row() for d in restored] == [d.as_row() for d in found]
+    assert len(DiagnosticSet.from_state(None)) == 0
+
+
+def test_parse_ruff(tmp_path):
+    repo = str(tmp_path)
+    stdout = json.dumps([
+        {"filename": f"{repo}/pkg/a.py", "code": "F401", "message": "unused", "location": {"row": 3}},
+        {"filename": f"{repo}/pkg/b.py", "code": None, "message": "SyntaxError", "location": {"row": 1}},
+    ])
+    diagnostics = parse_ruff(stdout, "", 1, repo)
+    assert [(d.file, d.line, d.code, d.error_class) for d in diagnostics] == [
+        ("pkg/a.py", 3, "F401", ErrorClass.UNKNOWN), ("pkg/b.py", 1, "syntax-error", ErrorClass.SYNTAX)
+    ]
+    assert parse_ruff("", "config error", 2, repo) is None
+
+
+def test_parse_mypy_json_and_text(tmp_path):
+    repo = str(tmp_path)
+    stdout = "\n".join([
+        json.dumps({"file": "a.py", "line": 4, "code": "arg-type", "severity": "error", "message": "bad arg"}),
+        "b.py:7: error: Cannot find module  [import-not-found]",
+        "Found 2 errors in 2 files",
+    ])
+    diagnostics = parse_mypy(stdout, "", 1, repo)
+    assert [(d.file, d.line, d.code, d.error_class) for d in diagnostics] == [
+        ("a.py", 4, "arg-type", ErrorClass.TYPE), ("b.py", 7, "import-not-found", ErrorClass.DEPENDENCY)
+    ]
+    assert parse_mypy("", "crash", 2, repo) is None
+
+
+def test_parse_bandit_compileall_and_pip_check(tmp_path):
+    repo = str(tmp_path)
+    report = {"results": [{"filename": f"{repo}/a.py", "line_number": 5, "test_id": "B602", "issue_severity": "HIGH",
+                           "issue_confidence": "HIGH", "issue_text": "shell=True"}]}
+    (issue,) = parse_bandit(json.dumps(report), "", 1, repo)
+    assert (issue.file, issue.line, issue.severity, issue.error_class) == ("a.py", 5, "error", ErrorClass.SECURITY)
+
+    stdout = f"*** Error compiling '{repo}/c.py'...\n  File \"{repo}/c.py\", line 2\n    def f(:\n SyntaxError: invalid syntax\n"
+    (syntax,) = parse_compileall(stdout, "", 1, repo)
+    assert (syntax.file, syntax.line, syntax.code) == ("c.py", 2, "SyntaxError")
+    assert parse_compileall("", "Traceback", 1, repo) is None
+
+    (conflict,) = parse_pip_check("foo 1.0 has requirement bar>=2, but you have bar 1.0.\n", "", 1, repo)
+    assert conflict.error_class == ErrorClass.DEPENDENCY
+    assert parse_pip_check("No broken requirements found.", "", 0, repo) == []
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app.agents.containers import ContainerPool, ContainerRuntime, DockerCliRuntime, PoolClosed
+from app.agents.sandbox import TIMEOUT_EXIT_CODE, DockerSandbox, LazySandboxManager, LocalSandbox, SandboxFactory
+from app.core.config import settings
+
+
+class FakeRuntime(ContainerRuntime):
+    """
+    Runs "exec" commands as local subprocesses and records what the pool asked for.
+    """
+    def __init__(self):
+        self.started = []
+        self.mounts = []
+        self.removed = []
+        self.execs = []
+        self.dirty_checks = 0
+
+    def start(self, image, mount_root):
+        container_id = f"fake-{len(self.started)}"
+        self.started.append(container_id)
+        self.mounts.append(mount_root)
+        return container_id
+
+    def exec(self, container_id, cmd, cwd=None, env=None, stdin=None, timeout=None):
+        self.execs.append((container_id, cmd, env))
+        try:
+            result = subprocess.run(cmd, cwd=cwd, input=stdin, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return "", "TimeoutExpired", TIMEOUT_EXIT_CODE
+        return result.stdout, result.stderr, result.returncode
+
+    def is_dirty(self, container_id):
+        self.dirty_checks += 1
+        return False
+
+    def remove(self, container_id):
+        self.removed.append(container_id)
+
+
+@pytest.fixture
+def sandbox_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SANDBOX_POOL_MIN_IDLE", 0)
+    monkeypatch.setattr(settings, "SANDBOX_WORKSPACE_ROOT", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_docker(tmp_path):
+    """
+    A `docker` executable whose `exec [-i] [-w DIR] [-e K=V]... ID CMD...` runs CMD locally.
+    """
+    path = tmp_path / "docker"
+    path.write_text(
+        f"#!{sys.executable}\n"
+        "import os, sys\n"
+        "args = sys.argv[2:]\n"
+        "while args[0].startswith('-'):\n"
+        "    flag = args.pop(0)\n"
+        "    if flag == '-w':\n"
+        "        os.chdir(args.pop(0))\n"
+        "    elif flag == '-e':\n"
+        "        key, _, value = args.pop(0).partition('=')\n"
+        "        os.environ[key] = value\n"
+        "os.execvp(args[1], args[1:])\n"
+    )
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return DockerCliRuntime(docker=str(path))
+
+
+def test_aexecute_reuses_warm_container(sandbox_settings):
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+    lines = []
+
+    async def run():
+        first = await sandbox.aexecute(["printf", "a\\nb\\n"], cwd=str(sandbox_settings), log_callback=lines.append)
+        second = await sandbox.aexecute(["true"], cwd=str(sandbox_settings))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == ("a\nb\n", "", 0)
+    assert second[2] == 0
+    assert lines == ["a", "b"]
+    assert runtime.started == ["fake-0"]
+    assert [container for container, _, _ in runtime.execs] == ["fake-0", "fake-0"]
+    sandbox.close()
+
+
+def test_aexecute_recycles_timed_out_container(sandbox_settings):
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+
+    async def run():
+        timed_out = await sandbox.aexecute(["sleep", "5"], cwd=str(sandbox_settings), timeout=0.2)
+        after = await sandbox.aexecute(["true"], cwd=str(sandbox_settings))
+        return timed_out, after
+
+    timed_out, after = asyncio.run(run())
+    assert timed_out[1:] == ("TimeoutExpired", TIMEOUT_EXIT_CODE)
+    assert after[2] == 0
+    assert runtime.started == ["fake-0", "fake-1"]
+    sandbox.close()
+
+
+def test_aexecute_forwards_only_changed_env(sandbox_settings):
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+    env = {**os.environ, "AGENT_TEST_VAR": "1"}
+    asyncio.run(sandbox.aexecute(["true"], cwd=str(sandbox_settings), env=env))
+    assert runtime.execs[0][2] == {"AGENT_TEST_VAR": "1"}
+    sandbox.close()
+
+
+def test_jobs_get_their_own_mount(sandbox_settings):
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+    job_a = sandbox_settings / "job-a" / "src"
+    job_b = sandbox_settings / "job-b"
+    job_a.mkdir(parents=True)
+    job_b.mkdir()
+
+    async def run():
+        await sandbox.aexecute(["true"], cwd=str(job_a))
+        await sandbox.aexecute(["true"], cwd=str(sandbox_settings / "job-a"))
+        await sandbox.aexecute(["true"], cwd=str(job_b))
+
+    asyncio.run(run())
+    root = os.path.realpath(sandbox_settings)
+    assert runtime.mounts == [os.path.join(root, "job-a"), os.path.join(root, "job-b")]
+    sandbox.close()
+
+
+def test_idle_job_pool_is_closed(sandbox_settings, monkeypatch):
+    monkeypatch.setattr(settings, "SANDBOX_POOL_IDLE_TTL", 0.0)
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+    for job in ("job-a", "job-b"):
+        (sandbox_settings / job).mkdir()
+        asyncio.run(sandbox.aexecute(["true"], cwd=str(sandbox_settings / job)))
+    assert list(sandbox.stats()) == [os.path.join(os.path.realpath(sandbox_settings), "job-b")]
+    assert "fake-0" in runtime.removed
+    sandbox.close()
+
+
+def test_dirty_check_only_after_failure(sandbox_settings):
+    runtime = FakeRuntime()
+    sandbox = DockerSandbox(image="test-image", runtime=runtime)
+    assert sandbox.execute(["true"], cwd=str(sandbox_settings))[2] == 0
+    assert runtime.dirty_checks == 0
+    assert asyncio.run(sandbox.aexecute(["false"], cwd=str(sandbox_settings)))[2] == 1
+    assert runtime.dirty_checks == 1
+    sandbox.close()
+
+
+def test_cli_runtime_runs_as_host_user(monkeypatch):
+    runtime = DockerCliRuntime()
+    calls = []
+    monkeypatch.setattr(runtime, "_docker", lambda *args, **kwargs: calls.append(args) or subprocess.CompletedProcess(args, 0, "cid\n", ""))
+    assert runtime.start("test-image", "/work/job-a") == "cid"
+    args = calls[0]
+    assert args[args.index("--user") + 1] == f"{os.getuid()}:{os.getgid()}"
+    assert args[args.index("-v") + 1] == "/work/job-a:/work/job-a"
+
+
+def test_pool_recycles_after_max_uses():
+    pool = ContainerPool(FakeRuntime(), "test-image", None, min_idle=0, max_size=1, max_uses=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    pool.release(first)
+    # Its second command used it up: the next caller gets a fresh container
+    second = pool.acquire()
+    assert second is not first
+    assert pool.snapshot()["recycled_max_uses"] == 1
+    pool.release(second, dirty=True)
+    assert pool.snapshot()["recycled_dirty"] == 1
+    pool.close()
+
+
+def test_full_pool_waits_for_a_release():
+    pool = ContainerPool(FakeRuntime(), "test-image", None, min_idle=0, max_size=1)
+    held = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    pool.release(held)
+    waiter.join(5)
+    assert got == [held]
+    pool.release(held)
+    pool.close()
+    with pytest.raises(PoolClosed):
+        pool.acquire()
+
+
+def test_codex_class_stays_on_host(sandbox_settings):
+    runtime = FakeRuntime()
+    manager = LazySandboxManager()
+    manager._set(DockerSandbox(image="test-image", runtime=runtime))
+
+    stdout, _, code = asyncio.run(manager.aexecute(["echo", "host"], command_class="codex"))
+    assert (stdout, code) == ("host\n", 0)
+    stdout, _, code = manager.execute(["echo", "host"], command_class="codex")
+    assert (stdout, code) == ("host\n", 0)
+    assert runtime.execs == []
+
+    asyncio.run(manager.aexecute(["true"], cwd=str(sandbox_settings), command_class="test"))
+    assert len(runtime.execs) == 1
+    manager.reset()
+
+
+def test_reprobe_closes_old_provider_after_last_command(sandbox_settings, monkeypatch):
+    monkeypatch.setattr(settings, "SANDBOX_PROVIDER", "auto")
+    runtime = FakeRuntime()
+    manager = LazySandboxManager()
+    old = DockerSandbox(image="test-image", runtime=runtime)
+    manager._set(old)
+    monkeypatch.setattr(SandboxFactory, "docker_available", staticmethod(lambda timeout=None: False))
+
+    async def run():
+        running = asyncio.ensure_future(manager.aexecute(["sleep", "0.3"], cwd=str(sandbox_settings)))
+        await asyncio.sleep(0.1)
+        await asyncio.to_thread(manager._reprobe)
+        swapped = isinstance(manager._provider, LocalSandbox)
+        pools_during = old.stats()
+        result = await running
+        return swapped, pools_during, result
+
+    swapped, pools_during, result = asyncio.run(run())
+    assert swapped
+    assert result[2] == 0
+    # Still open while its command ran
+    assert list(pools_during) == [os.path.realpath(sandbox_settings)]
+    # The retired provider closed its pool once the command returned
+    assert old.stats() == {}
+    manager.reset()
+
+
+def test_cli_runtime_streams_before_exit(fake_docker, tmp_path):
+    arrivals = []
+    script = "import time; print('frame', flush=True); time.sleep(0.5); print('done')"
+
+    async def run():
+        started = time.monotonic()
+        result = await fake_docker.aexec(
+            "fake", [sys.executable, "-c", script], cwd=str(tmp_path),
+            log_callback=lambda line: arrivals.append((line, time.monotonic() - started))
+        )
+        return result, time.monotonic() - started
+
+    (stdout, stderr, code), elapsed = asyncio.run(run())
+    assert (stdout, code) == ("frame\ndone\n", 0)
+    assert [line for line, _ in arrivals] == ["frame", "done"]
+    assert arrivals[0][1] < elapsed - 0.3
+
+
+def test_cli_runtime_caps_output_and_times_out(fake_docker, tmp_path):
+    flood = "import sys; [sys.stdout.write('x' * 99 + '\\n') for _ in range(1000)]"
+    stdout, _, code = asyncio.run(fake_docker.aexec("fake", [sys.executable, "-c", flood], max_output_bytes=2000))
+    assert code == 0
+    assert "bytes of output truncated" in stdout
+    assert len(stdout) < 3000
+
+    stdout, stderr, code = asyncio.run(fake_docker.aexec("fake", ["sleep", "5"], timeout=0.2))
+    assert (stderr, code) == ("TimeoutExpired", TIMEOUT_EXIT_CODE)
+
+
+def test_cli_runtime_passes_stdin_and_env(fake_docker, tmp_path):
+    stdout, _, code = asyncio.run(fake_docker.aexec(
+        "fake", ["sh", "-c", "cat; echo $AGENT_TEST_VAR; pwd"], cwd=str(tmp_path), env={"AGENT_TEST_VAR": "v"}, stdin="in\n"
+    ))
+    assert code == 0
+    assert stdout.splitlines() == ["in", "v", os.path.realpath(tmp_path)]
@@ -0,0 +1,91 @@
+import random
+from collections import deque
+
+import pytest
+
+from app.agents.impact_index import ImpactIndex
+from app.core.config import settings
+
+
+def _bfs(graph, changed, max_depth=None):
+    seen = set(changed)
+    queue = deque((f, 0) for f in changed)
+    while queue:
+        f, depth = queue.popleft()
+        if max_depth is not None and depth >= max_depth:
+            continue
+        for d in graph.get(f, ()):
+            if d not in seen:
+                seen.add(d)
+                queue.append((d, depth + 1))
+    return seen
+
+
+@pytest.fixture
+def graph():
+    rng = random.Random(7)
+    files = [f"m{i}.py" for i in range(200)]
+    graph = {}
+    for _ in range(600):
+        a, b = rng.sample(files, 2)
+        graph.setdefault(a, set()).add(b)
+    return graph
+
+
+@pytest.fixture
+def closures(monkeypatch):
+    monkeypatch.setattr(settings, "IMPACT_CLOSURE_HOT_QUERIES", 2)
+    monkeypatch.setattr(settings, "IMPACT_CLOSURE_CACHE_SIZE", 2)
+
+
+def test_matches_bfs(graph, closures):
+    index = ImpactIndex(graph, ["lonely.py"])
+    rng = random.Random(3)
+    for _ in range(30):
+        changed = set(rng.sample(index.files, 3)) | {"unknown.py"}
+        assert index.impacted(changed) == _bfs(graph, changed)
+        assert index.impacted(changed, max_depth=1) == _bfs(graph, changed, max_depth=1)
+    assert index.impacted(["lonely.py"]) == {"lonely.py"}
+    assert index.impacted([]) == set()
+
+
+def test_hot_seed_closure_is_cached(graph, closures):
+    index = ImpactIndex(graph)
+    seed = next(f for f in index.files if graph.get(f))
+    expected = _bfs(graph, {seed})
+    assert index.impacted([seed]) == expected
+    assert index.stats.snapshot()["closures_cached"] == 0
+
+    # The second query makes the seed hot; later ones are answered from its closure
+    assert index.impacted([seed]) == expected
+    assert index.impacted([seed]) == expected
+    stats = index.stats.snapshot()
+    assert stats["closures_cached"] == 1
+    assert stats["closure_hits"] == 2
+
+    # Depth-limited queries never use or feed the cache
+    index.impacted([seed], max_depth=1)
+    assert index.stats.snapshot()["closure_hits"] == 2
+
+
+def test_closure_cache_is_bounded_lru(graph, closures):
+    index = ImpactIndex(graph)
+    a, b, c = index.files[:3]
+    for seed in (a, a, b, b):
+        index.impacted([seed])
+    index.impacted([a])
+    for seed in (c, c):
+        index.impacted([seed])
+    # b was the least recently used when c's closure was added
+    assert list(index._closures) == [index.ids[a], index.ids[c]]
+    # A cached and an uncached seed together still match the plain traversal
+    assert index.impacted([a, b]) == _bfs(graph, {a, b})
+
+
+def test_cache_disabled(graph, monkeypatch):
+    monkeypatch.setattr(settings, "IMPACT_CLOSURE_CACHE_SIZE", 0)
+    index = ImpactIndex(graph)
+    seed = index.files[0]
+    for _ in range(5):
+        index.impacted([seed])
+    assert not index._closures and index.stats.snapshot()["closure_hits"] == 0
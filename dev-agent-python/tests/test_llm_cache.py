@@ -0,0 +1,71 @@
+import os
+
+import fakeredis
+import git
+import pytest
+
+from app.core import llm_cache as llm_cache_module
+from app.core.config import settings
+from app.core.llm_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(llm_cache_module.redis, "from_url", lambda *args, **kwargs: fakeredis.FakeRedis(server=server))
+    return ResponseCache()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = git.Repo.init(tmp_path / "main", initial_branch="main")
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "agent")
+        config.set_value("user", "email", "agent@example.com")
+    (tmp_path / "main" / "app.py").write_text("x = 1\n")
+    repo.git.add("-A")
+    repo.index.commit("init")
+    return repo
+
+
+def test_key_follows_workspace_state(cache, repo):
+    cwd = repo.working_tree_dir
+    first = cache.make_key("gpt", "read-only", "plan it", cwd=cwd)
+    assert cache.make_key("gpt", "read-only", "plan it", cwd=cwd) == first
+    assert cache.make_key("gpt", "read-only", "plan it") != first
+    with open(os.path.join(cwd, "app.py"), "w") as f:
+        f.write("x = 22\n")
+    assert cache.make_key("gpt", "read-only", "plan it", cwd=cwd) != first
+
+
+def test_worktree_fingerprint_asks_git(repo, tmp_path, monkeypatch):
+    worktree = str(tmp_path / "task")
+    repo.git.worktree("add", "-b", "task", worktree)
+    assert os.path.isfile(os.path.join(worktree, ".git"))
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("walked the tree")
+
+    monkeypatch.setattr(llm_cache_module.os, "walk", no_walk)
+    assert ResponseCache.workspace_fingerprint(worktree)
+
+
+def test_redis_tier_serves_after_memory_loss(cache):
+    cache.set("llmcache:a", "answer", 60)
+    cache._memory.clear()
+    cache._memory_bytes = 0
+    assert cache.get("llmcache:a") == "answer"
+    assert cache.stats()["redis_hits"] == 1
+
+
+def test_redis_byte_total_matches_entries(cache, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_REDIS_MAX_BYTES", 2000)
+    for i in range(50):
+        cache.set(f"llmcache:{i}", os.urandom(100).hex(), 60)
+    # Overwriting an entry replaces its size instead of adding to it
+    cache.set("llmcache:49", "short", 60)
+    client = cache._get_redis()
+    sizes = {key: int(size) for key, size in client.hgetall(cache.SIZES_KEY).items()}
+    assert int(client.get(cache.TOTAL_KEY)) == sum(sizes.values())
+    assert sum(sizes.values()) <= 2000
+    assert cache.stats()["evictions"] > 0
@@ -0,0 +1,43 @@
+import os
+
+import git
+import pytest
+
+from app.agents import knowledge_graph
+from app.agents.knowledge_graph import graph_for
+from app.agents.nodes.parallel import _commit_worktree, _create_worktree, _merge, _remove_worktree
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = git.Repo.init(tmp_path, initial_branch="main")
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "agent")
+        config.set_value("user", "email", "agent@example.com")
+    (tmp_path / "app.py").write_text("x = 1\n")
+    repo.git.add("-A")
+    repo.index.commit("init")
+    cache = tmp_path / ".agent_artifacts" / "cache"
+    (cache / "venv" / "bin").mkdir(parents=True)
+    (cache / ".gitignore").write_text("*\n")
+    (cache / "symbols.db").write_text("index")
+    return repo
+
+
+def test_task_worktree_round_trip(repo):
+    repo_path = repo.working_tree_dir
+    run = _create_worktree(repo, repo_path, "job", {"id": "t1", "name": "Add y"})
+    # The index cache is shared, the auto-fix venv is not
+    assert sorted(os.listdir(os.path.join(run.path, ".agent_artifacts", "cache"))) == [".gitignore", "symbols.db"]
+
+    with open(os.path.join(run.path, "y.py"), "w") as f:
+        f.write("y = 2\n")
+    graph_for(run.path)
+    assert _commit_worktree(run, "job")
+    assert _merge(repo, run) == (True, [])
+    _remove_worktree(repo, run)
+
+    assert os.path.exists(os.path.join(repo_path, "y.py"))
+    assert not os.path.exists(run.path)
+    assert os.path.realpath(run.path) not in knowledge_graph._graphs
+    assert repo.head.commit.message.startswith("Merge task 'Add y'")
@@ -0,0 +1,97 @@
+import asyncio
+import textwrap
+
+import pytest
+
+from app.agents.logic.pytest_runner import PytestRunner, parse_junit
+from app.agents.sandbox import LocalSandbox, SandboxProvider
+from app.core.config import settings
+
+
+class ScriptedSandbox(SandboxProvider):
+    """
+    A sandbox that is not the host: answers the plugin probe with `plugins`
+    and every other command with `result`.
+    """
+    runs_on_host = False
+
+    def __init__(self, plugins, result):
+        self.plugins = plugins
+        self.result = result
+        self.commands = []
+
+    def execute(self, cmd, cwd=None, env=None, **kwargs):
+        raise NotImplementedError
+
+    async def aexecute(self, cmd, cwd=None, env=None, **kwargs):
+        self.commands.append(cmd)
+        if cmd[1] == "-c":
+            return " ".join(self.plugins) + "\n", "", 0
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def no_selection(monkeypatch):
+    monkeypatch.setattr(settings, "TEST_SELECTION", False)
+    monkeypatch.setattr(settings, "TEST_MAX_WORKERS", 1)
+
+
+def _repo(tmp_path, body):
+    (tmp_path / "test_sample.py").write_text(textwrap.dedent(body))
+    return str(tmp_path)
+
+
+def test_parse_junit_counts_and_failures(tmp_path):
+    report = tmp_path / "junit.xml"
+    report.write_text(
+        '<testsuites><testsuite tests="2" failures="1" errors="0" skipped="0">'
+        '<testcase classname="pkg.test_mod" name="test_ok" file="pkg/test_mod.py" line="3"/>'
+        '<testcase classname="pkg.test_mod.TestThing" name="test_bad" file="pkg/test_mod.py" line="9">'
+        '<failure type="AssertionError" message="assert 1 == 2">E   assert 1 == 2</failure>'
+        '</testcase></testsuite></testsuites>'
+    )
+    counts, failures = parse_junit(str(report))
+    assert counts == {"tests": 2, "failures": 1, "errors": 0, "skipped": 0}
+    assert len(failures) == 1
+    failure = failures[0]
+    assert failure.nodeid == "pkg/test_mod.py::TestThing::test_bad"
+    assert (failure.file, failure.line, failure.kind, failure.type) == ("pkg/test_mod.py", 10, "failure", "AssertionError")
+
+
+def test_exit_code_one_without_report_fails(tmp_path):
+    # `python -m pytest` in an image without pytest: exit 1 and no JUnit file
+    sandbox = ScriptedSandbox(["pytest"], ("", "/usr/local/bin/python: No module named pytest", 1))
+    result = asyncio.run(PytestRunner(sandbox).run(str(tmp_path), "job"))
+    assert result.status == "failed"
+    assert "No module named pytest" in result.error
+
+
+def test_plugins_are_probed_in_the_sandbox(tmp_path):
+    sandbox = ScriptedSandbox([], ("", "", 0))
+    result = asyncio.run(PytestRunner(sandbox).run(str(tmp_path), "job"))
+    assert result.status == "skipped"
+    assert len(sandbox.commands) == 1
+
+
+def test_host_run_reports_failures(tmp_path):
+    repo = _repo(tmp_path, """
+        def test_ok():
+            assert True
+
+        def test_bad():
+            assert 1 == 2
+    """)
+    result = asyncio.run(PytestRunner(LocalSandbox()).run(repo, "job"))
+    assert result.status == "failed"
+    assert result.counts["tests"] == 2
+    assert [f.nodeid for f in result.failures] == ["test_sample.py::test_bad"]
+
+
+def test_host_run_passes(tmp_path):
+    repo = _repo(tmp_path, """
+        def test_ok():
+            assert True
+    """)
+    result = asyncio.run(PytestRunner(LocalSandbox()).run(repo, "job"))
+    assert result.status == "passed"
+    assert result.counts["tests"] == 1
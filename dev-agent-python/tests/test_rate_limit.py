@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from app.core import rate_limit
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(rate_limit.redis, "from_url", lambda *args, **kwargs: fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_BURST_SECONDS", 60)
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_POLL_MS", 20)
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_MAX_WAIT", 0.3)
+    return RateLimiter()
+
+
+def _limit(monkeypatch, rpm=0, tpm=0):
+    monkeypatch.setattr(settings, "LLM_RATE_LIMITS", {"azure": {"rpm": rpm, "tpm": tpm}})
+
+
+def test_request_bucket_throttles_past_capacity(limiter, monkeypatch):
+    # 2 RPM over a 60s burst: two calls fit, the third waits
+    _limit(monkeypatch, rpm=2)
+    first = limiter.acquire_blocking("azure", "gpt", 10, job_id="job")
+    second = limiter.acquire_blocking("azure", "gpt", 10, job_id="job")
+    third = limiter.acquire_blocking("azure", "gpt", 10, job_id="job")
+    assert first.waited < 0.1 and second.waited < 0.1
+    assert third.waited >= settings.LLM_RATE_LIMIT_MAX_WAIT - 0.1
+    stats = limiter.stats.snapshot()["azure:gpt"]
+    assert (stats["grants"], stats["throttled"], stats["local_fallback"]) == (3, 1, 0)
+
+
+def test_settle_returns_unused_tokens(limiter, monkeypatch):
+    _limit(monkeypatch, tpm=1000)
+    grant = limiter.acquire_blocking("azure", "gpt", 800, job_id="job")
+    limiter.settle(grant, 100)
+    level = float(limiter._get_redis().hget(limiter._key("azure:gpt", "tok"), "tokens"))
+    assert 895 <= level <= 1000
+    assert limiter.acquire_blocking("azure", "gpt", 850, job_id="job").waited < 0.1
+
+
+def test_async_acquire_keeps_the_loop_free(limiter, monkeypatch):
+    _limit(monkeypatch, rpm=100)
+
+    def slow_round_trip(*args):
+        time.sleep(0.2)
+        return 0
+
+    monkeypatch.setattr(limiter, "_redis_try_acquire", slow_round_trip)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+
+    async def run():
+        grant, _ = await asyncio.gather(limiter.acquire("azure", "gpt", 10, job_id="job"), ticker())
+        return grant
+
+    assert asyncio.run(run()) is not None
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
+
+
+def test_cancelled_acquire_leaves_the_queue(limiter, monkeypatch):
+    _limit(monkeypatch, rpm=1)
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_MAX_WAIT", 30.0)
+    limiter.acquire_blocking("azure", "gpt", 10, job_id="job")
+
+    async def run():
+        waiting = asyncio.ensure_future(limiter.acquire("azure", "gpt", 10, job_id="job"))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(run())
+    assert limiter._get_redis().zcard(limiter._key("azure:gpt", "queue")) == 0
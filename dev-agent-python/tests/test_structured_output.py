@@ -0,0 +1,67 @@
+import json
+
+from app.agents.logic import structured_output
+from app.agents.logic.structured_output import FRAME_MARKER, FrameScanner, extract_frame, find_unframed, get_validator
+
+PLAN_SCHEMA = {"type": "object", "required": ["task_graph"]}
+
+
+def test_nested_frame_is_captured_whole():
+    plan = {"task_graph": [{"id": "t1", "deps": [], "meta": {"note": "braces } { in a string \\\" too"}}]}
+    text = f"Thinking...\n{FRAME_MARKER} {json.dumps(plan)}\ntrailing"
+    assert extract_frame(text, PLAN_SCHEMA) == plan
+
+
+def test_frame_split_across_chunks():
+    plan = {"task_graph": [{"id": "t1"}], "path": "a\\\\b"}
+    text = f"noise {FRAME_MARKER}\n{json.dumps(plan)} done"
+    scanner = FrameScanner(PLAN_SCHEMA)
+    # One character at a time splits the marker, strings and escapes at every position
+    for ch in text:
+        scanner.feed(ch)
+    assert scanner.done
+    assert scanner.result == plan
+
+
+def test_invalid_frames_are_skipped():
+    text = (
+        f"{FRAME_MARKER} {{\"other\": 1}}\n"
+        f"{FRAME_MARKER} {{not json}}\n"
+        f"{FRAME_MARKER} {{\"task_graph\": []}}"
+    )
+    scanner = FrameScanner(PLAN_SCHEMA)
+    assert scanner.feed(text) == {"task_graph": []}
+    assert scanner.rejected == 2
+
+
+def test_scanner_stops_at_first_valid_frame():
+    scanner = FrameScanner()
+    scanner.feed(f"{FRAME_MARKER} {{\"n\": 1}}")
+    scanner.feed(f"{FRAME_MARKER} {{\"n\": 2}}")
+    assert scanner.result == {"n": 1}
+
+
+def test_oversized_frame_is_abandoned(monkeypatch):
+    monkeypatch.setattr(structured_output, "MAX_FRAME_CHARS", 32)
+    scanner = FrameScanner()
+    # The bound applies to a frame still buffering across chunks
+    scanner.feed(f"{FRAME_MARKER} {{\"blob\": \"")
+    for _ in range(4):
+        scanner.feed("x" * 16)
+    scanner.feed("\"}")
+    assert not scanner.done and scanner.rejected == 0
+    scanner.feed(f"{FRAME_MARKER} {{\"n\": 1}}")
+    assert scanner.result == {"n": 1}
+
+
+def test_unframed_fallback():
+    text = 'Here you go: {"task_graph": [{"id": "t1"}]} hope that helps {"x": 1}'
+    assert find_unframed(text, PLAN_SCHEMA) == {"task_graph": [{"id": "t1"}]}
+    assert extract_frame(text, PLAN_SCHEMA, fallback=False) is None
+    assert extract_frame("no json here") is None
+
+
+def test_validator_is_built_once_per_schema():
+    assert get_validator(None) is None
+    first = get_validator({"type": "object", "required": ["a"]})
+    assert get_validator({"required": ["a"], "type": "object"}) is first
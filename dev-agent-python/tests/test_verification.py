@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.agents.logic import verification
+from app.agents.logic.change_scope import ChangeScope
+from app.agents.logic.verification import DEFAULT_VERIFIERS, VerificationPipeline, _batches
+from app.agents.sandbox import LocalSandbox
+from app.core.config import settings
+
+
+class RecordingSandbox(LocalSandbox):
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    async def aexecute(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        return await super().aexecute(cmd, *args, **kwargs)
+
+
+@pytest.fixture
+def compileall():
+    return next(v for v in DEFAULT_VERIFIERS if v.name == "compileall")
+
+
+def test_batches_stay_within_budget(monkeypatch):
+    monkeypatch.setattr(verification, "_MAX_ARG_BYTES", 20)
+    paths = [f"/repo/m{i}.py" for i in range(5)]
+    batches = _batches(paths)
+    assert [p for batch in batches for p in batch] == paths
+    assert all(sum(len(p) + 1 for p in batch) <= 20 for batch in batches)
+    assert _batches([]) == []
+
+
+def test_full_scope_cached_run_is_batched(tmp_path, monkeypatch, compileall):
+    monkeypatch.setattr(settings, "VERIFY_CACHE_ENABLED", True)
+    monkeypatch.setattr(verification, "_MAX_ARG_BYTES", len(str(tmp_path)) * 3)
+    for i in range(6):
+        (tmp_path / f"mod{i}.py").write_text("x = 1\n" if i != 4 else "def broken(:\n")
+    sandbox = RecordingSandbox()
+    pipeline = VerificationPipeline([compileall], sandbox)
+    scope = ChangeScope("full", "test")
+
+    result = asyncio.run(pipeline._run_cached(compileall, str(tmp_path), "job", scope, ""))
+    runs = len(sandbox.commands)
+    assert runs > 1
+    assert result.status == "failed"
+    assert [d.file for d in result.diagnostics] == ["mod4.py"]
+    assert result.cache_misses == 6
+
+    # Every batch was cached, so a rerun answers all files without running the tool
+    again = asyncio.run(pipeline._run_cached(compileall, str(tmp_path), "job", scope, ""))
+    assert len(sandbox.commands) == runs and again.cache_hits == 6
+    assert [d.file for d in again.diagnostics] == ["mod4.py"]
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from app.agents import wrapper
+from app.agents.wrapper import CodexConnector
+from app.core.config import settings
+from app.core.llm_cache import ResponseCache
+from app.core.rate_limit import RateLimitGrant
+
+
+class Calls:
+    """
+    Stands in for the Codex CLI: counts calls and answers with a frame, or raises.
+    """
+    def __init__(self, error=None):
+        self.count = 0
+        self.error = error
+
+    async def __call__(self, prompt, model, *args, **kwargs):
+        self.count += 1
+        if self.error:
+            raise self.error
+        return {"ok": True}, 'AGENT_JSON_START: {"ok": true}', "", 0, None
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(cache, "_get_redis", lambda: None)
+    monkeypatch.setattr(wrapper, "llm_cache", cache)
+    monkeypatch.setattr(settings, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_CACHE_TTLS", {"planner": 60})
+    monkeypatch.setattr(wrapper.rate_limiter, "limits_for", lambda provider, model: None)
+    monkeypatch.setattr(wrapper.token_monitor, "call_tokens", lambda prompt, completion, model=None, usage=None: (100, 20, 0))
+    return CodexConnector()
+
+
+def _run(connector, cwd, node="planner", sandbox="read-only"):
+    return asyncio.run(connector._arun_once("plan it", None, "gpt", None, None, sandbox, "never", cwd, node, None))
+
+
+def test_cache_key_follows_the_workspace(connector, monkeypatch, tmp_path):
+    calls = Calls()
+    monkeypatch.setattr(connector, "_arun_uncached", calls)
+    (tmp_path / "app.py").write_text("x = 1\n")
+
+    assert _run(connector, str(tmp_path))[0] == {"ok": True}
+    assert _run(connector, str(tmp_path))[0] == {"ok": True}
+    assert calls.count == 1
+
+    # An edit the model could read changes the key; write sandboxes and uncached nodes never hit
+    (tmp_path / "app.py").write_text("x = 22\n")
+    _run(connector, str(tmp_path))
+    _run(connector, str(tmp_path), sandbox="workspace-write")
+    _run(connector, str(tmp_path), node="coder")
+    assert calls.count == 4
+
+
+def test_failed_call_settles_prompt_tokens_only(connector, monkeypatch, tmp_path):
+    settled = []
+    grant = RateLimitGrant("azure:gpt", 10000, settings.LLM_RATE_LIMIT_COMPLETION_TOKENS + 300, 0.0)
+
+    async def acquire(*args, **kwargs):
+        return grant
+
+    monkeypatch.setattr(wrapper.rate_limiter, "limits_for", lambda provider, model: {"tpm": 10000})
+    monkeypatch.setattr(wrapper.rate_limiter, "acquire", acquire)
+    monkeypatch.setattr(wrapper.rate_limiter, "settle", lambda g, used: settled.append((g, used)))
+    monkeypatch.setattr(connector, "_estimate_tokens", lambda prompt, model: grant.estimated_tokens)
+
+    monkeypatch.setattr(connector, "_arun_uncached", Calls(RuntimeError("CLI crashed")))
+    with pytest.raises(RuntimeError):
+        _run(connector, str(tmp_path), node="coder")
+    assert settled == [(grant, 300)]
+
+    # A completed call settles its counted usage
+    monkeypatch.setattr(connector, "_arun_uncached", Calls())
+    _run(connector, str(tmp_path), node="coder")
+    assert settled[-1] == (grant, 120)